@@ -0,0 +1,85 @@
+"""Compare per-user filter with vectorized batch filter.
+
+Pure CPU benchmark, no database is needed. Both sides start
+from ``UserPostRank`` rows, as returned by Gateway.
+
+Usage::
+
+    python benchmarks/batch_ranking.py --users 1 10 100 1000 --posts 200
+"""
+import argparse
+import random
+from collections import defaultdict
+from functools import partial
+
+from common import measure
+from digest.schemas import UserPostRank
+from digest.services.batch import batch_at_least_one_subscription
+from digest.services.filters import heap_at_least_one_subscription
+
+
+def make_ranks(
+    users: int, posts: int, subscriptions: int, seed: int = 0
+) -> list[UserPostRank]:
+    """Generate posts for users, ordered like Gateway does."""
+    rnd = random.Random(seed)
+    return [
+        UserPostRank(
+            user_id,
+            user_id * posts + post_id,
+            rnd.randrange(subscriptions),
+            rnd.randrange(1000),
+        )
+        for user_id in range(users)
+        for post_id in range(posts)
+    ]
+
+
+def per_user(
+    ranks: list[UserPostRank], user_ids: list[int], limit: int
+) -> dict[int, list[int]]:
+    """Group posts by user and run regular filter for every user."""
+    posts = defaultdict(list)
+    for rank in ranks:
+        posts[rank.user_id].append(rank)
+    return {
+        user_id: heap_at_least_one_subscription(*posts[user_id], limit=limit)
+        for user_id in user_ids
+    }
+
+
+def main():
+    """Run benchmark and print results table."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--users', type=int, nargs='+', default=[1, 10, 100, 1000, 10000]
+    )
+    parser.add_argument('--posts', type=int, default=200)
+    parser.add_argument('--subscriptions', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    options = parser.parse_args()
+
+    print(f'{"users":>7} {"per user, ms":>13} {"batch, ms":>10} speedup')
+    crossover = None
+    for users in options.users:
+        ranks = make_ranks(users, options.posts, options.subscriptions)
+        user_ids = list(range(users))
+        python_call = partial(per_user, ranks, user_ids, options.limit)
+        batch_call = partial(
+            batch_at_least_one_subscription, ranks, user_ids, options.limit
+        )
+        assert python_call() == batch_call()
+        python = measure(python_call, options.repeat)['median']
+        batch = measure(batch_call, options.repeat)['median']
+        if crossover is None and batch < python:
+            crossover = users
+        print(
+            f'{users:>7} {python * 1000:>13.2f} {batch * 1000:>10.2f} '
+            f'{python / batch:>6.1f}x'
+        )
+    print(f'Batch filter wins from {crossover} users per batch')
+
+
+if __name__ == '__main__':
+    main()
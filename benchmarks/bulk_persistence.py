@@ -0,0 +1,76 @@
+"""Compare ways to save many digests: per user, INSERT batch and COPY.
+
+Every call saves one digest of ``--limit`` posts for every user,
+chosen from posts of a seeded subscription.
+
+Usage::
+
+    python benchmarks/bulk_persistence.py --digests 1 100 10000
+"""
+import argparse
+import random
+from functools import partial
+
+from common import make_sessionmaker, measure, seeded_user, seeded_users
+from digest.adapters import Gateway
+
+
+def per_user(gateway: Gateway, digests: dict[int, list[int]]):
+    """Save digests one by one."""
+    for user_id, post_ids in digests.items():
+        gateway.create_digest(user_id, *post_ids)
+
+
+def main():
+    """Run benchmark and print results table."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--digests', type=int, nargs='+', default=[1, 100, 10_000]
+    )
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--limit', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument(
+        '--per-user-max',
+        type=int,
+        default=1000,
+        help='skip per user path for larger calls',
+    )
+    options = parser.parse_args()
+
+    sessionmaker_ = make_sessionmaker()
+    gateway = Gateway(sessionmaker_)
+    rnd = random.Random(0)
+    print(
+        f'{"digests":>8} {"per user, ms":>13} {"insert, ms":>11} '
+        f'{"copy, ms":>9} {"copy, digests/s":>16}'
+    )
+    with seeded_user(sessionmaker_, options.posts) as owner_id:
+        post_ids = [
+            post.id for post in gateway.read_post_ranks_for_user(owner_id)
+        ]
+        for count in options.digests:
+            with seeded_users(sessionmaker_, count) as user_ids:
+                digests = {
+                    user_id: rnd.sample(post_ids, options.limit)
+                    for user_id in user_ids
+                }
+                single = float('nan')
+                if count <= options.per_user_max:
+                    single = measure(
+                        partial(per_user, gateway, digests), options.repeat
+                    )['median']
+                insert = measure(
+                    partial(gateway.create_digests, digests), options.repeat
+                )['median']
+                copy = measure(
+                    partial(gateway.copy_digests, digests), options.repeat
+                )['median']
+            print(
+                f'{count:>8} {single * 1000:>13.1f} {insert * 1000:>11.1f} '
+                f'{copy * 1000:>9.1f} {count / copy:>16.0f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Helpers shared by benchmarks.
+
+Benchmarks connect to the database described by the usual ``.env``
+settings, create their own users, subscriptions and posts,
+and remove them afterwards.
+"""
+import random
+import statistics
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, delete, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from digest.db import (
+    Digest,
+    Post,
+    PostDigest,
+    Subscription,
+    User,
+    UserSubscription,
+)
+from digest.entrypoint import Settings
+
+
+def make_sessionmaker() -> sessionmaker:
+    """Create sessionmaker for database from settings.
+
+    :return: sessionmaker instance
+    """
+    engine = create_engine(Settings().database_url)
+    return sessionmaker(engine, expire_on_commit=False)
+
+
+@contextmanager
+def seeded_user(
+    sessionmaker_: sessionmaker,
+    posts: int,
+    subscriptions: int = 10,
+    content_size: int = 1000,
+    seed: int = 0,
+) -> Iterator[int]:
+    """Create user subscribed to sources with given number of posts.
+
+    Everything created (including digests) is deleted on exit.
+
+    :param sessionmaker_: sessionmaker instance
+    :type sessionmaker_: sessionmaker
+    :param posts: total number of posts in user subscriptions
+    :type posts: int
+    :param subscriptions: number of user subscriptions
+    :type subscriptions: int
+    :param content_size: length of every post content
+    :type content_size: int
+    :param seed: random seed
+    :type seed: int
+    :return: created user ID
+    """
+    rnd = random.Random(seed)
+    with sessionmaker_() as s:
+        user_id = s.execute(
+            insert(User).values(name='benchmark').returning(User.id)
+        ).scalar_one()
+        subscription_ids = s.scalars(
+            insert(Subscription).returning(Subscription.id),
+            [{'source': f'benchmark {i}'} for i in range(subscriptions)],
+        ).all()
+        s.execute(
+            insert(UserSubscription),
+            [
+                {'user_id': user_id, 'subscription_id': subscription_id}
+                for subscription_id in subscription_ids
+            ],
+        )
+        content = 'x' * content_size
+        s.execute(
+            insert(Post),
+            [
+                {
+                    'subscription_id': rnd.choice(subscription_ids),
+                    'content': content,
+                    'rating': rnd.randrange(1000),
+                }
+                for _ in range(posts)
+            ],
+        )
+        s.commit()
+    try:
+        yield user_id
+    finally:
+        with sessionmaker_() as s:
+            digest_ids = select(Digest.id).where(Digest.user_id == user_id)
+            s.execute(
+                delete(PostDigest).where(PostDigest.digest_id.in_(digest_ids))
+            )
+            s.execute(delete(Digest).where(Digest.user_id == user_id))
+            s.execute(
+                delete(UserSubscription).where(
+                    UserSubscription.user_id == user_id
+                )
+            )
+            s.execute(
+                delete(Post).where(Post.subscription_id.in_(subscription_ids))
+            )
+            s.execute(
+                delete(Subscription).where(
+                    Subscription.id.in_(subscription_ids)
+                )
+            )
+            s.execute(delete(User).where(User.id == user_id))
+            s.commit()
+
+
+@contextmanager
+def seeded_users(
+    sessionmaker_: sessionmaker, count: int
+) -> Iterator[list[int]]:
+    """Create users without subscriptions.
+
+    Users and their digests are deleted on exit.
+
+    :param sessionmaker_: sessionmaker instance
+    :type sessionmaker_: sessionmaker
+    :param count: number of users
+    :type count: int
+    :return: created user IDs
+    """
+    with sessionmaker_() as s:
+        user_ids = s.scalars(
+            insert(User).returning(User.id),
+            [{'name': 'benchmark'} for _ in range(count)],
+        ).all()
+        s.commit()
+    try:
+        yield user_ids
+    finally:
+        with sessionmaker_() as s:
+            digest_ids = select(Digest.id).where(Digest.user_id.in_(user_ids))
+            s.execute(
+                delete(PostDigest).where(PostDigest.digest_id.in_(digest_ids))
+            )
+            s.execute(delete(Digest).where(Digest.user_id.in_(user_ids)))
+            s.execute(delete(User).where(User.id.in_(user_ids)))
+            s.commit()
+
+
+def measure(function: Callable, repeat: int = 5) -> dict[str, float]:
+    """Call function several times and collect timings.
+
+    :param function: function without arguments to be measured
+    :type function: Callable
+    :param repeat: number of calls
+    :type repeat: int
+    :return: min, median and mean time in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+    }
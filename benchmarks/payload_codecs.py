@@ -0,0 +1,88 @@
+"""Compare digest payload codecs: encode and decode time against size.
+
+Pure CPU benchmark, no Redis is needed.
+
+Usage::
+
+    python benchmarks/payload_codecs.py --content 100 1000 10000
+"""
+import argparse
+import contextlib
+import random
+from datetime import datetime
+from functools import partial
+
+from common import measure
+from digest.adapters.codecs import JsonCodec, MsgpackCodec, decode_digest
+from digest.schemas import DigestDTO, PostDTO
+
+
+def make_digest(content_size: int, posts: int, seed: int = 0) -> DigestDTO:
+    """Generate digest with posts of given content length."""
+    rnd = random.Random(seed)
+    words = [
+        ''.join(rnd.choices('абвгдеёжзийклмнопрстуфхцчшщъыьэюя', k=7))
+        for _ in range(200)
+    ]
+    content = ' '.join(rnd.choices(words, k=content_size // 8))
+    return DigestDTO(
+        id=1,
+        user_id=1,
+        timestamp=datetime.now(),
+        posts=[
+            PostDTO(
+                id=post_id,
+                subscription_id=rnd.randrange(100),
+                content=content[:content_size],
+                rating=rnd.randrange(1000),
+            )
+            for post_id in range(posts)
+        ],
+    )
+
+
+def codecs() -> dict:
+    """Codecs to be compared, available ones only."""
+    result = {
+        'json': JsonCodec(),
+        'msgpack': MsgpackCodec('none'),
+        'msgpack+zlib': MsgpackCodec('zlib'),
+    }
+    with contextlib.suppress(ImportError):
+        result['msgpack+zstd'] = MsgpackCodec('zstd')
+    return result
+
+
+def main():
+    """Run benchmark and print results table."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--content', type=int, nargs='+', default=[100, 1000, 10000]
+    )
+    parser.add_argument('--posts', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=200)
+    options = parser.parse_args()
+
+    print(
+        f'{"content":>8} {"codec":>13} {"bytes":>8} '
+        f'{"encode, us":>11} {"decode, us":>11}'
+    )
+    for content_size in options.content:
+        digest_ = make_digest(content_size, options.posts)
+        for name, codec in codecs().items():
+            payload = codec.encode(digest_)
+            assert decode_digest(payload) == digest_
+            size = len(
+                payload.encode() if isinstance(payload, str) else payload
+            )
+            encode = measure(partial(codec.encode, digest_), options.repeat)
+            decode = measure(partial(decode_digest, payload), options.repeat)
+            print(
+                f'{content_size:>8} {name:>13} {size:>8} '
+                f'{encode["median"] * 1e6:>11.1f} '
+                f'{decode["median"] * 1e6:>11.1f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Compare ORM and column-projected ways to read posts for ranking.
+
+Usage::
+
+    python benchmarks/read_path.py --sizes 1000 10000 100000
+"""
+import argparse
+from functools import partial
+
+from common import make_sessionmaker, measure, seeded_user
+from digest.adapters import Gateway
+from digest.services.filters import at_least_one_subscription
+
+
+def orm_path(gateway: Gateway, user_id: int, limit: int) -> list[int]:
+    """Read full ORM posts, then filter them."""
+    posts = gateway.read_posts_for_user(user_id)
+    return at_least_one_subscription(*posts, limit=limit)
+
+
+def projected_path(gateway: Gateway, user_id: int, limit: int) -> list[int]:
+    """Read ranking fields only, then fetch content of chosen posts."""
+    posts = gateway.read_post_ranks_for_user(user_id)
+    post_ids = at_least_one_subscription(*posts, limit=limit)
+    gateway.read_posts(*post_ids)
+    return post_ids
+
+
+def main():
+    """Run benchmark and print results table."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000]
+    )
+    parser.add_argument('--subscriptions', type=int, default=10)
+    parser.add_argument('--content-size', type=int, default=1000)
+    parser.add_argument('--limit', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    options = parser.parse_args()
+
+    sessionmaker_ = make_sessionmaker()
+    gateway = Gateway(sessionmaker_)
+    print(f'{"posts":>8} {"orm, ms":>10} {"projected, ms":>14} speedup')
+    for size in options.sizes:
+        with seeded_user(
+            sessionmaker_, size, options.subscriptions, options.content_size
+        ) as user_id:
+            orm_call = partial(orm_path, gateway, user_id, options.limit)
+            projected_call = partial(
+                projected_path, gateway, user_id, options.limit
+            )
+            assert orm_call() == projected_call()
+            orm = measure(orm_call, options.repeat)
+            projected = measure(projected_call, options.repeat)
+        print(
+            f'{size:>8} {orm["median"] * 1000:>10.1f} '
+            f'{projected["median"] * 1000:>14.1f} '
+            f'{orm["median"] / projected["median"]:>7.1f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
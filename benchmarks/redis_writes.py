@@ -0,0 +1,60 @@
+"""Compare one SET per digest with pipelined SET and MSET writes.
+
+Uses Redis from ``.env`` settings. Keys are written under
+``benchmark:`` prefix and deleted afterwards.
+
+Usage::
+
+    python benchmarks/redis_writes.py --sizes 1 10 100 1000 --payload 2000
+"""
+import argparse
+from functools import partial
+
+from common import measure
+from digest.adapters.storage import RedisStorage
+from digest.entrypoint import Settings
+
+
+def store_one_by_one(storage: RedisStorage, data: dict[str, str]):
+    """Store every value with its own SET round-trip."""
+    for key, value in data.items():
+        storage.store(key, value)
+
+
+def main():
+    """Run benchmark and print results table."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[1, 10, 100, 1000, 10000]
+    )
+    parser.add_argument('--payload', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    options = parser.parse_args()
+
+    storage = RedisStorage(Settings().redis_url)
+    print(
+        f'{"keys":>7} {"SET, ms":>10} {"pipeline, ms":>13} '
+        f'{"MSET, ms":>10} {"keys/s (pipeline)":>18}'
+    )
+    for size in options.sizes:
+        data = {f'benchmark:{i}': 'x' * options.payload for i in range(size)}
+        try:
+            single = measure(
+                partial(store_one_by_one, storage, data), options.repeat
+            )['median']
+            pipeline = measure(
+                partial(storage.store_many, data), options.repeat
+            )['median']
+            mset = measure(
+                partial(storage.store_many, data, mset=True), options.repeat
+            )['median']
+        finally:
+            storage.client.delete(*data)
+        print(
+            f'{size:>7} {single * 1000:>10.2f} {pipeline * 1000:>13.2f} '
+            f'{mset * 1000:>10.2f} {size / pipeline:>18.0f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
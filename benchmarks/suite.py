@@ -0,0 +1,385 @@
+"""Benchmark suite of the digest pipeline on synthetic data.
+
+Measures filters, every Gateway query, digest persistence and the
+end-to-end flow on a dataset from ``synthetic.generate``, for a typical
+user (median number of subscriptions), a power user (the most
+subscriptions) and a batch of users. Filters are pure CPU, other groups
+use database and Redis from ``.env`` settings.
+
+Results are written as JSON. With ``--baseline`` median of every case
+is compared with the stored one, and the run fails if any case
+is slower by more than ``--tolerance``.
+
+Usage::
+
+    python benchmarks/suite.py --output baseline.json
+    python benchmarks/suite.py --baseline baseline.json --tolerance 0.25
+    python benchmarks/suite.py --groups filters --users 200
+"""
+import argparse
+import json
+import platform
+import sys
+from collections.abc import Callable, Iterator, Mapping
+from contextlib import contextmanager
+from functools import partial
+
+from common import make_sessionmaker, measure
+from digest.adapters import Gateway, RedisStorage
+from digest.entrypoint import Settings
+from digest.schemas import PostRank
+from digest.services.digester import Digester
+from digest.services.filters import (
+    at_least_one_subscription,
+    dummy_filter,
+    heap_at_least_one_subscription,
+    heap_dummy_filter,
+)
+from synthetic import Dataset, generate, seeded_dataset, user_ranks
+
+GROUPS = ('filters', 'gateway', 'persistence', 'flow')
+
+Cases = dict[str, Callable[[], object]]
+
+
+def chosen_users(dataset: Dataset, batch: int) -> dict[str, list[int]]:
+    """Choose user indices benchmarked as typical, power and batch.
+
+    :param dataset: generated dataset
+    :type dataset: Dataset
+    :param batch: number of users in batch
+    :type batch: int
+    :return: kind to user indices mapping
+    """
+    by_size = sorted(
+        range(len(dataset.users)), key=lambda user: len(dataset.users[user])
+    )
+    return {
+        'typical': [by_size[len(by_size) // 2]],
+        'power': [by_size[-1]],
+        'batch': sorted(by_size[:: max(len(by_size) // batch, 1)][:batch]),
+    }
+
+
+def filter_cases(dataset: Dataset, batch: int, limit: int) -> Cases:
+    """Build filter cases, on posts prepared like Gateway returns them.
+
+    :param dataset: generated dataset
+    :type dataset: Dataset
+    :param batch: number of users in batch
+    :type batch: int
+    :param limit: number of posts in digest
+    :type limit: int
+    :return: case name to function mapping
+    """
+    users = chosen_users(dataset, batch)
+    cases = {}
+    for kind in ('typical', 'power'):
+        posts = [
+            PostRank(*rank[1:]) for rank in user_ranks(dataset, users[kind])
+        ]
+        for filter_function in (
+            dummy_filter,
+            heap_dummy_filter,
+            at_least_one_subscription,
+            heap_at_least_one_subscription,
+        ):
+            cases[f'filters.{filter_function.__name__}.{kind}'] = partial(
+                filter_function, *posts, limit=limit
+            )
+    try:
+        from digest.services.batch import batch_at_least_one_subscription
+    except ImportError:
+        return cases
+    ranks = user_ranks(dataset, users['batch'])
+    cases['filters.batch_at_least_one_subscription.batch'] = partial(
+        batch_at_least_one_subscription, ranks, users['batch'], limit=limit
+    )
+    return cases
+
+
+def gateway_cases(
+    gateway: Gateway, user_ids: Mapping[str, list[int]], limit: int
+) -> Cases:
+    """Build cases of every Gateway read query.
+
+    :param gateway: database adapter
+    :type gateway: Gateway
+    :param user_ids: kind to user IDs mapping
+    :type user_ids: Mapping[str, list[int]]
+    :param limit: number of posts in digest
+    :type limit: int
+    :return: case name to function mapping
+    """
+    typical, power, batch = (
+        user_ids['typical'][0],
+        user_ids['power'][0],
+        user_ids['batch'],
+    )
+    power_subscriptions = gateway.read_subscriptions_for_users([power])[power]
+    last_post_id = gateway.read_last_post_id()
+    chosen = heap_at_least_one_subscription(
+        *gateway.read_post_ranks_for_user(typical), limit=limit
+    )
+    cases = {
+        'gateway.read_posts_for_user.typical': partial(
+            gateway.read_posts_for_user, typical
+        ),
+        'gateway.read_posts.digest': partial(gateway.read_posts, *chosen),
+        'gateway.read_post_ranks_for_users.batch': partial(
+            gateway.read_post_ranks_for_users, batch
+        ),
+        'gateway.read_subscriptions_for_users.batch': partial(
+            gateway.read_subscriptions_for_users, batch
+        ),
+        'gateway.read_subscribers.power': partial(
+            gateway.read_subscribers, power_subscriptions
+        ),
+        'gateway.read_top_posts.power': partial(
+            gateway.read_top_posts, power_subscriptions, limit
+        ),
+        'gateway.read_post_ranks_above.batch': partial(
+            gateway.read_post_ranks_above,
+            dict.fromkeys(batch, max(last_post_id - 1000, 0)),
+        ),
+        'gateway.read_last_post_id': gateway.read_last_post_id,
+    }
+    for kind, user_id in (('typical', typical), ('power', power)):
+        cases[f'gateway.read_post_ranks_for_user.{kind}'] = partial(
+            gateway.read_post_ranks_for_user, user_id
+        )
+        cases[f'gateway.read_candidate_ranks_for_user.{kind}'] = partial(
+            gateway.read_candidate_ranks_for_user, user_id, limit
+        )
+    return cases
+
+
+def persistence_cases(
+    gateway: Gateway, user_ids: Mapping[str, list[int]], limit: int
+) -> Cases:
+    """Build cases of saving digests, one and many at once.
+
+    :param gateway: database adapter
+    :type gateway: Gateway
+    :param user_ids: kind to user IDs mapping
+    :type user_ids: Mapping[str, list[int]]
+    :param limit: number of posts in digest
+    :type limit: int
+    :return: case name to function mapping
+    """
+    ranks = gateway.read_post_ranks_for_users(user_ids['batch'])
+    chosen = {user_id: [] for user_id in user_ids['batch']}
+    for rank in ranks:
+        if len(chosen[rank.user_id]) < limit:
+            chosen[rank.user_id].append(rank.id)
+    typical = user_ids['typical'][0]
+    typical_posts = chosen.get(typical) or next(iter(chosen.values()))
+    return {
+        'persistence.create_digest.typical': partial(
+            gateway.create_digest, typical, *typical_posts
+        ),
+        'persistence.create_digests.batch': partial(
+            gateway.create_digests, chosen
+        ),
+        'persistence.copy_digests.batch': partial(
+            gateway.copy_digests, chosen
+        ),
+    }
+
+
+def flow_cases(digester: Digester, user_ids: Mapping[str, list[int]]) -> Cases:
+    """Build end-to-end cases: compose, save and store digests.
+
+    :param digester: digester with Gateway and Redis storage
+    :type digester: Digester
+    :param user_ids: kind to user IDs mapping
+    :type user_ids: Mapping[str, list[int]]
+    :return: case name to function mapping
+    """
+    return {
+        'flow.flow.typical': partial(digester.flow, user_ids['typical'][0]),
+        'flow.flow.power': partial(digester.flow, user_ids['power'][0]),
+        'flow.flow_many.batch': partial(digester.flow_many, user_ids['batch']),
+    }
+
+
+@contextmanager
+def database_cases(
+    dataset: Dataset, groups: set[str], batch: int, limit: int
+) -> Iterator[Cases]:
+    """Seed database and build cases of database groups.
+
+    :param dataset: generated dataset
+    :type dataset: Dataset
+    :param groups: groups to be run
+    :type groups: set[str]
+    :param batch: number of users in batch
+    :type batch: int
+    :param limit: number of posts in digest
+    :type limit: int
+    :return: case name to function mapping
+    """
+    sessionmaker_ = make_sessionmaker()
+    gateway = Gateway(sessionmaker_)
+    storage = RedisStorage(Settings().redis_url)
+    with seeded_dataset(sessionmaker_, dataset) as seeded:
+        user_ids = {
+            kind: [seeded.user_ids[user] for user in users]
+            for kind, users in chosen_users(dataset, batch).items()
+        }
+        cases = {}
+        if 'gateway' in groups:
+            cases.update(gateway_cases(gateway, user_ids, limit))
+        if 'persistence' in groups:
+            cases.update(persistence_cases(gateway, user_ids, limit))
+        if 'flow' in groups:
+            digester = Digester(
+                gateway, None, storage, heap_at_least_one_subscription
+            )
+            cases.update(flow_cases(digester, user_ids))
+        try:
+            yield cases
+        finally:
+            storage.client.delete(*seeded.user_ids)
+
+
+def run(cases: Cases, repeat: int) -> dict[str, dict[str, float]]:
+    """Measure every case after a warm-up call, printing progress.
+
+    :param cases: case name to function mapping
+    :type cases: Cases
+    :param repeat: number of measured calls
+    :type repeat: int
+    :return: case name to timings mapping
+    """
+    results = {}
+    for name, function in cases.items():
+        function()
+        results[name] = measure(function, repeat)
+        print(
+            f'{name:<55} {results[name]["median"] * 1000:>10.2f} ms',
+            file=sys.stderr,
+        )
+    return results
+
+
+def compare(
+    results: Mapping[str, Mapping[str, float]],
+    baseline: Mapping[str, Mapping[str, float]],
+    tolerance: float,
+    min_delta: float = 0.0,
+) -> list[str]:
+    """Find cases whose median regressed compared with baseline.
+
+    Cases missing from either side are ignored, so are slowdowns
+    below ``min_delta``, which are within noise of fast cases.
+
+    :param results: case name to timings mapping
+    :type results: Mapping[str, Mapping[str, float]]
+    :param baseline: case name to stored timings mapping
+    :type baseline: Mapping[str, Mapping[str, float]]
+    :param tolerance: allowed slowdown, 0.25 means 25%
+    :type tolerance: float
+    :param min_delta: ignored slowdown, in seconds
+    :type min_delta: float
+    :return: descriptions of regressions
+    """
+    regressions = []
+    for name, timings in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]['median']
+        ratio = timings['median'] / expected
+        if ratio > 1 + tolerance and timings['median'] - expected > min_delta:
+            regressions.append(
+                f'{name}: {timings["median"] * 1000:.2f} ms, '
+                f'baseline {baseline[name]["median"] * 1000:.2f} ms '
+                f'({ratio:.2f}x)'
+            )
+    return regressions
+
+
+def main():
+    """Run suite, write results and compare them with baseline."""
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        '--groups', nargs='+', choices=GROUPS, default=list(GROUPS)
+    )
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--subscriptions', type=int, default=10_000)
+    parser.add_argument('--posts', type=int, default=200_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--limit', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write results to file')
+    parser.add_argument('--baseline', help='compare with stored results')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument(
+        '--min-delta-ms',
+        type=float,
+        default=0.05,
+        help='ignore slowdowns smaller than that',
+    )
+    options = parser.parse_args()
+
+    groups = set(options.groups)
+    dataset = generate(
+        options.users, options.subscriptions, options.posts, seed=options.seed
+    )
+    results = {}
+    if 'filters' in groups:
+        results.update(
+            run(
+                filter_cases(dataset, options.batch, options.limit),
+                options.repeat,
+            )
+        )
+    if groups - {'filters'}:
+        with database_cases(
+            dataset, groups, options.batch, options.limit
+        ) as cases:
+            results.update(run(cases, options.repeat))
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'users': options.users,
+            'subscriptions': options.subscriptions,
+            'posts': options.posts,
+            'seed': options.seed,
+            'batch': options.batch,
+            'limit': options.limit,
+            'repeat': options.repeat,
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w') as file:
+            file.write(text)
+    else:
+        print(text)
+
+    if options.baseline:
+        with open(options.baseline) as file:
+            baseline = json.load(file)
+        if baseline['meta'] != report['meta']:
+            print('Baseline was measured with other options', file=sys.stderr)
+        regressions = compare(
+            results,
+            baseline['results'],
+            options.tolerance,
+            options.min_delta_ms / 1000,
+        )
+        for regression in regressions:
+            print(f'Regression: {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""Seeded synthetic data with production-like skew.
+
+Subscription popularity follows Zipf law, so a few sources have most
+of the subscribers. Number of posts per source has a heavy (Pareto)
+tail. Most users have a few dozen subscriptions, while power users
+have thousands. The same seed always gives the same dataset.
+
+Usage::
+
+    python benchmarks/synthetic.py --users 1000 --posts 200000
+"""
+import argparse
+import bisect
+import itertools
+import math
+import random
+import statistics
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from typing import NamedTuple
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from digest.adapters.database import copy_rows
+from digest.db import (
+    Digest,
+    Post,
+    PostDigest,
+    Subscription,
+    User,
+    UserSubscription,
+)
+from digest.schemas import UserPostRank
+
+
+class Dataset(NamedTuple):
+    """Generated data, referencing subscriptions and posts by index."""
+
+    subscriptions: int
+    users: list[list[int]]
+    posts: list[tuple[int, int]]
+
+
+class Seeded(NamedTuple):
+    """Database IDs of seeded dataset."""
+
+    user_ids: list[int]
+    subscription_ids: list[int]
+
+
+def weighted_sample(
+    rnd: random.Random, cum_weights: Sequence[float], k: int
+) -> list[int]:
+    """Choose k distinct indices with probability proportional to weight.
+
+    :param rnd: random generator
+    :type rnd: random.Random
+    :param cum_weights: cumulative weights of indices
+    :type cum_weights: Sequence[float]
+    :param k: number of indices, at most number of weights
+    :type k: int
+    :return: chosen indices, in order of choice
+    """
+    total = cum_weights[-1]
+    chosen = {}
+    while len(chosen) < k:
+        for _ in range(2 * (k - len(chosen))):
+            index = bisect.bisect(cum_weights, rnd.random() * total)
+            chosen[min(index, len(cum_weights) - 1)] = None
+            if len(chosen) == k:
+                break
+    return list(chosen)
+
+
+def generate(
+    users: int = 1000,
+    subscriptions: int = 10_000,
+    posts: int = 200_000,
+    zipf_exponent: float = 1.1,
+    median_subscriptions: int = 20,
+    power_users: float = 0.01,
+    power_subscriptions: int = 2000,
+    posts_alpha: float = 1.5,
+    seed: int = 0,
+) -> Dataset:
+    """Generate dataset.
+
+    :param users: number of users
+    :type users: int
+    :param subscriptions: number of subscriptions (sources)
+    :type subscriptions: int
+    :param posts: total number of posts
+    :type posts: int
+    :param zipf_exponent: exponent of subscription popularity
+    :type zipf_exponent: float
+    :param median_subscriptions: median number of user subscriptions
+    :type median_subscriptions: int
+    :param power_users: share of users with many subscriptions
+    :type power_users: float
+    :param power_subscriptions: number of subscriptions of power user
+    :type power_subscriptions: int
+    :param posts_alpha: Pareto shape of source activity,
+        lower means heavier tail
+    :type posts_alpha: float
+    :param seed: random seed
+    :type seed: int
+    :return: generated dataset
+    """
+    rnd = random.Random(seed)
+    popularity = [
+        1 / rank**zipf_exponent for rank in range(1, subscriptions + 1)
+    ]
+    rnd.shuffle(popularity)
+    cum_popularity = list(itertools.accumulate(popularity))
+
+    user_subscriptions = []
+    for _ in range(users):
+        if rnd.random() < power_users:
+            count = power_subscriptions
+        else:
+            count = round(
+                rnd.lognormvariate(math.log(median_subscriptions), 0.8)
+            )
+        count = min(max(count, 1), subscriptions)
+        user_subscriptions.append(
+            sorted(weighted_sample(rnd, cum_popularity, count))
+        )
+
+    activity = [rnd.paretovariate(posts_alpha) for _ in range(subscriptions)]
+    cum_activity = list(itertools.accumulate(activity))
+    generated = [
+        (
+            min(
+                bisect.bisect(cum_activity, rnd.random() * cum_activity[-1]),
+                subscriptions - 1,
+            ),
+            int(rnd.expovariate(0.01)),
+        )
+        for _ in range(posts)
+    ]
+    return Dataset(subscriptions, user_subscriptions, generated)
+
+
+def user_ranks(
+    dataset: Dataset, users: Sequence[int] | None = None
+) -> list[UserPostRank]:
+    """Build candidate posts of users, as returned by Gateway.
+
+    Post IDs are post indices plus one, subscription IDs are indices.
+
+    :param dataset: generated dataset
+    :type dataset: Dataset
+    :param users: user indices, all users by default
+    :type users: Sequence[int]
+    :return: list of UserPostRanks, ordered by user and post ID
+    """
+    by_subscription = [[] for _ in range(dataset.subscriptions)]
+    for index, (subscription, rating) in enumerate(dataset.posts, 1):
+        by_subscription[subscription].append((index, rating))
+    if users is None:
+        users = range(len(dataset.users))
+    ranks = []
+    for user in users:
+        posts = sorted(
+            (post_id, subscription, rating)
+            for subscription in dataset.users[user]
+            for post_id, rating in by_subscription[subscription]
+        )
+        ranks.extend(UserPostRank(user, *post) for post in posts)
+    return ranks
+
+
+@contextmanager
+def seeded_dataset(
+    sessionmaker_: sessionmaker, dataset: Dataset, content_size: int = 200
+) -> Iterator[Seeded]:
+    """Load dataset into database.
+
+    Posts are loaded with COPY, in generated order, so post IDs grow
+    like in production. Everything created (including digests)
+    is deleted on exit. Requires psycopg2 driver.
+
+    :param sessionmaker_: sessionmaker instance
+    :type sessionmaker_: sessionmaker
+    :param dataset: generated dataset
+    :type dataset: Dataset
+    :param content_size: length of every post content
+    :type content_size: int
+    :return: database IDs of users and subscriptions
+    """
+    with sessionmaker_() as s:
+        user_ids = s.scalars(
+            insert(User).returning(User.id, sort_by_parameter_order=True),
+            [{'name': 'benchmark'} for _ in dataset.users],
+        ).all()
+        subscription_ids = s.scalars(
+            insert(Subscription).returning(
+                Subscription.id, sort_by_parameter_order=True
+            ),
+            [
+                {'source': f'benchmark {index}'}
+                for index in range(dataset.subscriptions)
+            ],
+        ).all()
+        connection = s.connection()
+        with connection.connection.dbapi_connection.cursor() as cursor:
+            copy_rows(
+                cursor,
+                UserSubscription.__tablename__,
+                ('user_id', 'subscription_id'),
+                (
+                    (user_id, subscription_ids[subscription])
+                    for user_id, subscriptions in zip(
+                        user_ids, dataset.users, strict=True
+                    )
+                    for subscription in subscriptions
+                ),
+            )
+            content = 'x' * content_size
+            copy_rows(
+                cursor,
+                Post.__tablename__,
+                ('subscription_id', 'content', 'rating'),
+                (
+                    (subscription_ids[subscription], content, rating)
+                    for subscription, rating in dataset.posts
+                ),
+            )
+        s.commit()
+    try:
+        yield Seeded(list(user_ids), list(subscription_ids))
+    finally:
+        with sessionmaker_() as s:
+            digest_ids = select(Digest.id).where(Digest.user_id.in_(user_ids))
+            s.execute(
+                delete(PostDigest).where(PostDigest.digest_id.in_(digest_ids))
+            )
+            s.execute(delete(Digest).where(Digest.user_id.in_(user_ids)))
+            s.execute(
+                delete(UserSubscription).where(
+                    UserSubscription.user_id.in_(user_ids)
+                )
+            )
+            s.execute(
+                delete(Post).where(Post.subscription_id.in_(subscription_ids))
+            )
+            s.execute(
+                delete(Subscription).where(
+                    Subscription.id.in_(subscription_ids)
+                )
+            )
+            s.execute(delete(User).where(User.id.in_(user_ids)))
+            s.commit()
+
+
+def main():
+    """Generate dataset and print its shape."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--subscriptions', type=int, default=10_000)
+    parser.add_argument('--posts', type=int, default=200_000)
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    dataset = generate(
+        options.users, options.subscriptions, options.posts, seed=options.seed
+    )
+    per_user = sorted(len(subscriptions) for subscriptions in dataset.users)
+    per_source = [0] * dataset.subscriptions
+    for subscription, _ in dataset.posts:
+        per_source[subscription] += 1
+    per_source.sort()
+    subscribers = [0] * dataset.subscriptions
+    for subscriptions in dataset.users:
+        for subscription in subscriptions:
+            subscribers[subscription] += 1
+    subscribers.sort()
+    for name, values in (
+        ('subscriptions per user', per_user),
+        ('posts per source', per_source),
+        ('subscribers per source', subscribers),
+    ):
+        print(
+            f'{name:>23}: median {statistics.median(values):g}, '
+            f'p99 {values[int(len(values) * 0.99)]}, max {values[-1]}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,17 @@
 """Adapters collection."""
 from digest.adapters.database import Gateway
-from digest.adapters.rabbit import RabbitReader
-from digest.adapters.storage import RedisStorage
+from digest.adapters.rabbit import Delivery, RabbitReader
+from digest.adapters.storage import (
+    BufferedWriter,
+    NormalizedRedisStorage,
+    RedisStorage,
+)
 
-__all__ = ('Gateway', 'RabbitReader', 'RedisStorage')
+__all__ = (
+    'BufferedWriter',
+    'Delivery',
+    'Gateway',
+    'NormalizedRedisStorage',
+    'RabbitReader',
+    'RedisStorage',
+)
@@ -0,0 +1,534 @@
+"""Asynchronous database adapters.
+
+Same queries as ``digest.adapters.database``, executed over
+``sqlalchemy.ext.asyncio``. Requires an async driver, e.g. asyncpg.
+"""
+import asyncio
+from collections.abc import Iterable, Mapping, Sequence
+from contextlib import asynccontextmanager
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from digest.adapters.database import (
+    RANK_COLUMNS,
+    allocate_digest_ids_stmt,
+    allocated_digest_rows,
+    assemble_digests,
+    candidate_posts_stmt,
+    candidate_ranks_for_users_stmt,
+    create_digests_stmt,
+    digest_stmt,
+    leaderboard_posts_stmt,
+    leaderboard_ranks_stmt,
+    ordered_posts,
+    post_digest_rows,
+    post_ranks_above_stmt,
+    post_ranks_for_users_stmt,
+    posts_by_ids_stmt,
+    posts_for_user_stmt,
+    refresh_leaderboards_stmt,
+    subscribers_stmt,
+    subscriptions_for_users_stmt,
+    top_posts_stmt,
+    touch_digests_stmt,
+)
+from digest.db import Digest, Post, PostDigest
+from digest.schemas import DigestDTO, PostDTO, PostRank, UserPostRank
+
+
+class AsyncRepoBase:
+    """Base asynchronous adapter class."""
+
+    def __init__(
+        self, sessionmaker_: async_sessionmaker, concurrency: int = 20
+    ):
+        """Initialize adapter with sessionmaker.
+
+        :param sessionmaker_: async_sessionmaker instance
+        :type sessionmaker_: async_sessionmaker
+        :param concurrency: maximum number of sessions used at once.
+            Should not exceed connection pool size
+        :type concurrency: int
+        """
+        self.sessionmaker = sessionmaker_
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    @asynccontextmanager
+    async def session_control(
+        self, commit: bool = True, session: AsyncSession = None
+    ):
+        """Create new AsyncSession if not provided.
+
+        Waits while ``concurrency`` sessions are already in use.
+
+        :param commit: commits if set to True and session is not provided
+        :type commit: bool
+        :param session: already opened session. Will be created if not provided
+        :type session: AsyncSession
+        :return: AsyncSession instance to work with
+        """
+        if session:
+            yield session
+            return
+        async with self._semaphore, self.sessionmaker() as current_session:
+            yield current_session
+            if commit:
+                await current_session.commit()
+
+    @asynccontextmanager
+    async def snapshot(self):
+        """Open AsyncSession reading one consistent database snapshot.
+
+        Transaction is REPEATABLE READ, so all reads made with the
+        session see the same committed rows. It is rolled back on exit.
+
+        :return: AsyncSession instance to work with
+        """
+        async with self._semaphore, self.sessionmaker() as session:
+            await session.connection(
+                execution_options={'isolation_level': 'REPEATABLE READ'}
+            )
+            yield session
+
+
+class AsyncGateway(AsyncRepoBase):
+    """Asynchronous database adapter. Mirrors ``Gateway`` methods."""
+
+    def __init__(
+        self,
+        sessionmaker_: async_sessionmaker,
+        concurrency: int = 20,
+        leaderboards: bool = False,
+    ):
+        """Initialize adapter with sessionmaker.
+
+        :param sessionmaker_: async_sessionmaker instance
+        :type sessionmaker_: async_sessionmaker
+        :param concurrency: maximum number of sessions used at once
+        :type concurrency: int
+        :param leaderboards: read posts from leaderboards,
+            see ``Gateway``
+        :type leaderboards: bool
+        """
+        super().__init__(sessionmaker_, concurrency)
+        self.leaderboards = leaderboards
+
+    async def read_posts_for_user(
+        self, user_id: int, session: AsyncSession | None = None
+    ) -> list[PostDTO]:
+        """Read posts from user subscriptions.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: list of Posts
+        """
+        if self.leaderboards:
+            stmt = leaderboard_posts_stmt(user_id)
+        else:
+            stmt = posts_for_user_stmt(user_id)
+        async with self.session_control(commit=False, session=session) as s:
+            response = await s.execute(stmt)
+            return [
+                PostDTO.model_validate(post) for post in response.scalars()
+            ]
+
+    async def read_post_ranks_for_user(
+        self, user_id: int, session: AsyncSession | None = None
+    ) -> list[PostRank]:
+        """Read ranking fields of posts from user subscriptions.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: list of PostRanks
+        """
+        if self.leaderboards:
+            stmt = leaderboard_ranks_stmt([user_id], with_user=False)
+        else:
+            stmt = posts_for_user_stmt(user_id, RANK_COLUMNS)
+        async with self.session_control(commit=False, session=session) as s:
+            connection = await s.connection()
+            response = await connection.execute(stmt)
+            return list(map(PostRank._make, response))
+
+    async def read_post_ranks_for_users(
+        self, user_ids: Sequence[int], session: AsyncSession | None = None
+    ) -> list[UserPostRank]:
+        """Read ranking fields of posts for many users in one query.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: list of UserPostRanks, ordered by user ID and post ID
+        """
+        if not user_ids:
+            return []
+        if self.leaderboards:
+            stmt = leaderboard_ranks_stmt(user_ids)
+        else:
+            stmt = post_ranks_for_users_stmt(user_ids)
+        async with self.session_control(commit=False, session=session) as s:
+            connection = await s.connection()
+            response = await connection.execute(stmt)
+            return list(map(UserPostRank._make, response))
+
+    async def read_subscriptions_for_users(
+        self, user_ids: Sequence[int], session: AsyncSession | None = None
+    ) -> dict[int, list[int]]:
+        """Read subscription IDs of many users in one query.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: user ID to subscription IDs mapping.
+            Users without subscriptions get empty list
+        """
+        result = {int(user_id): [] for user_id in user_ids}
+        if not result:
+            return result
+        stmt = subscriptions_for_users_stmt(user_ids)
+        async with self.session_control(commit=False, session=session) as s:
+            connection = await s.connection()
+            for user_id, subscription_id in await connection.execute(stmt):
+                result[user_id].append(subscription_id)
+        return result
+
+    async def read_subscribers(
+        self,
+        subscription_ids: Sequence[int],
+        session: AsyncSession | None = None,
+    ) -> list[int]:
+        """Read users subscribed to any of subscriptions.
+
+        :param subscription_ids: target subscription IDs
+        :type subscription_ids: Sequence[int]
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: user IDs, ascending
+        """
+        if not subscription_ids:
+            return []
+        stmt = subscribers_stmt(subscription_ids)
+        async with self.session_control(commit=False, session=session) as s:
+            return list(await s.scalars(stmt))
+
+    async def read_top_posts(
+        self,
+        subscription_ids: Sequence[int],
+        limit: int,
+        session: AsyncSession | None = None,
+    ) -> list[PostRank]:
+        """Read ranking fields of top posts of many subscriptions.
+
+        :param subscription_ids: target subscription IDs
+        :type subscription_ids: Sequence[int]
+        :param limit: number of posts per subscription
+        :type limit: int
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: list of PostRanks, grouped by subscription,
+            best rated first
+        """
+        if not subscription_ids:
+            return []
+        stmt = top_posts_stmt(subscription_ids, limit)
+        async with self.session_control(commit=False, session=session) as s:
+            connection = await s.connection()
+            response = await connection.execute(stmt)
+            return list(map(PostRank._make, response))
+
+    async def read_post_ranks_above(
+        self,
+        watermarks: Mapping[int, int],
+        session: AsyncSession | None = None,
+    ) -> list[UserPostRank]:
+        """Read ranking fields of posts added after per-user watermarks.
+
+        :param watermarks: user ID to last seen post ID mapping
+        :type watermarks: Mapping[int, int]
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: list of UserPostRanks, ordered by user ID and post ID
+        """
+        if not watermarks:
+            return []
+        stmt = post_ranks_above_stmt(watermarks)
+        async with self.session_control(commit=False, session=session) as s:
+            connection = await s.connection()
+            response = await connection.execute(stmt)
+            return list(map(UserPostRank._make, response))
+
+    async def read_last_post_id(
+        self, session: AsyncSession | None = None
+    ) -> int:
+        """Read the highest post ID.
+
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: post ID, 0 if there are no posts
+        """
+        async with self.session_control(commit=False, session=session) as s:
+            return await s.scalar(select(func.coalesce(func.max(Post.id), 0)))
+
+    async def read_candidate_ranks_for_user(
+        self,
+        user_id: int,
+        limit: int,
+        per_subscription: bool = True,
+        session: AsyncSession | None = None,
+    ) -> list[PostRank]:
+        """Read ranking fields of posts which filter is able to choose.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :param limit: how many posts filter is going to choose
+        :type limit: int
+        :param per_subscription: include best post of every subscription
+        :type per_subscription: bool
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: list of PostRanks
+        """
+        if self.leaderboards:
+            stmt = candidate_ranks_for_users_stmt(
+                [user_id], limit, per_subscription, True, with_user=False
+            )
+        else:
+            stmt = candidate_posts_stmt(
+                user_id, limit, per_subscription, RANK_COLUMNS
+            )
+        async with self.session_control(commit=False, session=session) as s:
+            connection = await s.connection()
+            response = await connection.execute(stmt)
+            return list(map(PostRank._make, response))
+
+    async def read_candidate_ranks_for_users(
+        self,
+        user_ids: Sequence[int],
+        limit: int,
+        per_subscription: bool = True,
+        session: AsyncSession | None = None,
+    ) -> list[UserPostRank]:
+        """Read ranking fields of candidate posts for many users.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :param limit: how many posts filter is going to choose
+        :type limit: int
+        :param per_subscription: include best post of every subscription
+        :type per_subscription: bool
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: list of UserPostRanks, ordered by user ID and post ID
+        """
+        if not user_ids:
+            return []
+        stmt = candidate_ranks_for_users_stmt(
+            user_ids, limit, per_subscription, self.leaderboards
+        )
+        async with self.session_control(commit=False, session=session) as s:
+            connection = await s.connection()
+            response = await connection.execute(stmt)
+            return list(map(UserPostRank._make, response))
+
+    async def read_posts(
+        self, *post_ids: int, session: AsyncSession | None = None
+    ) -> list[PostDTO]:
+        """Read full posts by IDs.
+
+        :param post_ids: target post IDs
+        :type post_ids: int
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: list of Posts, in order of given IDs
+        """
+        if not post_ids:
+            return []
+        stmt = posts_by_ids_stmt(post_ids)
+        async with self.session_control(commit=False, session=session) as s:
+            connection = await s.connection()
+            response = await connection.execute(stmt)
+            return ordered_posts(response, post_ids)
+
+    async def create_digest(
+        self,
+        user_id: int,
+        *post_ids: int,
+        session: AsyncSession | None = None,
+    ) -> DigestDTO | None:
+        """Create and save Digest for given user.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :param post_ids: post IDs to be included in Digest
+        :type post_ids: int
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: resulting Digest
+        """
+        digests = await self.create_digests({user_id: post_ids}, session)
+        return digests[user_id]
+
+    async def create_digests(
+        self,
+        digests: Mapping[int, Sequence[int]],
+        session: AsyncSession | None = None,
+    ) -> dict[int, DigestDTO | None]:
+        """Create and save Digests for many users in one transaction.
+
+        :param digests: user ID to post IDs mapping
+        :type digests: Mapping[int, Sequence[int]]
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: user ID to resulting Digest mapping.
+            Users without posts get None
+        """
+        result = dict.fromkeys(digests)
+        user_ids = [user_id for user_id, posts in digests.items() if posts]
+        if not user_ids:
+            return result
+        async with self.session_control(commit=True, session=session) as s:
+            response = await s.execute(
+                create_digests_stmt(),
+                [{'user_id': int(user_id)} for user_id in user_ids],
+            )
+            created = response.all()
+            await s.execute(
+                insert(PostDigest),
+                post_digest_rows(digests, user_ids, created),
+            )
+            post_ids = {
+                post_id for user_id in user_ids for post_id in digests[user_id]
+            }
+            posts = await self.read_posts(*post_ids, session=s)
+        result.update(assemble_digests(digests, user_ids, created, posts))
+        return result
+
+    async def copy_digests(
+        self,
+        digests: Mapping[int, Sequence[int]],
+        posts: Iterable[PostDTO] | None = None,
+        session: AsyncSession | None = None,
+    ) -> dict[int, DigestDTO | None]:
+        """Create and save Digests for many users with COPY.
+
+        See ``Gateway.copy_digests``. Requires asyncpg driver.
+
+        :param digests: user ID to post IDs mapping
+        :type digests: Mapping[int, Sequence[int]]
+        :param posts: posts of all Digests, if already read
+        :type posts: Iterable[PostDTO]
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: user ID to resulting Digest mapping.
+            Users without posts get None
+        """
+        result = dict.fromkeys(digests)
+        user_ids = [user_id for user_id, posts in digests.items() if posts]
+        if not user_ids:
+            return result
+        async with self.session_control(commit=True, session=session) as s:
+            connection = await s.connection()
+            allocated = await connection.execute(
+                allocate_digest_ids_stmt(len(user_ids))
+            )
+            created = allocated_digest_rows(user_ids, allocated)
+            raw_connection = await connection.get_raw_connection()
+            driver_connection = raw_connection.driver_connection
+            await driver_connection.copy_records_to_table(
+                Digest.__tablename__,
+                records=created,
+                columns=('id', 'user_id', 'timestamp'),
+            )
+            await driver_connection.copy_records_to_table(
+                PostDigest.__tablename__,
+                records=[
+                    (row['post_id'], row['digest_id'])
+                    for row in post_digest_rows(digests, user_ids, created)
+                ],
+                columns=('post_id', 'digest_id'),
+            )
+            if posts is None:
+                post_ids = {
+                    post_id
+                    for user_id in user_ids
+                    for post_id in digests[user_id]
+                }
+                posts = await self.read_posts(*post_ids, session=s)
+        result.update(assemble_digests(digests, user_ids, created, posts))
+        return result
+
+    async def touch_digests(
+        self,
+        digests: Mapping[int, tuple[int, Sequence[int]]],
+        session: AsyncSession | None = None,
+    ) -> dict[int, DigestDTO]:
+        """Refresh timestamp of existing Digests instead of creating new.
+
+        :param digests: digest ID to (user ID, post IDs) mapping
+        :type digests: Mapping[int, tuple[int, Sequence[int]]]
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: digest ID to Digest mapping.
+            Missing digests and digests of other users are skipped
+        """
+        if not digests:
+            return {}
+        stmt = touch_digests_stmt(
+            [
+                (digest_id, int(user_id))
+                for digest_id, (user_id, _) in digests.items()
+            ]
+        )
+        post_ids = {
+            digest_id: post_ids for digest_id, (_, post_ids) in digests.items()
+        }
+        async with self.session_control(commit=True, session=session) as s:
+            response = await s.execute(stmt)
+            touched = response.all()
+            posts = await self.read_posts(
+                *{post_id for row in touched for post_id in post_ids[row.id]},
+                session=s,
+            )
+        digest_ids = [row.id for row in touched]
+        return assemble_digests(post_ids, digest_ids, touched, posts)
+
+    async def refresh_leaderboards(
+        self, concurrently: bool = True, session: AsyncSession | None = None
+    ):
+        """Recompute subscription_top_posts view.
+
+        :param concurrently: do not block reads while refreshing
+        :type concurrently: bool
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: None
+        """
+        async with self.session_control(commit=True, session=session) as s:
+            await s.execute(refresh_leaderboards_stmt(concurrently))
+
+    async def read_digest(
+        self, digest_id: int, session: AsyncSession | None = None
+    ) -> DigestDTO | None:
+        """Read Digest by id.
+
+        :param digest_id: target digest ID
+        :type digest_id: int
+        :param session: session to be passed to session_control
+        :type session: AsyncSession
+        :return: found digest or None
+        """
+        stmt = digest_stmt(digest_id)
+        async with self.session_control(commit=False, session=session) as s:
+            response = await s.execute(stmt)
+            content: Digest = response.scalars().first()
+            if content:
+                return DigestDTO.model_validate(content)
+            return None
@@ -0,0 +1,242 @@
+"""Asynchronous RabbitMQ adapter. Requires aio-pika."""
+import asyncio
+import time
+
+import aio_pika
+
+from digest.adapters.rabbit import (
+    ATTEMPTS_HEADER,
+    DRAIN_POLL_INTERVAL,
+    Delivery,
+    RabbitReader,
+)
+
+
+class AsyncRabbitReader(RabbitReader):
+    """RabbitMQ adapter for asyncio.
+
+    Acknowledgement semantics are the same as ``RabbitReader`` ones,
+    but generators are asynchronous and should be iterated
+    with ``async for``. Like ``RabbitReader``, it does not reconnect:
+    delivery tags are valid within one channel only, so generators
+    fail once connection is lost, and unsettled deliveries are
+    redelivered by the broker.
+    """
+
+    async def _connect(self):
+        """Open connection and start consuming.
+
+        Deliveries left unsettled by previous connection are forgotten.
+
+        :return: connection, channel, queue of received deliveries
+            and delivery tag to message mapping
+        """
+        with self._lock:
+            self._unsettled.clear()
+            self._processed.clear()
+            self._in_progress.clear()
+        parameters = self.connection_parameters
+        connection = await aio_pika.connect(
+            host=parameters.host,
+            port=parameters.port,
+            login=parameters.credentials.username,
+            password=parameters.credentials.password,
+        )
+        channel = await connection.channel()
+        await channel.set_qos(prefetch_count=self.prefetch_count)
+        queue = await channel.declare_queue(self.queue)
+        received = asyncio.Queue()
+        messages = {}
+
+        async def on_message(message: aio_pika.abc.AbstractIncomingMessage):
+            headers = message.headers or {}
+            messages[message.delivery_tag] = message
+            with self._lock:
+                self._unsettled.append(message.delivery_tag)
+            received.put_nowait(
+                Delivery(
+                    message.body.decode(),
+                    message.delivery_tag,
+                    headers.get(ATTEMPTS_HEADER, 0),
+                    message.body,
+                    message.timestamp and message.timestamp.timestamp(),
+                )
+            )
+
+        await queue.consume(on_message)
+        return connection, channel, received, messages
+
+    @staticmethod
+    def _retry_message(
+        message: aio_pika.abc.AbstractIncomingMessage, headers: dict
+    ) -> aio_pika.Message:
+        """Copy failed message with its properties, merging headers in.
+
+        :param message: failed message
+        :type message: aio_pika.abc.AbstractIncomingMessage
+        :param headers: headers returned by ``_retry_headers``
+        :type headers: dict
+        :return: message to be republished
+        """
+        # user_id is left out, broker checks it against publishing connection
+        return aio_pika.Message(
+            message.body,
+            headers={**(message.headers or {}), **headers},
+            content_type=message.content_type,
+            content_encoding=message.content_encoding,
+            delivery_mode=message.delivery_mode,
+            priority=message.priority,
+            correlation_id=message.correlation_id,
+            reply_to=message.reply_to,
+            expiration=message.expiration,
+            message_id=message.message_id,
+            timestamp=message.timestamp,
+            type=message.type,
+            app_id=message.app_id,
+        )
+
+    async def _flush(self, channel, messages: dict, force: bool = False):
+        """Send acknowledgements for processed prefix of deliveries.
+
+        :param channel: channel deliveries were received from
+        :param messages: delivery tag to received message mapping
+        :type messages: dict
+        :param force: flush regardless of batch size and interval
+        :type force: bool
+        :return: None
+        """
+        last_acked = None
+        for delivery, ok in self._take_settled(force):
+            message = messages.pop(delivery.delivery_tag)
+            if ok:
+                last_acked = message
+                continue
+            headers = None if ok is None else self._retry_headers(delivery)
+            if headers is None:
+                await message.nack(requeue=False)
+                continue
+            await channel.default_exchange.publish(
+                self._retry_message(message, headers), routing_key=self.queue
+            )
+            last_acked = message
+        if last_acked is not None:
+            await last_acked.ack(multiple=True)
+
+    async def _receive(
+        self,
+        connection,
+        channel,
+        received: asyncio.Queue,
+        messages: dict,
+        timeout: float,
+    ) -> Delivery | None:
+        """Flush acknowledgements and wait for next delivery.
+
+        :param connection: open connection
+        :param channel: consuming channel
+        :param received: queue of received deliveries
+        :type received: asyncio.Queue
+        :param messages: delivery tag to received message mapping
+        :type messages: dict
+        :param timeout: maximum time to wait, in seconds
+        :type timeout: float
+        :raises aio_pika.exceptions.AMQPConnectionError: if connection
+            was lost
+        :return: next delivery or None if nothing arrived in time
+        """
+        if connection.is_closed:
+            raise aio_pika.exceptions.AMQPConnectionError(
+                'Connection to RabbitMQ was lost'
+            )
+        await self._flush(channel, messages)
+        if self._backlog_due():
+            queue = await channel.declare_queue(self.queue, passive=True)
+            self.backlog = queue.declaration_result.message_count
+        try:
+            return await asyncio.wait_for(received.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _drain(self, connection, channel, messages: dict):
+        """Keep sending acknowledgements until deliveries are reported.
+
+        Tasks handling yielded deliveries run meanwhile.
+
+        :param connection: open connection
+        :param channel: consuming channel
+        :param messages: delivery tag to received message mapping
+        :type messages: dict
+        :return: None
+        """
+        deadline = time.monotonic() + self.drain_timeout
+        while not connection.is_closed and not self._drain_expired(deadline):
+            await self._flush(channel, messages)
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+
+    async def _close(self, connection, channel, messages: dict):
+        """Send pending acknowledgements and close connection."""
+        if not connection.is_closed:
+            await self._flush(channel, messages, force=True)
+            await connection.close()
+
+    async def message_generator(self):
+        """Start listening process.
+
+        Yields received messages one-by-one.
+        Every yielded delivery should be reported with ack or reject.
+
+        :return: deliveries
+        """
+        connection, channel, received, messages = await self._connect()
+        try:
+            while not self._stopping.is_set():
+                delivery = await self._receive(
+                    connection, channel, received, messages, self.ack_interval
+                )
+                if delivery is not None:
+                    self._dispatch([delivery])
+                    yield delivery
+            await self._drain(connection, channel, messages)
+        finally:
+            await self._close(connection, channel, messages)
+
+    async def message_batches(self, size: int, timeout: float):
+        """Start listening process.
+
+        Yields received messages in batches, see
+        ``RabbitReader.message_batches``.
+        Every yielded delivery should be reported with ack or reject.
+
+        :param size: maximum number of messages in batch
+        :type size: int
+        :param timeout: maximum time to wait for batch to fill, in seconds
+        :type timeout: float
+        :return: lists of deliveries
+        """
+        connection, channel, received, messages = await self._connect()
+        try:
+            while not self._stopping.is_set():
+                batch = []
+                deadline = None
+                while len(batch) < size and not self._stopping.is_set():
+                    time_limit = self.ack_interval
+                    if deadline is not None:
+                        time_limit = min(
+                            deadline - time.monotonic(), time_limit
+                        )
+                        if time_limit <= 0:
+                            break
+                    delivery = await self._receive(
+                        connection, channel, received, messages, time_limit
+                    )
+                    if delivery is None:
+                        continue
+                    batch.append(delivery)
+                    if deadline is None:
+                        deadline = time.monotonic() + timeout
+                if batch:
+                    self._dispatch(batch)
+                    yield batch
+            await self._drain(connection, channel, messages)
+        finally:
+            await self._close(connection, channel, messages)
@@ -0,0 +1,185 @@
+"""Digest payload codecs for Redis.
+
+JSON payloads are written as is, so existing readers keep working.
+Binary payloads start with a header: ``MAGIC``, format version byte
+and compression byte. ``decode_digest`` reads both, so readers can be
+updated before writers during a rollout.
+"""
+import zlib
+from typing import Protocol
+
+from digest.schemas import DigestDTO, PostDTO
+
+MAGIC = b'DG'
+MSGPACK_VERSION = 1
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+COMPRESSIONS = {
+    'none': COMPRESSION_NONE,
+    'zlib': COMPRESSION_ZLIB,
+    'zstd': COMPRESSION_ZSTD,
+}
+
+
+class Codec(Protocol):
+    """Converts Digest to Redis payload."""
+
+    def encode(self, digest_data: DigestDTO) -> str | bytes:
+        """Encode digest to payload."""
+
+
+class JsonCodec:
+    """Plain JSON of DigestDTO, without header."""
+
+    def encode(self, digest_data: DigestDTO) -> str:
+        """Encode digest to JSON.
+
+        :param digest_data: digest to be encoded
+        :type digest_data: DigestDTO
+        :return: JSON string
+        """
+        return digest_data.model_dump_json()
+
+
+class MsgpackCodec:
+    """Compact binary format, compressed above size threshold.
+
+    Digest is packed as msgpack array
+    ``[id, user_id, timestamp, [[id, subscription_id, rating, content]]]``,
+    timestamp being ISO string. Requires msgpack,
+    and zstandard for zstd compression.
+    """
+
+    def __init__(
+        self,
+        compression: str = 'zlib',
+        threshold: int = 1024,
+        level: int | None = None,
+    ):
+        """Initialize codec.
+
+        :param compression: none, zlib or zstd
+        :type compression: str
+        :param threshold: minimal packed size to be compressed, in bytes
+        :type threshold: int
+        :param level: compression level, library default if not provided
+        :type level: int
+        """
+        import msgpack
+
+        if compression not in COMPRESSIONS:
+            raise ValueError(f'Unknown compression: {compression}')
+        self.packer = msgpack.Packer()
+        self.compression = COMPRESSIONS[compression]
+        self.threshold = threshold
+        self.compress = None
+        if self.compression == COMPRESSION_ZLIB:
+            level = -1 if level is None else level
+            self.compress = lambda data: zlib.compress(data, level)
+        elif self.compression == COMPRESSION_ZSTD:
+            import zstandard
+
+            kwargs = {} if level is None else {'level': level}
+            self.compress = zstandard.ZstdCompressor(**kwargs).compress
+
+    def encode(self, digest_data: DigestDTO) -> bytes:
+        """Encode digest to binary payload.
+
+        :param digest_data: digest to be encoded
+        :type digest_data: DigestDTO
+        :return: header and packed, possibly compressed, digest
+        """
+        packed = self.packer.pack(
+            [
+                digest_data.id,
+                digest_data.user_id,
+                digest_data.timestamp.isoformat(),
+                [
+                    [post.id, post.subscription_id, post.rating, post.content]
+                    for post in digest_data.posts
+                ],
+            ]
+        )
+        compression = COMPRESSION_NONE
+        if self.compress is not None and len(packed) >= self.threshold:
+            compression = self.compression
+            packed = self.compress(packed)
+        return MAGIC + bytes((MSGPACK_VERSION, compression)) + packed
+
+
+def make_codec(
+    name: str = 'json',
+    compression: str = 'zlib',
+    threshold: int = 1024,
+) -> Codec:
+    """Create codec by name.
+
+    :param name: json or msgpack
+    :type name: str
+    :param compression: compression of msgpack codec
+    :type compression: str
+    :param threshold: compression threshold of msgpack codec, in bytes
+    :type threshold: int
+    :return: codec instance
+    """
+    if name == 'json':
+        return JsonCodec()
+    if name == 'msgpack':
+        return MsgpackCodec(compression, threshold)
+    raise ValueError(f'Unknown codec: {name}')
+
+
+def decompress(compression: int, data: bytes) -> bytes:
+    """Decompress payload body according to header.
+
+    :param compression: compression byte of header
+    :type compression: int
+    :param data: payload body
+    :type data: bytes
+    :return: decompressed body
+    """
+    if compression == COMPRESSION_NONE:
+        return data
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(data)
+    if compression == COMPRESSION_ZSTD:
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f'Unknown payload compression: {compression}')
+
+
+def decode_digest(payload: str | bytes) -> DigestDTO:
+    """Decode payload written by any codec.
+
+    :param payload: payload read from Redis
+    :type payload: str | bytes
+    :return: decoded digest
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if not payload.startswith(MAGIC):
+        return DigestDTO.model_validate_json(payload)
+    version, compression = payload[len(MAGIC)], payload[len(MAGIC) + 1]
+    if version != MSGPACK_VERSION:
+        raise ValueError(f'Unknown payload version: {version}')
+    import msgpack
+
+    body = decompress(compression, payload[len(MAGIC) + 2 :])
+    id_, user_id, timestamp, posts = msgpack.unpackb(body)
+    return DigestDTO(
+        id=id_,
+        user_id=user_id,
+        timestamp=timestamp,
+        posts=[
+            PostDTO(
+                id=post_id,
+                subscription_id=subscription_id,
+                rating=rating,
+                content=content,
+            )
+            for post_id, subscription_id, rating, content in posts
+        ],
+    )
@@ -1,7 +1,32 @@
 """Database adapters."""
+import io
+from collections.abc import Iterable, Mapping, Sequence
 from contextlib import contextmanager
+from datetime import datetime
+from typing import NamedTuple
 
-from sqlalchemy import insert, select
+from sqlalchemy import (
+    Insert,
+    Integer,
+    Row,
+    Select,
+    Subquery,
+    TextClause,
+    Update,
+    and_,
+    any_,
+    bindparam,
+    exists,
+    func,
+    insert,
+    or_,
+    select,
+    text,
+    true,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import Session, selectinload, sessionmaker
 
 from digest.db import (
@@ -9,9 +34,647 @@ from digest.db import (
     Post,
     PostDigest,
     Subscription,
+    SubscriptionTopPost,
     UserSubscription,
 )
-from digest.schemas import DigestDTO, PostDTO
+from digest.schemas import DigestDTO, PostDTO, PostRank, UserPostRank
+
+RANK_COLUMNS = (Post.id, Post.subscription_id, Post.rating)
+
+
+def posts_for_user_stmt(user_id: int, columns: Sequence = (Post,)) -> Select:
+    """Build query selecting all posts from user subscriptions.
+
+    Posts are ordered by ID, so filters relying on stable sorting
+    break rating ties the same way on every call.
+
+    :param user_id: target user ID
+    :type user_id: int
+    :param columns: entity or columns to be selected
+    :type columns: Sequence
+    :return: select statement
+    """
+    stmt = select(*columns).join(Subscription).join(UserSubscription)
+    stmt = stmt.where(Subscription.id == Post.subscription_id)
+    stmt = stmt.where(UserSubscription.user_id == user_id)
+    return stmt.order_by(Post.id)
+
+
+def post_ranks_for_users_stmt(user_ids: Sequence[int]) -> Select:
+    """Build query selecting ranking fields of posts for many users.
+
+    User IDs are sent as single array parameter (``user_id = ANY(...)``),
+    so statement text does not depend on batch size.
+    Rows are ordered by user ID, then by post ID.
+
+    :param user_ids: target user IDs
+    :type user_ids: Sequence[int]
+    :return: select statement
+    """
+    user_ids_param = bindparam(
+        'user_ids',
+        [int(user_id) for user_id in user_ids],
+        type_=ARRAY(Integer),
+    )
+    stmt = select(UserSubscription.user_id, *RANK_COLUMNS)
+    stmt = stmt.join(
+        Post, Post.subscription_id == UserSubscription.subscription_id
+    )
+    stmt = stmt.where(UserSubscription.user_id == any_(user_ids_param))
+    return stmt.order_by(UserSubscription.user_id, Post.id)
+
+
+def leaderboard_ranks_stmt(
+    user_ids: Sequence[int], with_user: bool = True
+) -> Select:
+    """Build query selecting leaderboard posts of users subscriptions.
+
+    Every subscription contributes at most ``LEADERBOARD_SIZE`` posts,
+    with ratings as of last leaderboards refresh.
+
+    :param user_ids: target user IDs
+    :type user_ids: Sequence[int]
+    :param with_user: select user ID before ranking fields
+    :type with_user: bool
+    :return: select statement
+    """
+    board = SubscriptionTopPost
+    user_ids_param = bindparam(
+        'user_ids',
+        [int(user_id) for user_id in user_ids],
+        type_=ARRAY(Integer),
+    )
+    columns = (board.c.post_id, board.c.subscription_id, board.c.rating)
+    if with_user:
+        columns = (UserSubscription.user_id, *columns)
+    stmt = select(*columns).select_from(UserSubscription)
+    stmt = stmt.join(
+        board, board.c.subscription_id == UserSubscription.subscription_id
+    )
+    stmt = stmt.where(UserSubscription.user_id == any_(user_ids_param))
+    # posts deleted since last refresh can not be put into digest
+    stmt = stmt.where(exists().where(Post.id == board.c.post_id))
+    return stmt.order_by(UserSubscription.user_id, board.c.post_id)
+
+
+def leaderboard_posts_stmt(user_id: int) -> Select:
+    """Build query selecting leaderboard posts of user subscriptions.
+
+    :param user_id: target user ID
+    :type user_id: int
+    :return: select statement
+    """
+    post_ids = leaderboard_ranks_stmt([user_id], with_user=False)
+    post_ids = post_ids.with_only_columns(SubscriptionTopPost.c.post_id)
+    stmt = select(Post).where(Post.id.in_(post_ids.order_by(None)))
+    return stmt.order_by(Post.id)
+
+
+def refresh_leaderboards_stmt(concurrently: bool = True) -> TextClause:
+    """Build statement refreshing subscription_top_posts view.
+
+    :param concurrently: do not block reads while refreshing
+    :type concurrently: bool
+    :return: text statement
+    """
+    mode = ' CONCURRENTLY' if concurrently else ''
+    return text(f'REFRESH MATERIALIZED VIEW{mode} {SubscriptionTopPost.name}')
+
+
+def subscriptions_for_users_stmt(user_ids: Sequence[int]) -> Select:
+    """Build query selecting subscription IDs of many users.
+
+    :param user_ids: target user IDs
+    :type user_ids: Sequence[int]
+    :return: select statement
+    """
+    user_ids_param = bindparam(
+        'user_ids',
+        [int(user_id) for user_id in user_ids],
+        type_=ARRAY(Integer),
+    )
+    stmt = select(UserSubscription.user_id, UserSubscription.subscription_id)
+    stmt = stmt.where(UserSubscription.user_id == any_(user_ids_param))
+    return stmt.order_by(
+        UserSubscription.user_id, UserSubscription.subscription_id
+    )
+
+
+def subscribers_stmt(subscription_ids: Sequence[int]) -> Select:
+    """Build query selecting users subscribed to any of subscriptions.
+
+    :param subscription_ids: target subscription IDs
+    :type subscription_ids: Sequence[int]
+    :return: select statement
+    """
+    subscription_ids_param = bindparam(
+        'subscription_ids',
+        [int(subscription_id) for subscription_id in subscription_ids],
+        type_=ARRAY(Integer),
+    )
+    stmt = select(UserSubscription.user_id).distinct()
+    stmt = stmt.where(
+        UserSubscription.subscription_id == any_(subscription_ids_param)
+    )
+    return stmt.order_by(UserSubscription.user_id)
+
+
+def top_posts_stmt(subscription_ids: Sequence[int], limit: int) -> Select:
+    """Build query selecting ranking fields of top posts of subscriptions.
+
+    Every subscription contributes at most ``limit`` posts,
+    best rated first, ties broken by post ID.
+
+    :param subscription_ids: target subscription IDs
+    :type subscription_ids: Sequence[int]
+    :param limit: number of posts per subscription
+    :type limit: int
+    :return: select statement
+    """
+    subscription_ids_param = bindparam(
+        'subscription_ids',
+        [int(subscription_id) for subscription_id in subscription_ids],
+        type_=ARRAY(Integer),
+    )
+    top = select(*RANK_COLUMNS)
+    top = top.where(Post.subscription_id == Subscription.id)
+    top = top.order_by(Post.rating.desc(), Post.id).limit(limit)
+    top = top.lateral('top')
+    stmt = select(top.c.id, top.c.subscription_id, top.c.rating)
+    stmt = stmt.select_from(Subscription).join(top, true())
+    stmt = stmt.where(Subscription.id == any_(subscription_ids_param))
+    return stmt.order_by(top.c.subscription_id, top.c.rating.desc(), top.c.id)
+
+
+def post_ranks_above_stmt(watermarks: Mapping[int, int]) -> Select:
+    """Build query selecting posts of many users added after watermarks.
+
+    :param watermarks: user ID to last seen post ID mapping
+    :type watermarks: Mapping[int, int]
+    :return: select statement
+    """
+    requested = func.unnest(
+        bindparam(
+            'user_ids',
+            [int(user_id) for user_id in watermarks],
+            type_=ARRAY(Integer),
+        ),
+        bindparam(
+            'watermarks',
+            [int(watermark) for watermark in watermarks.values()],
+            type_=ARRAY(Integer),
+        ),
+    )
+    requested = requested.table_valued('user_id', 'watermark')
+    requested = requested.render_derived(name='requested')
+    stmt = select(requested.c.user_id, *RANK_COLUMNS)
+    stmt = stmt.select_from(requested)
+    stmt = stmt.join(
+        UserSubscription, UserSubscription.user_id == requested.c.user_id
+    )
+    stmt = stmt.join(
+        Post,
+        and_(
+            Post.subscription_id == UserSubscription.subscription_id,
+            Post.id > requested.c.watermark,
+        ),
+    )
+    return stmt.order_by(requested.c.user_id, Post.id)
+
+
+def post_ranks_range_stmt(
+    after: int = 0,
+    up_to: int | None = None,
+    subscription_ids: Sequence[int] | None = None,
+) -> Select:
+    """Build query selecting ranking fields of posts within ID range.
+
+    :param after: select posts with greater IDs only
+    :type after: int
+    :param up_to: select posts with IDs not greater than that, if set
+    :type up_to: int | None
+    :param subscription_ids: select posts of these subscriptions only,
+        if set
+    :type subscription_ids: Sequence[int] | None
+    :return: select statement
+    """
+    stmt = select(*RANK_COLUMNS).where(Post.id > after)
+    if up_to is not None:
+        stmt = stmt.where(Post.id <= up_to)
+    if subscription_ids is not None:
+        subscription_ids_param = bindparam(
+            'subscription_ids',
+            [int(subscription_id) for subscription_id in subscription_ids],
+            type_=ARRAY(Integer),
+        )
+        stmt = stmt.where(Post.subscription_id == any_(subscription_ids_param))
+    return stmt
+
+
+def all_subscriptions_stmt() -> Select:
+    """Build query selecting subscriptions of all users.
+
+    :return: select statement
+    """
+    return select(UserSubscription.user_id, UserSubscription.subscription_id)
+
+
+def last_post_id_stmt() -> Select:
+    """Build query selecting the highest post ID, 0 if there are no posts.
+
+    :return: select statement
+    """
+    return select(func.coalesce(func.max(Post.id), 0))
+
+
+def candidate_ranks_subquery(
+    user_condition,
+    limit: int,
+    per_subscription: bool = True,
+    leaderboards: bool = False,
+) -> Subquery:
+    """Build subquery of posts a rating-based filter can choose.
+
+    Every subscription contributes at most ``limit`` top-rated posts,
+    which are then ranked inside the subscription and across all
+    subscriptions of the same user. Post is a candidate if it is among
+    ``limit`` best posts of the user, or (with ``per_subscription``)
+    if it is the best post of one of ``limit`` best-ranked subscriptions.
+
+    Ties are broken by post ID, matching ``posts_for_user_stmt`` order.
+    With ``leaderboards`` top posts are read from subscription_top_posts
+    view, as of its last refresh, so ``limit`` should not exceed
+    ``LEADERBOARD_SIZE``.
+
+    :param user_condition: condition on ``UserSubscription.user_id``
+        selecting target users
+    :param limit: how many posts filter is going to choose
+    :type limit: int
+    :param per_subscription: include best post of every subscription
+    :type per_subscription: bool
+    :param leaderboards: read top posts from leaderboards
+    :type leaderboards: bool
+    :return: subquery with user_id, id, subscription_id and rating
+        columns
+    """
+    if leaderboards:
+        board = SubscriptionTopPost
+        top = select(
+            board.c.post_id.label('id'),
+            board.c.subscription_id,
+            board.c.rating,
+        )
+        top = top.where(
+            board.c.subscription_id == UserSubscription.subscription_id
+        )
+        # posts deleted since last refresh can not be put into digest
+        top = top.where(exists().where(Post.id == board.c.post_id))
+        top = top.order_by(board.c.position)
+    else:
+        top = select(Post.id, Post.subscription_id, Post.rating)
+        top = top.where(
+            Post.subscription_id == UserSubscription.subscription_id
+        )
+        top = top.order_by(Post.rating.desc(), Post.id)
+    top = top.limit(limit).lateral('top')
+
+    order = (top.c.rating.desc(), top.c.id)
+    subscription_rank = func.row_number().over(
+        partition_by=(UserSubscription.user_id, top.c.subscription_id),
+        order_by=order,
+    )
+    global_rank = func.row_number().over(
+        partition_by=UserSubscription.user_id, order_by=order
+    )
+    ranked = select(
+        UserSubscription.user_id,
+        top.c.id,
+        top.c.subscription_id,
+        top.c.rating,
+        subscription_rank.label('subscription_rank'),
+        global_rank.label('global_rank'),
+    )
+    ranked = ranked.select_from(UserSubscription).join(top, true())
+    ranked = ranked.where(user_condition)
+    ranked = ranked.subquery('ranked')
+
+    columns = (
+        ranked.c.user_id,
+        ranked.c.id,
+        ranked.c.subscription_id,
+        ranked.c.rating,
+    )
+    if not per_subscription:
+        candidates = select(*columns).where(ranked.c.global_rank <= limit)
+        return candidates.subquery('candidates')
+    is_leader = ranked.c.subscription_rank == 1
+    leader_rank = func.row_number().over(
+        partition_by=(ranked.c.user_id, is_leader),
+        order_by=(ranked.c.rating.desc(), ranked.c.id),
+    )
+    marked = select(
+        *columns,
+        ranked.c.global_rank,
+        is_leader.label('is_leader'),
+        leader_rank.label('leader_rank'),
+    ).subquery('marked')
+    condition = or_(
+        marked.c.global_rank <= limit,
+        and_(marked.c.is_leader, marked.c.leader_rank <= limit),
+    )
+    candidates = select(
+        marked.c.user_id,
+        marked.c.id,
+        marked.c.subscription_id,
+        marked.c.rating,
+    ).where(condition)
+    return candidates.subquery('candidates')
+
+
+def candidate_posts_stmt(
+    user_id: int,
+    limit: int,
+    per_subscription: bool = True,
+    columns: Sequence = (Post,),
+) -> Select:
+    """Build query selecting only posts a rating-based filter can choose.
+
+    See ``candidate_ranks_subquery`` for which posts are candidates.
+
+    :param user_id: target user ID
+    :type user_id: int
+    :param limit: how many posts filter is going to choose
+    :type limit: int
+    :param per_subscription: include best post of every subscription
+    :type per_subscription: bool
+    :param columns: entity or columns to be selected
+    :type columns: Sequence
+    :return: select statement
+    """
+    candidates = candidate_ranks_subquery(
+        UserSubscription.user_id == user_id, limit, per_subscription
+    )
+    stmt = select(*columns).where(Post.id.in_(select(candidates.c.id)))
+    return stmt.order_by(Post.id)
+
+
+def candidate_ranks_for_users_stmt(
+    user_ids: Sequence[int],
+    limit: int,
+    per_subscription: bool = True,
+    leaderboards: bool = False,
+    with_user: bool = True,
+) -> Select:
+    """Build query selecting candidate posts for many users.
+
+    Batched version of ``candidate_posts_stmt``: candidates are ranked
+    separately for every user, top posts of every subscription are read
+    with the same LATERAL subquery. User IDs are sent as single array
+    parameter. Rows are ordered by user ID, then by post ID.
+
+    :param user_ids: target user IDs
+    :type user_ids: Sequence[int]
+    :param limit: how many posts filter is going to choose
+    :type limit: int
+    :param per_subscription: include best post of every subscription
+    :type per_subscription: bool
+    :param leaderboards: read top posts from leaderboards
+    :type leaderboards: bool
+    :param with_user: select user ID before ranking fields
+    :type with_user: bool
+    :return: select statement
+    """
+    user_ids_param = bindparam(
+        'user_ids',
+        [int(user_id) for user_id in user_ids],
+        type_=ARRAY(Integer),
+    )
+    candidates = candidate_ranks_subquery(
+        UserSubscription.user_id == any_(user_ids_param),
+        limit,
+        per_subscription,
+        leaderboards,
+    )
+    columns = (
+        candidates.c.id,
+        candidates.c.subscription_id,
+        candidates.c.rating,
+    )
+    if with_user:
+        columns = (candidates.c.user_id, *columns)
+    stmt = select(*columns)
+    return stmt.order_by(candidates.c.user_id, candidates.c.id)
+
+
+def digest_stmt(digest_id: int) -> Select:
+    """Build query selecting Digest with its posts.
+
+    :param digest_id: target digest ID
+    :type digest_id: int
+    :return: select statement
+    """
+    stmt = select(Digest)
+    stmt = stmt.where(Digest.id == digest_id)
+    return stmt.options(selectinload(Digest.posts))
+
+
+def digest_posts_stmt(digest_id: int) -> Select:
+    """Build query selecting posts of given Digest.
+
+    Same lookup ``selectinload(Digest.posts)`` does while reading Digest.
+
+    :param digest_id: target digest ID
+    :type digest_id: int
+    :return: select statement
+    """
+    stmt = select(Post).join(PostDigest, PostDigest.post_id == Post.id)
+    return stmt.where(PostDigest.digest_id == digest_id)
+
+
+def posts_by_ids_stmt(post_ids: Sequence[int]) -> Select:
+    """Build query selecting full posts by IDs, without ORM entities.
+
+    :param post_ids: target post IDs
+    :type post_ids: Sequence[int]
+    :return: select statement
+    """
+    stmt = select(*RANK_COLUMNS, Post.content)
+    return stmt.where(Post.id.in_(post_ids))
+
+
+def create_digests_stmt() -> Insert:
+    """Build executemany insert of Digests returning created rows.
+
+    Rows are returned in order of parameters, so they can be zipped
+    with user IDs they were created for.
+
+    :return: insert statement
+    """
+    return insert(Digest).returning(
+        Digest.id,
+        Digest.user_id,
+        Digest.timestamp,
+        sort_by_parameter_order=True,
+    )
+
+
+def allocate_digest_ids_stmt(count: int) -> Select:
+    """Build query taking ``count`` IDs from digests sequence at once.
+
+    Every row also carries ``localtimestamp``, the value
+    ``digests.timestamp`` default would get in this transaction.
+
+    :param count: number of IDs
+    :type count: int
+    :return: select statement
+    """
+    sequence = func.pg_get_serial_sequence(Digest.__tablename__, 'id')
+    stmt = select(func.nextval(sequence), func.localtimestamp())
+    return stmt.select_from(func.generate_series(1, count))
+
+
+def touch_digests_stmt(digests: Sequence[tuple[int, int]]) -> Update:
+    """Build query refreshing timestamp of existing Digests.
+
+    Digest is touched only if it still belongs to expected user.
+
+    :param digests: (digest ID, user ID) pairs
+    :type digests: Sequence[tuple[int, int]]
+    :return: update statement returning touched rows
+    """
+    stmt = update(Digest).where(tuple_(Digest.id, Digest.user_id).in_(digests))
+    stmt = stmt.values(timestamp=func.localtimestamp())
+    return stmt.returning(Digest.id, Digest.user_id, Digest.timestamp)
+
+
+class DigestRow(NamedTuple):
+    """Digest row written without RETURNING."""
+
+    id: int
+    user_id: int
+    timestamp: datetime
+
+
+def allocated_digest_rows(
+    user_ids: Sequence[int], allocated: Iterable[Sequence]
+) -> list[DigestRow]:
+    """Assign allocated IDs and timestamp to users.
+
+    :param user_ids: users Digests are created for
+    :type user_ids: Sequence[int]
+    :param allocated: rows returned by ``allocate_digest_ids_stmt``
+    :type allocated: Iterable[Sequence]
+    :return: list of Digest rows, in order of user IDs
+    """
+    return [
+        DigestRow(digest_id, int(user_id), timestamp)
+        for user_id, (digest_id, timestamp) in zip(
+            user_ids, allocated, strict=True
+        )
+    ]
+
+
+def copy_rows(
+    cursor, table: str, columns: Sequence[str], rows: Iterable[Sequence]
+):
+    """Load rows into table with COPY, using psycopg2 cursor.
+
+    Values are sent in COPY text format, so they should not contain
+    tabs, newlines or backslashes (IDs and timestamps do not).
+
+    :param cursor: psycopg2 cursor
+    :param table: target table name
+    :type table: str
+    :param columns: target column names
+    :type columns: Sequence[str]
+    :param rows: rows of values, in order of columns
+    :type rows: Iterable[Sequence]
+    :return: None
+    """
+    buffer = io.StringIO()
+    buffer.writelines('\t'.join(map(str, row)) + '\n' for row in rows)
+    buffer.seek(0)
+    cursor.copy_expert(
+        f'COPY {table} ({", ".join(columns)}) FROM STDIN', buffer
+    )
+
+
+def ordered_posts(
+    rows: Iterable[Row], post_ids: Sequence[int]
+) -> list[PostDTO]:
+    """Build posts from ``posts_by_ids_stmt`` rows in order of given IDs.
+
+    Missing posts are skipped.
+
+    :param rows: selected rows
+    :type rows: Iterable[Row]
+    :param post_ids: requested post IDs
+    :type post_ids: Sequence[int]
+    :return: list of Posts
+    """
+    posts = {row.id: row for row in rows}
+    return [
+        PostDTO(
+            id=post.id,
+            subscription_id=post.subscription_id,
+            content=post.content,
+            rating=post.rating,
+        )
+        for post in map(posts.get, post_ids)
+        if post is not None
+    ]
+
+
+def post_digest_rows(
+    digests: Mapping[int, Sequence[int]],
+    user_ids: Sequence[int],
+    created: Sequence[Row | DigestRow],
+) -> list[dict]:
+    """Build post links parameters of just created Digests.
+
+    :param digests: user ID to post IDs mapping
+    :type digests: Mapping[int, Sequence[int]]
+    :param user_ids: users Digests were created for
+    :type user_ids: Sequence[int]
+    :param created: rows returned by ``create_digests_stmt``
+    :type created: Sequence[Row | DigestRow]
+    :return: list of PostDigest parameters
+    """
+    return [
+        {'post_id': post_id, 'digest_id': digest_.id}
+        for user_id, digest_ in zip(user_ids, created, strict=True)
+        for post_id in digests[user_id]
+    ]
+
+
+def assemble_digests(
+    digests: Mapping[int, Sequence[int]],
+    user_ids: Sequence[int],
+    created: Sequence[Row | DigestRow],
+    posts: Iterable[PostDTO],
+) -> dict[int, DigestDTO]:
+    """Build Digests from created rows and their posts.
+
+    :param digests: user ID to post IDs mapping
+    :type digests: Mapping[int, Sequence[int]]
+    :param user_ids: users Digests were created for
+    :type user_ids: Sequence[int]
+    :param created: rows returned by ``create_digests_stmt``
+    :type created: Sequence[Row | DigestRow]
+    :param posts: posts of all created Digests
+    :type posts: Iterable[PostDTO]
+    :return: user ID to Digest mapping
+    """
+    posts_by_id = {post.id: post for post in posts}
+    return {
+        user_id: DigestDTO(
+            id=digest_.id,
+            user_id=digest_.user_id,
+            timestamp=digest_.timestamp,
+            posts=[posts_by_id[post_id] for post_id in digests[user_id]],
+        )
+        for user_id, digest_ in zip(user_ids, created, strict=True)
+    }
 
 
 class RepoBase:
@@ -44,10 +707,46 @@ class RepoBase:
                 current_session.commit()
             current_session.close()
 
+    @contextmanager
+    def snapshot(self):
+        """Open Session reading one consistent database snapshot.
+
+        Transaction is REPEATABLE READ, so all reads made with the
+        session see the same committed rows. It is rolled back on exit.
+
+        :return: Session instance to work with
+        """
+        with self.sessionmaker() as session:
+            session.connection(
+                execution_options={'isolation_level': 'REPEATABLE READ'}
+            )
+            yield session
+
 
 class Gateway(RepoBase):
     """Database adapter. Works with all used in project tables."""
 
+    def __init__(
+        self, sessionmaker_: sessionmaker, leaderboards: bool = False
+    ):
+        """Initialize adapter with sessionmaker.
+
+        If leaderboards is set, posts of user subscriptions
+        (``read_posts_for_user``, ``read_post_ranks_for_user(s)``)
+        and candidate posts (``read_candidate_ranks_for_user(s)``)
+        are read from subscription_top_posts view: at most
+        ``LEADERBOARD_SIZE`` best rated posts of every subscription,
+        with ratings as of last refresh. Posts deleted since then
+        are skipped.
+
+        :param sessionmaker_: sessionmaker instance
+        :type sessionmaker_: sessionmaker
+        :param leaderboards: read posts from leaderboards
+        :type leaderboards: bool
+        """
+        super().__init__(sessionmaker_)
+        self.leaderboards = leaderboards
+
     def read_posts_for_user(
         self, user_id: int, session: Session | None = None
     ) -> list[PostDTO]:
@@ -59,14 +758,263 @@ class Gateway(RepoBase):
         :type session: Session
         :return: list of Posts
         """
-        stmt = select(Post).join(Subscription).join(UserSubscription)
-        stmt = stmt.where(Subscription.id == Post.subscription_id)
-        stmt = stmt.where(UserSubscription.user_id == user_id)
+        if self.leaderboards:
+            stmt = leaderboard_posts_stmt(user_id)
+        else:
+            stmt = posts_for_user_stmt(user_id)
+        with self.session_control(commit=False, session=session) as s:
+            response = s.execute(stmt)
+            posts: list[Post] = response.scalars().all()
+        return [PostDTO.model_validate(post) for post in posts]
+
+    def read_candidate_posts_for_user(
+        self,
+        user_id: int,
+        limit: int,
+        per_subscription: bool = True,
+        session: Session | None = None,
+    ) -> list[PostDTO]:
+        """Read only posts which rating-based filter is able to choose.
+
+        Ranking is done by Postgres, so at most ``2 * limit`` posts
+        are transferred regardless of subscriptions size.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :param limit: how many posts filter is going to choose
+        :type limit: int
+        :param per_subscription: include best post of every subscription
+        :type per_subscription: bool
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: list of Posts
+        """
+        stmt = candidate_posts_stmt(user_id, limit, per_subscription)
         with self.session_control(commit=False, session=session) as s:
             response = s.execute(stmt)
             posts: list[Post] = response.scalars().all()
         return [PostDTO.model_validate(post) for post in posts]
 
+    def read_post_ranks_for_user(
+        self, user_id: int, session: Session | None = None
+    ) -> list[PostRank]:
+        """Read ranking fields of posts from user subscriptions.
+
+        Post content is not selected and no ORM entities are built,
+        which makes this path much cheaper than ``read_posts_for_user``.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: list of PostRanks
+        """
+        if self.leaderboards:
+            stmt = leaderboard_ranks_stmt([user_id], with_user=False)
+        else:
+            stmt = posts_for_user_stmt(user_id, RANK_COLUMNS)
+        with self.session_control(commit=False, session=session) as s:
+            response = s.connection().execute(stmt)
+            return list(map(PostRank._make, response))
+
+    def read_post_ranks_for_users(
+        self, user_ids: Sequence[int], session: Session | None = None
+    ) -> list[UserPostRank]:
+        """Read ranking fields of posts for many users in one query.
+
+        Post subscribed by several users of the batch is returned
+        once for every such user.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: list of UserPostRanks, ordered by user ID and post ID
+        """
+        if not user_ids:
+            return []
+        if self.leaderboards:
+            stmt = leaderboard_ranks_stmt(user_ids)
+        else:
+            stmt = post_ranks_for_users_stmt(user_ids)
+        with self.session_control(commit=False, session=session) as s:
+            response = s.connection().execute(stmt)
+            return list(map(UserPostRank._make, response))
+
+    def read_subscriptions_for_users(
+        self, user_ids: Sequence[int], session: Session | None = None
+    ) -> dict[int, list[int]]:
+        """Read subscription IDs of many users in one query.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: user ID to subscription IDs mapping.
+            Users without subscriptions get empty list
+        """
+        result = {int(user_id): [] for user_id in user_ids}
+        if not result:
+            return result
+        stmt = subscriptions_for_users_stmt(user_ids)
+        with self.session_control(commit=False, session=session) as s:
+            for user_id, subscription_id in s.connection().execute(stmt):
+                result[user_id].append(subscription_id)
+        return result
+
+    def read_subscribers(
+        self, subscription_ids: Sequence[int], session: Session | None = None
+    ) -> list[int]:
+        """Read users subscribed to any of subscriptions.
+
+        :param subscription_ids: target subscription IDs
+        :type subscription_ids: Sequence[int]
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: user IDs, ascending
+        """
+        if not subscription_ids:
+            return []
+        stmt = subscribers_stmt(subscription_ids)
+        with self.session_control(commit=False, session=session) as s:
+            return list(s.scalars(stmt))
+
+    def read_top_posts(
+        self,
+        subscription_ids: Sequence[int],
+        limit: int,
+        session: Session | None = None,
+    ) -> list[PostRank]:
+        """Read ranking fields of top posts of many subscriptions.
+
+        :param subscription_ids: target subscription IDs
+        :type subscription_ids: Sequence[int]
+        :param limit: number of posts per subscription
+        :type limit: int
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: list of PostRanks, grouped by subscription,
+            best rated first
+        """
+        if not subscription_ids:
+            return []
+        stmt = top_posts_stmt(subscription_ids, limit)
+        with self.session_control(commit=False, session=session) as s:
+            response = s.connection().execute(stmt)
+            return list(map(PostRank._make, response))
+
+    def read_post_ranks_above(
+        self, watermarks: Mapping[int, int], session: Session | None = None
+    ) -> list[UserPostRank]:
+        """Read ranking fields of posts added after per-user watermarks.
+
+        :param watermarks: user ID to last seen post ID mapping
+        :type watermarks: Mapping[int, int]
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: list of UserPostRanks, ordered by user ID and post ID
+        """
+        if not watermarks:
+            return []
+        stmt = post_ranks_above_stmt(watermarks)
+        with self.session_control(commit=False, session=session) as s:
+            response = s.connection().execute(stmt)
+            return list(map(UserPostRank._make, response))
+
+    def read_last_post_id(self, session: Session | None = None) -> int:
+        """Read the highest post ID.
+
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: post ID, 0 if there are no posts
+        """
+        with self.session_control(commit=False, session=session) as s:
+            return s.scalar(last_post_id_stmt())
+
+    def read_candidate_ranks_for_user(
+        self,
+        user_id: int,
+        limit: int,
+        per_subscription: bool = True,
+        session: Session | None = None,
+    ) -> list[PostRank]:
+        """Read ranking fields of posts which filter is able to choose.
+
+        Column-projected version of ``read_candidate_posts_for_user``.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :param limit: how many posts filter is going to choose
+        :type limit: int
+        :param per_subscription: include best post of every subscription
+        :type per_subscription: bool
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: list of PostRanks
+        """
+        if self.leaderboards:
+            stmt = candidate_ranks_for_users_stmt(
+                [user_id], limit, per_subscription, True, with_user=False
+            )
+        else:
+            stmt = candidate_posts_stmt(
+                user_id, limit, per_subscription, RANK_COLUMNS
+            )
+        with self.session_control(commit=False, session=session) as s:
+            response = s.connection().execute(stmt)
+            return list(map(PostRank._make, response))
+
+    def read_candidate_ranks_for_users(
+        self,
+        user_ids: Sequence[int],
+        limit: int,
+        per_subscription: bool = True,
+        session: Session | None = None,
+    ) -> list[UserPostRank]:
+        """Read ranking fields of candidate posts for many users.
+
+        Batched version of ``read_candidate_ranks_for_user``.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :param limit: how many posts filter is going to choose
+        :type limit: int
+        :param per_subscription: include best post of every subscription
+        :type per_subscription: bool
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: list of UserPostRanks, ordered by user ID and post ID
+        """
+        if not user_ids:
+            return []
+        stmt = candidate_ranks_for_users_stmt(
+            user_ids, limit, per_subscription, self.leaderboards
+        )
+        with self.session_control(commit=False, session=session) as s:
+            response = s.connection().execute(stmt)
+            return list(map(UserPostRank._make, response))
+
+    def read_posts(
+        self, *post_ids: int, session: Session | None = None
+    ) -> list[PostDTO]:
+        """Read full posts by IDs.
+
+        Meant for fetching content of already chosen posts.
+        Posts are returned in order of given IDs, missing ones are skipped.
+
+        :param post_ids: target post IDs
+        :type post_ids: int
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: list of Posts
+        """
+        if not post_ids:
+            return []
+        stmt = posts_by_ids_stmt(post_ids)
+        with self.session_control(commit=False, session=session) as s:
+            response = s.connection().execute(stmt)
+            return ordered_posts(response, post_ids)
+
     def create_digest(
         self, user_id: int, *post_ids: int, session: Session | None = None
     ) -> DigestDTO | None:
@@ -97,6 +1045,150 @@ class Gateway(RepoBase):
             s.refresh(digest_)
             return DigestDTO.model_validate(digest_)
 
+    def create_digests(
+        self,
+        digests: Mapping[int, Sequence[int]],
+        session: Session | None = None,
+    ) -> dict[int, DigestDTO | None]:
+        """Create and save Digests for many users in one transaction.
+
+        Digests, their post links and their posts are written and read
+        with one statement each, whatever the number of users is.
+
+        :param digests: user ID to post IDs mapping
+        :type digests: Mapping[int, Sequence[int]]
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: user ID to resulting Digest mapping.
+            Users without posts get None
+        """
+        result = dict.fromkeys(digests)
+        user_ids = [user_id for user_id, posts in digests.items() if posts]
+        if not user_ids:
+            return result
+        with self.session_control(commit=True, session=session) as s:
+            created = s.execute(
+                create_digests_stmt(),
+                [{'user_id': int(user_id)} for user_id in user_ids],
+            ).all()
+            s.execute(
+                insert(PostDigest),
+                post_digest_rows(digests, user_ids, created),
+            )
+            post_ids = {
+                post_id for user_id in user_ids for post_id in digests[user_id]
+            }
+            posts = self.read_posts(*post_ids, session=s)
+        result.update(assemble_digests(digests, user_ids, created, posts))
+        return result
+
+    def copy_digests(
+        self,
+        digests: Mapping[int, Sequence[int]],
+        posts: Iterable[PostDTO] | None = None,
+        session: Session | None = None,
+    ) -> dict[int, DigestDTO | None]:
+        """Create and save Digests for many users with COPY.
+
+        Digest IDs are taken from the sequence with one query,
+        then digests and their post links are loaded with COPY.
+        Nothing is read back, Digests are built from already known
+        posts, or from posts read with one query if not provided.
+        Requires psycopg2 driver.
+
+        :param digests: user ID to post IDs mapping
+        :type digests: Mapping[int, Sequence[int]]
+        :param posts: posts of all Digests, if already read
+        :type posts: Iterable[PostDTO]
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: user ID to resulting Digest mapping.
+            Users without posts get None
+        """
+        result = dict.fromkeys(digests)
+        user_ids = [user_id for user_id, posts in digests.items() if posts]
+        if not user_ids:
+            return result
+        with self.session_control(commit=True, session=session) as s:
+            connection = s.connection()
+            allocated = connection.execute(
+                allocate_digest_ids_stmt(len(user_ids))
+            )
+            created = allocated_digest_rows(user_ids, allocated)
+            with connection.connection.dbapi_connection.cursor() as cursor:
+                copy_rows(
+                    cursor,
+                    Digest.__tablename__,
+                    ('id', 'user_id', 'timestamp'),
+                    created,
+                )
+                copy_rows(
+                    cursor,
+                    PostDigest.__tablename__,
+                    ('post_id', 'digest_id'),
+                    (
+                        (row['post_id'], row['digest_id'])
+                        for row in post_digest_rows(digests, user_ids, created)
+                    ),
+                )
+            if posts is None:
+                post_ids = {
+                    post_id
+                    for user_id in user_ids
+                    for post_id in digests[user_id]
+                }
+                posts = self.read_posts(*post_ids, session=s)
+        result.update(assemble_digests(digests, user_ids, created, posts))
+        return result
+
+    def touch_digests(
+        self,
+        digests: Mapping[int, tuple[int, Sequence[int]]],
+        session: Session | None = None,
+    ) -> dict[int, DigestDTO]:
+        """Refresh timestamp of existing Digests instead of creating new.
+
+        :param digests: digest ID to (user ID, post IDs) mapping
+        :type digests: Mapping[int, tuple[int, Sequence[int]]]
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: digest ID to Digest mapping.
+            Missing digests and digests of other users are skipped
+        """
+        if not digests:
+            return {}
+        stmt = touch_digests_stmt(
+            [
+                (digest_id, int(user_id))
+                for digest_id, (user_id, _) in digests.items()
+            ]
+        )
+        post_ids = {
+            digest_id: post_ids for digest_id, (_, post_ids) in digests.items()
+        }
+        with self.session_control(commit=True, session=session) as s:
+            touched = s.execute(stmt).all()
+            posts = self.read_posts(
+                *{post_id for row in touched for post_id in post_ids[row.id]},
+                session=s,
+            )
+        digest_ids = [row.id for row in touched]
+        return assemble_digests(post_ids, digest_ids, touched, posts)
+
+    def refresh_leaderboards(
+        self, concurrently: bool = True, session: Session | None = None
+    ):
+        """Recompute subscription_top_posts view.
+
+        :param concurrently: do not block reads while refreshing
+        :type concurrently: bool
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: None
+        """
+        with self.session_control(commit=True, session=session) as s:
+            s.execute(refresh_leaderboards_stmt(concurrently))
+
     def read_digest(
         self, digest_id: int, session: Session | None = None
     ) -> DigestDTO | None:
@@ -108,9 +1200,7 @@ class Gateway(RepoBase):
         :type session: Session
         :return: found digest or None
         """
-        stmt = select(Digest)
-        stmt = stmt.where(Digest.id == digest_id)
-        stmt = stmt.options(selectinload(Digest.posts))
+        stmt = digest_stmt(digest_id)
         with self.session_control(commit=False, session=session) as s:
             response = s.execute(stmt)
             content: Digest = response.scalars().first()
@@ -0,0 +1,148 @@
+"""PostgresQL notifications adapter. Requires psycopg2."""
+import logging
+import select
+import threading
+from typing import Protocol
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger('digest.notifications')
+
+POSTS_CHANNEL = 'posts_changed'
+EDITS_CHANNEL = 'posts_edited'
+SUBSCRIPTIONS_CHANNEL = 'subscriptions_changed'
+
+
+class Invalidated(Protocol):
+    """State derived from posts, e.g. ``TopPostsCache``."""
+
+    def invalidate(self, subscription_id: int):
+        """Drop state of changed subscription."""
+
+    def clear(self):
+        """Drop all state."""
+
+    def suspend(self):
+        """Drop all state and stop keeping new."""
+
+    def resume(self):
+        """Drop all state and start keeping new."""
+
+
+class PostsListener:
+    """Invalidates state on notifications about changed posts.
+
+    Notifications are sent by ``posts`` triggers, payload being
+    changed subscription ID, or empty string if table was truncated.
+    ``posts_changed`` channel receives every change, ``posts_edited``
+    only updates and deletes. ``subscriptions_changed`` channel receives
+    changes of ``users_subscriptions``, payload being changed user ID.
+    Listening happens on a daemon thread with its own connection.
+    State is suspended while connection is not established,
+    since changes made meanwhile are never notified.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        cache: Invalidated,
+        channel: str = POSTS_CHANNEL,
+        poll_interval: float = 1.0,
+        reconnect_delay: float = 1.0,
+    ):
+        """Initialize listener.
+
+        :param dsn: libpq connection string or URL
+        :type dsn: str
+        :param cache: state to be invalidated
+        :type cache: Invalidated
+        :param channel: notification channel
+        :type channel: str
+        :param poll_interval: how often stop request is checked, in seconds
+        :type poll_interval: float
+        :param reconnect_delay: pause before reconnecting, in seconds
+        :type reconnect_delay: float
+        """
+        self.dsn = dsn
+        self.cache = cache
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+        self.notifications = 0
+        self._stopping = threading.Event()
+        self._thread = None
+        cache.suspend()
+
+    def handle(self, payload: str):
+        """Apply notification to cache.
+
+        :param payload: changed subscription (or user) ID or empty string
+        :type payload: str
+        :return: None
+        """
+        self.notifications += 1
+        if payload:
+            self.cache.invalidate(int(payload))
+        else:
+            self.cache.clear()
+
+    def listen(self):
+        """Receive notifications until stopped, reconnecting on errors.
+
+        :return: None
+        """
+        while not self._stopping.is_set():
+            try:
+                connection = psycopg2.connect(self.dsn)
+            except psycopg2.Error:
+                logger.warning(
+                    'Failed to connect, state of %s is suspended', self.channel
+                )
+                self._stopping.wait(self.reconnect_delay)
+                continue
+            try:
+                connection.set_isolation_level(
+                    psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT
+                )
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+                self.cache.resume()
+                logger.info('Listening to %s', self.channel)
+                while not self._stopping.is_set():
+                    ready, _, _ = select.select(
+                        [connection], [], [], self.poll_interval
+                    )
+                    if not ready:
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self.handle(connection.notifies.pop(0).payload)
+            except psycopg2.Error:
+                logger.warning(
+                    'Lost connection, state of %s is suspended', self.channel
+                )
+            finally:
+                self.cache.suspend()
+                connection.close()
+
+    def start(self):
+        """Start listening on background thread.
+
+        :return: None
+        """
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self.listen, name='posts-listener', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop listening and wait for background thread.
+
+        :return: None
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
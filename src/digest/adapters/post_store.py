@@ -0,0 +1,1401 @@
+"""In-memory columnar store of posts ranking fields.
+
+Requires NumPy, which is an optional dependency.
+
+``PostStore`` keeps ranking fields of all posts, grouped by subscription,
+and subscriptions of all users in NumPy arrays, so posts of user
+subscriptions are found without database round-trips. ``StoreGateway``
+serves ``Gateway`` read queries from the store, and reads post content
+from database only for requested (i.e. chosen) post IDs.
+Columns can be written to a snapshot file and mapped back into memory
+by a starting worker, see ``write_snapshot`` and ``read_snapshot``.
+"""
+import itertools
+import json
+import logging
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+from collections.abc import Iterable, Mapping, Sequence
+from contextlib import contextmanager, suppress
+from typing import NamedTuple
+
+import numpy as np
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, sessionmaker
+
+from digest.adapters.database import (
+    Gateway,
+    RepoBase,
+    all_subscriptions_stmt,
+    last_post_id_stmt,
+    post_ranks_range_stmt,
+    subscriptions_for_users_stmt,
+)
+from digest.schemas import PostDTO, PostRank, UserPostRank
+
+SNAPSHOT_MAGIC = b'DGPS'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_PREFIX = struct.Struct('<4sBxxxI')
+SNAPSHOT_ALIGNMENT = 64
+SNAPSHOT_DTYPE = np.dtype('<i8')
+RELOAD_JITTER = 0.25
+
+logger = logging.getLogger('digest.post_store')
+
+
+class Columns(NamedTuple):
+    """Ranking fields of posts and subscriptions of users, as arrays.
+
+    Posts of ``subscription_ids[i]`` are
+    ``post_ids[offsets[i]:offsets[i + 1]]`` (``ratings`` alike),
+    best rated first, ties broken by post ID. Subscriptions of
+    ``user_ids[j]`` are
+    ``user_subscriptions[user_offsets[j]:user_offsets[j + 1]]``,
+    ascending. ``subscription_ids`` and ``user_ids`` are ascending.
+    """
+
+    subscription_ids: np.ndarray
+    offsets: np.ndarray
+    post_ids: np.ndarray
+    ratings: np.ndarray
+    user_ids: np.ndarray
+    user_offsets: np.ndarray
+    user_subscriptions: np.ndarray
+
+
+class State(NamedTuple):
+    """Immutable state of store, replaced as a whole on every change.
+
+    ``overrides`` maps subscriptions changed since columns were built
+    to their posts (post IDs and ratings, in columns order).
+    ``watermark`` is the highest post ID known to the store.
+    ``user_overrides`` maps users whose subscriptions changed since
+    columns were built to their subscription IDs, ascending.
+    """
+
+    columns: Columns
+    overrides: dict[int, tuple[np.ndarray, np.ndarray]]
+    watermark: int
+    user_overrides: dict[int, np.ndarray]
+
+
+def rows_array(rows: Iterable[Sequence[int]], width: int) -> np.ndarray:
+    """Convert rows of integers to two-dimensional array.
+
+    :param rows: rows of ``width`` integers
+    :type rows: Iterable[Sequence[int]]
+    :param width: number of columns
+    :type width: int
+    :return: array of shape (number of rows, width)
+    """
+    return np.fromiter(
+        itertools.chain.from_iterable(rows), dtype=np.int64
+    ).reshape(-1, width)
+
+
+def group_offsets(keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Find distinct values of sorted array and where they start.
+
+    :param keys: sorted array
+    :type keys: np.ndarray
+    :return: distinct values and offsets of their groups,
+        followed by length of array
+    """
+    unique, starts = np.unique(keys, return_index=True)
+    return unique, np.append(starts, len(keys)).astype(np.int64)
+
+
+def build_columns(posts: np.ndarray, subscriptions: np.ndarray) -> Columns:
+    """Build columns from rows.
+
+    :param posts: (post ID, subscription ID, rating) rows
+    :type posts: np.ndarray
+    :param subscriptions: (user ID, subscription ID) rows
+    :type subscriptions: np.ndarray
+    :return: columns
+    """
+    post_ids, post_subscriptions, ratings = posts.T
+    order = np.lexsort((post_ids, -ratings, post_subscriptions))
+    subscription_ids, offsets = group_offsets(post_subscriptions[order])
+    return Columns(
+        subscription_ids,
+        offsets,
+        post_ids[order],
+        ratings[order],
+        *user_columns(subscriptions),
+    )
+
+
+def user_columns(
+    subscriptions: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Build subscriptions columns from rows.
+
+    :param subscriptions: (user ID, subscription ID) rows
+    :type subscriptions: np.ndarray
+    :return: ``user_ids``, ``user_offsets`` and ``user_subscriptions``
+        columns
+    """
+    users, user_subscriptions = subscriptions.T
+    order = np.lexsort((user_subscriptions, users))
+    user_ids, user_offsets = group_offsets(users[order])
+    return user_ids, user_offsets, user_subscriptions[order]
+
+
+def sorted_posts(
+    post_ids: np.ndarray, ratings: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Sort posts of one subscription the way columns keep them.
+
+    :param post_ids: post IDs
+    :type post_ids: np.ndarray
+    :param ratings: post ratings
+    :type ratings: np.ndarray
+    :return: post IDs and ratings, best rated first
+    """
+    order = np.lexsort((post_ids, -ratings))
+    return post_ids[order], ratings[order]
+
+
+def column_posts(
+    columns: Columns, subscription_id: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Get posts of one subscription from columns.
+
+    :param columns: store columns
+    :type columns: Columns
+    :param subscription_id: target subscription ID
+    :type subscription_id: int
+    :return: post IDs and ratings, best rated first
+    """
+    index = np.searchsorted(columns.subscription_ids, subscription_id)
+    if (
+        index == len(columns.subscription_ids)
+        or columns.subscription_ids[index] != subscription_id
+    ):
+        return columns.post_ids[:0], columns.ratings[:0]
+    start, end = columns.offsets[index], columns.offsets[index + 1]
+    return columns.post_ids[start:end], columns.ratings[start:end]
+
+
+def subscription_posts(
+    state: State, subscription_id: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Get current posts of one subscription.
+
+    :param state: store state
+    :type state: State
+    :param subscription_id: target subscription ID
+    :type subscription_id: int
+    :return: post IDs and ratings, best rated first
+    """
+    if subscription_id in state.overrides:
+        return state.overrides[subscription_id]
+    return column_posts(state.columns, subscription_id)
+
+
+def gather(
+    state: State, subscription_ids: Iterable[int], limit: int | None = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Collect posts of many subscriptions.
+
+    :param state: store state
+    :type state: State
+    :param subscription_ids: target subscription IDs, without duplicates
+    :type subscription_ids: Iterable[int]
+    :param limit: number of best posts taken of every subscription,
+        all if not set
+    :type limit: int | None
+    :return: post IDs, subscription IDs, ratings, and mask of the best
+        post of every subscription, grouped by subscription
+    """
+    columns = state.columns
+    requested = [int(subscription_id) for subscription_id in subscription_ids]
+    overridden = [sid for sid in requested if sid in state.overrides]
+    if overridden:
+        requested = [sid for sid in requested if sid not in state.overrides]
+    requested = np.array(requested, dtype=np.int64)
+    indices = np.searchsorted(columns.subscription_ids, requested)
+    found = indices < len(columns.subscription_ids)
+    found[found] = columns.subscription_ids[indices[found]] == requested[found]
+    indices = indices[found]
+    starts = columns.offsets[indices]
+    lengths = columns.offsets[indices + 1] - starts
+    if limit is not None:
+        lengths = np.minimum(lengths, limit)
+    group_starts = np.cumsum(lengths) - lengths
+    positions = np.repeat(starts - group_starts, lengths) + np.arange(
+        lengths.sum()
+    )
+    leaders = np.zeros(len(positions), dtype=bool)
+    leaders[group_starts[lengths > 0]] = True
+    parts = [
+        (
+            columns.post_ids[positions],
+            np.repeat(columns.subscription_ids[indices], lengths),
+            columns.ratings[positions],
+            leaders,
+        )
+    ]
+    for subscription_id in overridden:
+        post_ids, ratings = state.overrides[subscription_id][:2]
+        post_ids, ratings = post_ids[:limit], ratings[:limit]
+        leaders = np.zeros(len(post_ids), dtype=bool)
+        leaders[:1] = True
+        parts.append(
+            (
+                post_ids,
+                np.full(len(post_ids), subscription_id, dtype=np.int64),
+                ratings,
+                leaders,
+            )
+        )
+    if len(parts) == 1:
+        return parts[0]
+    return tuple(map(np.concatenate, zip(*parts, strict=True)))
+
+
+def to_ranks(
+    post_ids: np.ndarray, subscription_ids: np.ndarray, ratings: np.ndarray
+) -> list[PostRank]:
+    """Convert columns to PostRanks of Python integers.
+
+    :param post_ids: post IDs
+    :type post_ids: np.ndarray
+    :param subscription_ids: subscription IDs
+    :type subscription_ids: np.ndarray
+    :param ratings: ratings
+    :type ratings: np.ndarray
+    :return: list of PostRanks
+    """
+    return list(
+        map(
+            PostRank._make,
+            zip(
+                post_ids.tolist(),
+                subscription_ids.tolist(),
+                ratings.tolist(),
+                strict=True,
+            ),
+        )
+    )
+
+
+def apply_changes(
+    state: State,
+    added: np.ndarray,
+    replaced: Iterable[int],
+    replacements: np.ndarray,
+    watermark: int,
+    resubscribed: Iterable[int] = (),
+    subscriptions: np.ndarray | None = None,
+) -> State:
+    """Build state with added posts and replaced subscriptions.
+
+    New posts already known to the store are skipped, so posts
+    below the watermark may be read again.
+
+    :param state: current state
+    :type state: State
+    :param added: (post ID, subscription ID, rating) rows of new posts
+    :type added: np.ndarray
+    :param replaced: subscriptions whose posts were read again
+    :type replaced: Iterable[int]
+    :param replacements: (post ID, subscription ID, rating) rows
+        of all posts of replaced subscriptions
+    :type replacements: np.ndarray
+    :param watermark: the highest post ID after changes
+    :type watermark: int
+    :param resubscribed: users whose subscriptions were read again
+    :type resubscribed: Iterable[int]
+    :param subscriptions: (user ID, subscription ID) rows
+        of all subscriptions of resubscribed users
+    :type subscriptions: np.ndarray | None
+    :return: new state
+    """
+    overrides = dict(state.overrides)
+    replaced = {int(subscription_id) for subscription_id in replaced}
+    for subscription_id in replaced:
+        rows = replacements[replacements[:, 1] == subscription_id]
+        overrides[subscription_id] = sorted_posts(rows[:, 0], rows[:, 2])
+    for subscription_id in np.unique(added[:, 1]).tolist():
+        if subscription_id in replaced:
+            continue
+        rows = added[added[:, 1] == subscription_id]
+        post_ids, ratings = subscription_posts(state, subscription_id)
+        rows = rows[~np.isin(rows[:, 0], post_ids)]
+        if not len(rows):
+            continue
+        overrides[subscription_id] = sorted_posts(
+            np.concatenate((post_ids, rows[:, 0])),
+            np.concatenate((ratings, rows[:, 2])),
+        )
+    user_overrides = dict(state.user_overrides)
+    for user_id in resubscribed:
+        rows = subscriptions[subscriptions[:, 0] == int(user_id)]
+        user_overrides[int(user_id)] = np.sort(rows[:, 1])
+    return State(state.columns, overrides, watermark, user_overrides)
+
+
+def compact(state: State) -> State:
+    """Merge overridden subscriptions and users into columns.
+
+    :param state: current state
+    :type state: State
+    :return: state without overrides
+    """
+    columns = state.columns
+    counts = np.diff(columns.offsets)
+    post_subscriptions = np.repeat(columns.subscription_ids, counts)
+    kept = ~np.isin(post_subscriptions, list(state.overrides))
+    parts = [
+        np.column_stack(
+            (
+                columns.post_ids[kept],
+                post_subscriptions[kept],
+                columns.ratings[kept],
+            )
+        )
+    ]
+    for subscription_id, (post_ids, ratings) in state.overrides.items():
+        parts.append(
+            np.column_stack(
+                (
+                    post_ids,
+                    np.full(len(post_ids), subscription_id, dtype=np.int64),
+                    ratings,
+                )
+            )
+        )
+    users = np.repeat(columns.user_ids, np.diff(columns.user_offsets))
+    kept = ~np.isin(users, list(state.user_overrides))
+    user_parts = [
+        np.column_stack((users[kept], columns.user_subscriptions[kept]))
+    ]
+    for user_id, subscription_ids in state.user_overrides.items():
+        user_parts.append(
+            np.column_stack(
+                (
+                    np.full(len(subscription_ids), user_id, dtype=np.int64),
+                    subscription_ids,
+                )
+            )
+        )
+    return State(
+        build_columns(np.concatenate(parts), np.concatenate(user_parts)),
+        {},
+        state.watermark,
+        {},
+    )
+
+
+def aligned(position: int) -> int:
+    """Round file position up to ``SNAPSHOT_ALIGNMENT``.
+
+    :param position: position in file
+    :type position: int
+    :return: aligned position
+    """
+    return -(-position // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+
+def write_snapshot(path: str, state: State, loaded_at: float):
+    """Write columns and watermark of state to file.
+
+    File starts with ``SNAPSHOT_PREFIX``: ``SNAPSHOT_MAGIC``, format
+    version and length of JSON header, which holds watermark, load time
+    and position and length of every column. Columns follow as aligned
+    little-endian int64 arrays. File is written next to the target
+    and renamed, so readers never see partially written snapshot.
+
+    :param path: snapshot file path
+    :type path: str
+    :param state: state without overrides and user overrides
+    :type state: State
+    :param loaded_at: when posts and subscriptions were last read
+        as a whole, as UNIX time
+    :type loaded_at: float
+    :return: None
+    """
+    arrays, offset = {}, 0
+    for name, column in zip(Columns._fields, state.columns, strict=True):
+        arrays[name] = [offset, len(column)]
+        offset = aligned(offset + len(column) * SNAPSHOT_DTYPE.itemsize)
+    header = json.dumps(
+        {
+            'watermark': state.watermark,
+            'loaded_at': loaded_at,
+            'arrays': arrays,
+        }
+    ).encode()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary, 'wb') as file:
+            file.write(
+                SNAPSHOT_PREFIX.pack(
+                    SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)
+                )
+            )
+            file.write(header)
+            for column in state.columns:
+                file.write(b'\0' * (aligned(file.tell()) - file.tell()))
+                file.write(
+                    np.ascontiguousarray(column, dtype=SNAPSHOT_DTYPE).data
+                )
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(temporary)
+        raise
+
+
+def read_snapshot(path: str) -> tuple[State, float]:
+    """Map snapshot file into memory.
+
+    Columns are read-only views of the mapped file, nothing is copied:
+    pages are read from disk when first accessed, and are shared by all
+    processes mapping the same file. File may be replaced meanwhile,
+    mapped one is kept until columns are released.
+
+    :param path: snapshot file path
+    :type path: str
+    :raises ValueError: if file is not a snapshot of known version
+    :return: state and when its posts and subscriptions were read
+        as a whole, as UNIX time
+    """
+    with open(path, 'rb') as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(buffer) < SNAPSHOT_PREFIX.size:
+        raise ValueError(f'{path} is not a post store snapshot')
+    magic, version, header_size = SNAPSHOT_PREFIX.unpack_from(buffer)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError(
+            f'{path} is not a post store snapshot of version '
+            f'{SNAPSHOT_VERSION}'
+        )
+    header = json.loads(
+        buffer[SNAPSHOT_PREFIX.size : SNAPSHOT_PREFIX.size + header_size]
+    )
+    start = aligned(SNAPSHOT_PREFIX.size + header_size)
+    columns = Columns(
+        *(
+            np.frombuffer(
+                buffer,
+                dtype=SNAPSHOT_DTYPE,
+                count=header['arrays'][name][1],
+                offset=start + header['arrays'][name][0],
+            )
+            for name in Columns._fields
+        )
+    )
+    return State(columns, {}, header['watermark'], {}), header['loaded_at']
+
+
+class ChangedUsers:
+    """Users whose subscriptions changed since previous poll of store.
+
+    Invalidated by ``PostsListener`` on ``subscriptions_changed``
+    channel, with user IDs instead of subscription IDs. Truncate
+    and missed notifications make the store read everything again.
+    """
+
+    def __init__(self, store: 'PostStore'):
+        """Initialize empty set of users.
+
+        :param store: store whose subscriptions are tracked
+        :type store: PostStore
+        """
+        self.store = store
+        self._users = set()
+        self._listened = False
+        self._lock = threading.Lock()
+
+    def invalidate(self, user_id: int):
+        """Read subscriptions of user again on next poll.
+
+        :param user_id: user ID whose subscriptions changed
+        :type user_id: int
+        :return: None
+        """
+        with self._lock:
+            self._users.add(int(user_id))
+
+    def clear(self):
+        """Read everything again on next poll.
+
+        :return: None
+        """
+        self.store.clear()
+
+    def suspend(self):
+        """Note that changes are not notified anymore.
+
+        :return: None
+        """
+
+    def resume(self):
+        """Read everything again, if notifications were missed.
+
+        :return: None
+        """
+        if self._listened:
+            self.store.clear()
+        self._listened = True
+
+    def take(self) -> set[int]:
+        """Get changed users and forget them.
+
+        :return: user IDs
+        """
+        with self._lock:
+            users, self._users = self._users, set()
+        return users
+
+    def restore(self, users: Iterable[int]):
+        """Remember again users taken by a failed poll.
+
+        :param users: user IDs
+        :type users: Iterable[int]
+        :return: None
+        """
+        with self._lock:
+            self._users.update(users)
+
+
+class PostStore(RepoBase):
+    """Ranking fields of all posts and all user subscriptions, in memory.
+
+    Store is loaded with one full read of ``posts`` and
+    ``users_subscriptions`` tables, then kept current by polling:
+    every ``poll_interval`` seconds posts with IDs above the watermark
+    are read, as well as all posts of subscriptions invalidated since
+    previous poll (normally by ``PostsListener`` on ``posts_edited``
+    channel) and subscriptions of users in ``users`` (invalidated
+    on ``subscriptions_changed`` channel). Every poll reads one database
+    snapshot. Post IDs are taken before insert transactions commit,
+    so the last ``margin`` post IDs up to the watermark are read again.
+    Everything is read again about every ``reload_interval`` seconds
+    (randomly shifted by up to ``RELOAD_JITTER`` of it, so workers
+    started together do not read everything at once), which bounds
+    staleness of edits missed while listener was disconnected.
+
+    Changed subscriptions are kept apart from columns, and merged into
+    them once they hold more than ``compact_ratio`` of all posts.
+    State is replaced as a whole, so reads need no locking.
+
+    With ``snapshot_path``, state is written there every
+    ``snapshot_interval`` seconds, and store is started from the
+    snapshot, if there is one, instead of reading everything: columns
+    are mapped into memory, then subscriptions of all users and posts
+    above its watermark are read. Written snapshot is mapped back,
+    so the writer shares its pages with other processes too.
+    """
+
+    def __init__(
+        self,
+        sessionmaker_: sessionmaker,
+        poll_interval: float = 1.0,
+        reload_interval: float = 600.0,
+        compact_ratio: float = 0.1,
+        snapshot_path: str | None = None,
+        snapshot_interval: float = 60.0,
+        margin: int = 100,
+    ):
+        """Initialize empty store.
+
+        :param sessionmaker_: sessionmaker instance
+        :type sessionmaker_: sessionmaker
+        :param poll_interval: how often changes are read, in seconds
+        :type poll_interval: float
+        :param reload_interval: how often everything is read again,
+            in seconds, 0 disables
+        :type reload_interval: float
+        :param compact_ratio: share of changed posts merged into columns
+        :type compact_ratio: float
+        :param snapshot_path: snapshot file path, if snapshots are used
+        :type snapshot_path: str | None
+        :param snapshot_interval: how often snapshot is written,
+            in seconds, 0 disables writing
+        :type snapshot_interval: float
+        :param margin: number of post IDs up to watermark read again
+        :type margin: int
+        """
+        super().__init__(sessionmaker_)
+        self.poll_interval = poll_interval
+        self.reload_interval = reload_interval
+        self.compact_ratio = compact_ratio
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.margin = margin
+        self.users = ChangedUsers(self)
+        self.loaded_at = None
+        self.loads = 0
+        self.polls = 0
+        self.snapshots = 0
+        self._snapshot_state = None
+        self._snapshot_written = time.monotonic()
+        self._reload_at = None
+        self._resubscribe = False
+        self._state = None
+        self._stale = set()
+        self._reload = False
+        self._listened = False
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self) -> bool:
+        """Whether store is loaded and can serve reads."""
+        return self._state is not None
+
+    @property
+    def state(self) -> State:
+        """Current state. Store should be ready."""
+        return self._state
+
+    @property
+    def size(self) -> int:
+        """Number of posts in store."""
+        state = self._state
+        if state is None:
+            return 0
+        return len(state.columns.post_ids) + sum(
+            len(post_ids) - len(column_posts(state.columns, sid)[0])
+            for sid, (post_ids, _) in state.overrides.items()
+        )
+
+    def invalidate(self, subscription_id: int):
+        """Read posts of changed subscription again on next poll.
+
+        :param subscription_id: changed subscription ID
+        :type subscription_id: int
+        :return: None
+        """
+        with self._lock:
+            self._stale.add(int(subscription_id))
+
+    def clear(self):
+        """Read everything again on next poll.
+
+        :return: None
+        """
+        self._reload = True
+
+    def suspend(self):
+        """Note that changes are not notified anymore.
+
+        Store keeps serving reads, edits are picked up by reload.
+
+        :return: None
+        """
+
+    def resume(self):
+        """Read everything again, if notifications were missed.
+
+        Changes are missed only after listener has been connected
+        at least once, first connection triggers no reload.
+
+        :return: None
+        """
+        if self._listened:
+            self._reload = True
+        self._listened = True
+
+    def install(
+        self, posts: np.ndarray, subscriptions: np.ndarray, watermark: int
+    ):
+        """Replace whole state.
+
+        :param posts: (post ID, subscription ID, rating) rows of all posts
+        :type posts: np.ndarray
+        :param subscriptions: (user ID, subscription ID) rows
+            of all subscriptions
+        :type subscriptions: np.ndarray
+        :param watermark: the highest post ID
+        :type watermark: int
+        :return: None
+        """
+        self._state = State(
+            build_columns(posts, subscriptions), {}, int(watermark), {}
+        )
+        self.loaded_at = time.time()
+        self.loads += 1
+        self._resubscribe = False
+        self.schedule_reload()
+
+    def schedule_reload(self):
+        """Schedule next full read about ``reload_interval`` from now.
+
+        :return: None
+        """
+        jitter = random.uniform(-RELOAD_JITTER, RELOAD_JITTER)
+        self._reload_at = time.monotonic() + self.reload_interval * (
+            1 + jitter
+        )
+
+    def apply(
+        self,
+        added: np.ndarray,
+        replaced: Iterable[int],
+        replacements: np.ndarray,
+        watermark: int,
+        resubscribed: Iterable[int] = (),
+        subscriptions: np.ndarray | None = None,
+    ):
+        """Add new posts and replace posts of changed subscriptions.
+
+        :param added: (post ID, subscription ID, rating) rows of new posts
+        :type added: np.ndarray
+        :param replaced: subscriptions whose posts were read again
+        :type replaced: Iterable[int]
+        :param replacements: (post ID, subscription ID, rating) rows
+            of all posts of replaced subscriptions
+        :type replacements: np.ndarray
+        :param watermark: the highest post ID after changes
+        :type watermark: int
+        :param resubscribed: users whose subscriptions were read again
+        :type resubscribed: Iterable[int]
+        :param subscriptions: (user ID, subscription ID) rows
+            of all subscriptions of resubscribed users
+        :type subscriptions: np.ndarray | None
+        :return: None
+        """
+        state = apply_changes(
+            self._state,
+            added,
+            replaced,
+            replacements,
+            int(watermark),
+            resubscribed,
+            subscriptions,
+        )
+        changed = sum(
+            len(post_ids) for post_ids, _ in state.overrides.values()
+        )
+        changed_users = sum(map(len, state.user_overrides.values()))
+        posts_limit = self.compact_ratio * len(state.columns.post_ids)
+        users_limit = self.compact_ratio * len(
+            state.columns.user_subscriptions
+        )
+        if changed > posts_limit or changed_users > users_limit:
+            state = compact(state)
+        self._state = state
+        self.polls += 1
+
+    def load(self):
+        """Read all posts and subscriptions in one database snapshot.
+
+        :return: None
+        """
+        self._reload = False
+        with self._lock:
+            self._stale.clear()
+        self.users.take()
+        started = time.perf_counter()
+        with self.snapshot() as s:
+            connection = s.connection()
+            watermark = connection.scalar(last_post_id_stmt())
+            posts = rows_array(
+                connection.execute(post_ranks_range_stmt(up_to=watermark)), 3
+            )
+            subscriptions = rows_array(
+                connection.execute(all_subscriptions_stmt()), 2
+            )
+        self.install(posts, subscriptions, watermark)
+        logger.info(
+            'Loaded %d posts and %d subscriptions in %.1f s',
+            len(posts),
+            len(subscriptions),
+            time.perf_counter() - started,
+        )
+
+    def poll(self):
+        """Read posts added since last poll and changed subscriptions.
+
+        Changed subscriptions are read up to the new watermark,
+        so posts added meanwhile are read by the next poll.
+        Changes are remembered again if reading fails.
+
+        :return: None
+        """
+        with self._lock:
+            stale, self._stale = self._stale, set()
+        users = self.users.take()
+        state = self._state
+        try:
+            with self.snapshot() as s:
+                connection = s.connection()
+                added = rows_array(
+                    connection.execute(
+                        post_ranks_range_stmt(
+                            after=max(state.watermark - self.margin, 0)
+                        )
+                    ),
+                    3,
+                )
+                watermark = max(
+                    state.watermark, int(added[:, 0].max(initial=0))
+                )
+                replacements = rows_array(
+                    connection.execute(
+                        post_ranks_range_stmt(
+                            up_to=watermark, subscription_ids=list(stale)
+                        )
+                    )
+                    if stale
+                    else (),
+                    3,
+                )
+                subscriptions = rows_array(
+                    connection.execute(
+                        subscriptions_for_users_stmt(list(users))
+                    )
+                    if users
+                    else (),
+                    2,
+                )
+        except BaseException:
+            with self._lock:
+                self._stale.update(stale)
+            self.users.restore(users)
+            raise
+        self.apply(added, stale, replacements, watermark, users, subscriptions)
+
+    def reload_due(self) -> bool:
+        """Check whether everything should be read again.
+
+        :return: True if store is not loaded, was cleared,
+            or scheduled reload time has come
+        """
+        return (
+            self._state is None
+            or self._reload
+            or (
+                bool(self.reload_interval)
+                and time.monotonic() >= self._reload_at
+            )
+        )
+
+    def load_snapshot(self) -> bool:
+        """Start store from snapshot file.
+
+        :return: True if snapshot was found and mapped
+        """
+        try:
+            state, loaded_at = read_snapshot(self.snapshot_path)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError):
+            logger.exception('Failed to read %s', self.snapshot_path)
+            return False
+        self._state = self._snapshot_state = state
+        self.loaded_at = loaded_at
+        self._resubscribe = True
+        self.schedule_reload()
+        logger.info(
+            'Mapped %d posts and %d subscriptions up to post %d from %s',
+            len(state.columns.post_ids),
+            len(state.columns.user_subscriptions),
+            state.watermark,
+            self.snapshot_path,
+        )
+        return True
+
+    def load_subscriptions(self):
+        """Read subscriptions of all users, keeping posts columns.
+
+        Snapshot may be older than changes notified since start,
+        so subscriptions are read again after store is started from it.
+
+        :return: None
+        """
+        self.users.take()
+        started = time.perf_counter()
+        with self.snapshot() as s:
+            subscriptions = rows_array(
+                s.connection().execute(all_subscriptions_stmt()), 2
+            )
+        state = self._state
+        user_ids, user_offsets, user_subscriptions = user_columns(
+            subscriptions
+        )
+        columns = state.columns._replace(
+            user_ids=user_ids,
+            user_offsets=user_offsets,
+            user_subscriptions=user_subscriptions,
+        )
+        self._state = state._replace(columns=columns, user_overrides={})
+        self._resubscribe = False
+        logger.info(
+            'Loaded %d subscriptions in %.1f s',
+            len(subscriptions),
+            time.perf_counter() - started,
+        )
+
+    def snapshot_due(self) -> bool:
+        """Check whether snapshot should be written.
+
+        :return: True if snapshots are written, state has changed since
+            last snapshot and ``snapshot_interval`` seconds have passed
+        """
+        return (
+            self.snapshot_path is not None
+            and bool(self.snapshot_interval)
+            and self._state is not None
+            and self._state is not self._snapshot_state
+            and time.monotonic() - self._snapshot_written
+            >= self.snapshot_interval
+        )
+
+    def save_snapshot(self):
+        """Merge changed subscriptions into columns and write snapshot.
+
+        Written file is mapped and replaces state, so merged columns
+        are not kept in private memory.
+
+        :return: None
+        """
+        state = self._state
+        if state.overrides or state.user_overrides:
+            state = compact(state)
+        started = time.perf_counter()
+        self._snapshot_written = time.monotonic()
+        write_snapshot(self.snapshot_path, state, self.loaded_at)
+        state = self._state = self._snapshot_state = read_snapshot(
+            self.snapshot_path
+        )[0]
+        self.snapshots += 1
+        logger.info(
+            'Wrote snapshot up to post %d to %s in %.1f s',
+            state.watermark,
+            self.snapshot_path,
+            time.perf_counter() - started,
+        )
+
+    def refresh(self):
+        """Load store or bring it up to date.
+
+        Store which is not loaded yet is started from snapshot,
+        if there is one.
+
+        :return: None
+        """
+        if self._state is None and self.snapshot_path is not None:
+            self.load_snapshot()
+        if self.reload_due():
+            self.load()
+            return
+        if self._resubscribe:
+            self.load_subscriptions()
+        self.poll()
+
+    def run(self):
+        """Refresh store until stopped, logging database errors.
+
+        :return: None
+        """
+        while not self._stopping.is_set():
+            try:
+                self.refresh()
+            except SQLAlchemyError:
+                logger.exception('Failed to refresh post store')
+            if self.snapshot_due():
+                try:
+                    self.save_snapshot()
+                except OSError:
+                    logger.exception('Failed to write %s', self.snapshot_path)
+            self._stopping.wait(self.poll_interval)
+
+    def start(self):
+        """Start refreshing on background thread.
+
+        :return: None
+        """
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self.run, name='post-store', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop refreshing and wait for background thread.
+
+        :return: None
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def user_subscriptions(self, user_id: int) -> np.ndarray:
+        """Get subscription IDs of user.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :return: subscription IDs, ascending
+        """
+        state = self._state
+        overridden = state.user_overrides.get(int(user_id))
+        if overridden is not None:
+            return overridden
+        columns = state.columns
+        index = np.searchsorted(columns.user_ids, int(user_id))
+        if index == len(columns.user_ids) or columns.user_ids[index] != int(
+            user_id
+        ):
+            return columns.user_subscriptions[:0]
+        start, end = (
+            columns.user_offsets[index],
+            columns.user_offsets[index + 1],
+        )
+        return columns.user_subscriptions[start:end]
+
+    def post_ranks(self, user_id: int, after: int = 0) -> list[PostRank]:
+        """Get ranking fields of posts from user subscriptions.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :param after: take posts with greater IDs only
+        :type after: int
+        :return: list of PostRanks, ordered by post ID
+        """
+        post_ids, subscription_ids, ratings, _ = gather(
+            self._state, self.user_subscriptions(user_id)
+        )
+        order = np.argsort(post_ids)
+        if after:
+            order = order[post_ids[order] > after]
+        return to_ranks(
+            post_ids[order], subscription_ids[order], ratings[order]
+        )
+
+    def candidate_ranks(
+        self, user_id: int, limit: int, per_subscription: bool = True
+    ) -> list[PostRank]:
+        """Get ranking fields of posts which filter is able to choose.
+
+        Same posts ``candidate_posts_stmt`` selects.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :param limit: how many posts filter is going to choose
+        :type limit: int
+        :param per_subscription: include best post of every subscription
+        :type per_subscription: bool
+        :return: list of PostRanks, ordered by post ID
+        """
+        post_ids, subscription_ids, ratings, leaders = gather(
+            self._state, self.user_subscriptions(user_id), limit
+        )
+        order = np.lexsort((post_ids, -ratings))
+        chosen = order[:limit]
+        if per_subscription:
+            chosen = np.union1d(chosen, order[leaders[order]][:limit])
+        chosen = chosen[np.argsort(post_ids[chosen])]
+        return to_ranks(
+            post_ids[chosen], subscription_ids[chosen], ratings[chosen]
+        )
+
+    def top_posts(
+        self, subscription_ids: Sequence[int], limit: int
+    ) -> list[PostRank]:
+        """Get ranking fields of top posts of many subscriptions.
+
+        :param subscription_ids: target subscription IDs
+        :type subscription_ids: Sequence[int]
+        :param limit: number of posts per subscription
+        :type limit: int
+        :return: list of PostRanks, grouped by subscription ID
+            (ascending), best rated first
+        """
+        return to_ranks(
+            *gather(self._state, sorted(set(subscription_ids)), limit)[:3]
+        )
+
+    def subscribers(self, subscription_ids: Sequence[int]) -> list[int]:
+        """Get users subscribed to any of subscriptions.
+
+        :param subscription_ids: target subscription IDs
+        :type subscription_ids: Sequence[int]
+        :return: user IDs, ascending
+        """
+        state = self._state
+        columns = state.columns
+        subscribed = np.isin(columns.user_subscriptions, subscription_ids)
+        owners = np.searchsorted(
+            columns.user_offsets, np.flatnonzero(subscribed), side='right'
+        )
+        user_ids = columns.user_ids[np.unique(owners) - 1]
+        if not state.user_overrides:
+            return user_ids.tolist()
+        user_ids = user_ids[~np.isin(user_ids, list(state.user_overrides))]
+        changed = [
+            user_id
+            for user_id, user_subscriptions in state.user_overrides.items()
+            if np.isin(user_subscriptions, subscription_ids).any()
+        ]
+        return np.union1d(user_ids, np.array(changed, dtype=np.int64)).tolist()
+
+    @property
+    def watermark(self) -> int:
+        """The highest post ID known to the store."""
+        return self._state.watermark
+
+
+class StoreGateway(Gateway):
+    """Database adapter reading ranking fields of posts from PostStore.
+
+    Queries are served by the store once it is loaded, and by database
+    before that. Post content is always read from database, only
+    for posts being returned.
+    """
+
+    def __init__(self, sessionmaker_: sessionmaker, store: PostStore):
+        """Initialize adapter with sessionmaker and store.
+
+        :param sessionmaker_: sessionmaker instance
+        :type sessionmaker_: sessionmaker
+        :param store: store of posts ranking fields
+        :type store: PostStore
+        """
+        super().__init__(sessionmaker_)
+        self.store = store
+
+    @contextmanager
+    def snapshot(self):
+        """Open consistent database snapshot, unless store serves reads.
+
+        :return: Session instance, or None once the store is loaded
+        """
+        if self.store.ready:
+            yield None
+            return
+        with super().snapshot() as session:
+            yield session
+
+    def read_posts_for_user(
+        self, user_id: int, session: Session | None = None
+    ) -> list[PostDTO]:
+        """Read posts from user subscriptions.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: list of Posts
+        """
+        if not self.store.ready:
+            return super().read_posts_for_user(user_id, session)
+        ranks = self.store.post_ranks(user_id)
+        return self.read_posts(*(rank.id for rank in ranks), session=session)
+
+    def read_candidate_posts_for_user(
+        self,
+        user_id: int,
+        limit: int,
+        per_subscription: bool = True,
+        session: Session | None = None,
+    ) -> list[PostDTO]:
+        """Read only posts which rating-based filter is able to choose.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :param limit: how many posts filter is going to choose
+        :type limit: int
+        :param per_subscription: include best post of every subscription
+        :type per_subscription: bool
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: list of Posts
+        """
+        if not self.store.ready:
+            return super().read_candidate_posts_for_user(
+                user_id, limit, per_subscription, session
+            )
+        ranks = self.store.candidate_ranks(user_id, limit, per_subscription)
+        return self.read_posts(*(rank.id for rank in ranks), session=session)
+
+    def read_post_ranks_for_user(
+        self, user_id: int, session: Session | None = None
+    ) -> list[PostRank]:
+        """Read ranking fields of posts from user subscriptions.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: list of PostRanks
+        """
+        if not self.store.ready:
+            return super().read_post_ranks_for_user(user_id, session)
+        return self.store.post_ranks(user_id)
+
+    def read_post_ranks_for_users(
+        self, user_ids: Sequence[int], session: Session | None = None
+    ) -> list[UserPostRank]:
+        """Read ranking fields of posts for many users.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: list of UserPostRanks, ordered by user ID and post ID
+        """
+        if not self.store.ready:
+            return super().read_post_ranks_for_users(user_ids, session)
+        return [
+            UserPostRank(user_id, *rank)
+            for user_id in sorted({int(user_id) for user_id in user_ids})
+            for rank in self.store.post_ranks(user_id)
+        ]
+
+    def read_subscriptions_for_users(
+        self, user_ids: Sequence[int], session: Session | None = None
+    ) -> dict[int, list[int]]:
+        """Read subscription IDs of many users.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: user ID to subscription IDs mapping.
+            Users without subscriptions get empty list
+        """
+        if not self.store.ready:
+            return super().read_subscriptions_for_users(user_ids, session)
+        return {
+            int(user_id): self.store.user_subscriptions(user_id).tolist()
+            for user_id in user_ids
+        }
+
+    def read_subscribers(
+        self, subscription_ids: Sequence[int], session: Session | None = None
+    ) -> list[int]:
+        """Read users subscribed to any of subscriptions.
+
+        :param subscription_ids: target subscription IDs
+        :type subscription_ids: Sequence[int]
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: user IDs, ascending
+        """
+        if not self.store.ready:
+            return super().read_subscribers(subscription_ids, session)
+        return self.store.subscribers(subscription_ids)
+
+    def read_top_posts(
+        self,
+        subscription_ids: Sequence[int],
+        limit: int,
+        session: Session | None = None,
+    ) -> list[PostRank]:
+        """Read ranking fields of top posts of many subscriptions.
+
+        :param subscription_ids: target subscription IDs
+        :type subscription_ids: Sequence[int]
+        :param limit: number of posts per subscription
+        :type limit: int
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: list of PostRanks, grouped by subscription,
+            best rated first
+        """
+        if not self.store.ready:
+            return super().read_top_posts(subscription_ids, limit, session)
+        return self.store.top_posts(subscription_ids, limit)
+
+    def read_post_ranks_above(
+        self, watermarks: Mapping[int, int], session: Session | None = None
+    ) -> list[UserPostRank]:
+        """Read ranking fields of posts added after per-user watermarks.
+
+        :param watermarks: user ID to last seen post ID mapping
+        :type watermarks: Mapping[int, int]
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: list of UserPostRanks, ordered by user ID and post ID
+        """
+        if not self.store.ready:
+            return super().read_post_ranks_above(watermarks, session)
+        return [
+            UserPostRank(int(user_id), *rank)
+            for user_id in sorted(watermarks)
+            for rank in self.store.post_ranks(user_id, watermarks[user_id])
+        ]
+
+    def read_last_post_id(self, session: Session | None = None) -> int:
+        """Read the highest post ID known to the store.
+
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: post ID, 0 if there are no posts
+        """
+        if not self.store.ready:
+            return super().read_last_post_id(session)
+        return self.store.watermark
+
+    def read_candidate_ranks_for_user(
+        self,
+        user_id: int,
+        limit: int,
+        per_subscription: bool = True,
+        session: Session | None = None,
+    ) -> list[PostRank]:
+        """Read ranking fields of posts which filter is able to choose.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :param limit: how many posts filter is going to choose
+        :type limit: int
+        :param per_subscription: include best post of every subscription
+        :type per_subscription: bool
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: list of PostRanks
+        """
+        if not self.store.ready:
+            return super().read_candidate_ranks_for_user(
+                user_id, limit, per_subscription, session
+            )
+        return self.store.candidate_ranks(user_id, limit, per_subscription)
+
+    def read_candidate_ranks_for_users(
+        self,
+        user_ids: Sequence[int],
+        limit: int,
+        per_subscription: bool = True,
+        session: Session | None = None,
+    ) -> list[UserPostRank]:
+        """Read ranking fields of candidate posts for many users.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :param limit: how many posts filter is going to choose
+        :type limit: int
+        :param per_subscription: include best post of every subscription
+        :type per_subscription: bool
+        :param session: session to be passed to session_control
+        :type session: Session
+        :return: list of UserPostRanks, ordered by user ID and post ID
+        """
+        if not self.store.ready:
+            return super().read_candidate_ranks_for_users(
+                user_ids, limit, per_subscription, session
+            )
+        return [
+            UserPostRank(user_id, *rank)
+            for user_id in sorted({int(user_id) for user_id in user_ids})
+            for rank in self.store.candidate_ranks(
+                user_id, limit, per_subscription
+            )
+        ]
@@ -1,9 +1,46 @@
 """RabbitMQ adapter."""
+import copy
+import logging
+import threading
+import time
+from collections import deque
+from typing import NamedTuple
+
 import pika
 
+logger = logging.getLogger('digest.rabbit')
+
+ATTEMPTS_HEADER = 'x-digest-attempts'
+# how often stopping generators check whether deliveries are reported
+DRAIN_POLL_INTERVAL = 0.05
+
+
+class Delivery(NamedTuple):
+    """Received message, which should be acknowledged after processing."""
+
+    user_id: str
+    delivery_tag: int
+    attempts: int = 0
+    body: bytes = b''
+    published: float | None = None
+    # properties message was published with, kept to republish it
+    # (AsyncRabbitReader copies them from received message instead)
+    properties: pika.BasicProperties | None = None
+
 
 class RabbitReader:
-    """RabbitMQ adapter."""
+    """RabbitMQ adapter.
+
+    Messages are acknowledged only after they are reported as processed
+    with ``ack``. Acknowledgements are sent with ``multiple=True`` for the
+    longest processed prefix of deliveries, once ``ack_batch_size`` of
+    them are ready or ``ack_interval`` seconds have passed.
+    Messages reported with ``reject`` are published back to the queue
+    until they fail ``max_redeliveries`` times, then they are dropped.
+    Messages reported with ``discard`` are dropped at once.
+    Once stopped, generators keep connection open until every yielded
+    delivery is reported, so flows in progress are acknowledged.
+    """
 
     def __init__(
         self,
@@ -12,6 +49,11 @@ class RabbitReader:
         port: int = 5672,
         username: str | None = None,
         password: str | None = None,
+        prefetch_count: int = 100,
+        ack_batch_size: int = 50,
+        ack_interval: float = 1.0,
+        max_redeliveries: int = 3,
+        drain_timeout: float = 30.0,
     ):
         """Prepare adapter settings.
 
@@ -27,6 +69,17 @@ class RabbitReader:
         :type username: str
         :param password: password
         :type password: str
+        :param prefetch_count: maximum number of unacknowledged deliveries
+        :type prefetch_count: int
+        :param ack_batch_size: number of processed deliveries to ack at once
+        :type ack_batch_size: int
+        :param ack_interval: maximum delay of acknowledgements, in seconds
+        :type ack_interval: float
+        :param max_redeliveries: how many times failed message is retried
+        :type max_redeliveries: int
+        :param drain_timeout: how long stopping generators wait for yielded
+            deliveries to be reported, in seconds
+        :type drain_timeout: float
         """
         if username and password:
             credentials = pika.credentials.PlainCredentials(username, password)
@@ -38,22 +91,352 @@ class RabbitReader:
                 host=host, port=port
             )
         self.queue = queue
+        self.prefetch_count = prefetch_count
+        self.ack_batch_size = ack_batch_size
+        self.ack_interval = ack_interval
+        self.max_redeliveries = max_redeliveries
+        self.drain_timeout = drain_timeout
+        # number of messages ready in queue, refreshed every
+        # backlog_interval seconds while consuming, 0 disables it
+        self.backlog_interval = 0.0
+        self.backlog = None
+        self._backlog_checked = 0.0
 
-    def message_generator(self):
-        """Start listening process.
+        # ack and reject may be called from other threads,
+        # while channel is used from the consuming one only
+        self._lock = threading.Lock()
+        self._unsettled = deque()
+        self._processed = {}
+        # yielded deliveries not reported with ack or reject yet
+        self._in_progress = set()
+        self._last_flush = time.monotonic()
+        self._stopping = threading.Event()
 
-        Yields received messages one-by-one.
+    def stop(self):
+        """Ask listening process to stop.
 
-        :return: user ID as string
+        Generators stop yielding within ``ack_interval`` seconds, wait
+        up to ``drain_timeout`` seconds for yielded deliveries to be
+        reported, and return after sending their acknowledgements.
+        Safe to call from signal handlers and other threads.
+
+        :return: None
+        """
+        self._stopping.set()
+
+    def ack(self, delivery: Delivery):
+        """Report delivery as successfully processed.
+
+        :param delivery: processed delivery
+        :type delivery: Delivery
+        :return: None
+        """
+        with self._lock:
+            self._processed[delivery.delivery_tag] = (delivery, True)
+            self._in_progress.discard(delivery.delivery_tag)
+
+    def reject(self, delivery: Delivery):
+        """Report delivery as failed.
+
+        :param delivery: failed delivery
+        :type delivery: Delivery
+        :return: None
+        """
+        with self._lock:
+            self._processed[delivery.delivery_tag] = (delivery, False)
+            self._in_progress.discard(delivery.delivery_tag)
+
+    def discard(self, delivery: Delivery):
+        """Report delivery which can never be processed.
+
+        It is not retried: broker drops it, or routes it to dead letter
+        exchange, if queue has one.
+
+        :param delivery: malformed delivery
+        :type delivery: Delivery
+        :return: None
+        """
+        with self._lock:
+            self._processed[delivery.delivery_tag] = (delivery, None)
+            self._in_progress.discard(delivery.delivery_tag)
+
+    def _dispatch(self, deliveries: list[Delivery]):
+        """Remember deliveries as yielded and not reported yet.
+
+        :param deliveries: deliveries about to be yielded
+        :type deliveries: list[Delivery]
+        :return: None
+        """
+        with self._lock:
+            self._in_progress.update(
+                delivery.delivery_tag for delivery in deliveries
+            )
+
+    def _in_flight(self) -> int:
+        """Count yielded deliveries not reported yet.
+
+        :return: number of deliveries
+        """
+        with self._lock:
+            return len(self._in_progress)
+
+    def _drain_expired(self, deadline: float) -> bool:
+        """Check whether stopping generator should stop waiting.
+
+        :param deadline: monotonic time to wait until
+        :type deadline: float
+        :return: True if every yielded delivery is reported
+            or time is over
+        """
+        in_flight = self._in_flight()
+        if not in_flight:
+            return True
+        if time.monotonic() < deadline:
+            return False
+        logger.error(
+            'Closing connection with %d deliveries in progress, '
+            'they will be redelivered',
+            in_flight,
+        )
+        return True
+
+    def _take_settled(self, force: bool = False) -> list[tuple]:
+        """Take processed prefix of deliveries, if it is time to settle it.
+
+        :param force: take regardless of batch size and interval
+        :type force: bool
+        :return: list of (delivery, succeeded) pairs, in delivery order.
+            Succeeded is None for discarded deliveries
+        """
+        with self._lock:
+            ready = 0
+            for delivery_tag in self._unsettled:
+                if delivery_tag not in self._processed:
+                    break
+                ready += 1
+            failed = any(not ok for _, ok in self._processed.values())
+            due = time.monotonic() - self._last_flush >= self.ack_interval
+            if not ready or not (
+                force or failed or due or ready >= self.ack_batch_size
+            ):
+                return []
+            self._last_flush = time.monotonic()
+            return [
+                self._processed.pop(self._unsettled.popleft())
+                for _ in range(ready)
+            ]
+
+    def _backlog_due(self) -> bool:
+        """Check whether it is time to refresh backlog.
+
+        :return: True if backlog should be read from broker
+        """
+        if not self.backlog_interval:
+            return False
+        now = time.monotonic()
+        if now - self._backlog_checked < self.backlog_interval:
+            return False
+        self._backlog_checked = now
+        return True
+
+    def _retry_headers(self, delivery: Delivery) -> dict | None:
+        """Decide what to do with failed delivery.
+
+        :param delivery: failed delivery
+        :type delivery: Delivery
+        :return: headers to republish message with,
+            or None if message should be dropped
+        """
+        if delivery.attempts < self.max_redeliveries:
+            return {ATTEMPTS_HEADER: delivery.attempts + 1}
+        logger.error(
+            'Dropping message for user %s after %d attempts',
+            delivery.user_id,
+            delivery.attempts + 1,
+        )
+        return None
+
+    def _retry_properties(
+        self, delivery: Delivery, headers: dict
+    ) -> pika.BasicProperties:
+        """Copy properties of failed delivery, merging retry headers in.
+
+        :param delivery: failed delivery
+        :type delivery: Delivery
+        :param headers: headers returned by ``_retry_headers``
+        :type headers: dict
+        :return: properties to republish message with
+        """
+        properties = copy.copy(delivery.properties) or pika.BasicProperties()
+        properties.headers = {**(properties.headers or {}), **headers}
+        # broker checks user_id against publishing connection
+        properties.user_id = None
+        return properties
+
+    def _flush(self, channel, force: bool = False):
+        """Send acknowledgements for processed prefix of deliveries.
+
+        :param channel: channel deliveries were received from
+        :param force: flush regardless of batch size and interval
+        :type force: bool
+        :return: None
+        """
+        last_acked = None
+        for delivery, ok in self._take_settled(force):
+            if ok:
+                last_acked = delivery.delivery_tag
+                continue
+            headers = None if ok is None else self._retry_headers(delivery)
+            if headers is None:
+                channel.basic_nack(delivery.delivery_tag, requeue=False)
+                continue
+            channel.basic_publish(
+                '',
+                self.queue,
+                delivery.body,
+                self._retry_properties(delivery, headers),
+            )
+            last_acked = delivery.delivery_tag
+        if last_acked is not None:
+            channel.basic_ack(last_acked, multiple=True)
+
+    def _connect(self):
+        """Open connection and start consuming.
+
+        :return: connection, channel and deque of received deliveries
         """
         connection = pika.BlockingConnection(self.connection_parameters)
         channel = connection.channel()
 
         channel.queue_declare(queue=self.queue)
+        channel.basic_qos(prefetch_count=self.prefetch_count)
+        received = deque()
+
+        def on_message(_channel, method, properties, body):
+            headers = properties.headers or {}
+            received.append(
+                Delivery(
+                    body.decode(),
+                    method.delivery_tag,
+                    headers.get(ATTEMPTS_HEADER, 0),
+                    body,
+                    properties.timestamp,
+                    properties,
+                )
+            )
+            with self._lock:
+                self._unsettled.append(method.delivery_tag)
+
+        channel.basic_consume(self.queue, on_message)
+        return connection, channel, received
+
+    def _receive(
+        self, connection, channel, received: deque, time_limit: float
+    ) -> Delivery | None:
+        """Flush acknowledgements and wait for next delivery.
+
+        :param connection: open connection
+        :param channel: consuming channel
+        :param received: deque of received deliveries
+        :type received: deque
+        :param time_limit: maximum time to wait, in seconds
+        :type time_limit: float
+        :return: next delivery or None if nothing arrived in time
+        """
+        self._flush(channel)
+        if self._backlog_due():
+            self.backlog = channel.queue_declare(
+                queue=self.queue, passive=True
+            ).method.message_count
+        if not received:
+            connection.process_data_events(time_limit=time_limit)
+        if received:
+            return received.popleft()
+        return None
+
+    def _drain(self, connection, channel):
+        """Keep sending acknowledgements until deliveries are reported.
+
+        :param connection: open connection
+        :param channel: consuming channel
+        :return: None
+        """
+        deadline = time.monotonic() + self.drain_timeout
+        while not self._drain_expired(deadline):
+            self._flush(channel)
+            connection.process_data_events(time_limit=DRAIN_POLL_INTERVAL)
+
+    def _close(self, connection, channel):
+        """Send pending acknowledgements and close connection."""
+        if connection.is_open:
+            self._flush(channel, force=True)
+            connection.close()
+
+    def message_generator(self):
+        """Start listening process.
+
+        Yields received messages one-by-one.
+        Every yielded delivery should be reported with ack or reject.
+
+        :return: deliveries
+        """
+        connection, channel, received = self._connect()
         try:
-            for method, _properties, body in channel.consume(self.queue):
-                channel.basic_ack(method.delivery_tag)
-                yield body.decode()
+            while not self._stopping.is_set():
+                delivery = self._receive(
+                    connection, channel, received, self.ack_interval
+                )
+                if delivery is not None:
+                    self._dispatch([delivery])
+                    yield delivery
+            self._drain(connection, channel)
+        except KeyboardInterrupt:
+            return
+        finally:
+            self._close(connection, channel)
+
+    def message_batches(self, size: int, timeout: float):
+        """Start listening process.
+
+        Yields received messages in batches. Batch is yielded when it
+        has ``size`` messages, or when ``timeout`` seconds have passed
+        since its first message arrived.
+        Every yielded delivery should be reported with ack or reject.
+        Prefetch count should not be lower than batch size,
+        otherwise batches are always yielded by timeout.
+
+        :param size: maximum number of messages in batch
+        :type size: int
+        :param timeout: maximum time to wait for batch to fill, in seconds
+        :type timeout: float
+        :return: lists of deliveries
+        """
+        connection, channel, received = self._connect()
+        try:
+            while not self._stopping.is_set():
+                batch = []
+                deadline = None
+                while len(batch) < size and not self._stopping.is_set():
+                    time_limit = self.ack_interval
+                    if deadline is not None:
+                        time_limit = min(
+                            deadline - time.monotonic(), time_limit
+                        )
+                        if time_limit <= 0:
+                            break
+                    delivery = self._receive(
+                        connection, channel, received, time_limit
+                    )
+                    if delivery is None:
+                        continue
+                    batch.append(delivery)
+                    if deadline is None:
+                        deadline = time.monotonic() + timeout
+                if batch:
+                    self._dispatch(batch)
+                    yield batch
+            self._drain(connection, channel)
         except KeyboardInterrupt:
-            connection.close()
             return
+        finally:
+            self._close(connection, channel)
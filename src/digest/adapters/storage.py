@@ -1,29 +1,785 @@
 """Redis adapter."""
+import hashlib
+import itertools
+import json
 import logging
+import threading
+import time
+from collections.abc import Iterable, Mapping, Sequence
+from concurrent.futures import Future
+from typing import NamedTuple
 
 import redis
+import redis.asyncio
+
+from digest.adapters.codecs import Codec, JsonCodec, decode_digest
+from digest.schemas import DigestDTO, PostDTO
 
 logger = logging.getLogger('digest.redis')
 
+FINGERPRINTS_KEY = 'digest:fingerprints'
+
+
+def fingerprint(post_ids: Iterable[int]) -> str:
+    """Compute compact fingerprint of ordered post IDs.
+
+    :param post_ids: digest post IDs, in digest order
+    :type post_ids: Iterable[int]
+    :return: 16 hex digits
+    """
+    data = ','.join(map(str, post_ids)).encode()
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def format_fingerprints(
+    fingerprints: Mapping[int, tuple[str, int]]
+) -> dict[int, str]:
+    """Format fingerprints as ``FINGERPRINTS_KEY`` hash values.
+
+    :param fingerprints: user ID to (fingerprint, digest ID) mapping
+    :type fingerprints: Mapping[int, tuple[str, int]]
+    :return: user ID to value mapping
+    """
+    return {
+        user_id: f'{value}:{digest_id}'
+        for user_id, (value, digest_id) in fingerprints.items()
+    }
+
+
+def parse_fingerprints(
+    user_ids: Sequence[int], values: Sequence[str | None]
+) -> dict[int, tuple[str, int]]:
+    """Parse ``FINGERPRINTS_KEY`` hash values.
+
+    :param user_ids: requested user IDs
+    :type user_ids: Sequence[int]
+    :param values: values in order of user IDs, None if missing
+    :type values: Sequence[str | None]
+    :return: user ID to (fingerprint, digest ID) mapping
+    """
+    result = {}
+    for user_id, value in zip(user_ids, values, strict=True):
+        if value is not None:
+            value, digest_id = value.split(':')
+            result[user_id] = (value, int(digest_id))
+    return result
+
+
+def write_chunks(
+    data: Mapping[int, str | bytes], chunk_size: int
+) -> list[list[tuple[int, str | bytes]]]:
+    """Split data into chunks, one chunk per Redis command.
+
+    :param data: user ID to data mapping
+    :type data: Mapping[int, str | bytes]
+    :param chunk_size: maximum number of keys in chunk
+    :type chunk_size: int
+    :return: list of (user ID, data) chunks
+    """
+    items = iter(data.items())
+    return list(iter(lambda: list(itertools.islice(items, chunk_size)), []))
+
+
+def failed_keys(
+    chunks: Iterable[list[tuple[int, str | bytes]]], replies: Iterable
+) -> dict[int, Exception]:
+    """Collect keys whose commands replied with error.
+
+    :param chunks: chunks commands were sent for
+    :type chunks: Iterable[list[tuple[int, str | bytes]]]
+    :param replies: pipeline replies, one per chunk
+    :type replies: Iterable
+    :return: user ID to error mapping
+    """
+    failed = {}
+    for chunk, reply in zip(chunks, replies, strict=True):
+        if isinstance(reply, Exception):
+            failed.update((user_id, reply) for user_id, _ in chunk)
+    if failed:
+        logger.error('Failed to store %d keys', len(failed))
+    return failed
+
 
 class RedisStorage:
     """Redis adapter."""
 
-    def __init__(self, url: str):
+    def __init__(self, url: str, codec: Codec | None = None):
         """Initialize Redis client.
 
         :param url: Redis Url
         :type url: str
+        :param codec: digest payload codec, JSON if not provided
+        :type codec: Codec
         """
         self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.raw_client = redis.Redis.from_url(url)
+        self.codec = codec or JsonCodec()
+
+    def encode(self, digest_data: DigestDTO) -> str | bytes:
+        """Encode digest with storage codec.
+
+        :param digest_data: digest to be encoded
+        :type digest_data: DigestDTO
+        :return: payload
+        """
+        return self.codec.encode(digest_data)
+
+    def load(self, user_id: int) -> DigestDTO | None:
+        """Read digest stored with any codec.
 
-    def store(self, user_id: int, data: str):
+        :param user_id: target user ID
+        :type user_id: int
+        :return: stored digest or None
+        """
+        payload = self.raw_client.get(user_id)
+        if payload is None:
+            return None
+        return decode_digest(payload)
+
+    def store(self, user_id: int, data: str | bytes):
         """Store data to Redis.
 
         :param user_id: user ID to be used as key
         :type user_id: int
-        :param data: data to store. Should be JSON, but no check is implemented
-        :type data: str
+        :param data: data to store, usually encoded with ``encode``
+        :type data: str | bytes
         :return: None
         """
         self.client.set(user_id, data)
+
+    def store_many(
+        self,
+        data: Mapping[int, str | bytes],
+        chunk_size: int = 1000,
+        mset: bool = False,
+    ) -> dict[int, Exception]:
+        """Store data for many users in one round-trip.
+
+        Commands are sent in one pipeline, ``chunk_size`` keys
+        per ``SET`` or per ``MSET`` command.
+        Errors of single commands do not stop the others, they are
+        reported instead. Connection errors are raised as usual.
+
+        :param data: user ID to data mapping
+        :type data: Mapping[int, str | bytes]
+        :param chunk_size: number of keys per MSET command
+        :type chunk_size: int
+        :param mset: send MSET commands instead of SET ones
+        :type mset: bool
+        :return: user ID to error mapping for keys which were not stored
+        """
+        if not data:
+            return {}
+        pipeline = self.client.pipeline(transaction=False)
+        chunks = write_chunks(data, chunk_size if mset else 1)
+        for chunk in chunks:
+            if mset:
+                pipeline.mset(dict(chunk))
+            else:
+                pipeline.set(*chunk[0])
+        replies = pipeline.execute(raise_on_error=False)
+        return failed_keys(chunks, replies)
+
+    def read_fingerprints(
+        self, user_ids: Iterable[int]
+    ) -> dict[int, tuple[str, int]]:
+        """Read fingerprints of last digests of users.
+
+        :param user_ids: target user IDs
+        :type user_ids: Iterable[int]
+        :return: user ID to (fingerprint, digest ID) mapping,
+            users without fingerprint are skipped
+        """
+        user_ids = list(user_ids)
+        values = self.client.hmget(FINGERPRINTS_KEY, user_ids)
+        return parse_fingerprints(user_ids, values)
+
+    def store_fingerprints(self, fingerprints: Mapping[int, tuple[str, int]]):
+        """Store fingerprints of last digests of users.
+
+        :param fingerprints: user ID to (fingerprint, digest ID) mapping
+        :type fingerprints: Mapping[int, tuple[str, int]]
+        :return: None
+        """
+        if fingerprints:
+            self.client.hset(
+                FINGERPRINTS_KEY, mapping=format_fingerprints(fingerprints)
+            )
+
+
+class AsyncRedisStorage:
+    """Asynchronous Redis adapter. Mirrors ``RedisStorage`` methods."""
+
+    def __init__(self, url: str, codec: Codec | None = None):
+        """Initialize Redis client.
+
+        :param url: Redis Url
+        :type url: str
+        :param codec: digest payload codec, JSON if not provided
+        :type codec: Codec
+        """
+        self.client = redis.asyncio.Redis.from_url(url, decode_responses=True)
+        self.codec = codec or JsonCodec()
+
+    def encode(self, digest_data: DigestDTO) -> str | bytes:
+        """Encode digest with storage codec.
+
+        :param digest_data: digest to be encoded
+        :type digest_data: DigestDTO
+        :return: payload
+        """
+        return self.codec.encode(digest_data)
+
+    async def store(self, user_id: int, data: str | bytes):
+        """Store data to Redis.
+
+        :param user_id: user ID to be used as key
+        :type user_id: int
+        :param data: data to store
+        :type data: str | bytes
+        :return: None
+        """
+        await self.client.set(user_id, data)
+
+    async def store_many(
+        self,
+        data: Mapping[int, str | bytes],
+        chunk_size: int = 1000,
+        mset: bool = False,
+    ) -> dict[int, Exception]:
+        """Store data for many users in one round-trip.
+
+        See ``RedisStorage.store_many``.
+
+        :param data: user ID to data mapping
+        :type data: Mapping[int, str | bytes]
+        :param chunk_size: number of keys per MSET command
+        :type chunk_size: int
+        :param mset: send MSET commands instead of SET ones
+        :type mset: bool
+        :return: user ID to error mapping for keys which were not stored
+        """
+        if not data:
+            return {}
+        pipeline = self.client.pipeline(transaction=False)
+        chunks = write_chunks(data, chunk_size if mset else 1)
+        for chunk in chunks:
+            if mset:
+                pipeline.mset(dict(chunk))
+            else:
+                pipeline.set(*chunk[0])
+        replies = await pipeline.execute(raise_on_error=False)
+        return failed_keys(chunks, replies)
+
+    async def read_fingerprints(
+        self, user_ids: Iterable[int]
+    ) -> dict[int, tuple[str, int]]:
+        """Read fingerprints of last digests of users.
+
+        :param user_ids: target user IDs
+        :type user_ids: Iterable[int]
+        :return: user ID to (fingerprint, digest ID) mapping,
+            users without fingerprint are skipped
+        """
+        user_ids = list(user_ids)
+        values = await self.client.hmget(FINGERPRINTS_KEY, user_ids)
+        return parse_fingerprints(user_ids, values)
+
+    async def store_fingerprints(
+        self, fingerprints: Mapping[int, tuple[str, int]]
+    ):
+        """Store fingerprints of last digests of users.
+
+        :param fingerprints: user ID to (fingerprint, digest ID) mapping
+        :type fingerprints: Mapping[int, tuple[str, int]]
+        :return: None
+        """
+        if fingerprints:
+            await self.client.hset(
+                FINGERPRINTS_KEY, mapping=format_fingerprints(fingerprints)
+            )
+
+
+class NormalizedPayload(NamedTuple):
+    """Digest split into per-user value and shared post bodies."""
+
+    digest: str
+    posts: dict[int, str]
+
+
+class NormalizedLayout:
+    """Store every post body once, in a hash shared by all digests.
+
+    Per-user key holds JSON with digest ID, timestamp and ordered
+    post IDs only. Post bodies are kept in ``POSTS_KEY`` hash,
+    keyed by post ID, and are sent again only when they change.
+    Payload codec is not used by this layout.
+
+    Every digest is written by ``STORE_SCRIPT``, which counts digests
+    referencing every post (``refs:<post ID>`` fields of the same hash)
+    and deletes bodies no digest references anymore. Script refuses
+    digest referencing body which was not sent and is missing from
+    the hash (e.g. after flush or failover), then digest is written
+    again with all its bodies, and remembered bodies are forgotten.
+    """
+
+    POSTS_KEY = 'digest:posts'
+    LOAD_SCRIPT = """
+local digest = redis.call('GET', KEYS[1])
+if not digest then
+    return nil
+end
+local ids = cjson.decode(digest)['posts']
+if #ids == 0 then
+    return {digest}
+end
+local posts = redis.call('HMGET', KEYS[2], unpack(ids))
+table.insert(posts, 1, digest)
+return posts
+"""
+    STORE_SCRIPT = """
+local ids = {}
+for i, id in ipairs(cjson.decode(ARGV[1])['posts']) do
+    ids[i] = string.format('%d', id)
+end
+local sent = {}
+for i = 2, #ARGV, 2 do
+    sent[ARGV[i]] = true
+end
+local missing = {}
+for _, id in ipairs(ids) do
+    if not sent[id] and redis.call('HEXISTS', KEYS[2], id) == 0 then
+        table.insert(missing, id)
+    end
+end
+if #missing > 0 then
+    return missing
+end
+for i = 2, #ARGV, 2 do
+    redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+end
+for _, id in ipairs(ids) do
+    redis.call('HINCRBY', KEYS[2], 'refs:' .. id, 1)
+end
+local ok, old = pcall(cjson.decode, redis.call('GET', KEYS[1]) or '{}')
+if ok and type(old) == 'table' and type(old['posts']) == 'table' then
+    for _, id in ipairs(old['posts']) do
+        if type(id) == 'number' then
+            id = string.format('%d', id)
+            local refs = 'refs:' .. id
+            if redis.call('HEXISTS', KEYS[2], refs) == 1
+                and redis.call('HINCRBY', KEYS[2], refs, -1) <= 0 then
+                redis.call('HDEL', KEYS[2], id, refs)
+            end
+        end
+    end
+end
+redis.call('SET', KEYS[1], ARGV[1])
+return {}
+"""
+
+    def __init__(self, *args, max_known_posts: int = 1_000_000, **kwargs):
+        """Initialize storage and cache of already written posts.
+
+        :param max_known_posts: number of post fingerprints to remember.
+            Cache is cleared when exceeded
+        :type max_known_posts: int
+        """
+        super().__init__(*args, **kwargs)
+        self.max_known_posts = max_known_posts
+        self.rewrites = 0
+        self._known_posts = {}
+
+    def encode(self, digest_data: DigestDTO) -> NormalizedPayload:
+        """Split digest into per-user value and post bodies.
+
+        :param digest_data: digest to be encoded
+        :type digest_data: DigestDTO
+        :return: payload
+        """
+        digest = json.dumps(
+            {
+                'id': digest_data.id,
+                'user_id': digest_data.user_id,
+                'timestamp': digest_data.timestamp.isoformat(),
+                'posts': [post.id for post in digest_data.posts],
+            }
+        )
+        posts = {post.id: post.model_dump_json() for post in digest_data.posts}
+        return NormalizedPayload(digest, posts)
+
+    def _writes(
+        self, data: Mapping[int, NormalizedPayload], resend: bool = False
+    ) -> list[tuple[int, dict[int, str], list]]:
+        """Prepare ``STORE_SCRIPT`` calls of digests.
+
+        Post body is sent with the first digest referencing it,
+        unless it was written already and has not changed since.
+
+        :param data: user ID to payload mapping
+        :type data: Mapping[int, NormalizedPayload]
+        :param resend: send all post bodies
+        :type resend: bool
+        :return: user ID, sent posts and script arguments of every digest
+        """
+        writes = []
+        sent = set()
+        for user_id, payload in data.items():
+            posts = {
+                post_id: body
+                for post_id, body in payload.posts.items()
+                if post_id not in sent
+                and (resend or self._known_posts.get(post_id) != hash(body))
+            }
+            sent.update(posts)
+            args = [payload.digest, *itertools.chain(*posts.items())]
+            writes.append((user_id, posts, args))
+        return writes
+
+    def _remember(self, posts: Mapping[int, str]):
+        """Remember fingerprints of written post bodies.
+
+        :param posts: post ID to written body mapping
+        :type posts: Mapping[int, str]
+        :return: None
+        """
+        if len(self._known_posts) + len(posts) > self.max_known_posts:
+            self._known_posts.clear()
+        self._known_posts.update(
+            (post_id, hash(body)) for post_id, body in posts.items()
+        )
+
+    def _failed(
+        self, writes: list[tuple[int, dict[int, str], list]], replies: list
+    ) -> tuple[dict[int, Exception], list[int]]:
+        """Check replies of ``STORE_SCRIPT`` calls.
+
+        If remembered post bodies turn out to be missing from Redis,
+        all remembered bodies are forgotten.
+
+        :param writes: calls returned by ``_writes``
+        :type writes: list[tuple[int, dict[int, str], list]]
+        :param replies: pipeline replies, one per call
+        :type replies: list
+        :return: user ID to error mapping for keys which were not
+            stored, and users whose digests should be written again
+            with all bodies
+        """
+        failed = {}
+        missing = []
+        written = {}
+        for (user_id, posts, _), reply in zip(writes, replies, strict=True):
+            if isinstance(reply, Exception):
+                failed[user_id] = reply
+            elif reply:
+                missing.append(user_id)
+            else:
+                written.update(posts)
+        if failed:
+            logger.error('Failed to store %d keys', len(failed))
+        if missing:
+            logger.warning(
+                'Posts of %d digests are missing from %s, writing again',
+                len(missing),
+                self.POSTS_KEY,
+            )
+            self._known_posts.clear()
+            self.rewrites += len(missing)
+        self._remember(written)
+        return failed, missing
+
+    @staticmethod
+    def assemble(reply: list | None) -> DigestDTO | None:
+        """Build digest from ``LOAD_SCRIPT`` reply.
+
+        Posts missing from the shared hash are skipped.
+
+        :param reply: per-user value followed by post bodies
+        :type reply: list | None
+        :return: digest or None
+        """
+        if not reply:
+            return None
+        digest, *posts = reply
+        header = json.loads(digest)
+        header['posts'] = [
+            PostDTO.model_validate_json(post)
+            for post in posts
+            if post is not None
+        ]
+        return DigestDTO(**header)
+
+
+class NormalizedRedisStorage(NormalizedLayout, RedisStorage):
+    """Redis adapter with normalized layout, see ``NormalizedLayout``."""
+
+    def __init__(self, url: str, max_known_posts: int = 1_000_000):
+        """Initialize Redis client.
+
+        :param url: Redis Url
+        :type url: str
+        :param max_known_posts: number of post fingerprints to remember
+        :type max_known_posts: int
+        """
+        super().__init__(url, max_known_posts=max_known_posts)
+        self.load_script = self.client.register_script(self.LOAD_SCRIPT)
+        self.store_script = self.client.register_script(self.STORE_SCRIPT)
+
+    def store(self, user_id: int, data: NormalizedPayload):
+        """Store digest and its changed posts in one round-trip.
+
+        :param user_id: user ID to be used as key
+        :type user_id: int
+        :param data: payload produced by ``encode``
+        :type data: NormalizedPayload
+        :return: None
+        """
+        failed = self.store_many({user_id: data})
+        if failed:
+            raise failed[user_id]
+
+    def store_many(
+        self,
+        data: Mapping[int, NormalizedPayload],
+        chunk_size: int = 1000,
+        mset: bool = False,
+    ) -> dict[int, Exception]:
+        """Store digests and their changed posts in one round-trip.
+
+        Digests whose posts were missing from Redis take another
+        round-trip.
+
+        :param data: user ID to payload mapping
+        :type data: Mapping[int, NormalizedPayload]
+        :param chunk_size: not used, every digest is written by script
+        :type chunk_size: int
+        :param mset: not used, every digest is written by script
+        :type mset: bool
+        :return: user ID to error mapping for keys which were not stored
+        """
+        if not data:
+            return {}
+        failed, missing = self._store(data)
+        if missing:
+            retry = {user_id: data[user_id] for user_id in missing}
+            failed.update(self._store(retry, resend=True)[0])
+        return failed
+
+    def _store(
+        self, data: Mapping[int, NormalizedPayload], resend: bool = False
+    ) -> tuple[dict[int, Exception], list[int]]:
+        """Call ``STORE_SCRIPT`` for every digest in one pipeline.
+
+        :param data: user ID to payload mapping
+        :type data: Mapping[int, NormalizedPayload]
+        :param resend: send all post bodies
+        :type resend: bool
+        :return: see ``_failed``
+        """
+        writes = self._writes(data, resend)
+        pipeline = self.client.pipeline(transaction=False)
+        for user_id, _, args in writes:
+            self.store_script(
+                keys=[user_id, self.POSTS_KEY], args=args, client=pipeline
+            )
+        replies = pipeline.execute(raise_on_error=False)
+        return self._failed(writes, replies)
+
+    def load(self, user_id: int) -> DigestDTO | None:
+        """Reassemble digest with its posts in one round-trip.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :return: stored digest or None
+        """
+        return self.assemble(self.load_script(keys=[user_id, self.POSTS_KEY]))
+
+
+class AsyncNormalizedRedisStorage(NormalizedLayout, AsyncRedisStorage):
+    """Asynchronous Redis adapter with normalized layout."""
+
+    def __init__(self, url: str, max_known_posts: int = 1_000_000):
+        """Initialize Redis client.
+
+        :param url: Redis Url
+        :type url: str
+        :param max_known_posts: number of post fingerprints to remember
+        :type max_known_posts: int
+        """
+        super().__init__(url, max_known_posts=max_known_posts)
+        self.load_script = self.client.register_script(self.LOAD_SCRIPT)
+        self.store_script = self.client.register_script(self.STORE_SCRIPT)
+
+    async def store(self, user_id: int, data: NormalizedPayload):
+        """Store digest and its changed posts in one round-trip.
+
+        :param user_id: user ID to be used as key
+        :type user_id: int
+        :param data: payload produced by ``encode``
+        :type data: NormalizedPayload
+        :return: None
+        """
+        failed = await self.store_many({user_id: data})
+        if failed:
+            raise failed[user_id]
+
+    async def store_many(
+        self,
+        data: Mapping[int, NormalizedPayload],
+        chunk_size: int = 1000,
+        mset: bool = False,
+    ) -> dict[int, Exception]:
+        """Store digests and their changed posts in one round-trip.
+
+        See ``NormalizedRedisStorage.store_many``.
+
+        :param data: user ID to payload mapping
+        :type data: Mapping[int, NormalizedPayload]
+        :param chunk_size: not used, every digest is written by script
+        :type chunk_size: int
+        :param mset: not used, every digest is written by script
+        :type mset: bool
+        :return: user ID to error mapping for keys which were not stored
+        """
+        if not data:
+            return {}
+        failed, missing = await self._store(data)
+        if missing:
+            retry = {user_id: data[user_id] for user_id in missing}
+            failed.update((await self._store(retry, resend=True))[0])
+        return failed
+
+    async def _store(
+        self, data: Mapping[int, NormalizedPayload], resend: bool = False
+    ) -> tuple[dict[int, Exception], list[int]]:
+        """Call ``STORE_SCRIPT`` for every digest in one pipeline.
+
+        :param data: user ID to payload mapping
+        :type data: Mapping[int, NormalizedPayload]
+        :param resend: send all post bodies
+        :type resend: bool
+        :return: see ``_failed``
+        """
+        writes = self._writes(data, resend)
+        pipeline = self.client.pipeline(transaction=False)
+        for user_id, _, args in writes:
+            await self.store_script(
+                keys=[user_id, self.POSTS_KEY], args=args, client=pipeline
+            )
+        replies = await pipeline.execute(raise_on_error=False)
+        return self._failed(writes, replies)
+
+    async def load(self, user_id: int) -> DigestDTO | None:
+        """Reassemble digest with its posts in one round-trip.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :return: stored digest or None
+        """
+        reply = await self.load_script(keys=[user_id, self.POSTS_KEY])
+        return self.assemble(reply)
+
+
+class BufferedWriter:
+    """Collect writes from many threads and store them in pipelines.
+
+    Buffer is flushed with ``RedisStorage.store_many`` when it has
+    ``max_size`` values, or ``max_delay`` seconds after first value
+    was buffered. Every write returns a Future, resolved once the value
+    is stored, so callers can wait for durability before acknowledging.
+    """
+
+    def __init__(
+        self,
+        storage: RedisStorage,
+        max_size: int = 100,
+        max_delay: float = 0.005,
+        mset: bool = False,
+    ):
+        """Initialize empty buffer.
+
+        :param storage: Redis storage to flush to
+        :type storage: RedisStorage
+        :param max_size: number of values to flush at once
+        :type max_size: int
+        :param max_delay: maximum time value waits in buffer, in seconds
+        :type max_delay: float
+        :param mset: flush with MSET commands instead of SET ones
+        :type mset: bool
+        """
+        self.storage = storage
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.mset = mset
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffer = {}
+        self._futures = []
+        self._timer = None
+        self.flushes = 0
+
+    def write(self, user_id: int, data: str | bytes) -> Future:
+        """Buffer value for writing.
+
+        Later value for the same user replaces buffered one.
+
+        :param user_id: user ID to be used as key
+        :type user_id: int
+        :param data: data to store
+        :type data: str | bytes
+        :return: Future resolved with None once value is stored,
+            or with exception if it was not
+        """
+        future = Future()
+        with self._lock:
+            self._buffer[user_id] = data
+            self._futures.append((user_id, future))
+            full = len(self._buffer) >= self.max_size
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.max_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+        return future
+
+    def flush(self) -> dict[int, Exception]:
+        """Store buffered values and resolve their futures.
+
+        Flushes are serialized, so older value never overwrites newer one.
+
+        :return: user ID to error mapping for keys which were not stored
+        """
+        with self._flush_lock:
+            with self._lock:
+                data, self._buffer = self._buffer, {}
+                futures, self._futures = self._futures, []
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not data:
+                return {}
+            started = time.perf_counter()
+            try:
+                failed = self.storage.store_many(data, mset=self.mset)
+            except Exception as error:
+                failed = dict.fromkeys(data, error)
+            self.flushes += 1
+            logger.debug(
+                'Flushed %d keys in %.1f ms',
+                len(data),
+                (time.perf_counter() - started) * 1000,
+            )
+            for user_id, future in futures:
+                if user_id in failed:
+                    future.set_exception(failed[user_id])
+                else:
+                    future.set_result(None)
+            return failed
+
+    def close(self):
+        """Flush remaining values.
+
+        :return: None
+        """
+        self.flush()
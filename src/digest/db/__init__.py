@@ -1,18 +1,22 @@
 """Infrastructure module."""
 from digest.db.models import (
+    LEADERBOARD_SIZE,
     Digest,
     Post,
     PostDigest,
     Subscription,
+    SubscriptionTopPost,
     User,
     UserSubscription,
 )
 
 __all__ = (
+    'LEADERBOARD_SIZE',
     'Digest',
     'Post',
     'PostDigest',
     'Subscription',
+    'SubscriptionTopPost',
     'User',
     'UserSubscription',
 )
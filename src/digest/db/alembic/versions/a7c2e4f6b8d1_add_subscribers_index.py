@@ -0,0 +1,36 @@
+"""Add index for subscribers lookup
+
+Primary key of users_subscriptions starts with user_id, so finding
+subscribers of a subscription scanned the whole table.
+Index is built CONCURRENTLY, like other hot query indexes.
+
+Revision ID: a7c2e4f6b8d1
+Revises: f3b6d2a8c4e9
+Create Date: 2026-10-18 19:37:20.554871
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'a7c2e4f6b8d1'
+down_revision = 'f3b6d2a8c4e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_users_subscriptions_subscription_id',
+            'users_subscriptions',
+            ['subscription_id', 'user_id'],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_users_subscriptions_subscription_id',
+            table_name='users_subscriptions',
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,63 @@
+"""Notify about changed subscriptions
+
+Every insert, update or delete of a user subscription sends user ID
+to subscriptions_changed channel, truncate sends empty payload.
+Used to keep subscriptions of in-process post stores current.
+
+Revision ID: b2f7c9e1d4a6
+Revises: a7c2e4f6b8d1
+Create Date: 2026-10-18 21:12:44.905317
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b2f7c9e1d4a6'
+down_revision = 'a7c2e4f6b8d1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE FUNCTION notify_subscriptions_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                PERFORM pg_notify('subscriptions_changed', '');
+                RETURN NULL;
+            END IF;
+            IF TG_OP = 'INSERT' THEN
+                PERFORM pg_notify('subscriptions_changed', NEW.user_id::text);
+                RETURN NULL;
+            END IF;
+            PERFORM pg_notify('subscriptions_changed', OLD.user_id::text);
+            IF TG_OP = 'UPDATE' AND NEW.user_id <> OLD.user_id THEN
+                PERFORM pg_notify(
+                    'subscriptions_changed', NEW.user_id::text
+                );
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER subscriptions_changed
+        AFTER INSERT OR UPDATE OR DELETE ON users_subscriptions
+        FOR EACH ROW EXECUTE FUNCTION notify_subscriptions_changed()
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER subscriptions_truncated
+        AFTER TRUNCATE ON users_subscriptions
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_subscriptions_changed()
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER subscriptions_truncated ON users_subscriptions')
+    op.execute('DROP TRIGGER subscriptions_changed ON users_subscriptions')
+    op.execute('DROP FUNCTION notify_subscriptions_changed()')
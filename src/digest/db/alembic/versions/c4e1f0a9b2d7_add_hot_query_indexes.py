@@ -0,0 +1,49 @@
+"""Add indexes for digest hot queries
+
+Indexes are built CONCURRENTLY, so migration does not lock
+tables for writes. users_subscriptions needs no extra index:
+its primary key (user_id, subscription_id) already serves
+lookups by user_id.
+
+Revision ID: c4e1f0a9b2d7
+Revises: 707f513cdf16
+Create Date: 2026-10-18 12:04:51.318207
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'c4e1f0a9b2d7'
+down_revision = '707f513cdf16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_posts_subscription_id_rating',
+            'posts',
+            ['subscription_id', sa.text('rating DESC'), 'id'],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_posts_digests_digest_id',
+            'posts_digests',
+            ['digest_id', 'post_id'],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_posts_digests_digest_id',
+            table_name='posts_digests',
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'ix_posts_subscription_id_rating',
+            table_name='posts',
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,65 @@
+"""Notify about changed posts
+
+Every insert, update or delete of a post sends subscription ID
+to posts_changed channel, truncate sends empty payload.
+Used to invalidate in-process caches of top posts.
+
+Revision ID: d81b3c5e7f20
+Revises: c4e1f0a9b2d7
+Create Date: 2026-10-18 15:21:07.602114
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'd81b3c5e7f20'
+down_revision = 'c4e1f0a9b2d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE FUNCTION notify_posts_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                PERFORM pg_notify('posts_changed', '');
+                RETURN NULL;
+            END IF;
+            IF TG_OP = 'INSERT' THEN
+                PERFORM pg_notify('posts_changed', NEW.subscription_id::text);
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('posts_changed', OLD.subscription_id::text);
+            ELSE
+                PERFORM pg_notify('posts_changed', OLD.subscription_id::text);
+                IF NEW.subscription_id <> OLD.subscription_id THEN
+                    PERFORM pg_notify(
+                        'posts_changed', NEW.subscription_id::text
+                    );
+                END IF;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER posts_changed
+        AFTER INSERT OR UPDATE OR DELETE ON posts
+        FOR EACH ROW EXECUTE FUNCTION notify_posts_changed()
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER posts_truncated
+        AFTER TRUNCATE ON posts
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_posts_changed()
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER posts_truncated ON posts')
+    op.execute('DROP TRIGGER posts_changed ON posts')
+    op.execute('DROP FUNCTION notify_posts_changed()')
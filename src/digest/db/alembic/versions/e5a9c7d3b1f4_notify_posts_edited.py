@@ -0,0 +1,79 @@
+"""Notify about edited posts
+
+Updates and deletes of posts, and truncate, are also sent
+to posts_edited channel. Inserts are not: they are found
+by incremental recomputation with post ID watermark.
+
+Revision ID: e5a9c7d3b1f4
+Revises: d81b3c5e7f20
+Create Date: 2026-10-18 16:40:12.281530
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'e5a9c7d3b1f4'
+down_revision = 'd81b3c5e7f20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION notify_posts_changed()
+        RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                PERFORM pg_notify('posts_changed', '');
+                PERFORM pg_notify('posts_edited', '');
+                RETURN NULL;
+            END IF;
+            IF TG_OP = 'INSERT' THEN
+                PERFORM pg_notify('posts_changed', NEW.subscription_id::text);
+                RETURN NULL;
+            END IF;
+            PERFORM pg_notify('posts_changed', OLD.subscription_id::text);
+            PERFORM pg_notify('posts_edited', OLD.subscription_id::text);
+            IF TG_OP = 'UPDATE'
+                AND NEW.subscription_id <> OLD.subscription_id THEN
+                PERFORM pg_notify(
+                    'posts_changed', NEW.subscription_id::text
+                );
+                PERFORM pg_notify(
+                    'posts_edited', NEW.subscription_id::text
+                );
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION notify_posts_changed()
+        RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                PERFORM pg_notify('posts_changed', '');
+                RETURN NULL;
+            END IF;
+            IF TG_OP = 'INSERT' THEN
+                PERFORM pg_notify('posts_changed', NEW.subscription_id::text);
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('posts_changed', OLD.subscription_id::text);
+            ELSE
+                PERFORM pg_notify('posts_changed', OLD.subscription_id::text);
+                IF NEW.subscription_id <> OLD.subscription_id THEN
+                    PERFORM pg_notify(
+                        'posts_changed', NEW.subscription_id::text
+                    );
+                END IF;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
@@ -0,0 +1,50 @@
+"""Add subscription_top_posts leaderboard
+
+Materialized view with top 20 posts of every subscription,
+best rated first. Refreshed with digest-db refresh-leaderboards.
+Unique index allows REFRESH ... CONCURRENTLY and covers
+leaderboard reads, so they are served by index-only scans.
+
+Revision ID: f3b6d2a8c4e9
+Revises: e5a9c7d3b1f4
+Create Date: 2026-10-18 18:02:45.913304
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'f3b6d2a8c4e9'
+down_revision = 'e5a9c7d3b1f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE MATERIALIZED VIEW subscription_top_posts AS
+        SELECT subscription_id, position, post_id, rating
+        FROM (
+            SELECT
+                subscription_id,
+                row_number() OVER (
+                    PARTITION BY subscription_id ORDER BY rating DESC, id
+                ) AS position,
+                id AS post_id,
+                rating
+            FROM posts
+        ) AS ranked
+        WHERE position <= 20
+        WITH DATA
+        """
+    )
+    op.execute(
+        """
+        CREATE UNIQUE INDEX ix_subscription_top_posts_subscription_id
+        ON subscription_top_posts (subscription_id, position)
+        INCLUDE (post_id, rating)
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP MATERIALIZED VIEW subscription_top_posts')
@@ -0,0 +1,181 @@
+"""Custom digest-db commands."""
+import argparse
+import time
+from collections.abc import Callable
+
+from alembic.config import Config
+from sqlalchemy import Select, create_engine
+from sqlalchemy.orm import sessionmaker
+
+from digest.adapters.database import (
+    Gateway,
+    candidate_posts_stmt,
+    candidate_ranks_for_users_stmt,
+    digest_posts_stmt,
+    digest_stmt,
+    leaderboard_ranks_stmt,
+    posts_for_user_stmt,
+)
+
+
+def hot_queries(user_id: int, digest_id: int, limit: int) -> dict[str, Select]:
+    """Collect queries Gateway runs for every processed message.
+
+    :param user_id: user ID to be used in queries
+    :type user_id: int
+    :param digest_id: digest ID to be used in queries
+    :type digest_id: int
+    :param limit: number of posts in digest
+    :type limit: int
+    :return: query name to statement mapping
+    """
+    return {
+        'read_posts_for_user': posts_for_user_stmt(user_id),
+        'read_candidate_posts_for_user (per subscription)': (
+            candidate_posts_stmt(user_id, limit, per_subscription=True)
+        ),
+        'read_candidate_posts_for_user (top rated)': candidate_posts_stmt(
+            user_id, limit, per_subscription=False
+        ),
+        'read_post_ranks_for_user (leaderboards)': leaderboard_ranks_stmt(
+            [user_id], with_user=False
+        ),
+        'read_candidate_ranks_for_user (leaderboards)': (
+            candidate_ranks_for_users_stmt(
+                [user_id], limit, leaderboards=True, with_user=False
+            )
+        ),
+        'read_digest': digest_stmt(digest_id),
+        'read_digest (posts)': digest_posts_stmt(digest_id),
+    }
+
+
+def explain(config: Config, user_id: int, digest_id: int, limit: int):
+    """Print EXPLAIN ANALYZE output for every hot Gateway query.
+
+    :param config: Alembic config with sqlalchemy.url option set
+    :type config: Config
+    :param user_id: user ID to be used in queries
+    :type user_id: int
+    :param digest_id: digest ID to be used in queries
+    :type digest_id: int
+    :param limit: number of posts in digest
+    :type limit: int
+    :return: None
+    """
+    engine = create_engine(config.get_main_option('sqlalchemy.url'))
+    with engine.connect() as connection:
+        for name, stmt in hot_queries(user_id, digest_id, limit).items():
+            compiled = stmt.compile(dialect=engine.dialect)
+            response = connection.exec_driver_sql(
+                f'EXPLAIN (ANALYZE, BUFFERS) {compiled}', compiled.params
+            )
+            config.print_stdout(f'-- {name}')
+            for (line,) in response:
+                config.print_stdout(line)
+            config.print_stdout('')
+    engine.dispose()
+
+
+def refresh_leaderboards(config: Config, every: float | None = None):
+    """Refresh subscription_top_posts view, once or periodically.
+
+    :param config: Alembic config with sqlalchemy.url option set
+    :type config: Config
+    :param every: repeat every N seconds until interrupted
+    :type every: float
+    :return: None
+    """
+    engine = create_engine(config.get_main_option('sqlalchemy.url'))
+    gateway = Gateway(sessionmaker(engine))
+    try:
+        while True:
+            started = time.perf_counter()
+            gateway.refresh_leaderboards()
+            elapsed = time.perf_counter() - started
+            config.print_stdout(f'Leaderboards refreshed in {elapsed:.2f}s')
+            if every is None:
+                break
+            time.sleep(max(every - elapsed, 0))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.dispose()
+
+
+def add_command(
+    parser: argparse.ArgumentParser,
+    command: Callable,
+    arguments: dict[str, dict],
+    help_text: str,
+):
+    """Register custom command next to Alembic ones.
+
+    Command is called by ``CommandLine.run_cmd`` the same way Alembic
+    commands are: with Config and keyword arguments taken from options.
+
+    :param parser: Alembic CommandLine parser
+    :type parser: argparse.ArgumentParser
+    :param command: function to be called
+    :type command: Callable
+    :param arguments: option name to ``add_argument`` kwargs mapping
+    :type arguments: dict
+    :param help_text: command help
+    :type help_text: str
+    :return: None
+    """
+    # Alembic keeps no reference to its subparsers, so look it up
+    subparsers = next(
+        action
+        for action in parser._actions
+        if isinstance(action, argparse._SubParsersAction)
+    )
+    subparser = subparsers.add_parser(
+        command.__name__.replace('_', '-'), help=help_text
+    )
+    for name, kwargs in arguments.items():
+        subparser.add_argument(f'--{name.replace("_", "-")}', **kwargs)
+    subparser.set_defaults(cmd=(command, [], list(arguments)))
+
+
+def register_commands(parser: argparse.ArgumentParser):
+    """Register all custom commands.
+
+    :param parser: Alembic CommandLine parser
+    :type parser: argparse.ArgumentParser
+    :return: None
+    """
+    add_command(
+        parser,
+        explain,
+        {
+            'user_id': {
+                'type': int,
+                'required': True,
+                'help': 'User ID to read posts for',
+            },
+            'digest_id': {
+                'type': int,
+                'default': 1,
+                'help': 'Digest ID to read',
+            },
+            'limit': {
+                'type': int,
+                'default': 5,
+                'help': 'Number of posts in digest',
+            },
+        },
+        'Print EXPLAIN ANALYZE for hot Gateway queries.',
+    )
+    add_command(
+        parser,
+        refresh_leaderboards,
+        {
+            'every': {
+                'type': float,
+                'metavar': 'SECONDS',
+                'help': 'Refresh periodically instead of once',
+            },
+        },
+        'Refresh per-subscription leaderboards.',
+    )
@@ -5,12 +5,15 @@ from pathlib import Path
 
 from alembic.config import CommandLine, Config
 
+from digest.db.commands import register_commands
+
 PROJECT_PATH = Path(__file__).parent.parent.resolve()
 
 
 def main():
-    """Parse arguments and run Alembic."""
+    """Parse arguments and run Alembic or custom command."""
     alembic = CommandLine()
+    register_commands(alembic.parser)
     alembic.parser.add_argument(
         '--postgres-username',
         help='Postgres username',
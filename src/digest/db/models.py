@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import ForeignKey, MetaData
+from sqlalchemy import ForeignKey, Index, Integer, MetaData, column, table
 from sqlalchemy.dialects.postgresql import TIMESTAMP
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
@@ -74,6 +74,20 @@ class Post(Base):
     )
 
 
+Index(
+    'ix_posts_subscription_id_rating',
+    Post.subscription_id,
+    Post.rating.desc(),
+    Post.id,
+)
+Index('ix_posts_digests_digest_id', PostDigest.digest_id, PostDigest.post_id)
+Index(
+    'ix_users_subscriptions_subscription_id',
+    UserSubscription.subscription_id,
+    UserSubscription.user_id,
+)
+
+
 class Digest(Base):
     __tablename__ = 'digests'
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -87,3 +101,15 @@ class Digest(Base):
     posts: Mapped[list['Post']] = relationship(
         secondary=PostDigest.__table__, back_populates='digests'
     )
+
+
+LEADERBOARD_SIZE = 20
+
+# Materialized view created by migration, kept out of metadata
+SubscriptionTopPost = table(
+    'subscription_top_posts',
+    column('subscription_id', Integer),
+    column('position', Integer),
+    column('post_id', Integer),
+    column('rating', Integer),
+)
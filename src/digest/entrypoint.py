@@ -1,5 +1,9 @@
 """Main entrypoint module."""
+import argparse
 import logging
+import signal
+from functools import partial
+from typing import Literal
 
 from pydantic import (
     Field,
@@ -9,12 +13,31 @@ from pydantic import (
     field_validator,
 )
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, make_url
 from sqlalchemy.orm import sessionmaker
 
-from digest.adapters import Gateway, RabbitReader, RedisStorage
+from digest.adapters import (
+    BufferedWriter,
+    Gateway,
+    NormalizedRedisStorage,
+    RabbitReader,
+    RedisStorage,
+)
+from digest.adapters.codecs import Codec, make_codec
+from digest.services.cache import TopPostsCache
+from digest.services.coalescing import Coalescer
 from digest.services.digester import Digester
-from digest.services.filters import at_least_one_subscription
+from digest.services.fanout import SubscriptionFanout
+from digest.services.filters import heap_at_least_one_subscription
+from digest.services.incremental import IncrementalState
+from digest.services.metrics import Metrics, MetricsServer
+from digest.services.profiling import Profiler
+from digest.services.runners import (
+    ProcessSupervisor,
+    ThreadPoolRunner,
+    worker_index,
+)
+from digest.services.stats import FlowStats
 
 logger = logging.getLogger('digest')
 
@@ -43,12 +66,98 @@ class Settings(BaseSettings):
     rabbit_username: str | None = Field(None, alias='digest_rabbit_username')
     rabbit_password: str | None = Field(None, alias='digest_rabbit_password')
     rabbit_queue: str = Field(..., alias='digest_rabbit_queue')
+    rabbit_prefetch_count: int = Field(
+        100, alias='digest_rabbit_prefetch_count', ge=1
+    )
+    rabbit_ack_batch_size: int = Field(
+        50, alias='digest_rabbit_ack_batch_size', ge=1
+    )
+    rabbit_max_redeliveries: int = Field(
+        3, alias='digest_rabbit_max_redeliveries', ge=0
+    )
 
     redis_host: str = Field('localhost', alias='digest_redis_host')
     redis_port: int = Field(6379, alias='digest_redis_port')
     redis_db: int = Field(0, alias='digest_redis_db')
 
     redis_url: RedisDsn | None = None
+    redis_write_buffer: int = Field(0, alias='digest_redis_write_buffer', ge=0)
+    redis_layout: Literal['plain', 'normalized'] = Field(
+        'plain', alias='digest_redis_layout'
+    )
+    redis_codec: Literal['json', 'msgpack'] = Field(
+        'json', alias='digest_redis_codec'
+    )
+    redis_compression: Literal['none', 'zlib', 'zstd'] = Field(
+        'zlib', alias='digest_redis_compression'
+    )
+    redis_compression_threshold: int = Field(
+        1024, alias='digest_redis_compression_threshold', ge=0
+    )
+
+    vectorized: bool = Field(False, alias='digest_vectorized')
+    batch_size: int = Field(1, alias='digest_batch_size', ge=1)
+    batch_timeout_ms: int = Field(50, alias='digest_batch_timeout_ms', ge=0)
+    copy_threshold: int = Field(0, alias='digest_copy_threshold', ge=0)
+    dedupe: bool = Field(False, alias='digest_dedupe')
+    posts_cache_mb: int = Field(0, alias='digest_posts_cache_mb', ge=0)
+    posts_cache_ttl: float = Field(300, alias='digest_posts_cache_ttl', gt=0)
+    posts_cache_top_k: int = Field(20, alias='digest_posts_cache_top_k', ge=1)
+    leaderboards: bool = Field(False, alias='digest_leaderboards')
+    incremental: bool = Field(False, alias='digest_incremental')
+    incremental_max_users: int = Field(
+        100_000, alias='digest_incremental_max_users', ge=1
+    )
+    incremental_check_every: int = Field(
+        100, alias='digest_incremental_check_every', ge=0
+    )
+    incremental_margin: int = Field(
+        100, alias='digest_incremental_margin', ge=0
+    )
+    post_store: bool = Field(False, alias='digest_post_store')
+    post_store_poll_interval: float = Field(
+        1.0, alias='digest_post_store_poll_interval', gt=0
+    )
+    post_store_reload_interval: float = Field(
+        600, alias='digest_post_store_reload_interval', ge=0
+    )
+    post_store_snapshot: str | None = Field(
+        None, alias='digest_post_store_snapshot'
+    )
+    post_store_snapshot_interval: float = Field(
+        60, alias='digest_post_store_snapshot_interval', gt=0
+    )
+    post_store_margin: int = Field(100, alias='digest_post_store_margin', ge=0)
+    coalesce: bool = Field(False, alias='digest_coalesce')
+    coalesce_window_ms: int = Field(
+        5000, alias='digest_coalesce_window_ms', ge=0
+    )
+    concurrency: int = Field(1, alias='digest_concurrency', ge=1)
+    processes: int = Field(1, alias='digest_processes', ge=1)
+    engine: Literal['sync', 'asyncio'] = Field('sync', alias='digest_engine')
+    mode: Literal['users', 'subscriptions'] = Field(
+        'users', alias='digest_mode'
+    )
+    fanout_window_ms: int = Field(1000, alias='digest_fanout_window_ms', ge=0)
+    fanout_max_events: int = Field(
+        1000, alias='digest_fanout_max_events', ge=1
+    )
+    fanout_chunk_size: int = Field(500, alias='digest_fanout_chunk_size', ge=1)
+    async_db_concurrency: int = Field(
+        20, alias='digest_async_db_concurrency', ge=1
+    )
+
+    metrics_host: str = Field('', alias='digest_metrics_host')
+    metrics_port: int = Field(0, alias='digest_metrics_port', ge=0)
+    metrics_backlog_interval: float = Field(
+        5.0, alias='digest_metrics_backlog_interval', ge=0
+    )
+
+    profile_dir: str | None = Field(None, alias='digest_profile_dir')
+    profile: bool = Field(False, alias='digest_profile')
+    profile_every: int = Field(1000, alias='digest_profile_every', ge=0)
+    profile_slow_ms: int = Field(1000, alias='digest_profile_slow_ms', ge=0)
+    profile_keep: int = Field(100, alias='digest_profile_keep', ge=1)
 
     verbosity: int = Field(0, alias='digest_verbosity', ge=0)
 
@@ -86,6 +195,20 @@ class Settings(BaseSettings):
             )
         )
 
+    @property
+    def async_database_url(self) -> str:
+        """Database url with asyncpg driver, used by asyncio engine."""
+        url = make_url(str(self.database_url))
+        url = url.set(drivername='postgresql+asyncpg')
+        return url.render_as_string(hide_password=False)
+
+    @property
+    def listen_database_url(self) -> str:
+        """Database url understood by libpq, used by posts listener."""
+        url = make_url(str(self.database_url))
+        url = url.set(drivername='postgresql')
+        return url.render_as_string(hide_password=False)
+
     @field_validator('severity_name')
     def compute_severity_name(
         cls, value: str, info: FieldValidationInfo  # noqa
@@ -101,10 +224,62 @@ class Settings(BaseSettings):
         return 'DEBUG'
 
 
-def main():
-    """Parse arguments, initialize Digester and start flow."""
-    settings = Settings()
+def parse_arguments() -> dict:
+    """Parse command line arguments.
+
+    :return: settings overrides, keyed by settings alias
+    """
+    parser = argparse.ArgumentParser(
+        prog='digest', description='Compose digests for user IDs from queue.'
+    )
+    parser.add_argument(
+        '--concurrency',
+        dest='digest_concurrency',
+        type=int,
+        metavar='N',
+        help='Process messages on N threads',
+    )
+    parser.add_argument(
+        '--processes',
+        dest='digest_processes',
+        type=int,
+        metavar='N',
+        help='Run N worker processes, restarting crashed ones',
+    )
+    parser.add_argument(
+        '--mode',
+        dest='digest_mode',
+        choices=('users', 'subscriptions'),
+        help='Consume user IDs, or IDs of changed subscriptions',
+    )
+    parser.add_argument(
+        '--metrics-port',
+        dest='digest_metrics_port',
+        type=int,
+        metavar='PORT',
+        help='Serve Prometheus metrics on PORT (PORT + N for N-th process)',
+    )
+    parser.add_argument(
+        '--engine',
+        dest='digest_engine',
+        choices=('sync', 'asyncio'),
+        help='Process messages with blocking or with asyncio adapters',
+    )
+    options = parser.parse_args()
+    return {
+        name: value
+        for name, value in vars(options).items()
+        if value is not None
+    }
+
 
+def setup_logging(settings: Settings):
+    """Configure digest logger.
+
+    :param settings: script settings
+    :type settings: Settings
+    :return: None
+    """
     formatter = logging.Formatter(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
@@ -113,10 +288,279 @@ def main():
     logger.addHandler(handler)
     logger.setLevel(settings.severity_name)
 
+
+def build_codec(settings: Settings) -> Codec:
+    """Create Redis payload codec.
+
+    :param settings: script settings
+    :type settings: Settings
+    :return: codec instance
+    """
+    return make_codec(
+        settings.redis_codec,
+        settings.redis_compression,
+        settings.redis_compression_threshold,
+    )
+
+
+def filter_functions(settings: Settings) -> tuple:
+    """Choose per-user and batch filter functions.
+
+    :param settings: script settings
+    :type settings: Settings
+    :return: filter function and batch filter function or None
+    """
+    if settings.vectorized:
+        from digest.services.batch import batch_at_least_one_subscription
+
+        return heap_at_least_one_subscription, batch_at_least_one_subscription
+    return heap_at_least_one_subscription, None
+
+
+def build_posts_cache(settings: Settings) -> TopPostsCache | None:
+    """Create posts cache and start listening to its invalidations.
+
+    :param settings: script settings
+    :type settings: Settings
+    :return: cache instance or None if disabled
+    """
+    if not settings.posts_cache_mb:
+        return None
+    from digest.adapters.notifications import PostsListener
+
+    posts_cache = TopPostsCache(
+        settings.posts_cache_top_k,
+        settings.posts_cache_mb << 20,
+        settings.posts_cache_ttl,
+    )
+    PostsListener(settings.listen_database_url, posts_cache).start()
+    logger.info('Posts cache has been set')
+    return posts_cache
+
+
+def build_incremental(settings: Settings) -> IncrementalState | None:
+    """Create incremental state and start listening to post edits.
+
+    :param settings: script settings
+    :type settings: Settings
+    :return: incremental state or None if disabled
+    """
+    if not settings.incremental:
+        return None
+    from digest.adapters.notifications import EDITS_CHANNEL, PostsListener
+
+    incremental = IncrementalState(
+        settings.incremental_max_users,
+        settings.incremental_check_every,
+        settings.incremental_margin,
+    )
+    PostsListener(
+        settings.listen_database_url, incremental, EDITS_CHANNEL
+    ).start()
+    logger.info('Incremental recomputation has been set')
+    return incremental
+
+
+def build_gateway(settings: Settings, sessionmaker_: sessionmaker) -> Gateway:
+    """Create database adapter, reading posts from post store if enabled.
+
+    Requires NumPy and psycopg2 with post store. In processes mode
+    only the first worker writes post store snapshots.
+
+    :param settings: script settings
+    :type settings: Settings
+    :param sessionmaker_: sessionmaker instance
+    :type sessionmaker_: sessionmaker
+    :return: Gateway instance
+    """
+    if not settings.post_store:
+        return Gateway(sessionmaker_, settings.leaderboards)
+    from digest.adapters.notifications import (
+        EDITS_CHANNEL,
+        SUBSCRIPTIONS_CHANNEL,
+        PostsListener,
+    )
+    from digest.adapters.post_store import PostStore, StoreGateway
+
+    store = PostStore(
+        sessionmaker_,
+        settings.post_store_poll_interval,
+        settings.post_store_reload_interval,
+        snapshot_path=settings.post_store_snapshot,
+        snapshot_interval=settings.post_store_snapshot_interval
+        if worker_index() == 0
+        else 0,
+        margin=settings.post_store_margin,
+    )
+    PostsListener(settings.listen_database_url, store, EDITS_CHANNEL).start()
+    PostsListener(
+        settings.listen_database_url, store.users, SUBSCRIPTIONS_CHANNEL
+    ).start()
+    store.start()
+    logger.info('Post store has been set, it is being loaded')
+    return StoreGateway(sessionmaker_, store)
+
+
+def build_coalescer(settings: Settings) -> Coalescer | None:
+    """Create registry of computations in flight.
+
+    :param settings: script settings
+    :type settings: Settings
+    :return: coalescer or None if disabled
+    """
+    if not settings.coalesce:
+        return None
+    logger.info('Request coalescing has been set')
+    return Coalescer(settings.coalesce_window_ms / 1000)
+
+
+def build_metrics(settings: Settings) -> Metrics | None:
+    """Create registry of worker metrics.
+
+    :param settings: script settings
+    :type settings: Settings
+    :return: metrics or None if disabled
+    """
+    if not settings.metrics_port:
+        return None
+    return Metrics()
+
+
+def build_profiler(settings: Settings) -> Profiler | None:
+    """Create profiler, switched on and off with SIGUSR1.
+
+    :param settings: script settings
+    :type settings: Settings
+    :return: profiler or None if profile directory is not set
+    """
+    if settings.profile_dir is None:
+        return None
+    profiler = Profiler(
+        settings.profile_dir,
+        every=settings.profile_every,
+        slow_threshold=settings.profile_slow_ms / 1000,
+        keep=settings.profile_keep,
+        enabled=settings.profile,
+    )
+    signal.signal(signal.SIGUSR1, lambda *_: profiler.toggle())
+    logger.info(
+        'Profiler has been set, it is %s, send SIGUSR1 to switch it',
+        'on' if settings.profile else 'off',
+    )
+    return profiler
+
+
+def serve_metrics(settings: Settings, digester: Digester, stats: FlowStats):
+    """Register worker gauges and start serving metrics, if enabled.
+
+    :param settings: script settings
+    :type settings: Settings
+    :param digester: digester recording metrics
+    :type digester: Digester
+    :param stats: statistics of runnable
+    :type stats: FlowStats
+    :return: None
+    """
+    metrics = digester.metrics
+    if metrics is None:
+        return
+    metrics.register_stats(stats)
+    rabbit_reader = digester.rabbit_reader
+    rabbit_reader.backlog_interval = settings.metrics_backlog_interval
+    metrics.register(
+        'digest_queue_backlog',
+        'gauge',
+        'Messages ready in queue.',
+        lambda: rabbit_reader.backlog,
+    )
+    MetricsServer(
+        metrics, settings.metrics_host, settings.metrics_port + worker_index()
+    ).start()
+
+
+def build_async_digester(settings: Settings) -> Digester:
+    """Create asyncio adapters and AsyncDigester using them.
+
+    Requires asyncpg and aio-pika.
+
+    :param settings: script settings
+    :type settings: Settings
+    :return: AsyncDigester instance
+    """
+    if settings.post_store:
+        raise ValueError('Post store supports sync engine only')
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    from digest.adapters.async_database import AsyncGateway
+    from digest.adapters.async_rabbit import AsyncRabbitReader
+    from digest.adapters.storage import (
+        AsyncNormalizedRedisStorage,
+        AsyncRedisStorage,
+    )
+    from digest.services.async_digester import AsyncDigester
+
+    logger.info('Setting up asyncio adapters')
+    engine = create_async_engine(
+        settings.async_database_url, pool_size=settings.async_db_concurrency
+    )
+    gateway = AsyncGateway(
+        async_sessionmaker(engine, expire_on_commit=False),
+        settings.async_db_concurrency,
+        settings.leaderboards,
+    )
+    prefetch_count = max(settings.rabbit_prefetch_count, settings.batch_size)
+    rabbit_reader = AsyncRabbitReader(
+        settings.rabbit_queue,
+        settings.rabbit_host,
+        settings.rabbit_port,
+        settings.rabbit_username,
+        settings.rabbit_password,
+        prefetch_count=prefetch_count,
+        ack_batch_size=settings.rabbit_ack_batch_size,
+        max_redeliveries=settings.rabbit_max_redeliveries,
+    )
+    if settings.redis_layout == 'normalized':
+        redis_storage = AsyncNormalizedRedisStorage(settings.redis_url)
+    else:
+        redis_storage = AsyncRedisStorage(
+            settings.redis_url, build_codec(settings)
+        )
+    logger.info('Asyncio adapters have been set')
+
+    return AsyncDigester(
+        gateway,
+        rabbit_reader,
+        redis_storage,
+        *filter_functions(settings),
+        batch_size=settings.batch_size,
+        batch_timeout=settings.batch_timeout_ms / 1000,
+        max_in_flight=prefetch_count,
+        copy_threshold=settings.copy_threshold,
+        dedupe=settings.dedupe,
+        posts_cache=build_posts_cache(settings),
+        incremental=build_incremental(settings),
+        coalescer=build_coalescer(settings),
+        metrics=build_metrics(settings),
+        profiler=build_profiler(settings),
+    )
+
+
+def build_digester(settings: Settings) -> Digester:
+    """Create adapters and Digester using them.
+
+    :param settings: script settings
+    :type settings: Settings
+    :return: Digester instance
+    """
+    if settings.engine == 'asyncio':
+        return build_async_digester(settings)
+
     logger.info('Setting up database adapter')
-    engine = create_engine(settings.database_url)
+    engine = create_engine(
+        settings.database_url, pool_size=max(settings.concurrency, 5)
+    )
     sessionmaker_ = sessionmaker(engine)
-    gateway = Gateway(sessionmaker_)
+    gateway = build_gateway(settings, sessionmaker_)
     logger.info('Database adapter has been set')
 
     logger.info('Setting up RabbitMQ adapter')
@@ -125,18 +569,104 @@ def main():
     username = settings.rabbit_username
     password = settings.rabbit_password
     queue = settings.rabbit_queue
-    rabbit_reader = RabbitReader(queue, host, port, username, password)
+    rabbit_reader = RabbitReader(
+        queue,
+        host,
+        port,
+        username,
+        password,
+        prefetch_count=max(
+            settings.rabbit_prefetch_count, settings.batch_size
+        ),
+        ack_batch_size=settings.rabbit_ack_batch_size,
+        max_redeliveries=settings.rabbit_max_redeliveries,
+    )
     logger.info('RabbitMQ adapter has been set')
 
     logger.info('Setting up Redis adapter')
-    redis_storage = RedisStorage(settings.redis_url)
+    if settings.redis_layout == 'normalized':
+        redis_storage = NormalizedRedisStorage(settings.redis_url)
+    else:
+        redis_storage = RedisStorage(settings.redis_url, build_codec(settings))
+    redis_writer = None
+    if settings.redis_write_buffer:
+        redis_writer = BufferedWriter(
+            redis_storage, max_size=settings.redis_write_buffer
+        )
     logger.info('Redis adapter has been set')
 
-    compose_function = at_least_one_subscription
+    return Digester(
+        gateway,
+        rabbit_reader,
+        redis_storage,
+        *filter_functions(settings),
+        batch_size=settings.batch_size,
+        batch_timeout=settings.batch_timeout_ms / 1000,
+        redis_writer=redis_writer,
+        copy_threshold=settings.copy_threshold,
+        dedupe=settings.dedupe,
+        posts_cache=build_posts_cache(settings),
+        incremental=build_incremental(settings),
+        coalescer=build_coalescer(settings),
+        metrics=build_metrics(settings),
+        profiler=build_profiler(settings),
+    )
+
 
-    digester = Digester(
-        gateway, rabbit_reader, redis_storage, compose_function
+def build_fanout(settings: Settings) -> SubscriptionFanout:
+    """Create Digester and SubscriptionFanout using it.
+
+    :param settings: script settings
+    :type settings: Settings
+    :return: SubscriptionFanout instance
+    """
+    if settings.engine == 'asyncio':
+        raise ValueError('Subscriptions mode supports sync engine only')
+    digester = build_digester(settings)
+    rabbit_reader = digester.rabbit_reader
+    rabbit_reader.prefetch_count = max(
+        rabbit_reader.prefetch_count, settings.fanout_max_events
+    )
+    return SubscriptionFanout(
+        digester,
+        rabbit_reader,
+        window=settings.fanout_window_ms / 1000,
+        max_events=settings.fanout_max_events,
+        chunk_size=settings.fanout_chunk_size,
     )
 
+
+def build_runner(
+    settings: Settings,
+) -> Digester | ThreadPoolRunner | SubscriptionFanout:
+    """Create Digester, wrapped into thread pool if needed.
+
+    :param settings: script settings
+    :type settings: Settings
+    :return: runnable with ``stats`` and ``stop``
+    """
+    if settings.mode == 'subscriptions':
+        runner = build_fanout(settings)
+        digester = runner.digester
+    else:
+        digester = runner = build_digester(settings)
+        # with asyncio concurrency is provided by event loop
+        if settings.engine == 'sync' and settings.concurrency > 1:
+            runner = ThreadPoolRunner(digester, settings.concurrency)
+    serve_metrics(settings, digester, runner.stats)
+    return runner
+
+
+def main():
+    """Parse arguments, initialize Digester and start flow."""
+    settings = Settings(**parse_arguments())
+    setup_logging(settings)
+
     logger.info('Starting main method')
-    digester()
+    if settings.processes > 1:
+        # adapters are created by every worker after fork
+        ProcessSupervisor(
+            partial(build_runner, settings), settings.processes
+        )()
+    else:
+        build_runner(settings)()
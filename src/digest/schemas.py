@@ -1,5 +1,6 @@
 """Schemas, used in project."""
 from datetime import datetime
+from typing import NamedTuple
 
 from pydantic import BaseModel, ConfigDict
 
@@ -15,6 +16,23 @@ class PostDTO(BaseModel):
     rating: int
 
 
+class PostRank(NamedTuple):
+    """Post fields needed for ranking, without content."""
+
+    id: int
+    subscription_id: int
+    rating: int
+
+
+class UserPostRank(NamedTuple):
+    """Post ranking fields together with subscribed user ID."""
+
+    user_id: int
+    id: int
+    subscription_id: int
+    rating: int
+
+
 class DigestDTO(BaseModel):
     """Full Digest representation."""
 
@@ -1,5 +1,16 @@
 """Services collection."""
 from digest.services.digester import Digester
-from digest.services.filters import at_least_one_subscription, dummy_filter
+from digest.services.filters import (
+    at_least_one_subscription,
+    dummy_filter,
+    heap_at_least_one_subscription,
+    heap_dummy_filter,
+)
 
-__all__ = ('Digester', 'at_least_one_subscription', 'dummy_filter')
+__all__ = (
+    'Digester',
+    'at_least_one_subscription',
+    'dummy_filter',
+    'heap_at_least_one_subscription',
+    'heap_dummy_filter',
+)
@@ -0,0 +1,443 @@
+"""Asynchronous Digester module."""
+import asyncio
+import logging
+import time
+from collections.abc import Callable, Iterable, Mapping, Sequence
+
+from digest.adapters.async_database import AsyncGateway
+from digest.adapters.async_rabbit import AsyncRabbitReader
+from digest.adapters.rabbit import Delivery
+from digest.adapters.storage import AsyncRedisStorage
+from digest.schemas import DigestDTO, PostRank
+from digest.services.cache import TopPostsCache
+from digest.services.coalescing import Coalescer
+from digest.services.digester import Digester
+from digest.services.incremental import IncrementalState
+from digest.services.metrics import Metrics
+from digest.services.profiling import Profiler
+
+logger = logging.getLogger('digest.digester')
+
+
+class AsyncDigester(Digester):
+    """Asynchronous Digester.
+
+    Same flow as ``Digester``, but every I/O method is a coroutine
+    and deliveries are processed concurrently on one event loop.
+    Number of deliveries in flight is capped by ``max_in_flight``,
+    number of simultaneous database sessions is capped by gateway.
+    """
+
+    def __init__(
+        self,
+        gateway: AsyncGateway,
+        rabbit_reader: AsyncRabbitReader,
+        redis_storage: AsyncRedisStorage,
+        filter_function: Callable[..., list[int]],
+        batch_filter_function: Callable[..., dict[int, list[int]]]
+        | None = None,
+        batch_size: int = 1,
+        batch_timeout: float = 0.05,
+        max_in_flight: int = 1000,
+        copy_threshold: int = 0,
+        dedupe: bool = False,
+        posts_cache: TopPostsCache | None = None,
+        incremental: IncrementalState | None = None,
+        coalescer: Coalescer | None = None,
+        metrics: Metrics | None = None,
+        profiler: Profiler | None = None,
+    ):
+        """Initialize AsyncDigester.
+
+        See ``Digester`` for description of common parameters.
+
+        :param gateway: asynchronous database adapter.
+        :type gateway: AsyncGateway
+        :param rabbit_reader: asynchronous RabbitMQ listener.
+        :type rabbit_reader: AsyncRabbitReader
+        :param redis_storage: asynchronous Redis storage.
+        :type redis_storage: AsyncRedisStorage
+        :param filter_function: filter function
+        :type filter_function: Callable
+        :param batch_filter_function: filter function for many users
+        :type batch_filter_function: Callable
+        :param batch_size: maximum number of user IDs processed at once
+        :type batch_size: int
+        :param batch_timeout: maximum time to wait for batch, in seconds
+        :type batch_timeout: float
+        :param max_in_flight: maximum number of deliveries
+            (or batches) processed at once
+        :type max_in_flight: int
+        :param copy_threshold: minimal batch size to be saved with COPY,
+            0 disables COPY
+        :type copy_threshold: int
+        :param dedupe: reuse unchanged digests
+        :type dedupe: bool
+        :param posts_cache: cache of top posts of subscriptions
+        :type posts_cache: TopPostsCache
+        :param incremental: remembered candidate posts of users
+        :type incremental: IncrementalState
+        :param coalescer: registry of computations in flight
+        :type coalescer: Coalescer
+        :param metrics: registry of worker metrics
+        :type metrics: Metrics
+        :param profiler: profiler of sampled and slow messages
+        :type profiler: Profiler
+        """
+        super().__init__(
+            gateway,
+            rabbit_reader,
+            redis_storage,
+            filter_function,
+            batch_filter_function,
+            batch_size,
+            batch_timeout,
+            copy_threshold=copy_threshold,
+            dedupe=dedupe,
+            posts_cache=posts_cache,
+            incremental=incremental,
+            coalescer=coalescer,
+            metrics=metrics,
+            profiler=profiler,
+        )
+        self.max_in_flight = max_in_flight
+
+    async def incremental_ranks(
+        self, user_ids: Sequence[int], limit: int
+    ) -> dict[int, list[PostRank]]:
+        """Bring remembered candidate posts of users up to date.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :param limit: number of posts to be used
+        :type limit: int
+        :return: user ID to candidate posts mapping
+        """
+        subscriptions = await self.gateway.read_subscriptions_for_users(
+            user_ids
+        )
+        plan = self.incremental.plan(subscriptions, limit)
+        async with self.gateway.snapshot() as session:
+            watermark = await self.gateway.read_last_post_id(session)
+            added = await self.gateway.read_post_ranks_above(
+                plan.watermarks, session
+            )
+            refetched = await self.gateway.read_top_posts(
+                list(plan.refetch), limit, session
+            )
+        return self.incremental.apply(
+            plan, subscriptions, limit, watermark, added, refetched
+        )
+
+    async def top_posts(
+        self, subscription_ids: Iterable[int]
+    ) -> dict[int, list[PostRank]]:
+        """Get top posts of subscriptions, reading missing ones.
+
+        :param subscription_ids: target subscription IDs
+        :type subscription_ids: Iterable[int]
+        :return: subscription ID to top posts mapping
+        """
+        found, missing = self.posts_cache.lookup(subscription_ids)
+        if missing:
+            generation = self.posts_cache.generation
+            ranks = await self.gateway.read_top_posts(
+                missing, self.posts_cache.top_k
+            )
+            found.update(self.posts_cache.update(missing, ranks, generation))
+        return found
+
+    async def cached_ranks(
+        self, user_ids: Sequence[int]
+    ) -> dict[int, list[PostRank]]:
+        """Collect candidate posts of users from posts_cache.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :return: user ID to candidate posts mapping
+        """
+        subscriptions = await self.gateway.read_subscriptions_for_users(
+            user_ids
+        )
+        top = await self.top_posts(
+            {sid for sids in subscriptions.values() for sid in sids}
+        )
+        return self.merge_top_posts(subscriptions, top)
+
+    async def make_digest(self, user_id: int, limit: int = 5) -> DigestDTO:
+        """Make Digest for given user and store it to PostgresQL.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :param limit: number of posts to be used
+        :type limit: int
+        :return: composed digest
+        """
+        pushdown = getattr(self.filter_function, 'pushdown', None)
+        with self.timed('read'):
+            if self.uses_incremental():
+                ranks = await self.incremental_ranks([user_id], limit)
+                posts = ranks[int(user_id)]
+            elif self.uses_posts_cache(limit):
+                posts = (await self.cached_ranks([user_id]))[int(user_id)]
+            elif pushdown is None:
+                posts = await self.gateway.read_post_ranks_for_user(user_id)
+            else:
+                posts = await self.gateway.read_candidate_ranks_for_user(
+                    user_id, limit, **pushdown
+                )
+        self.record_posts([len(posts)])
+        with self.timed('filter'):
+            post_ids = self.filter_function(*posts, limit=limit)
+        if self.dedupe:
+            digests = await self.save_digests({user_id: post_ids})
+            return digests[user_id]
+        with self.timed('save'):
+            return await self.gateway.create_digest(user_id, *post_ids)
+
+    async def choose_posts(
+        self, user_ids: Sequence[int], limit: int = 5
+    ) -> dict[int, list[int]]:
+        """Choose digest posts for many users at once.
+
+        :param user_ids: target user IDs, without duplicates
+        :type user_ids: Sequence[int]
+        :param limit: number of posts to be used
+        :type limit: int
+        :return: user ID to chosen post IDs mapping
+        """
+        pushdown = getattr(self.filter_function, 'pushdown', None)
+        with self.timed('read'):
+            if self.uses_incremental():
+                ranks = self.user_ranks(
+                    await self.incremental_ranks(user_ids, limit)
+                )
+            elif self.uses_posts_cache(limit):
+                ranks = self.user_ranks(await self.cached_ranks(user_ids))
+            elif pushdown is None:
+                ranks = await self.gateway.read_post_ranks_for_users(user_ids)
+            else:
+                ranks = await self.gateway.read_candidate_ranks_for_users(
+                    user_ids, limit, **pushdown
+                )
+        self.observe_posts(ranks, user_ids)
+        with self.timed('filter'):
+            return self.filter_ranks(ranks, user_ids, limit)
+
+    async def make_digests(
+        self, user_ids: Sequence[int], limit: int = 5
+    ) -> dict[int, DigestDTO | None]:
+        """Make Digests for many users and store them to PostgresQL.
+
+        :param user_ids: target user IDs, without duplicates
+        :type user_ids: Sequence[int]
+        :param limit: number of posts to be used
+        :type limit: int
+        :return: user ID to composed digest mapping
+        """
+        chosen = await self.choose_posts(user_ids, limit)
+        return await self.save_digests(chosen)
+
+    async def save_digests(
+        self, chosen: Mapping[int, Sequence[int]]
+    ) -> dict[int, DigestDTO | None]:
+        """Save Digests of chosen posts, reusing unchanged ones if enabled.
+
+        :param chosen: user ID to chosen post IDs mapping
+        :type chosen: Mapping[int, Sequence[int]]
+        :return: user ID to digest mapping
+        """
+        with self.timed('save'):
+            reused = {}
+            if self.dedupe:
+                reused = await self.reuse_digests(chosen)
+                chosen = {
+                    user_id: post_ids
+                    for user_id, post_ids in chosen.items()
+                    if user_id not in reused
+                }
+            if self.copy_threshold and len(chosen) >= self.copy_threshold:
+                digests = await self.gateway.copy_digests(chosen)
+            else:
+                digests = await self.gateway.create_digests(chosen)
+            if self.dedupe:
+                await self.redis_storage.store_fingerprints(
+                    self.fingerprints(chosen, digests)
+                )
+            digests.update(reused)
+            return digests
+
+    async def reuse_digests(
+        self, chosen: Mapping[int, Sequence[int]]
+    ) -> dict[int, DigestDTO]:
+        """Refresh previous digests of users whose posts did not change.
+
+        :param chosen: user ID to chosen post IDs mapping
+        :type chosen: Mapping[int, Sequence[int]]
+        :return: user ID to reused digest mapping
+        """
+        chosen = {
+            user_id: post_ids
+            for user_id, post_ids in chosen.items()
+            if post_ids
+        }
+        if not chosen:
+            return {}
+        stored = await self.redis_storage.read_fingerprints(chosen)
+        matching = self.matching_digests(chosen, stored)
+        touched = await self.gateway.touch_digests(matching)
+        self.stats.record_unchanged(len(touched))
+        return {
+            matching[digest_id][0]: digest_data
+            for digest_id, digest_data in touched.items()
+        }
+
+    async def store_digest(self, digest_data: DigestDTO):
+        """Store digest to Redis.
+
+        :param digest_data: digest to be stored
+        :type digest_data: DigestDTO
+        :return: None
+        """
+        payload = self.redis_storage.encode(digest_data)
+        with self.timed('store'):
+            await self.redis_storage.store(digest_data.user_id, payload)
+
+    async def flow(self, user_id: int):
+        """Compose digest for given user and store it to Redis.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :return: None
+        """
+        digest_data = await self.make_digest(user_id)
+        await self.store_digest(digest_data or self.empty_digest(user_id))
+
+    async def flow_many(self, user_ids: Sequence[int]) -> dict[int, Exception]:
+        """Compose digests for many users and store them to Redis.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :return: user ID to error mapping for digests not stored to Redis
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        digests = await self.make_digests(user_ids)
+        payloads = self.payloads(digests)
+        with self.timed('store'):
+            return await self.redis_storage.store_many(payloads)
+
+    async def process(self, delivery: Delivery) -> bool:
+        """Apply flow to delivery unless it is attached to another one.
+
+        :param delivery: received delivery
+        :type delivery: Delivery
+        :return: True if flow succeeded or delivery was attached
+        """
+        self.observe_received([delivery])
+        if self.discard_malformed(delivery):
+            return False
+        if self.attach(delivery):
+            return True
+        return await self.process_claimed(delivery)
+
+    async def process_claimed(self, delivery: Delivery) -> bool:
+        """Apply flow to delivery and report result to RabbitMQ.
+
+        :param delivery: received delivery
+        :type delivery: Delivery
+        :return: True if flow succeeded
+        """
+        started = time.perf_counter()
+        try:
+            with self.profiled([delivery.user_id]), self.timed('message'):
+                await self.flow(delivery.user_id)
+        except Exception:
+            logger.exception('Failed to process user %s', delivery.user_id)
+            self.release(delivery, False)
+            self.rabbit_reader.reject(delivery)
+            self.stats.record(time.perf_counter() - started, ok=False)
+            return False
+        self.release(delivery, True)
+        self.rabbit_reader.ack(delivery)
+        self.stats.record(time.perf_counter() - started)
+        return True
+
+    async def process_batch(self, deliveries: Sequence[Delivery]):
+        """Apply flow_many to deliveries and report results to RabbitMQ.
+
+        Malformed deliveries are discarded, deliveries attached
+        to computations in flight are skipped.
+        If batch fails, deliveries are processed one by one.
+
+        :param deliveries: received deliveries
+        :type deliveries: Sequence[Delivery]
+        :return: None
+        """
+        self.observe_received(deliveries)
+        if self.metrics is not None:
+            self.metrics.observe_batch(len(deliveries))
+        deliveries = self.accepted(deliveries)
+        if not deliveries:
+            return
+        started = time.perf_counter()
+        user_ids = [delivery.user_id for delivery in deliveries]
+        try:
+            with self.profiled(user_ids):
+                failed = await self.flow_many(user_ids)
+        except Exception:
+            logger.exception('Failed to process batch, retrying one by one')
+            for delivery in deliveries:
+                await self.process_claimed(delivery)
+            return
+        self.settle_batch(deliveries, failed, time.perf_counter() - started)
+
+    async def handle(self, item: Delivery | Sequence[Delivery]):
+        """Process item produced by ``deliveries`` generator.
+
+        :param item: delivery or list of deliveries
+        :type item: Delivery | Sequence[Delivery]
+        :return: None
+        """
+        if isinstance(item, Delivery):
+            await self.process(item)
+        else:
+            await self.process_batch(item)
+
+    async def run(self):
+        """Start the whole process on running event loop.
+
+        Every delivery (or batch) is handled in its own task,
+        so slow database or Redis calls do not block other messages.
+        Once stopped, RabbitMQ generator waits for pending tasks
+        to report their deliveries before acknowledgements
+        are flushed and connection is closed.
+        """
+        logger.info('Start listening')
+        slots = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+
+        def release(task: asyncio.Task):
+            tasks.discard(task)
+            slots.release()
+            if not task.cancelled() and task.exception() is not None:
+                logger.error(
+                    'Failed to handle deliveries', exc_info=task.exception()
+                )
+
+        deliveries = self.deliveries()
+        try:
+            async for item in deliveries:
+                await slots.acquire()
+                task = asyncio.create_task(self.handle(item))
+                tasks.add(task)
+                task.add_done_callback(release)
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            await deliveries.aclose()
+            logger.info('Stopped: %s', self.stats.summary())
+            self.log_cache_summary()
+
+    def __call__(self):
+        """Start the whole process in new event loop."""
+        asyncio.run(self.run())
@@ -0,0 +1,210 @@
+"""Vectorized posts-filtering functions for many users at once.
+
+Requires NumPy, which is an optional dependency.
+
+Batch filters take ranking fields of posts of many users, as returned by
+``Gateway.read_post_ranks_for_users``, and return chosen post IDs for
+every user. Results are identical to calling regular filters per user
+with the same posts order: ties are broken by stable sorting.
+"""
+import itertools
+from collections.abc import Sequence
+from typing import NamedTuple
+
+import numpy as np
+
+from digest.schemas import UserPostRank
+
+
+class PostColumns(NamedTuple):
+    """Columnar representation of posts of many users."""
+
+    post_ids: np.ndarray
+    subscription_ids: np.ndarray
+    ratings: np.ndarray
+    owners: np.ndarray
+
+
+def to_columns(
+    ranks: Sequence[UserPostRank], user_ids: Sequence[int]
+) -> PostColumns:
+    """Convert rows to columns, replacing user ID with its batch index.
+
+    :param ranks: posts of users
+    :type ranks: Sequence[UserPostRank]
+    :param user_ids: users of the batch
+    :type user_ids: Sequence[int]
+    :return: posts columns
+    """
+    rows = np.fromiter(
+        itertools.chain.from_iterable(ranks),
+        dtype=np.int64,
+        count=4 * len(ranks),
+    ).reshape(-1, 4)
+    users = np.array([int(user_id) for user_id in user_ids], dtype=np.int64)
+    sorter = np.argsort(users, kind='stable')
+    owners = sorter[np.searchsorted(users, rows[:, 0], sorter=sorter)]
+    return PostColumns(rows[:, 1], rows[:, 2], rows[:, 3], owners)
+
+
+def _stable_order(major: np.ndarray, minor: np.ndarray) -> np.ndarray:
+    """Sort by two integer keys, keeping input order on ties.
+
+    Keys are packed into single int64 when it cannot overflow,
+    as one-key stable argsort is several times faster than lexsort.
+
+    :param major: primary key, non-negative
+    :type major: np.ndarray
+    :param minor: secondary key
+    :type minor: np.ndarray
+    :return: sorting order
+    """
+    if not len(major):
+        return np.arange(0)
+    minor = minor.astype(np.int64)
+    minor -= minor.min()
+    span = int(minor.max()) + 1
+    if (int(major.max()) + 1) * span <= np.iinfo(np.int64).max:
+        return np.argsort(major * span + minor, kind='stable')
+    return np.lexsort((minor, major))
+
+
+def _segment_rank(mask: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Count set mask items from segment start up to every item inclusive.
+
+    :param mask: boolean array
+    :type mask: np.ndarray
+    :param starts: segment start of every item
+    :type starts: np.ndarray
+    :return: inclusive running count within segment
+    """
+    counts = np.concatenate(([0], np.cumsum(mask)))
+    return counts[1:] - counts[starts]
+
+
+def _split(
+    post_ids: np.ndarray, owners: np.ndarray, users: int
+) -> list[list[int]]:
+    """Split chosen post IDs (grouped by owner) into per-user lists."""
+    if not users:
+        return []
+    counts = np.bincount(owners, minlength=users)
+    return [
+        chunk.tolist() for chunk in np.split(post_ids, np.cumsum(counts)[:-1])
+    ]
+
+
+def rank_columns(columns: PostColumns, users: int) -> tuple[np.ndarray, ...]:
+    """Order posts by owner, then by rating, keeping input order on ties.
+
+    :param columns: posts columns
+    :type columns: PostColumns
+    :param users: number of users in batch
+    :type users: int
+    :return: ranked order, owners in that order,
+        segment start of every item and position within segment
+    """
+    order = _stable_order(columns.owners, -columns.ratings)
+    owners = columns.owners[order]
+    first = np.searchsorted(owners, np.arange(users))
+    starts = first[owners]
+    positions = np.arange(len(order)) - starts
+    return order, owners, starts, positions
+
+
+def columns_dummy_filter(
+    columns: PostColumns, users: int, limit: int = 5
+) -> list[list[int]]:
+    """Vectorized ``dummy_filter`` over columns.
+
+    :param columns: posts columns
+    :type columns: PostColumns
+    :param users: number of users in batch
+    :type users: int
+    :param limit: how many posts should be returned for every user
+    :type limit: int
+    :return: list of chosen Posts IDs for every user index
+    """
+    order, owners, _, positions = rank_columns(columns, users)
+    chosen = positions < limit
+    return _split(columns.post_ids[order][chosen], owners[chosen], users)
+
+
+def columns_at_least_one_subscription(
+    columns: PostColumns, users: int, limit: int = 5
+) -> list[list[int]]:
+    """Vectorized ``at_least_one_subscription`` over columns.
+
+    First pass chooses best post of each user subscription,
+    limited to ``limit`` best ones. Second pass fills the rest
+    with other top-rated posts.
+
+    :param columns: posts columns
+    :type columns: PostColumns
+    :param users: number of users in batch
+    :type users: int
+    :param limit: how many posts should be returned for every user
+    :type limit: int
+    :return: list of chosen Posts IDs for every user index
+    """
+    if limit <= 0:
+        return [[] for _ in range(users)]
+    order, owners, starts, _ = rank_columns(columns, users)
+    subscriptions = columns.subscription_ids[order]
+
+    groups = _stable_order(owners, subscriptions)
+    group_owners = owners[groups]
+    group_subscriptions = subscriptions[groups]
+    group_start = np.ones(len(groups), dtype=bool)
+    group_start[1:] = (group_owners[1:] != group_owners[:-1]) | (
+        group_subscriptions[1:] != group_subscriptions[:-1]
+    )
+    leaders = np.zeros(len(order), dtype=bool)
+    leaders[groups[group_start]] = True
+
+    first_pass = leaders & (_segment_rank(leaders, starts) <= limit)
+    first_pass_counts = np.bincount(owners[first_pass], minlength=users)
+    rest = ~first_pass
+    second_pass = rest & (
+        _segment_rank(rest, starts) <= limit - first_pass_counts[owners]
+    )
+
+    chosen = np.flatnonzero(first_pass | second_pass)
+    chosen = chosen[_stable_order(owners[chosen], second_pass[chosen])]
+    return _split(columns.post_ids[order][chosen], owners[chosen], users)
+
+
+def batch_dummy_filter(
+    ranks: Sequence[UserPostRank], user_ids: Sequence[int], limit: int = 5
+) -> dict[int, list[int]]:
+    """Filter posts of many users by rating.
+
+    :param ranks: posts of users
+    :type ranks: Sequence[UserPostRank]
+    :param user_ids: users of the batch
+    :type user_ids: Sequence[int]
+    :param limit: how many posts should be returned for every user
+    :type limit: int
+    :return: user ID to list of chosen Posts IDs mapping
+    """
+    columns = to_columns(ranks, user_ids)
+    chosen = columns_dummy_filter(columns, len(user_ids), limit)
+    return dict(zip(user_ids, chosen, strict=True))
+
+
+def batch_at_least_one_subscription(
+    ranks: Sequence[UserPostRank], user_ids: Sequence[int], limit: int = 5
+) -> dict[int, list[int]]:
+    """Semi-smart filter for many users.
+
+    :param ranks: posts of users
+    :type ranks: Sequence[UserPostRank]
+    :param user_ids: users of the batch
+    :type user_ids: Sequence[int]
+    :param limit: how many posts should be returned for every user
+    :type limit: int
+    :return: user ID to list of chosen Posts IDs mapping
+    """
+    columns = to_columns(ranks, user_ids)
+    chosen = columns_at_least_one_subscription(columns, len(user_ids), limit)
+    return dict(zip(user_ids, chosen, strict=True))
@@ -0,0 +1,207 @@
+"""In-process cache of top-rated posts of subscriptions."""
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from collections.abc import Iterable, Sequence
+
+from digest.schemas import PostRank
+
+ENTRY_SIZE = 200
+POST_SIZE = sys.getsizeof(PostRank(0, 0, 0)) + 3 * sys.getsizeof(2**40)
+
+
+def entry_size(ranks: Sequence[PostRank]) -> int:
+    """Estimate memory used by cached list of posts.
+
+    :param ranks: cached posts
+    :type ranks: Sequence[PostRank]
+    :return: approximate size, in bytes
+    """
+    return ENTRY_SIZE + POST_SIZE * len(ranks)
+
+
+class TopPostsCache:
+    """Thread-safe LRU cache of top ``top_k`` posts of every subscription.
+
+    Entries are evicted when total estimated size exceeds ``max_bytes``
+    and expire after ``ttl`` seconds, so a missed invalidation is not
+    kept forever. Subscriptions are invalidated by ``invalidate``,
+    normally called by ``PostsListener``.
+
+    Loads race with invalidations: a list read from database before
+    subscription was invalidated is stale. ``generation`` is taken
+    before a load and passed to ``update``, which skips subscriptions
+    invalidated since then.
+    """
+
+    def __init__(
+        self, top_k: int = 20, max_bytes: int = 64 << 20, ttl: float = 300
+    ):
+        """Initialize empty cache.
+
+        :param top_k: number of posts kept per subscription
+        :type top_k: int
+        :param max_bytes: memory budget, in bytes
+        :type max_bytes: int
+        :param ttl: lifetime of entry, in seconds
+        :type ttl: float
+        """
+        self.top_k = top_k
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.active = True
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._invalidated = {}
+        self._cleared = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        """Token to be passed to ``update`` after database read."""
+        with self._lock:
+            return self._generation
+
+    def lookup(
+        self, subscription_ids: Iterable[int]
+    ) -> tuple[dict[int, list[PostRank]], list[int]]:
+        """Get cached posts of subscriptions.
+
+        :param subscription_ids: target subscription IDs
+        :type subscription_ids: Iterable[int]
+        :return: subscription ID to cached posts mapping
+            and list of subscription IDs not found
+        """
+        found = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for subscription_id in subscription_ids:
+                entry = self._entries.get(subscription_id)
+                if entry is not None and entry[1] <= now:
+                    self._discard(subscription_id)
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    missing.append(subscription_id)
+                    continue
+                self._entries.move_to_end(subscription_id)
+                found[subscription_id] = entry[0]
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def update(
+        self,
+        subscription_ids: Sequence[int],
+        ranks: Iterable[PostRank],
+        generation: int,
+    ) -> dict[int, list[PostRank]]:
+        """Put posts read from database to cache.
+
+        :param subscription_ids: subscriptions whose posts were read
+        :type subscription_ids: Sequence[int]
+        :param ranks: top posts of these subscriptions,
+            best rated first within subscription
+        :type ranks: Iterable[PostRank]
+        :param generation: ``generation`` taken before posts were read
+        :type generation: int
+        :return: subscription ID to posts mapping,
+            including subscriptions without posts
+        """
+        grouped = defaultdict(list)
+        for rank in ranks:
+            grouped[rank.subscription_id].append(rank)
+        result = {
+            subscription_id: grouped[subscription_id]
+            for subscription_id in subscription_ids
+        }
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            if not self.active or generation < self._cleared:
+                return result
+            for subscription_id, posts in result.items():
+                if self._invalidated.get(subscription_id, -1) >= generation:
+                    continue
+                self._discard(subscription_id)
+                size = entry_size(posts)
+                self._entries[subscription_id] = (posts, expires, size)
+                self.size += size
+            while self.size > self.max_bytes and self._entries:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+        return result
+
+    def invalidate(self, subscription_id: int):
+        """Drop cached posts of subscription.
+
+        :param subscription_id: changed subscription ID
+        :type subscription_id: int
+        :return: None
+        """
+        with self._lock:
+            self._invalidated[subscription_id] = self._generation
+            self._generation += 1
+            if self._discard(subscription_id):
+                self.invalidations += 1
+
+    def clear(self):
+        """Drop all cached posts.
+
+        :return: None
+        """
+        with self._lock:
+            self._generation += 1
+            self._cleared = self._generation
+            self._invalidated.clear()
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self.size = 0
+
+    def suspend(self):
+        """Drop all cached posts and stop caching new ones.
+
+        Used while invalidations can not be received.
+
+        :return: None
+        """
+        self.active = False
+        self.clear()
+
+    def resume(self):
+        """Drop all cached posts and start caching again.
+
+        :return: None
+        """
+        self.clear()
+        self.active = True
+
+    def _discard(self, subscription_id: int) -> bool:
+        entry = self._entries.pop(subscription_id, None)
+        if entry is None:
+            return False
+        self.size -= entry[2]
+        return True
+
+    def summary(self) -> str:
+        """Describe cache statistics in one line.
+
+        :return: human-readable summary
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            ratio = self.hits / lookups if lookups else 0
+            return (
+                f'{self.hits} hits, {self.misses} misses '
+                f'({ratio:.1%} hit ratio), {self.evictions} evicted, '
+                f'{self.expirations} expired, '
+                f'{self.invalidations} invalidated, '
+                f'{len(self._entries)} entries, {self.size >> 10} KiB'
+            )
@@ -0,0 +1,75 @@
+"""Coalescing of repeated requests for the same user."""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class Coalescer:
+    """Thread-safe registry of digests being computed or just computed.
+
+    The first delivery of a user claims computation (becomes leader),
+    later deliveries of the user get leader's Future instead, while
+    it is in progress and for ``window`` seconds after it succeeded.
+    Future result is True if leader's digest was stored.
+    Failed computations are forgotten at once, so next delivery
+    computes digest again.
+    """
+
+    def __init__(self, window: float = 5.0):
+        """Initialize empty registry.
+
+        :param window: how long successful result is reused, in seconds
+        :type window: float
+        """
+        self.window = window
+        self._pending = {}
+        self._completed = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, user_id: int) -> Future | None:
+        """Claim computation of user digest.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :return: None if caller should compute digest and ``complete``
+            it, or Future of computation to attach to otherwise
+        """
+        user_id = int(user_id)
+        now = time.monotonic()
+        with self._lock:
+            while self._completed:
+                oldest, (completed_at, _) = next(iter(self._completed.items()))
+                if completed_at + self.window > now:
+                    break
+                del self._completed[oldest]
+            future = self._pending.get(user_id)
+            if future is not None:
+                return future
+            completed = self._completed.get(user_id)
+            if completed is not None:
+                return completed[1]
+            self._pending[user_id] = Future()
+            return None
+
+    def complete(self, user_id: int, ok: bool):
+        """Report result of claimed computation.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :param ok: whether digest was stored
+        :type ok: bool
+        :return: None
+        """
+        user_id = int(user_id)
+        with self._lock:
+            future = self._pending.pop(user_id)
+            if ok and self.window > 0:
+                self._completed.pop(user_id, None)
+                self._completed[user_id] = (time.monotonic(), future)
+        future.set_result(ok)
+
+    def __len__(self) -> int:
+        """Count users being computed or recently computed."""
+        with self._lock:
+            return len(self._pending) + len(self._completed)
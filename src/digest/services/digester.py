@@ -1,12 +1,23 @@
 """Digester module."""
 import logging
-from collections.abc import Callable
+import time
+from collections import Counter, defaultdict
+from collections.abc import Callable, Iterable, Mapping, Sequence
+from concurrent.futures import Future
+from contextlib import AbstractContextManager, contextmanager, nullcontext
 from datetime import datetime
+from functools import partial
 
 from digest.adapters.database import Gateway
-from digest.adapters.rabbit import RabbitReader
-from digest.adapters.storage import RedisStorage
-from digest.schemas import DigestDTO
+from digest.adapters.rabbit import Delivery, RabbitReader
+from digest.adapters.storage import BufferedWriter, RedisStorage, fingerprint
+from digest.schemas import DigestDTO, PostRank, UserPostRank
+from digest.services.cache import TopPostsCache
+from digest.services.coalescing import Coalescer
+from digest.services.incremental import IncrementalState
+from digest.services.metrics import Metrics
+from digest.services.profiling import Profiler
+from digest.services.stats import FlowStats
 
 logger = logging.getLogger('digest.digester')
 
@@ -25,13 +36,52 @@ class Digester:
         rabbit_reader: RabbitReader,
         redis_storage: RedisStorage,
         filter_function: Callable[..., list[int]],
+        batch_filter_function: Callable[..., dict[int, list[int]]]
+        | None = None,
+        batch_size: int = 1,
+        batch_timeout: float = 0.05,
+        redis_writer: BufferedWriter | None = None,
+        copy_threshold: int = 0,
+        dedupe: bool = False,
+        posts_cache: TopPostsCache | None = None,
+        incremental: IncrementalState | None = None,
+        coalescer: Coalescer | None = None,
+        metrics: Metrics | None = None,
+        profiler: Profiler | None = None,
     ):
         """Initialize Digester.
 
         User subscriptions and Posts will be read from gateway.
         User IDs will be read from rabbit_reader.
         Posts will be filtered with compose_function.
-        Composed Digests will be stored to redis_storage.
+        Only ranking fields of posts are read; content is loaded
+        for chosen posts only, while digest is created.
+        If filter supports pushdown, only candidate posts will be read.
+        Batches of users are filtered with batch_filter_function,
+        if provided, or with filter_function for every user otherwise.
+        If batch_size is greater than 1, user IDs are read and processed
+        in batches of up to batch_size, waiting at most batch_timeout
+        seconds for a batch to fill.
+        Batches of at least copy_threshold users (if set) are saved
+        to PostgresQL with COPY instead of INSERT.
+        If dedupe is set, fingerprint of every saved digest is kept
+        in Redis, and digest with the same posts as the previous one
+        only refreshes its timestamp instead of being saved again.
+        If posts_cache is provided and filter supports pushdown,
+        posts are merged from cached top posts of user subscriptions
+        instead of being read from posts table.
+        If incremental is provided and filter supports pushdown,
+        candidate posts of every user are remembered, and only posts
+        added since previous digest are read.
+        If coalescer is provided, deliveries of a user whose digest
+        is being computed, or was just computed, are settled with
+        result of that computation instead of computing it again.
+        If metrics are provided, latency of every stage, batch sizes,
+        numbers of posts read and consumer lag are recorded there.
+        If profiler is provided, it decides which messages to profile.
+        Composed Digests will be stored to redis_storage,
+        through redis_writer if provided, so digests composed
+        by concurrent threads share Redis round-trips.
 
         :param gateway: database adapter.
         :type gateway: Gateway
@@ -41,11 +91,257 @@ class Digester:
         :type redis_storage: RedisStorage
         :param filter_function: filter function
         :type filter_function: Callable
+        :param batch_filter_function: filter function for many users
+        :type batch_filter_function: Callable
+        :param batch_size: maximum number of user IDs processed at once
+        :type batch_size: int
+        :param batch_timeout: maximum time to wait for batch, in seconds
+        :type batch_timeout: float
+        :param redis_writer: buffered writer over redis_storage
+        :type redis_writer: BufferedWriter
+        :param copy_threshold: minimal batch size to be saved with COPY,
+            0 disables COPY
+        :type copy_threshold: int
+        :param dedupe: reuse unchanged digests
+        :type dedupe: bool
+        :param posts_cache: cache of top posts of subscriptions
+        :type posts_cache: TopPostsCache
+        :param incremental: remembered candidate posts of users
+        :type incremental: IncrementalState
+        :param coalescer: registry of computations in flight
+        :type coalescer: Coalescer
+        :param metrics: registry of worker metrics
+        :type metrics: Metrics
+        :param profiler: profiler of sampled and slow messages
+        :type profiler: Profiler
         """
         self.gateway = gateway
         self.rabbit_reader = rabbit_reader
         self.redis_storage = redis_storage
         self.filter_function = filter_function
+        self.batch_filter_function = batch_filter_function
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.redis_writer = redis_writer
+        self.copy_threshold = copy_threshold
+        self.dedupe = dedupe
+        self.posts_cache = posts_cache
+        self.incremental = incremental
+        self.coalescer = coalescer
+        self.metrics = metrics
+        self.profiler = profiler
+        self.stats = FlowStats()
+
+    def timed(self, stage: str) -> AbstractContextManager:
+        """Measure latency of stage, if metrics are enabled.
+
+        :param stage: stage name
+        :type stage: str
+        :return: context manager enclosing the stage
+        """
+        if self.profiler is None:
+            if self.metrics is None:
+                return nullcontext()
+            return self.metrics.time(stage)
+        return self.traced(stage)
+
+    @contextmanager
+    def traced(self, stage: str):
+        """Record stage latency to metrics and to profiler trace.
+
+        :param stage: stage name
+        :type stage: str
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            if self.metrics is not None:
+                self.metrics.observe(stage, seconds)
+            self.profiler.record_stage(stage, seconds)
+
+    def profiled(self, user_ids: Sequence[int]) -> AbstractContextManager:
+        """Let profiler trace processing of message, if enabled.
+
+        :param user_ids: user IDs of the message (or batch)
+        :type user_ids: Sequence[int]
+        :return: context manager enclosing processing
+        """
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.message(user_ids)
+
+    def observe_posts(
+        self, ranks: Iterable[UserPostRank], user_ids: Sequence[int]
+    ):
+        """Record numbers of candidate posts read for users.
+
+        :param ranks: posts of users
+        :type ranks: Iterable[UserPostRank]
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :return: None
+        """
+        if self.metrics is None and self.profiler is None:
+            return
+        counts = Counter(rank.user_id for rank in ranks)
+        self.record_posts([counts[int(user_id)] for user_id in user_ids])
+
+    def record_posts(self, counts: Sequence[int]):
+        """Report numbers of candidate posts to metrics and profiler.
+
+        :param counts: number of posts of every user
+        :type counts: Sequence[int]
+        :return: None
+        """
+        if self.metrics is not None:
+            self.metrics.observe_posts(counts)
+        if self.profiler is not None:
+            self.profiler.record_posts(sum(counts))
+
+    def observe_received(self, deliveries: Sequence[Delivery]):
+        """Record consumer lag of deliveries taken for processing.
+
+        Only messages published with timestamp are taken into account.
+
+        :param deliveries: received deliveries
+        :type deliveries: Sequence[Delivery]
+        :return: None
+        """
+        if self.metrics is None:
+            return
+        now = time.time()
+        self.metrics.observe_lag(
+            now - delivery.published
+            for delivery in deliveries
+            if delivery.published is not None
+        )
+
+    def uses_posts_cache(self, limit: int) -> bool:
+        """Check whether posts can be taken from posts_cache.
+
+        Filters supporting pushdown choose among top ``limit`` posts
+        of every subscription, so cached ``top_k`` posts are enough.
+
+        :param limit: number of posts to be used
+        :type limit: int
+        :return: True if cache is enabled and sufficient
+        """
+        return (
+            self.posts_cache is not None
+            and getattr(self.filter_function, 'pushdown', None) is not None
+            and limit <= self.posts_cache.top_k
+        )
+
+    def uses_incremental(self) -> bool:
+        """Check whether candidates are recomputed incrementally.
+
+        :return: True if incremental state is enabled
+            and filter supports pushdown
+        """
+        return (
+            self.incremental is not None
+            and getattr(self.filter_function, 'pushdown', None) is not None
+        )
+
+    def incremental_ranks(
+        self, user_ids: Sequence[int], limit: int
+    ) -> dict[int, list[PostRank]]:
+        """Bring remembered candidate posts of users up to date.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :param limit: number of posts to be used
+        :type limit: int
+        :return: user ID to candidate posts mapping
+        """
+        subscriptions = self.gateway.read_subscriptions_for_users(user_ids)
+        plan = self.incremental.plan(subscriptions, limit)
+        with self.gateway.snapshot() as session:
+            watermark = self.gateway.read_last_post_id(session)
+            added = self.gateway.read_post_ranks_above(
+                plan.watermarks, session
+            )
+            refetched = self.gateway.read_top_posts(
+                list(plan.refetch), limit, session
+            )
+        return self.incremental.apply(
+            plan, subscriptions, limit, watermark, added, refetched
+        )
+
+    def top_posts(
+        self, subscription_ids: Iterable[int]
+    ) -> dict[int, list[PostRank]]:
+        """Get top posts of subscriptions, reading missing ones.
+
+        :param subscription_ids: target subscription IDs
+        :type subscription_ids: Iterable[int]
+        :return: subscription ID to top posts mapping
+        """
+        found, missing = self.posts_cache.lookup(subscription_ids)
+        if missing:
+            generation = self.posts_cache.generation
+            ranks = self.gateway.read_top_posts(
+                missing, self.posts_cache.top_k
+            )
+            found.update(self.posts_cache.update(missing, ranks, generation))
+        return found
+
+    def cached_ranks(
+        self, user_ids: Sequence[int]
+    ) -> dict[int, list[PostRank]]:
+        """Collect candidate posts of users from posts_cache.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :return: user ID to candidate posts mapping
+        """
+        subscriptions = self.gateway.read_subscriptions_for_users(user_ids)
+        top = self.top_posts(
+            {sid for sids in subscriptions.values() for sid in sids}
+        )
+        return self.merge_top_posts(subscriptions, top)
+
+    @staticmethod
+    def merge_top_posts(
+        subscriptions: Mapping[int, Sequence[int]],
+        top: Mapping[int, Sequence[PostRank]],
+    ) -> dict[int, list[PostRank]]:
+        """Merge top posts of user subscriptions.
+
+        Posts are ordered by ID, like posts read from database,
+        so filters break rating ties the same way.
+
+        :param subscriptions: user ID to subscription IDs mapping
+        :type subscriptions: Mapping[int, Sequence[int]]
+        :param top: subscription ID to top posts mapping
+        :type top: Mapping[int, Sequence[PostRank]]
+        :return: user ID to candidate posts mapping
+        """
+        return {
+            user_id: sorted(
+                (rank for sid in sids for rank in top[sid]),
+                key=lambda rank: rank.id,
+            )
+            for user_id, sids in subscriptions.items()
+        }
+
+    @staticmethod
+    def user_ranks(
+        ranks: Mapping[int, Sequence[PostRank]]
+    ) -> list[UserPostRank]:
+        """Flatten candidate posts of users for batch filters.
+
+        :param ranks: user ID to candidate posts mapping
+        :type ranks: Mapping[int, Sequence[PostRank]]
+        :return: list of UserPostRanks, ordered by user ID and post ID
+        """
+        return [
+            UserPostRank(user_id, *rank)
+            for user_id in sorted(ranks)
+            for rank in ranks[user_id]
+        ]
 
     def make_digest(self, user_id: int, limit: int = 5) -> DigestDTO:
         """Make Digest for given user and store it to PostgresQL.
@@ -56,9 +352,205 @@ class Digester:
         :type limit: int
         :return: composed digest
         """
-        posts = self.gateway.read_posts_for_user(user_id)
-        post_ids = self.filter_function(*posts, limit=limit)
-        return self.gateway.create_digest(user_id, *post_ids)
+        pushdown = getattr(self.filter_function, 'pushdown', None)
+        with self.timed('read'):
+            if self.uses_incremental():
+                ranks = self.incremental_ranks([user_id], limit)
+                posts = ranks[int(user_id)]
+            elif self.uses_posts_cache(limit):
+                posts = self.cached_ranks([user_id])[int(user_id)]
+            elif pushdown is None:
+                posts = self.gateway.read_post_ranks_for_user(user_id)
+            else:
+                posts = self.gateway.read_candidate_ranks_for_user(
+                    user_id, limit, **pushdown
+                )
+        self.record_posts([len(posts)])
+        with self.timed('filter'):
+            post_ids = self.filter_function(*posts, limit=limit)
+        if self.dedupe:
+            return self.save_digests({user_id: post_ids})[user_id]
+        with self.timed('save'):
+            return self.gateway.create_digest(user_id, *post_ids)
+
+    def choose_posts(
+        self, user_ids: Sequence[int], limit: int = 5
+    ) -> dict[int, list[int]]:
+        """Choose digest posts for many users at once.
+
+        Posts of all users are read with a single query.
+
+        :param user_ids: target user IDs, without duplicates
+        :type user_ids: Sequence[int]
+        :param limit: number of posts to be used
+        :type limit: int
+        :return: user ID to chosen post IDs mapping
+        """
+        pushdown = getattr(self.filter_function, 'pushdown', None)
+        with self.timed('read'):
+            if self.uses_incremental():
+                ranks = self.user_ranks(
+                    self.incremental_ranks(user_ids, limit)
+                )
+            elif self.uses_posts_cache(limit):
+                ranks = self.user_ranks(self.cached_ranks(user_ids))
+            elif pushdown is None:
+                ranks = self.gateway.read_post_ranks_for_users(user_ids)
+            else:
+                ranks = self.gateway.read_candidate_ranks_for_users(
+                    user_ids, limit, **pushdown
+                )
+        self.observe_posts(ranks, user_ids)
+        with self.timed('filter'):
+            return self.filter_ranks(ranks, user_ids, limit)
+
+    def filter_ranks(
+        self,
+        ranks: Sequence[UserPostRank],
+        user_ids: Sequence[int],
+        limit: int = 5,
+    ) -> dict[int, list[int]]:
+        """Choose digest posts for many users from already read posts.
+
+        :param ranks: posts of users
+        :type ranks: Sequence[UserPostRank]
+        :param user_ids: target user IDs, without duplicates
+        :type user_ids: Sequence[int]
+        :param limit: number of posts to be used
+        :type limit: int
+        :return: user ID to chosen post IDs mapping
+        """
+        if self.batch_filter_function is not None:
+            return self.batch_filter_function(ranks, user_ids, limit=limit)
+        posts = defaultdict(list)
+        for rank in ranks:
+            posts[rank.user_id].append(rank)
+        return {
+            user_id: self.filter_function(*posts[int(user_id)], limit=limit)
+            for user_id in user_ids
+        }
+
+    def make_digests(
+        self, user_ids: Sequence[int], limit: int = 5
+    ) -> dict[int, DigestDTO | None]:
+        """Make Digests for many users and store them to PostgresQL.
+
+        :param user_ids: target user IDs, without duplicates
+        :type user_ids: Sequence[int]
+        :param limit: number of posts to be used
+        :type limit: int
+        :return: user ID to composed digest mapping
+        """
+        chosen = self.choose_posts(user_ids, limit)
+        return self.save_digests(chosen)
+
+    def save_digests(
+        self, chosen: Mapping[int, Sequence[int]]
+    ) -> dict[int, DigestDTO | None]:
+        """Save Digests of chosen posts, reusing unchanged ones if enabled.
+
+        :param chosen: user ID to chosen post IDs mapping
+        :type chosen: Mapping[int, Sequence[int]]
+        :return: user ID to digest mapping
+        """
+        with self.timed('save'):
+            reused = {}
+            if self.dedupe:
+                reused = self.reuse_digests(chosen)
+                chosen = {
+                    user_id: post_ids
+                    for user_id, post_ids in chosen.items()
+                    if user_id not in reused
+                }
+            if self.copy_threshold and len(chosen) >= self.copy_threshold:
+                digests = self.gateway.copy_digests(chosen)
+            else:
+                digests = self.gateway.create_digests(chosen)
+            if self.dedupe:
+                self.redis_storage.store_fingerprints(
+                    self.fingerprints(chosen, digests)
+                )
+            digests.update(reused)
+            return digests
+
+    def matching_digests(
+        self,
+        chosen: Mapping[int, Sequence[int]],
+        stored: Mapping[int, tuple[str, int]],
+    ) -> dict[int, tuple[int, Sequence[int]]]:
+        """Find users whose previous digest has the same posts.
+
+        :param chosen: user ID to chosen post IDs mapping
+        :type chosen: Mapping[int, Sequence[int]]
+        :param stored: user ID to (fingerprint, digest ID) mapping
+        :type stored: Mapping[int, tuple[str, int]]
+        :return: digest ID to (user ID, post IDs) mapping
+        """
+        return {
+            stored[user_id][1]: (user_id, post_ids)
+            for user_id, post_ids in chosen.items()
+            if user_id in stored
+            and stored[user_id][0] == fingerprint(post_ids)
+        }
+
+    @staticmethod
+    def fingerprints(
+        chosen: Mapping[int, Sequence[int]],
+        digests: Mapping[int, DigestDTO | None],
+    ) -> dict[int, tuple[str, int]]:
+        """Compute fingerprints of saved digests.
+
+        :param chosen: user ID to chosen post IDs mapping
+        :type chosen: Mapping[int, Sequence[int]]
+        :param digests: user ID to saved digest mapping
+        :type digests: Mapping[int, DigestDTO | None]
+        :return: user ID to (fingerprint, digest ID) mapping
+        """
+        return {
+            user_id: (fingerprint(chosen[user_id]), digest_data.id)
+            for user_id, digest_data in digests.items()
+            if digest_data is not None
+        }
+
+    def reuse_digests(
+        self, chosen: Mapping[int, Sequence[int]]
+    ) -> dict[int, DigestDTO]:
+        """Refresh previous digests of users whose posts did not change.
+
+        :param chosen: user ID to chosen post IDs mapping
+        :type chosen: Mapping[int, Sequence[int]]
+        :return: user ID to reused digest mapping
+        """
+        chosen = {
+            user_id: post_ids
+            for user_id, post_ids in chosen.items()
+            if post_ids
+        }
+        if not chosen:
+            return {}
+        stored = self.redis_storage.read_fingerprints(chosen)
+        matching = self.matching_digests(chosen, stored)
+        touched = self.gateway.touch_digests(matching)
+        self.stats.record_unchanged(len(touched))
+        return {
+            matching[digest_id][0]: digest_data
+            for digest_id, digest_data in touched.items()
+        }
+
+    @staticmethod
+    def empty_digest(user_id: int) -> DigestDTO:
+        """Make placeholder Digest for user without posts.
+
+        :param user_id: target user ID
+        :type user_id: int
+        :return: empty digest
+        """
+        return DigestDTO(
+            id=0,
+            user_id=user_id,
+            timestamp=datetime.now().isoformat(),
+            posts=[],
+        )
 
     def store_digest(self, digest_data: DigestDTO):
         """Store digest to Redis.
@@ -67,9 +559,12 @@ class Digester:
         :type digest_data: DigestDTO
         :return: None
         """
-        self.redis_storage.store(
-            digest_data.user_id, digest_data.model_dump_json()
-        )
+        payload = self.redis_storage.encode(digest_data)
+        with self.timed('store'):
+            if self.redis_writer is not None:
+                self.redis_writer.write(digest_data.user_id, payload).result()
+                return
+            self.redis_storage.store(digest_data.user_id, payload)
 
     def flow(self, user_id: int):
         """Compose digest for given user and store it to Redis.
@@ -82,20 +577,277 @@ class Digester:
         if digest_data:
             self.store_digest(digest_data)
         else:
-            self.store_digest(
-                DigestDTO(
-                    id=0,
-                    user_id=user_id,
-                    timestamp=datetime.now().isoformat(),
-                    posts=[],
-                )
+            self.store_digest(self.empty_digest(user_id))
+
+    def flow_many(self, user_ids: Sequence[int]) -> dict[int, Exception]:
+        """Compose digests for many users and store them to Redis.
+
+        Posts are read with one query, digests are saved in one
+        transaction and stored to Redis in one pipeline.
+        Repeated user IDs are processed once.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :return: user ID to error mapping for digests not stored to Redis
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        digests = self.make_digests(user_ids)
+        payloads = self.payloads(digests)
+        with self.timed('store'):
+            return self.redis_storage.store_many(payloads)
+
+    def payloads(
+        self, digests: Mapping[int, DigestDTO | None]
+    ) -> dict[int, str | bytes]:
+        """Serialize digests for Redis, replacing missing ones with empty.
+
+        :param digests: user ID to digest mapping
+        :type digests: Mapping[int, DigestDTO | None]
+        :return: user ID to payload mapping
+        """
+        return {
+            digest_data.user_id: self.redis_storage.encode(digest_data)
+            for digest_data in (
+                digest_data or self.empty_digest(user_id)
+                for user_id, digest_data in digests.items()
+            )
+        }
+
+    def discard_malformed(self, delivery: Delivery) -> bool:
+        """Discard delivery whose body is not a user ID.
+
+        It can never succeed, so it is not retried.
+
+        :param delivery: received delivery
+        :type delivery: Delivery
+        :return: True if delivery was malformed and has been discarded
+        """
+        try:
+            int(delivery.user_id)
+        except (TypeError, ValueError):
+            logger.error('Discarding malformed message %r', delivery.user_id)
+            self.rabbit_reader.discard(delivery)
+            self.stats.record(0.0, ok=False)
+            return True
+        return False
+
+    def accepted(self, deliveries: Sequence[Delivery]) -> list[Delivery]:
+        """Discard malformed deliveries and attach duplicate ones.
+
+        :param deliveries: received deliveries
+        :type deliveries: Sequence[Delivery]
+        :return: deliveries to be processed
+        """
+        return [
+            delivery
+            for delivery in deliveries
+            if not self.discard_malformed(delivery)
+            and not self.attach(delivery)
+        ]
+
+    def attach(self, delivery: Delivery) -> bool:
+        """Attach delivery to computation of the same user, if any.
+
+        Attached delivery is acknowledged or rejected
+        when that computation finishes.
+
+        :param delivery: received delivery
+        :type delivery: Delivery
+        :return: True if delivery was attached and needs no processing
+        """
+        if self.coalescer is None:
+            return False
+        future = self.coalescer.claim(delivery.user_id)
+        if future is None:
+            return False
+        self.stats.record_coalesced()
+        future.add_done_callback(partial(self.settle_attached, delivery))
+        return True
+
+    def settle_attached(self, delivery: Delivery, future: Future):
+        """Report attached delivery according to result it was attached to.
+
+        :param delivery: attached delivery
+        :type delivery: Delivery
+        :param future: computation delivery was attached to
+        :type future: Future
+        :return: None
+        """
+        if future.result():
+            self.rabbit_reader.ack(delivery)
+        else:
+            self.rabbit_reader.reject(delivery)
+
+    def release(self, delivery: Delivery, ok: bool):
+        """Report result of computation claimed by delivery.
+
+        :param delivery: processed delivery
+        :type delivery: Delivery
+        :param ok: whether digest was stored
+        :type ok: bool
+        :return: None
+        """
+        if self.coalescer is not None:
+            self.coalescer.complete(delivery.user_id, ok)
+
+    def process(self, delivery: Delivery) -> bool:
+        """Apply flow to delivery unless it is attached to another one.
+
+        :param delivery: received delivery
+        :type delivery: Delivery
+        :return: True if flow succeeded or delivery was attached
+        """
+        self.observe_received([delivery])
+        if self.discard_malformed(delivery):
+            return False
+        if self.attach(delivery):
+            return True
+        return self.process_claimed(delivery)
+
+    def process_claimed(self, delivery: Delivery) -> bool:
+        """Apply flow to delivery and report result to RabbitMQ.
+
+        :param delivery: received delivery
+        :type delivery: Delivery
+        :return: True if flow succeeded
+        """
+        started = time.perf_counter()
+        try:
+            with self.profiled([delivery.user_id]), self.timed('message'):
+                self.flow(delivery.user_id)
+        except Exception:
+            logger.exception('Failed to process user %s', delivery.user_id)
+            self.release(delivery, False)
+            self.rabbit_reader.reject(delivery)
+            self.stats.record(time.perf_counter() - started, ok=False)
+            return False
+        self.release(delivery, True)
+        self.rabbit_reader.ack(delivery)
+        self.stats.record(time.perf_counter() - started)
+        return True
+
+    def process_batch(self, deliveries: Sequence[Delivery]):
+        """Apply flow_many to deliveries and report results to RabbitMQ.
+
+        Malformed deliveries are discarded, deliveries attached
+        to computations in flight are skipped.
+        If batch fails, deliveries are processed one by one,
+        so a single bad message does not fail the others.
+
+        :param deliveries: received deliveries
+        :type deliveries: Sequence[Delivery]
+        :return: None
+        """
+        self.observe_received(deliveries)
+        if self.metrics is not None:
+            self.metrics.observe_batch(len(deliveries))
+        deliveries = self.accepted(deliveries)
+        if not deliveries:
+            return
+        logger.debug('Processing batch of %d users', len(deliveries))
+        started = time.perf_counter()
+        user_ids = [delivery.user_id for delivery in deliveries]
+        try:
+            with self.profiled(user_ids):
+                failed = self.flow_many(user_ids)
+        except Exception:
+            logger.exception('Failed to process batch, retrying one by one')
+            for delivery in deliveries:
+                self.process_claimed(delivery)
+            return
+        self.settle_batch(deliveries, failed, time.perf_counter() - started)
+
+    def settle_batch(
+        self,
+        deliveries: Sequence[Delivery],
+        failed: Mapping[int, Exception],
+        latency: float,
+    ):
+        """Report results of processed batch to RabbitMQ and statistics.
+
+        Deliveries whose digests were not stored are rejected.
+
+        :param deliveries: processed deliveries
+        :type deliveries: Sequence[Delivery]
+        :param failed: user ID to error mapping returned by flow_many
+        :type failed: Mapping[int, Exception]
+        :param latency: batch processing time, in seconds
+        :type latency: float
+        :return: None
+        """
+        if self.metrics is not None:
+            self.metrics.observe('batch', latency)
+        rejected = 0
+        for delivery in deliveries:
+            error = failed.get(int(delivery.user_id))
+            if error is None:
+                self.release(delivery, True)
+                self.rabbit_reader.ack(delivery)
+                continue
+            logger.error(
+                'Failed to store digest of user %s: %s',
+                delivery.user_id,
+                error,
+            )
+            self.release(delivery, False)
+            self.rabbit_reader.reject(delivery)
+            rejected += 1
+        if rejected:
+            self.stats.record(latency, ok=False, count=rejected)
+        if len(deliveries) > rejected:
+            self.stats.record(latency, count=len(deliveries) - rejected)
+
+    def deliveries(self):
+        """Choose RabbitMQ generator according to batch size.
+
+        :return: generator of deliveries or of lists of deliveries
+        """
+        if self.batch_size > 1:
+            return self.rabbit_reader.message_batches(
+                self.batch_size, self.batch_timeout
             )
+        return self.rabbit_reader.message_generator()
+
+    def handle(self, item: Delivery | Sequence[Delivery]):
+        """Process item produced by ``deliveries`` generator.
+
+        :param item: delivery or list of deliveries
+        :type item: Delivery | Sequence[Delivery]
+        :return: None
+        """
+        if isinstance(item, Delivery):
+            self.process(item)
+        else:
+            self.process_batch(item)
+
+    def log_cache_summary(self):
+        """Log posts_cache and incremental statistics, if enabled.
+
+        :return: None
+        """
+        if self.posts_cache is not None:
+            logger.info('Posts cache: %s', self.posts_cache.summary())
+        if self.incremental is not None:
+            logger.info('Incremental: %s', self.incremental.summary())
+
+    def stop(self):
+        """Ask running process to stop after current message.
+
+        :return: None
+        """
+        self.rabbit_reader.stop()
 
     def __call__(self):
         """Start the whole process.
 
-        Listen to RabbitMQ, and apply flow to every user ID.
+        Listen to RabbitMQ, and apply flow to every user ID,
+        or flow_many to every batch of user IDs.
+        Messages are acknowledged after they are processed.
         """
         logger.info('Start listening')
-        for user_id in self.rabbit_reader.message_generator():
-            self.flow(user_id)
+        try:
+            for item in self.deliveries():
+                self.handle(item)
+        finally:
+            logger.info('Stopped: %s', self.stats.summary())
+            self.log_cache_summary()
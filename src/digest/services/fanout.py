@@ -0,0 +1,247 @@
+"""Subscription-driven digest recomputation."""
+import logging
+import time
+from collections.abc import Sequence
+
+from digest.adapters.rabbit import Delivery, RabbitReader
+from digest.schemas import PostRank
+from digest.services.digester import Digester
+from digest.services.stats import FlowStats
+
+logger = logging.getLogger('digest.fanout')
+
+
+class SubscriptionFanout:
+    """Recompute digests of all subscribers of changed subscriptions.
+
+    Messages carry subscription IDs instead of user IDs. Events received
+    within ``window`` seconds are coalesced, their subscribers are read
+    with one query and processed in chunks of ``chunk_size`` users.
+    If filter supports pushdown, top posts of every subscription are read
+    once per window and shared by all its subscribers.
+    Events are acknowledged after digests of all subscribers are stored.
+    Subscribers whose digests were not stored are recomputed alone,
+    up to ``retries`` times. Only if they still fail, events of the window
+    are rejected, and every redelivery recomputes all their subscribers
+    again; RabbitReader caps it at ``max_redeliveries`` times.
+    """
+
+    def __init__(
+        self,
+        digester: Digester,
+        rabbit_reader: RabbitReader,
+        window: float = 1.0,
+        max_events: int = 1000,
+        chunk_size: int = 500,
+        limit: int = 5,
+        retries: int = 2,
+    ):
+        """Initialize fan-out.
+
+        :param digester: digester used to filter, save and store digests
+        :type digester: Digester
+        :param rabbit_reader: listener of subscription events queue
+        :type rabbit_reader: RabbitReader
+        :param window: time to coalesce events for, in seconds
+        :type window: float
+        :param max_events: maximum number of events coalesced
+        :type max_events: int
+        :param chunk_size: number of users processed at once
+        :type chunk_size: int
+        :param limit: number of posts in digest
+        :type limit: int
+        :param retries: how many times users whose digests were not
+            stored are recomputed before events are rejected
+        :type retries: int
+        """
+        self.digester = digester
+        self.rabbit_reader = rabbit_reader
+        self.window = window
+        self.max_events = max_events
+        self.chunk_size = chunk_size
+        self.limit = limit
+        self.retries = retries
+        self.stats = FlowStats()
+        self.recomputed = 0
+
+    def shares_ranking(self) -> bool:
+        """Check whether filter can work on shared subscription tops.
+
+        :return: True if filter supports pushdown
+        """
+        filter_function = self.digester.filter_function
+        return getattr(filter_function, 'pushdown', None) is not None
+
+    def choose_posts(
+        self, user_ids: Sequence[int], top: dict[int, list[PostRank]]
+    ) -> dict[int, list[int]]:
+        """Choose digest posts for chunk of users.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :param top: subscription ID to top posts mapping, shared
+            by chunks of one window and updated with missing ones
+        :type top: dict[int, list[PostRank]]
+        :return: user ID to chosen post IDs mapping
+        """
+        if not self.shares_ranking():
+            return self.digester.choose_posts(user_ids, self.limit)
+        gateway = self.digester.gateway
+        with self.digester.timed('read'):
+            subscriptions = gateway.read_subscriptions_for_users(user_ids)
+            missing = {
+                subscription_id
+                for subscription_ids in subscriptions.values()
+                for subscription_id in subscription_ids
+                if subscription_id not in top
+            }
+            if missing:
+                top.update({sid: [] for sid in missing})
+                for rank in gateway.read_top_posts(list(missing), self.limit):
+                    top[rank.subscription_id].append(rank)
+        ranks = self.digester.user_ranks(
+            self.digester.merge_top_posts(subscriptions, top)
+        )
+        self.digester.observe_posts(ranks, user_ids)
+        with self.digester.timed('filter'):
+            return self.digester.filter_ranks(ranks, user_ids, self.limit)
+
+    def flow(self, subscription_ids: Sequence[int]) -> dict[int, Exception]:
+        """Recompute and store digests of subscribers.
+
+        Users whose digests were not stored are retried alone.
+
+        :param subscription_ids: changed subscription IDs
+        :type subscription_ids: Sequence[int]
+        :return: user ID to error mapping for digests not stored to Redis
+        """
+        user_ids = self.digester.gateway.read_subscribers(subscription_ids)
+        logger.debug(
+            '%d subscriptions changed, recomputing %d users',
+            len(subscription_ids),
+            len(user_ids),
+        )
+        top = {}
+        failed = self.recompute(user_ids, top)
+        for _ in range(self.retries):
+            if not failed:
+                break
+            logger.warning(
+                'Retrying %d users whose digests were not stored', len(failed)
+            )
+            failed = self.recompute(sorted(failed), top)
+        return failed
+
+    def recompute(
+        self, user_ids: Sequence[int], top: dict[int, list[PostRank]]
+    ) -> dict[int, Exception]:
+        """Recompute and store digests of users, chunk by chunk.
+
+        :param user_ids: target user IDs
+        :type user_ids: Sequence[int]
+        :param top: subscription ID to top posts mapping, see
+            ``choose_posts``
+        :type top: dict[int, list[PostRank]]
+        :return: user ID to error mapping for digests not stored to Redis
+        """
+        failed = {}
+        for start in range(0, len(user_ids), self.chunk_size):
+            chunk = user_ids[start : start + self.chunk_size]
+            digests = self.digester.save_digests(self.choose_posts(chunk, top))
+            payloads = self.digester.payloads(digests)
+            with self.digester.timed('store'):
+                failed.update(self.digester.redis_storage.store_many(payloads))
+            self.recomputed += len(chunk)
+        return failed
+
+    def accepted(
+        self, deliveries: Sequence[Delivery]
+    ) -> tuple[list[int], list[Delivery]]:
+        """Parse subscription IDs, discarding malformed deliveries.
+
+        :param deliveries: received deliveries
+        :type deliveries: Sequence[Delivery]
+        :return: sorted unique subscription IDs and well-formed deliveries
+        """
+        subscription_ids = set()
+        accepted = []
+        for delivery in deliveries:
+            try:
+                subscription_ids.add(int(delivery.user_id))
+            except (TypeError, ValueError):
+                logger.error(
+                    'Discarding malformed message %r', delivery.user_id
+                )
+                self.rabbit_reader.discard(delivery)
+                self.stats.record(0.0, ok=False)
+            else:
+                accepted.append(delivery)
+        return sorted(subscription_ids), accepted
+
+    def process(self, deliveries: Sequence[Delivery]):
+        """Apply flow to coalesced events and report result to RabbitMQ.
+
+        Message body is subscription ID. Malformed events are discarded
+        on their own. If any digest was not saved even after retries,
+        all other events are rejected, to be retried together.
+
+        :param deliveries: received deliveries
+        :type deliveries: Sequence[Delivery]
+        :return: None
+        """
+        metrics = self.digester.metrics
+        if metrics is not None:
+            metrics.observe_batch(len(deliveries))
+        started = time.perf_counter()
+        subscription_ids, deliveries = self.accepted(deliveries)
+        if not deliveries:
+            return
+        try:
+            failed = self.flow(subscription_ids)
+        except Exception:
+            logger.exception(
+                'Failed to process subscriptions %s', subscription_ids
+            )
+            ok = False
+        else:
+            ok = not failed
+            if failed:
+                logger.error(
+                    'Failed to store digests of %d users of subscriptions %s',
+                    len(failed),
+                    subscription_ids,
+                )
+        for delivery in deliveries:
+            if ok:
+                self.rabbit_reader.ack(delivery)
+            else:
+                self.rabbit_reader.reject(delivery)
+        latency = time.perf_counter() - started
+        if metrics is not None:
+            metrics.observe('batch', latency)
+        self.stats.record(latency, ok=ok, count=len(deliveries))
+
+    def stop(self):
+        """Ask running process to stop after current window.
+
+        :return: None
+        """
+        self.rabbit_reader.stop()
+
+    def __call__(self):
+        """Start the whole process.
+
+        Listen to RabbitMQ and apply flow to every window of events.
+        """
+        logger.info('Start listening to subscription events')
+        try:
+            for deliveries in self.rabbit_reader.message_batches(
+                self.max_events, self.window
+            ):
+                self.process(deliveries)
+        finally:
+            logger.info(
+                'Stopped: %s, %d digests recomputed',
+                self.stats.summary(),
+                self.recomputed,
+            )
@@ -1,12 +1,34 @@
 """Posts-filtering functions."""
-from digest.schemas import PostDTO
+from collections.abc import Callable
 
+from digest.schemas import PostDTO, PostRank
+from digest.services.selection import top_rated, top_rated_per_subscription
 
-def dummy_filter(*posts: PostDTO, limit: int = 5) -> list[int]:
+
+def supports_pushdown(per_subscription: bool) -> Callable:
+    """Mark filter as able to work on database-preselected candidates.
+
+    Marked filter gets ``pushdown`` attribute with keyword arguments
+    for ``Gateway.read_candidate_posts_for_user``.
+
+    :param per_subscription: filter may choose best post of any subscription
+    :type per_subscription: bool
+    :return: decorator
+    """
+
+    def decorator(filter_function: Callable) -> Callable:
+        filter_function.pushdown = {'per_subscription': per_subscription}
+        return filter_function
+
+    return decorator
+
+
+@supports_pushdown(per_subscription=False)
+def dummy_filter(*posts: PostDTO | PostRank, limit: int = 5) -> list[int]:
     """Filter posts by rating.
 
     :param posts: posts to be filtered
-    :type posts: PostDTO
+    :type posts: PostDTO | PostRank
     :param limit: how many posts should be returned
     :type limit: int
     :return: list of chosen Posts IDs
@@ -15,7 +37,10 @@ def dummy_filter(*posts: PostDTO, limit: int = 5) -> list[int]:
     return [post.id for post in result]
 
 
-def at_least_one_subscription(*posts: PostDTO, limit: int = 5) -> list[int]:
+@supports_pushdown(per_subscription=True)
+def at_least_one_subscription(
+    *posts: PostDTO | PostRank, limit: int = 5
+) -> list[int]:
     """Semi-smart filter.
 
     Return top-rated post from each subscription.
@@ -23,7 +48,7 @@ def at_least_one_subscription(*posts: PostDTO, limit: int = 5) -> list[int]:
     then add other top-rated posts.
 
     :param posts: posts to be filtered
-    :type posts: PostDTO
+    :type posts: PostDTO | PostRank
     :param limit: how many posts should be returned
     :type limit: int
     :return: list of chosen Posts IDs
@@ -46,3 +71,37 @@ def at_least_one_subscription(*posts: PostDTO, limit: int = 5) -> list[int]:
         if index not in indexes:
             result.append(post.id)
     return result
+
+
+@supports_pushdown(per_subscription=False)
+def heap_dummy_filter(*posts: PostDTO | PostRank, limit: int = 5) -> list[int]:
+    """Filter posts by rating.
+
+    Same result as ``dummy_filter``, but uses heap-based selection
+    instead of sorting all posts.
+
+    :param posts: posts to be filtered
+    :type posts: PostDTO | PostRank
+    :param limit: how many posts should be returned
+    :type limit: int
+    :return: list of chosen Posts IDs
+    """
+    return top_rated(posts, limit)
+
+
+@supports_pushdown(per_subscription=True)
+def heap_at_least_one_subscription(
+    *posts: PostDTO | PostRank, limit: int = 5
+) -> list[int]:
+    """Semi-smart filter.
+
+    Same result as ``at_least_one_subscription``, but makes one pass
+    over posts with heap-based selection and hashed lookups.
+
+    :param posts: posts to be filtered
+    :type posts: PostDTO | PostRank
+    :param limit: how many posts should be returned
+    :type limit: int
+    :return: list of chosen Posts IDs
+    """
+    return top_rated_per_subscription(posts, limit)
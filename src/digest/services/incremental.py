@@ -0,0 +1,395 @@
+"""Incremental recomputation of digest candidates.
+
+Filters supporting pushdown choose among top ``limit`` posts of every
+subscription. For every user these per-subscription lists are
+remembered together with a watermark, the highest post ID existing
+when they were read. Next time only posts above the watermark are read
+and merged in, and subscriptions whose posts were edited or deleted,
+or which user has just subscribed to, are read again.
+
+Post IDs are taken from a sequence before insert transactions commit,
+so a post may become visible after posts with higher IDs. To catch
+such posts, the last ``margin`` IDs up to the watermark are read again.
+"""
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from collections.abc import Iterable, Mapping, Sequence
+from typing import NamedTuple
+
+from digest.schemas import PostRank, UserPostRank
+
+logger = logging.getLogger('digest.incremental')
+
+
+class Candidates(NamedTuple):
+    """Remembered candidates of one user."""
+
+    watermark: int
+    limit: int
+    generation: int
+    updates: int
+    top: dict[int, list[PostRank]]
+
+
+class Plan(NamedTuple):
+    """Reads needed to bring candidates of many users up to date."""
+
+    generation: int
+    known: dict[int, Candidates]
+    stale: dict[int, set[int]]
+    checked: set[int]
+    refetch: set[int]
+    margin: int = 0
+
+    @property
+    def watermarks(self) -> dict[int, int]:
+        """User ID to watermark mapping for posts added since then.
+
+        Watermarks are lowered by ``margin``, to read again posts
+        committed after the watermark was taken.
+        """
+        return {
+            user_id: max(candidates.watermark - self.margin, 0)
+            for user_id, candidates in self.known.items()
+        }
+
+
+def best_first(post: PostRank) -> tuple[int, int]:
+    """Sort key of subscription top: best rated first, then by ID."""
+    return -post.rating, post.id
+
+
+def merge_top(
+    top: Sequence[PostRank], added: Iterable[PostRank], limit: int
+) -> list[PostRank]:
+    """Merge new posts into top posts of subscription.
+
+    :param top: top posts, best first
+    :type top: Sequence[PostRank]
+    :param added: posts to be merged, possibly already in top
+    :type added: Iterable[PostRank]
+    :param limit: number of posts to be kept
+    :type limit: int
+    :return: top posts, best first
+    """
+    merged = {post.id: post for post in top}
+    merged.update((post.id, post) for post in added)
+    return sorted(merged.values(), key=best_first)[:limit]
+
+
+def flatten(top: Mapping[int, Sequence[PostRank]]) -> list[PostRank]:
+    """Collect candidates of all subscriptions, ordered by post ID.
+
+    :param top: subscription ID to top posts mapping
+    :type top: Mapping[int, Sequence[PostRank]]
+    :return: candidate posts
+    """
+    return sorted(
+        (post for posts in top.values() for post in posts),
+        key=lambda post: post.id,
+    )
+
+
+class IncrementalState:
+    """Thread-safe LRU of remembered candidates of up to ``max_users``.
+
+    Edited and deleted posts are reported by ``invalidate``, normally
+    called by ``PostsListener``. Every ``check_every``-th update
+    of a user is verified against candidates read from scratch.
+    Up to ``max_edited`` edited subscriptions are remembered: edits
+    older than all remembered candidates are forgotten, and if that
+    is not enough, all candidates are forgotten too.
+    """
+
+    def __init__(
+        self,
+        max_users: int = 100_000,
+        check_every: int = 100,
+        margin: int = 100,
+        max_edited: int = 10_000,
+    ):
+        """Initialize empty state.
+
+        :param max_users: number of users remembered
+        :type max_users: int
+        :param check_every: verify every N-th update of a user,
+            0 disables verification
+        :type check_every: int
+        :param margin: number of post IDs up to watermark read again
+        :type margin: int
+        :param max_edited: number of edited subscriptions remembered
+        :type max_edited: int
+        """
+        self.max_users = max_users
+        self.check_every = check_every
+        self.margin = margin
+        self.max_edited = max_edited
+        self.active = True
+        self.updates = 0
+        self.rebuilds = 0
+        self.checks = 0
+        self.mismatches = 0
+        self._users = OrderedDict()
+        self._generation = 0
+        self._edited = {}
+        self._cleared = 0
+        self._lock = threading.Lock()
+
+    def plan(
+        self, subscriptions: Mapping[int, Sequence[int]], limit: int
+    ) -> Plan:
+        """Decide which reads are needed for given users.
+
+        :param subscriptions: user ID to subscription IDs mapping
+        :type subscriptions: Mapping[int, Sequence[int]]
+        :param limit: number of posts filter is going to choose
+        :type limit: int
+        :return: reads plan
+        """
+        known = {}
+        stale = {}
+        checked = set()
+        refetch = set()
+        with self._lock:
+            generation = self._generation
+            for user_id, subscription_ids in subscriptions.items():
+                candidates = self._users.get(user_id)
+                if (
+                    not self.active
+                    or candidates is None
+                    or candidates.limit != limit
+                ):
+                    refetch.update(subscription_ids)
+                    continue
+                self._users.move_to_end(user_id)
+                known[user_id] = candidates
+                stale[user_id] = {
+                    subscription_id
+                    for subscription_id in subscription_ids
+                    if subscription_id not in candidates.top
+                    or self._edited.get(subscription_id, -1)
+                    >= candidates.generation
+                }
+                updates = candidates.updates + 1
+                if self.check_every and updates % self.check_every == 0:
+                    checked.add(user_id)
+                    refetch.update(subscription_ids)
+                else:
+                    refetch.update(stale[user_id])
+        return Plan(generation, known, stale, checked, refetch, self.margin)
+
+    def apply(
+        self,
+        plan: Plan,
+        subscriptions: Mapping[int, Sequence[int]],
+        limit: int,
+        watermark: int,
+        added: Iterable[UserPostRank],
+        refetched: Iterable[PostRank],
+    ) -> dict[int, list[PostRank]]:
+        """Update candidates with read posts.
+
+        :param plan: plan returned by ``plan``
+        :type plan: Plan
+        :param subscriptions: user ID to subscription IDs mapping
+        :type subscriptions: Mapping[int, Sequence[int]]
+        :param limit: number of posts filter is going to choose
+        :type limit: int
+        :param watermark: highest post ID, read in the same database
+            snapshot as other reads
+        :type watermark: int
+        :param added: posts above watermarks of ``plan``
+        :type added: Iterable[UserPostRank]
+        :param refetched: top posts of ``plan.refetch`` subscriptions
+        :type refetched: Iterable[PostRank]
+        :return: user ID to candidate posts mapping
+        """
+        added_by_user = defaultdict(list)
+        for post in added:
+            added_by_user[post.user_id].append(PostRank(*post[1:]))
+        fresh = {subscription_id: [] for subscription_id in plan.refetch}
+        for post in refetched:
+            fresh[post.subscription_id].append(post)
+
+        result = {}
+        updated = {}
+        counts = dict.fromkeys(
+            ('updates', 'rebuilds', 'checks', 'mismatches'), 0
+        )
+        for user_id, subscription_ids in subscriptions.items():
+            candidates = plan.known.get(user_id)
+            if candidates is None:
+                top = {sid: fresh[sid] for sid in subscription_ids}
+                counts['rebuilds'] += 1
+                updates = 0
+            else:
+                top = self.merge(
+                    candidates,
+                    subscription_ids,
+                    added_by_user[user_id],
+                    {sid: fresh[sid] for sid in plan.stale[user_id]},
+                    limit,
+                )
+                updates = candidates.updates + 1
+                if user_id in plan.checked:
+                    expected = {sid: fresh[sid] for sid in subscription_ids}
+                    counts['checks'] += 1
+                    if top != expected:
+                        counts['mismatches'] += 1
+                        logger.warning(
+                            'Incremental candidates of user %s '
+                            'differ from full rebuild',
+                            user_id,
+                        )
+                    top = expected
+                else:
+                    counts['updates'] += 1
+            result[user_id] = flatten(top)
+            updated[user_id] = Candidates(
+                watermark, limit, plan.generation, updates, top
+            )
+        with self._lock:
+            self.updates += counts['updates']
+            self.rebuilds += counts['rebuilds']
+            self.checks += counts['checks']
+            self.mismatches += counts['mismatches']
+        self.remember(updated, plan.generation)
+        return result
+
+    @staticmethod
+    def merge(
+        candidates: Candidates,
+        subscription_ids: Sequence[int],
+        added: Sequence[PostRank],
+        fresh: Mapping[int, Sequence[PostRank]],
+        limit: int,
+    ) -> dict[int, list[PostRank]]:
+        """Bring remembered candidates of user up to date.
+
+        :param candidates: remembered candidates
+        :type candidates: Candidates
+        :param subscription_ids: current subscriptions of user
+        :type subscription_ids: Sequence[int]
+        :param added: user posts above watermark
+        :type added: Sequence[PostRank]
+        :param fresh: subscription ID to top posts mapping
+            of subscriptions read again
+        :type fresh: Mapping[int, Sequence[PostRank]]
+        :param limit: number of posts kept per subscription
+        :type limit: int
+        :return: subscription ID to top posts mapping
+        """
+        added_by_subscription = defaultdict(list)
+        for post in added:
+            added_by_subscription[post.subscription_id].append(post)
+        top = {}
+        for subscription_id in subscription_ids:
+            if subscription_id in fresh:
+                top[subscription_id] = list(fresh[subscription_id])
+                continue
+            top[subscription_id] = merge_top(
+                candidates.top[subscription_id],
+                added_by_subscription[subscription_id],
+                limit,
+            )
+        return top
+
+    def remember(self, updated: Mapping[int, Candidates], generation: int):
+        """Store updated candidates, unless state was cleared meanwhile.
+
+        :param updated: user ID to candidates mapping
+        :type updated: Mapping[int, Candidates]
+        :param generation: generation of plan candidates were read by
+        :type generation: int
+        :return: None
+        """
+        with self._lock:
+            if not self.active or generation < self._cleared:
+                return
+            for user_id, candidates in updated.items():
+                self._users[user_id] = candidates
+                self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def invalidate(self, subscription_id: int):
+        """Mark posts of subscription as edited.
+
+        :param subscription_id: changed subscription ID
+        :type subscription_id: int
+        :return: None
+        """
+        with self._lock:
+            self._edited[subscription_id] = self._generation
+            self._generation += 1
+            if len(self._edited) > self.max_edited:
+                self._prune()
+
+    def _prune(self):
+        """Forget edits older than all remembered candidates.
+
+        Candidates of plans made before the oldest remembered ones are
+        not remembered afterwards, since edits they depend on are gone.
+        If edits still take more than half of ``max_edited``,
+        all candidates are forgotten. Called with lock held.
+
+        :return: None
+        """
+        oldest = min(
+            (candidates.generation for candidates in self._users.values()),
+            default=self._generation,
+        )
+        self._edited = {
+            subscription_id: generation
+            for subscription_id, generation in self._edited.items()
+            if generation >= oldest
+        }
+        self._cleared = max(self._cleared, oldest)
+        if len(self._edited) > self.max_edited // 2:
+            logger.info(
+                'Forgetting candidates of %d users, too many edits',
+                len(self._users),
+            )
+            self._cleared = self._generation
+            self._edited.clear()
+            self._users.clear()
+
+    def clear(self):
+        """Forget candidates of all users.
+
+        :return: None
+        """
+        with self._lock:
+            self._generation += 1
+            self._cleared = self._generation
+            self._edited.clear()
+            self._users.clear()
+
+    def suspend(self):
+        """Forget all candidates and stop remembering new ones.
+
+        :return: None
+        """
+        self.active = False
+        self.clear()
+
+    def resume(self):
+        """Forget all candidates and start remembering again.
+
+        :return: None
+        """
+        self.clear()
+        self.active = True
+
+    def summary(self) -> str:
+        """Describe statistics in one line.
+
+        :return: human-readable summary
+        """
+        with self._lock:
+            return (
+                f'{self.updates} incremental updates, '
+                f'{self.rebuilds} rebuilds, {self.checks} checks '
+                f'({self.mismatches} mismatched), {len(self._users)} users'
+            )
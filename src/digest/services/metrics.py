@@ -0,0 +1,374 @@
+"""Worker metrics in Prometheus text format."""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Callable, Iterable, Sequence
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from digest.services.stats import FlowStats
+
+logger = logging.getLogger('digest.metrics')
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+LAG_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_value(value: float) -> str:
+    """Format sample value, using Prometheus spelling of infinity."""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket bounds. Not thread-safe."""
+
+    def __init__(self, buckets: Sequence[float]):
+        """Initialize empty histogram.
+
+        :param buckets: upper bounds of buckets, ascending
+        :type buckets: Sequence[float]
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """Add value to histogram.
+
+        :param value: observed value
+        :type value: float
+        :return: None
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name: str, labels: str = '') -> list[str]:
+        """Render histogram samples.
+
+        :param name: metric name
+        :type name: str
+        :param labels: rendered labels to be added to every sample,
+            e.g. ``stage="read"``
+        :type labels: str
+        :return: sample lines
+        """
+        prefix = f'{labels},' if labels else ''
+        suffix = f'{{{labels}}}' if labels else ''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(
+            (*self.buckets, float('inf')), self.counts, strict=True
+        ):
+            cumulative += count
+            lines.append(
+                f'{name}_bucket{{{prefix}le="{format_value(bound)}"}} '
+                f'{cumulative}'
+            )
+        lines.append(f'{name}_sum{suffix} {format_value(self.sum)}')
+        lines.append(f'{name}_count{suffix} {self.count}')
+        return lines
+
+
+class Rate:
+    """Per-second rate of a growing counter between calls."""
+
+    def __init__(self, counter: Callable[[], float]):
+        """Initialize rate.
+
+        :param counter: returns current counter value
+        :type counter: Callable[[], float]
+        """
+        self.counter = counter
+        self._last = (time.monotonic(), counter())
+
+    def __call__(self) -> float:
+        """Compute rate since previous call.
+
+        :return: counter increase per second
+        """
+        now, value = time.monotonic(), self.counter()
+        last_time, last_value = self._last
+        self._last = (now, value)
+        if now <= last_time:
+            return 0.0
+        return (value - last_value) / (now - last_time)
+
+
+class Metrics:
+    """Thread-safe registry of worker metrics.
+
+    Histograms are updated by processing code: latency of every stage
+    (``read``, ``filter``, ``save``, ``store``, whole ``message``
+    and ``batch``), batch sizes, number of candidate posts per user
+    and consumer lag (time since message was published).
+    Counters and gauges are read from callbacks when rendered.
+    """
+
+    def __init__(self):
+        """Initialize empty registry."""
+        self._stages = {}
+        self._batch_sizes = Histogram(SIZE_BUCKETS)
+        self._posts = Histogram(SIZE_BUCKETS)
+        self._lag = Histogram(LAG_BUCKETS)
+        self._callbacks = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        """Record stage latency.
+
+        :param stage: stage name
+        :type stage: str
+        :param seconds: stage duration
+        :type seconds: float
+        :return: None
+        """
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage: str):
+        """Record latency of enclosed block, even if it fails.
+
+        :param stage: stage name
+        :type stage: str
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def observe_batch(self, size: int):
+        """Record number of messages processed together.
+
+        :param size: batch size
+        :type size: int
+        :return: None
+        """
+        with self._lock:
+            self._batch_sizes.observe(size)
+
+    def observe_posts(self, counts: Iterable[int]):
+        """Record numbers of candidate posts read for users.
+
+        :param counts: number of posts of every user
+        :type counts: Iterable[int]
+        :return: None
+        """
+        with self._lock:
+            for count in counts:
+                self._posts.observe(count)
+
+    def observe_lag(self, seconds: Iterable[float]):
+        """Record ages of messages taken for processing.
+
+        :param seconds: time since every message was published
+        :type seconds: Iterable[float]
+        :return: None
+        """
+        with self._lock:
+            for age in seconds:
+                self._lag.observe(max(age, 0.0))
+
+    def register(
+        self,
+        name: str,
+        kind: str,
+        description: str,
+        callback: Callable[[], float | None],
+    ):
+        """Register counter or gauge read when metrics are rendered.
+
+        :param name: metric name
+        :type name: str
+        :param kind: ``counter`` or ``gauge``
+        :type kind: str
+        :param description: help text
+        :type description: str
+        :param callback: returns current value, or None if unknown
+        :type callback: Callable[[], float | None]
+        :return: None
+        """
+        self._callbacks[name] = (kind, description, callback)
+
+    def register_stats(self, stats: FlowStats):
+        """Register processing counters and throughput of worker.
+
+        :param stats: worker statistics
+        :type stats: FlowStats
+        :return: None
+        """
+        self.register(
+            'digest_messages_succeeded_total',
+            'counter',
+            'Messages processed successfully.',
+            lambda: stats.succeeded,
+        )
+        self.register(
+            'digest_messages_failed_total',
+            'counter',
+            'Messages failed to be processed.',
+            lambda: stats.failed,
+        )
+        self.register(
+            'digest_digests_unchanged_total',
+            'counter',
+            'Digests reused instead of being saved again.',
+            lambda: stats.unchanged,
+        )
+        self.register(
+            'digest_requests_coalesced_total',
+            'counter',
+            'Messages attached to computation of the same user.',
+            lambda: stats.coalesced,
+        )
+        self.register(
+            'digest_messages_per_second',
+            'gauge',
+            'Messages processed per second since previous scrape.',
+            Rate(lambda: stats.succeeded + stats.failed),
+        )
+
+    def render(self) -> str:
+        """Render all metrics in Prometheus text exposition format.
+
+        :return: metrics text
+        """
+        lines = []
+        for name, (kind, description, callback) in self._callbacks.items():
+            value = callback()
+            if value is None:
+                continue
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {format_value(value)}')
+        with self._lock:
+            lines.append(
+                '# HELP digest_stage_seconds Latency of processing stages.'
+            )
+            lines.append('# TYPE digest_stage_seconds histogram')
+            for stage, histogram in sorted(self._stages.items()):
+                lines.extend(
+                    histogram.samples(
+                        'digest_stage_seconds', f'stage="{stage}"'
+                    )
+                )
+            for name, description, histogram in (
+                (
+                    'digest_batch_size',
+                    'Number of messages processed together.',
+                    self._batch_sizes,
+                ),
+                (
+                    'digest_user_posts',
+                    'Number of candidate posts read per user.',
+                    self._posts,
+                ),
+                (
+                    'digest_consumer_lag_seconds',
+                    'Time since message was published.',
+                    self._lag,
+                ),
+            ):
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} histogram')
+                lines.extend(histogram.samples(name))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve ``Metrics`` of the server on ``/metrics``."""
+
+    def do_GET(self):  # noqa: N802
+        """Respond with rendered metrics."""
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Log requests at debug level only."""
+        logger.debug(format, *args)
+
+
+class MetricsServer:
+    """HTTP endpoint of metrics, served from a daemon thread."""
+
+    def __init__(self, metrics: Metrics, host: str = '', port: int = 9100):
+        """Initialize server, without binding the port yet.
+
+        :param metrics: metrics to be served
+        :type metrics: Metrics
+        :param host: interface to listen on, all by default
+        :type host: str
+        :param port: port to listen on, 0 picks a free one
+        :type port: int
+        """
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Bind the port and start serving on background thread.
+
+        :return: None
+        """
+        self._server = ThreadingHTTPServer(
+            (self.host, self.port), MetricsHandler
+        )
+        self._server.daemon_threads = True
+        self._server.metrics = self.metrics
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            name='metrics-server',
+            daemon=True,
+        )
+        self._thread.start()
+        logger.info('Serving metrics on port %d', self.port)
+
+    def stop(self):
+        """Stop serving and release the port.
+
+        :return: None
+        """
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
@@ -0,0 +1,259 @@
+"""Opt-in profiling of processed messages."""
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from collections.abc import Sequence
+from contextlib import contextmanager, suppress
+from datetime import datetime
+
+logger = logging.getLogger('digest.profiling')
+
+
+class Trace:
+    """Stage timings and post counts of one profiled message."""
+
+    def __init__(self, user_ids: Sequence[int]):
+        """Initialize empty trace.
+
+        :param user_ids: user IDs of the message (or batch)
+        :type user_ids: Sequence[int]
+        """
+        self.user_ids = [int(user_id) for user_id in user_ids]
+        self.stages = defaultdict(float)
+        self.posts = 0
+
+
+class Profiler:
+    """Profile sampled and slow messages, dumping results to directory.
+
+    Every ``every``-th message is run under cProfile. Messages taking
+    longer than ``slow_threshold`` seconds are reported too; since it is
+    known only afterwards, their users are remembered and their next
+    message is profiled. Every report consists of JSON file with user
+    IDs, post count, latency and stage timings, and ``.prof`` file
+    (readable with ``pstats``) if message was profiled.
+    Only ``keep`` latest reports are kept.
+    Only one message at a time is profiled on every thread, so with
+    asyncio profile may include other tasks interleaved with it.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        every: int = 1000,
+        slow_threshold: float = 1.0,
+        keep: int = 100,
+        enabled: bool = False,
+        max_slow_users: int = 1000,
+    ):
+        """Initialize profiler.
+
+        :param directory: directory for reports, created if missing
+        :type directory: str
+        :param every: profile every N-th message, 0 disables sampling
+        :type every: int
+        :param slow_threshold: report messages slower than that,
+            in seconds, 0 disables
+        :type slow_threshold: float
+        :param keep: number of latest reports kept
+        :type keep: int
+        :param enabled: whether profiling is on from the start
+        :type enabled: bool
+        :param max_slow_users: number of slow users remembered
+        :type max_slow_users: int
+        """
+        self.directory = directory
+        self.every = every
+        self.slow_threshold = slow_threshold
+        self.keep = keep
+        self.enabled = enabled
+        self.max_slow_users = max_slow_users
+        self.reports = 0
+        self._messages = 0
+        self._slow_users = OrderedDict()
+        self._profiling = set()
+        self._trace = contextvars.ContextVar('trace', default=None)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def toggle(self):
+        """Switch profiling on or off. Safe to call from signal handlers.
+
+        :return: None
+        """
+        self.enabled = not self.enabled
+        logger.warning(
+            'Profiling is %s', 'enabled' if self.enabled else 'disabled'
+        )
+
+    def reason(self, user_ids: Sequence[int]) -> str | None:
+        """Decide whether message should be profiled.
+
+        :param user_ids: user IDs of the message
+        :type user_ids: Sequence[int]
+        :return: reason to profile, or None
+        """
+        with self._lock:
+            self._messages += 1
+            for user_id in user_ids:
+                if self._slow_users.pop(int(user_id), None) is not None:
+                    return 'slow user'
+            if self.every and self._messages % self.every == 0:
+                return 'sampled'
+        return None
+
+    @contextmanager
+    def message(self, user_ids: Sequence[int]):
+        """Trace processing of enclosed message, profiling it if chosen.
+
+        :param user_ids: user IDs of the message (or batch)
+        :type user_ids: Sequence[int]
+        """
+        if not self.enabled:
+            yield
+            return
+        trace = Trace(user_ids)
+        token = self._trace.set(trace)
+        reason = self.reason(user_ids)
+        profile = None
+        thread_id = threading.get_ident()
+        if reason is not None and thread_id not in self._profiling:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # another profiler is active, e.g. on Python 3.12+
+                profile = None
+            else:
+                self._profiling.add(thread_id)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            latency = time.perf_counter() - started
+            if profile is not None:
+                profile.disable()
+                self._profiling.discard(thread_id)
+            self._trace.reset(token)
+            slow = bool(self.slow_threshold) and latency > self.slow_threshold
+            if slow:
+                self.remember_slow(trace.user_ids)
+            if profile is not None or slow:
+                self.report(trace, latency, reason or 'slow', profile)
+
+    def record_stage(self, stage: str, seconds: float):
+        """Add stage latency to trace of current message, if any.
+
+        :param stage: stage name
+        :type stage: str
+        :param seconds: stage duration
+        :type seconds: float
+        :return: None
+        """
+        trace = self._trace.get()
+        if trace is not None:
+            trace.stages[stage] += seconds
+
+    def record_posts(self, count: int):
+        """Add number of read posts to trace of current message, if any.
+
+        :param count: number of candidate posts
+        :type count: int
+        :return: None
+        """
+        trace = self._trace.get()
+        if trace is not None:
+            trace.posts += count
+
+    def remember_slow(self, user_ids: Sequence[int]):
+        """Remember users to profile their next message.
+
+        :param user_ids: user IDs of slow message
+        :type user_ids: Sequence[int]
+        :return: None
+        """
+        with self._lock:
+            for user_id in user_ids:
+                self._slow_users[user_id] = True
+                self._slow_users.move_to_end(user_id)
+            while len(self._slow_users) > self.max_slow_users:
+                self._slow_users.popitem(last=False)
+
+    def report(
+        self,
+        trace: Trace,
+        latency: float,
+        reason: str,
+        profile: cProfile.Profile | None,
+    ):
+        """Dump report of message and remove outdated reports.
+
+        :param trace: trace of the message
+        :type trace: Trace
+        :param latency: message processing time, in seconds
+        :type latency: float
+        :param reason: why message is reported
+        :type reason: str
+        :param profile: profile of the message, if it was profiled
+        :type profile: cProfile.Profile | None
+        :return: None
+        """
+        with self._lock:
+            self.reports += 1
+            sequence = self.reports
+        users = f'user-{trace.user_ids[0]}' if trace.user_ids else 'users'
+        if len(trace.user_ids) > 1:
+            users = f'{users}-and-{len(trace.user_ids) - 1}'
+        name = (
+            f'{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}-'
+            f'{sequence:06d}-{users}'
+        )
+        path = os.path.join(self.directory, name)
+        try:
+            if profile is not None:
+                profile.dump_stats(f'{path}.prof')
+            with open(f'{path}.json', 'w') as file:
+                json.dump(
+                    {
+                        'reason': reason,
+                        'user_ids': trace.user_ids,
+                        'posts': trace.posts,
+                        'latency': latency,
+                        'stages': dict(trace.stages),
+                        'profile': f'{name}.prof' if profile else None,
+                    },
+                    file,
+                )
+            self.rotate()
+        except OSError:
+            logger.exception('Failed to write profile %s', name)
+            return
+        logger.info(
+            'Profiled %s (%s): %.1f ms, %d posts',
+            users,
+            reason,
+            latency * 1000,
+            trace.posts,
+        )
+
+    def rotate(self):
+        """Remove all reports but ``keep`` latest ones.
+
+        :return: None
+        """
+        names = sorted(
+            name
+            for name in os.listdir(self.directory)
+            if name.endswith('.json')
+        )
+        for name in names[: max(len(names) - self.keep, 0)]:
+            stem = os.path.join(self.directory, name[: -len('.json')])
+            for suffix in ('.json', '.prof'):
+                # reports may be removed by other workers meanwhile
+                with suppress(FileNotFoundError):
+                    os.remove(f'{stem}{suffix}')
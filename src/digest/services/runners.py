@@ -0,0 +1,283 @@
+"""Alternative ways to run Digester."""
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from digest.services.digester import Digester
+from digest.services.stats import FlowStats
+
+logger = logging.getLogger('digest.runners')
+
+# FlowStats counters aggregated from worker processes
+COUNTERS = ('succeeded', 'failed', 'unchanged', 'coalesced')
+
+
+class ThreadPoolRunner:
+    """Run Digester flow on a bounded thread pool.
+
+    Deliveries are consumed in the calling thread and processed by
+    worker threads. Every worker opens its own sessions (Gateway creates
+    a session per call), so database engine pool should have at least
+    ``concurrency`` connections. Each delivery is acknowledged after its
+    own flow finishes, in whatever order flows finish. Once stopped,
+    RabbitMQ generator keeps connection open until flows in progress
+    report their deliveries.
+    """
+
+    def __init__(self, digester: Digester, concurrency: int):
+        """Initialize runner.
+
+        :param digester: digester to run
+        :type digester: Digester
+        :param concurrency: number of worker threads
+        :type concurrency: int
+        """
+        self.digester = digester
+        self.concurrency = concurrency
+
+    @property
+    def stats(self) -> FlowStats:
+        """Statistics of the digester being run."""
+        return self.digester.stats
+
+    def stop(self):
+        """Ask running process to stop after messages in progress.
+
+        :return: None
+        """
+        self.digester.stop()
+
+    def __call__(self):
+        """Start the whole process.
+
+        At most ``2 * concurrency`` deliveries are handed over to the pool
+        at once, the rest stay in RabbitMQ prefetch buffer.
+        """
+        logger.info('Start listening with %d threads', self.concurrency)
+        slots = threading.BoundedSemaphore(2 * self.concurrency)
+        deliveries = self.digester.deliveries()
+        executor = ThreadPoolExecutor(
+            self.concurrency, thread_name_prefix='digest'
+        )
+
+        def done(future: Future):
+            slots.release()
+            error = future.exception()
+            if error is not None:
+                logger.error('Failed to handle deliveries', exc_info=error)
+
+        try:
+            for item in deliveries:
+                slots.acquire()
+                future = executor.submit(self.digester.handle, item)
+                future.add_done_callback(done)
+        finally:
+            executor.shutdown(wait=True)
+            deliveries.close()
+            logger.info('Stopped: %s', self.digester.stats.summary())
+            self.digester.log_cache_summary()
+
+
+_worker_index = 0
+
+
+def worker_index() -> int:
+    """Get index of current worker process.
+
+    :return: index given by ProcessSupervisor, 0 in other processes
+    """
+    return _worker_index
+
+
+def _report(stats: FlowStats, counters, index: int, reported: list[int]):
+    """Add counters gathered since last report to shared counters."""
+    current = [getattr(stats, name) for name in COUNTERS]
+    with counters.get_lock():
+        for offset, value in enumerate(current):
+            counters[len(COUNTERS) * index + offset] += (
+                value - reported[offset]
+            )
+    reported[:] = current
+
+
+def _run_worker(factory: Callable, index: int, counters, interval: float):
+    """Build runnable in forked process and run it until stopped.
+
+    Everything, including connections, is created after the fork.
+    SIGTERM stops runnable gracefully, SIGINT is left to supervisor.
+    SIGUSR1 is ignored unless runnable handles it.
+    """
+    global _worker_index
+    _worker_index = index
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    runnable = factory()
+    signal.signal(signal.SIGTERM, lambda *_: runnable.stop())
+
+    reported = [0] * len(COUNTERS)
+    done = threading.Event()
+
+    def report_periodically():
+        while not done.wait(interval):
+            _report(runnable.stats, counters, index, reported)
+
+    reporter = threading.Thread(target=report_periodically, daemon=True)
+    reporter.start()
+    try:
+        runnable()
+    finally:
+        done.set()
+        _report(runnable.stats, counters, index, reported)
+
+
+class ProcessSupervisor:
+    """Run Digester in several forked worker processes.
+
+    Every worker builds its own Digester (with its own database engine,
+    RabbitMQ connection and Redis client) by calling ``factory``
+    after the fork. Crashed workers are restarted. On SIGTERM or SIGINT
+    workers are asked to stop and are given ``shutdown_timeout`` seconds
+    to finish messages in progress. SIGUSR1 is forwarded to workers.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Digester | ThreadPoolRunner],
+        processes: int,
+        status_interval: float = 30.0,
+        shutdown_timeout: float = 30.0,
+        restart_delay: float = 1.0,
+    ):
+        """Initialize supervisor.
+
+        :param factory: builds runnable with ``stats`` and ``stop``
+        :type factory: Callable
+        :param processes: number of worker processes
+        :type processes: int
+        :param status_interval: how often to log status line, in seconds
+        :type status_interval: float
+        :param shutdown_timeout: time given to workers to stop, in seconds
+        :type shutdown_timeout: float
+        :param restart_delay: minimal delay between restarts of a worker
+        :type restart_delay: float
+        """
+        self.factory = factory
+        self.processes = processes
+        self.status_interval = status_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.restart_delay = restart_delay
+        self.restarts = 0
+        self._context = multiprocessing.get_context('fork')
+        self._counters = self._context.Array('q', len(COUNTERS) * processes)
+        self._workers: list[multiprocessing.Process] = []
+        self._started = time.monotonic()
+        self._stopping = threading.Event()
+
+    def _spawn(self, index: int) -> multiprocessing.Process:
+        """Fork worker process with given index."""
+        worker = self._context.Process(
+            target=_run_worker,
+            args=(
+                self.factory,
+                index,
+                self._counters,
+                min(self.status_interval, 1.0),
+            ),
+            name=f'digest-worker-{index}',
+        )
+        worker.start()
+        return worker
+
+    def status(self) -> str:
+        """Describe aggregated state of workers in one line.
+
+        :return: human-readable status
+        """
+        with self._counters.get_lock():
+            counters = list(self._counters)
+        succeeded, failed, unchanged, coalesced = (
+            sum(counters[offset :: len(COUNTERS)])
+            for offset in range(len(COUNTERS))
+        )
+        processed = succeeded + failed
+        elapsed = time.monotonic() - self._started
+        alive = sum(1 for worker in self._workers if worker.is_alive())
+        return (
+            f'workers {alive}/{self.processes} alive, '
+            f'{self.restarts} restarts, '
+            f'processed {processed} messages ({failed} failed), '
+            f'{processed / elapsed:.1f} msg/s, '
+            f'{unchanged} unchanged digests, '
+            f'{coalesced} coalesced requests'
+        )
+
+    def stop(self):
+        """Ask supervisor to stop workers and exit.
+
+        :return: None
+        """
+        self._stopping.set()
+
+    def _forward(self, signal_number: int):
+        """Send signal to all alive workers."""
+        for worker in self._workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal_number)
+
+    def _drain(self):
+        """Ask workers to stop, kill those which do not stop in time."""
+        for worker in self._workers:
+            if worker.is_alive():
+                worker.terminate()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for worker in self._workers:
+            worker.join(max(deadline - time.monotonic(), 0))
+            if worker.is_alive():
+                logger.error(
+                    'Killing %s, it did not stop in time', worker.name
+                )
+                worker.kill()
+                worker.join()
+
+    def __call__(self):
+        """Start workers and supervise them until stopped."""
+        logger.info('Starting %d worker processes', self.processes)
+        handlers = {
+            signal_number: signal.signal(signal_number, lambda *_: self.stop())
+            for signal_number in (signal.SIGTERM, signal.SIGINT)
+        }
+        handlers[signal.SIGUSR1] = signal.signal(
+            signal.SIGUSR1, lambda *_: self._forward(signal.SIGUSR1)
+        )
+        self._workers = [self._spawn(index) for index in range(self.processes)]
+        started = [time.monotonic()] * self.processes
+        last_status = time.monotonic()
+        try:
+            while not self._stopping.wait(0.2):
+                for index, worker in enumerate(self._workers):
+                    if worker.is_alive():
+                        continue
+                    if time.monotonic() - started[index] < self.restart_delay:
+                        continue
+                    logger.error(
+                        '%s exited with code %s, restarting',
+                        worker.name,
+                        worker.exitcode,
+                    )
+                    self.restarts += 1
+                    self._workers[index] = self._spawn(index)
+                    started[index] = time.monotonic()
+                if time.monotonic() - last_status >= self.status_interval:
+                    logger.info('Status: %s', self.status())
+                    last_status = time.monotonic()
+        finally:
+            logger.info('Stopping worker processes')
+            self._drain()
+            for signal_number, handler in handlers.items():
+                signal.signal(signal_number, handler)
+            logger.info('Stopped: %s', self.status())
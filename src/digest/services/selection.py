@@ -0,0 +1,64 @@
+"""Single-pass top-k selection used by filters.
+
+Functions here accept any iterable of posts, look at every post once
+and keep only ``O(limit)`` posts (plus one post per subscription)
+in memory. Results are identical to stable sorting by rating:
+posts with equal rating keep their input order.
+"""
+import heapq
+from collections.abc import Iterable
+
+from digest.schemas import PostDTO, PostRank
+
+
+def top_rated(posts: Iterable[PostDTO | PostRank], limit: int) -> list[int]:
+    """Choose top-rated posts.
+
+    :param posts: posts to choose from
+    :type posts: Iterable
+    :param limit: how many posts should be returned
+    :type limit: int
+    :return: list of chosen Posts IDs, best first
+    """
+    best = heapq.nsmallest(limit, posts, key=lambda post: -post.rating)
+    return [post.id for post in best]
+
+
+def top_rated_per_subscription(
+    posts: Iterable[PostDTO | PostRank], limit: int
+) -> list[int]:
+    """Choose best post of every subscription, then other top-rated posts.
+
+    Candidates are compared by ``(rating, -position)`` key, so earlier
+    post wins a tie, just like in stable sort.
+
+    :param posts: posts to choose from
+    :type posts: Iterable
+    :param limit: how many posts should be returned
+    :type limit: int
+    :return: list of chosen Posts IDs
+    """
+    if limit <= 0:
+        return []
+
+    leaders = {}
+    top = []
+    for position, post in enumerate(posts):
+        candidate = (post.rating, -position, post.id)
+        leader = leaders.get(post.subscription_id)
+        if leader is None or post.rating > leader[0]:
+            leaders[post.subscription_id] = candidate
+        if len(top) < limit:
+            heapq.heappush(top, candidate)
+        elif candidate > top[0]:
+            heapq.heapreplace(top, candidate)
+
+    chosen = heapq.nlargest(limit, leaders.values())
+    result = [post_id for _, _, post_id in chosen]
+    chosen_positions = {position for _, position, _ in chosen}
+    for _, position, post_id in sorted(top, reverse=True):
+        if len(result) >= limit:
+            break
+        if position not in chosen_positions:
+            result.append(post_id)
+    return result
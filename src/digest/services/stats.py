@@ -0,0 +1,103 @@
+"""Processing statistics."""
+import random
+import statistics
+import threading
+import time
+
+
+class FlowStats:
+    """Thread-safe throughput and latency statistics.
+
+    Latencies are kept in a fixed-size uniform sample (reservoir),
+    so memory does not grow with uptime.
+    """
+
+    def __init__(self, sample_size: int = 10_000):
+        """Initialize empty statistics.
+
+        :param sample_size: maximum number of latencies kept
+        :type sample_size: int
+        """
+        self.sample_size = sample_size
+        self.started = time.monotonic()
+        self.succeeded = 0
+        self.failed = 0
+        self.unchanged = 0
+        self.coalesced = 0
+        self._latencies = []
+        self._seen = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool = True, count: int = 1):
+        """Record processed messages.
+
+        :param latency: processing time of every message, in seconds
+        :type latency: float
+        :param ok: whether processing succeeded
+        :type ok: bool
+        :param count: number of messages processed together
+        :type count: int
+        :return: None
+        """
+        with self._lock:
+            if ok:
+                self.succeeded += count
+            else:
+                self.failed += count
+            for _ in range(count):
+                self._seen += 1
+                if len(self._latencies) < self.sample_size:
+                    self._latencies.append(latency)
+                else:
+                    index = random.randrange(self._seen)
+                    if index < self.sample_size:
+                        self._latencies[index] = latency
+
+    def record_unchanged(self, count: int = 1):
+        """Record digests reused instead of being written again.
+
+        :param count: number of reused digests
+        :type count: int
+        :return: None
+        """
+        with self._lock:
+            self.unchanged += count
+
+    def record_coalesced(self, count: int = 1):
+        """Record messages attached to computation of the same user.
+
+        :param count: number of attached messages
+        :type count: int
+        :return: None
+        """
+        with self._lock:
+            self.coalesced += count
+
+    def summary(self) -> str:
+        """Describe statistics in one line.
+
+        :return: human-readable summary
+        """
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            processed = self.succeeded + self.failed
+            line = (
+                f'processed {processed} messages ({self.failed} failed) '
+                f'in {elapsed:.1f}s, {processed / elapsed:.1f} msg/s'
+            )
+            if self.unchanged:
+                line = f'{line}, {self.unchanged} unchanged digests'
+            if self.coalesced:
+                line = f'{line}, {self.coalesced} coalesced requests'
+            if len(self._latencies) < 2:
+                return line
+            quantiles = statistics.quantiles(
+                self._latencies, n=100, method='inclusive'
+            )
+            return (
+                f'{line}, latency ms: '
+                f'p50 {quantiles[49] * 1000:.1f}, '
+                f'p95 {quantiles[94] * 1000:.1f}, '
+                f'p99 {quantiles[98] * 1000:.1f}, '
+                f'max {max(self._latencies) * 1000:.1f}'
+            )
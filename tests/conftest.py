@@ -1,9 +1,12 @@
+import asyncio
+import inspect
+
 import pytest
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine, text
 from digest.adapters.database import Gateway
 from digest.adapters.storage import RedisStorage
-from digest.adapters.rabbit import RabbitReader
+from digest.adapters.rabbit import Delivery, RabbitReader
 from digest.services.digester import Digester
 from digest.services.filters import dummy_filter
 from digest.entrypoint import Settings
@@ -77,9 +80,32 @@ def rabbit_reader(settings):
 class FakeRabbitReader(RabbitReader):
     def __init__(self):
         self.user_list = [1, 2, 3]
+        self.acked = []
+        self.rejected = []
+        self.discarded = []
+
+    def deliveries(self):
+        return [
+            Delivery(user_id, delivery_tag)
+            for delivery_tag, user_id in enumerate(self.user_list, 1)
+        ]
 
     def message_generator(self, limit: int = 3):
-        yield from self.user_list
+        yield from self.deliveries()
+
+    def message_batches(self, size: int, timeout: float):
+        deliveries = self.deliveries()
+        for start in range(0, len(deliveries), size):
+            yield deliveries[start:start + size]
+
+    def ack(self, delivery):
+        self.acked.append(delivery.user_id)
+
+    def reject(self, delivery):
+        self.rejected.append(delivery.user_id)
+
+    def discard(self, delivery):
+        self.discarded.append(delivery.user_id)
 
 
 @pytest.fixture
@@ -95,3 +121,76 @@ def digester(gateway, redis_client, fake_rabbit_reader):
         redis_client,
         dummy_filter,
     )
+
+
+class FakeAsyncRabbitReader(FakeRabbitReader):
+    async def message_generator(self, limit: int = 3):
+        for delivery in self.deliveries():
+            yield delivery
+
+    async def message_batches(self, size: int, timeout: float):
+        for batch in super().message_batches(size, timeout):
+            yield batch
+
+
+class BlockingDigester:
+    """Drive AsyncDigester from synchronous tests.
+
+    Coroutine methods are run to completion on given loop,
+    adapters are replaced with blocking ones for assertions.
+    """
+
+    def __init__(self, digester, loop, gateway, redis_storage):
+        vars(self).update(
+            _digester=digester,
+            _loop=loop,
+            gateway=gateway,
+            redis_storage=redis_storage,
+        )
+
+    def __getattr__(self, name):
+        attribute = getattr(self._digester, name)
+        if inspect.iscoroutinefunction(attribute):
+            def run(*args, **kwargs):
+                return self._loop.run_until_complete(attribute(*args, **kwargs))
+            return run
+        return attribute
+
+    def __setattr__(self, name, value):
+        setattr(self._digester, name, value)
+
+    def __call__(self):
+        self._loop.run_until_complete(self._digester.run())
+
+
+@pytest.fixture(scope='session')
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def async_digester(settings, loop, gateway, redis_client):
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from digest.adapters.async_database import AsyncGateway
+    from digest.adapters.storage import AsyncRedisStorage
+    from digest.services.async_digester import AsyncDigester
+
+    engine = create_async_engine(settings.async_database_url)
+    digester = AsyncDigester(
+        AsyncGateway(async_sessionmaker(engine, expire_on_commit=False)),
+        FakeAsyncRabbitReader(),
+        AsyncRedisStorage(settings.redis_url),
+        dummy_filter,
+    )
+    yield BlockingDigester(digester, loop, gateway, redis_client)
+    loop.run_until_complete(digester.redis_storage.client.close())
+    loop.run_until_complete(engine.dispose())
+
+
+@pytest.fixture(params=['sync', 'asyncio'])
+def any_digester(request):
+    if request.param == 'asyncio':
+        return request.getfixturevalue('async_digester')
+    return request.getfixturevalue('digester')
@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+from digest.schemas import UserPostRank
+from digest.services.filters import at_least_one_subscription, dummy_filter
+
+pytest.importorskip('numpy')
+
+from digest.services.batch import (  # noqa: E402
+    batch_at_least_one_subscription,
+    batch_dummy_filter,
+)
+
+
+def random_batch(seed: int) -> tuple[list[UserPostRank], list[int]]:
+    rnd = random.Random(seed)
+    user_ids = rnd.sample(range(1, 100), rnd.randint(1, 10))
+    ranks = []
+    for user_id in sorted(user_ids):
+        subscriptions = rnd.randint(1, 6)
+        for post_id in sorted(rnd.sample(range(1, 500), rnd.randint(0, 30))):
+            ranks.append(
+                UserPostRank(
+                    user_id,
+                    post_id,
+                    rnd.randint(1, subscriptions),
+                    rnd.randint(0, 5),
+                )
+            )
+    return ranks, user_ids
+
+
+@pytest.mark.parametrize(
+    ('batch_filter', 'filter_function'),
+    [
+        (batch_dummy_filter, dummy_filter),
+        (batch_at_least_one_subscription, at_least_one_subscription),
+    ],
+)
+@pytest.mark.parametrize('seed', range(100))
+def test_batch_filter_matches_filter(batch_filter, filter_function, seed):
+    ranks, user_ids = random_batch(seed)
+    for limit in range(8):
+        result = batch_filter(ranks, user_ids, limit=limit)
+        assert list(result) == user_ids
+        for user_id in user_ids:
+            posts = [rank for rank in ranks if rank.user_id == user_id]
+            assert result[user_id] == filter_function(*posts, limit=limit)
+
+
+def test_batch_filter_empty():
+    assert batch_at_least_one_subscription([], [1, 2]) == {1: [], 2: []}
+    assert batch_dummy_filter([], []) == {}
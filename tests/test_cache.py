@@ -0,0 +1,91 @@
+from digest.schemas import PostRank
+from digest.services.cache import TopPostsCache, entry_size
+from digest.services.digester import Digester
+
+
+def ranks(subscription_id, *ratings):
+    return [
+        PostRank(subscription_id * 100 + index, subscription_id, rating)
+        for index, rating in enumerate(ratings)
+    ]
+
+
+def test_cache_lookup_and_update():
+    cache = TopPostsCache(top_k=2)
+    found, missing = cache.lookup([1, 2])
+    assert found == {}
+    assert missing == [1, 2]
+    result = cache.update([1, 2], ranks(1, 5, 4), cache.generation)
+    assert result == {1: ranks(1, 5, 4), 2: []}
+    found, missing = cache.lookup([1, 2, 3])
+    assert found == result
+    assert missing == [3]
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_cache_evicts_least_recently_used():
+    size = entry_size(ranks(1, 1))
+    cache = TopPostsCache(max_bytes=2 * size)
+    for subscription_id in (1, 2):
+        cache.update(
+            [subscription_id], ranks(subscription_id, 1), cache.generation
+        )
+    cache.lookup([1])
+    cache.update([3], ranks(3, 1), cache.generation)
+    assert cache.evictions == 1
+    assert cache.size == 2 * size
+    found, missing = cache.lookup([1, 2, 3])
+    assert sorted(found) == [1, 3]
+    assert missing == [2]
+
+
+def test_cache_expires():
+    cache = TopPostsCache(ttl=0)
+    cache.update([1], ranks(1, 1), cache.generation)
+    assert cache.lookup([1]) == ({}, [1])
+    assert cache.expirations == 1
+    assert cache.size == 0
+
+
+def test_cache_invalidate():
+    cache = TopPostsCache()
+    cache.update([1, 2], ranks(1, 1) + ranks(2, 1), cache.generation)
+    cache.invalidate(1)
+    assert cache.lookup([1, 2]) == ({2: ranks(2, 1)}, [1])
+    cache.clear()
+    assert cache.lookup([2]) == ({}, [2])
+    assert cache.invalidations == 2
+
+
+def test_cache_skips_stale_load():
+    cache = TopPostsCache()
+    generation = cache.generation
+    cache.invalidate(1)
+    result = cache.update([1, 2], ranks(1, 1) + ranks(2, 1), generation)
+    assert result == {1: ranks(1, 1), 2: ranks(2, 1)}
+    assert cache.lookup([1, 2]) == ({2: ranks(2, 1)}, [1])
+
+    generation = cache.generation
+    cache.clear()
+    cache.update([1], ranks(1, 1), generation)
+    assert cache.lookup([1]) == ({}, [1])
+
+
+def test_cache_suspended():
+    cache = TopPostsCache()
+    cache.suspend()
+    cache.update([1], ranks(1, 1), cache.generation)
+    assert cache.lookup([1]) == ({}, [1])
+    cache.resume()
+    cache.update([1], ranks(1, 1), cache.generation)
+    assert cache.lookup([1]) == ({1: ranks(1, 1)}, [])
+
+
+def test_merge_top_posts():
+    top = {1: ranks(1, 5, 4), 2: ranks(2, 6), 3: []}
+    merged = Digester.merge_top_posts({7: [2, 1], 8: [3], 9: []}, top)
+    assert merged == {7: ranks(1, 5, 4) + ranks(2, 6), 8: [], 9: []}
+    assert Digester.user_ranks({8: ranks(2, 6), 7: ranks(1, 5)}) == [
+        (7, 100, 1, 5),
+        (8, 200, 2, 6),
+    ]
@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from digest.adapters.rabbit import Delivery
+from digest.services.coalescing import Coalescer
+from digest.services.digester import Digester
+from digest.services.filters import dummy_filter
+
+
+class CountingDigester(Digester):
+    def __init__(self, rabbit_reader, coalescer, fail=()):
+        super().__init__(
+            None, rabbit_reader, None, dummy_filter, coalescer=coalescer
+        )
+        self.fail = set(fail)
+        self.computed = []
+
+    def flow(self, user_id):
+        self.computed.append(int(user_id))
+        if int(user_id) in self.fail:
+            raise RuntimeError('flow failed')
+
+    def flow_many(self, user_ids):
+        user_ids = [int(user_id) for user_id in user_ids]
+        self.computed.extend(dict.fromkeys(user_ids))
+        return {
+            user_id: RuntimeError('store failed')
+            for user_id in user_ids
+            if user_id in self.fail
+        }
+
+
+def test_coalescer_attaches_to_pending():
+    coalescer = Coalescer(window=0)
+    assert coalescer.claim(1) is None
+    future = coalescer.claim(1)
+    assert future is not None
+    assert coalescer.claim('1') is future
+    assert coalescer.claim(2) is None
+    assert len(coalescer) == 2
+    coalescer.complete(1, True)
+    assert future.result() is True
+    assert coalescer.claim(1) is None
+
+
+def test_coalescer_window():
+    coalescer = Coalescer(window=0.05)
+    assert coalescer.claim(1) is None
+    coalescer.complete(1, True)
+    future = coalescer.claim(1)
+    assert future is not None and future.result() is True
+    time.sleep(0.06)
+    assert coalescer.claim(1) is None
+    assert len(coalescer) == 1
+
+
+def test_coalescer_forgets_failures():
+    coalescer = Coalescer(window=60)
+    assert coalescer.claim(1) is None
+    future = coalescer.claim(1)
+    coalescer.complete(1, False)
+    assert future.result() is False
+    assert coalescer.claim(1) is None
+
+
+def test_coalescer_concurrent_claims():
+    coalescer = Coalescer(window=60)
+    leaders = []
+    barrier = threading.Barrier(8)
+
+    def claim():
+        barrier.wait()
+        if coalescer.claim(1) is None:
+            leaders.append(threading.get_ident())
+
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(leaders) == 1
+
+
+def test_digester_process_coalesced(fake_rabbit_reader):
+    digester = CountingDigester(fake_rabbit_reader, Coalescer(window=60))
+    for user_id in (1, 1, 2, 1):
+        assert digester.process(Delivery(user_id, user_id))
+    assert digester.computed == [1, 2]
+    assert fake_rabbit_reader.acked == [1, 1, 2, 1]
+    assert digester.stats.coalesced == 2
+    assert 'coalesced' in digester.stats.summary()
+
+
+def test_digester_process_pending_failure(fake_rabbit_reader):
+    coalescer = Coalescer(window=60)
+    digester = CountingDigester(fake_rabbit_reader, coalescer, fail=[1])
+    assert coalescer.claim(1) is None
+    assert digester.process(Delivery(1, 1))
+    assert fake_rabbit_reader.acked == []
+    coalescer.complete(1, False)
+    assert fake_rabbit_reader.rejected == [1]
+    assert not digester.process(Delivery(1, 2))
+    assert fake_rabbit_reader.rejected == [1, 1]
+
+
+def test_digester_process_batch_coalesced(fake_rabbit_reader):
+    digester = CountingDigester(
+        fake_rabbit_reader, Coalescer(window=60), fail=[3]
+    )
+    digester.process_batch(
+        [Delivery(user_id, tag) for tag, user_id in enumerate([1, 3, 1, 2])]
+    )
+    digester.process_batch([Delivery(2, 4), Delivery(3, 5)])
+    assert digester.computed == [1, 3, 2, 3]
+    assert sorted(fake_rabbit_reader.acked) == [1, 1, 2, 2]
+    assert fake_rabbit_reader.rejected == [3, 3]
+    assert digester.stats.coalesced == 2
+
+
+@pytest.mark.parametrize('window', [None, 60])
+def test_digester_discards_malformed(fake_rabbit_reader, window):
+    coalescer = None if window is None else Coalescer(window=window)
+    digester = CountingDigester(fake_rabbit_reader, coalescer)
+    assert not digester.process(Delivery('abc', 1))
+    assert digester.process(Delivery('1', 2))
+    digester.process_batch([Delivery('2', 3), Delivery('x', 4)])
+    assert digester.computed == [1, 2]
+    assert fake_rabbit_reader.discarded == ['abc', 'x']
+    assert fake_rabbit_reader.rejected == []
+    assert fake_rabbit_reader.acked == ['1', '2']
+    assert digester.stats.failed == 2
+
+
+def test_async_digester_discards_malformed(fake_rabbit_reader):
+    pytest.importorskip('aio_pika')
+    pytest.importorskip('asyncpg')
+    from digest.services.async_digester import AsyncDigester
+
+    class CountingAsyncDigester(AsyncDigester):
+        async def flow(self, user_id):
+            int(user_id)
+
+        async def flow_many(self, user_ids):
+            return {}
+
+    digester = CountingAsyncDigester(
+        None,
+        fake_rabbit_reader,
+        None,
+        dummy_filter,
+        coalescer=Coalescer(window=60),
+    )
+    assert not asyncio.run(digester.process(Delivery('abc', 1)))
+    assert asyncio.run(digester.process(Delivery('1', 2)))
+    asyncio.run(digester.process_batch([Delivery('x', 3), Delivery('2', 4)]))
+    assert fake_rabbit_reader.discarded == ['abc', 'x']
+    assert fake_rabbit_reader.rejected == []
+    assert fake_rabbit_reader.acked == ['1', '2']
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from digest.adapters.codecs import (
+    MAGIC,
+    JsonCodec,
+    MsgpackCodec,
+    decode_digest,
+    make_codec,
+)
+from digest.schemas import DigestDTO, PostDTO
+
+pytest.importorskip('msgpack')
+
+
+def make_digest(content_size):
+    return DigestDTO(
+        id=7,
+        user_id=3,
+        timestamp='2023-07-20T12:30:00.123456',
+        posts=[
+            PostDTO(
+                id=post_id,
+                subscription_id=post_id % 3,
+                content='Новость ' * content_size,
+                rating=post_id * 10,
+            )
+            for post_id in range(1, 6)
+        ],
+    )
+
+
+def test_json_codec_is_plain_json():
+    digest_ = make_digest(10)
+    payload = JsonCodec().encode(digest_)
+    assert json.loads(payload)['user_id'] == 3
+    assert decode_digest(payload) == digest_
+    assert decode_digest(payload.encode()) == digest_
+
+
+@pytest.mark.parametrize('compression', ['none', 'zlib'])
+@pytest.mark.parametrize('content_size', [0, 1, 1000])
+def test_msgpack_codec_round_trip(compression, content_size):
+    digest_ = make_digest(content_size)
+    payload = MsgpackCodec(compression, threshold=256).encode(digest_)
+    assert payload.startswith(MAGIC)
+    assert payload[len(MAGIC)] == 1
+    assert decode_digest(payload) == digest_
+
+
+def test_msgpack_codec_compresses_above_threshold():
+    codec = MsgpackCodec('zlib', threshold=256)
+    small = codec.encode(make_digest(1))
+    large = codec.encode(make_digest(1000))
+    assert small[len(MAGIC) + 1] == 0
+    assert large[len(MAGIC) + 1] == 1
+    assert len(large) < len(JsonCodec().encode(make_digest(1000))) / 10
+
+
+def test_msgpack_codec_zstd():
+    pytest.importorskip('zstandard')
+    digest_ = make_digest(1000)
+    payload = MsgpackCodec('zstd', threshold=0).encode(digest_)
+    assert payload[len(MAGIC) + 1] == 2
+    assert decode_digest(payload) == digest_
+
+
+def test_decode_unknown_version():
+    payload = MsgpackCodec('none').encode(make_digest(1))
+    with pytest.raises(ValueError, match='version'):
+        decode_digest(MAGIC + b'\x09' + payload[len(MAGIC) + 1 :])
+
+
+def test_make_codec():
+    assert isinstance(make_codec('json'), JsonCodec)
+    assert isinstance(make_codec('msgpack', 'none'), MsgpackCodec)
+    with pytest.raises(ValueError):
+        make_codec('pickle')
+    with pytest.raises(ValueError):
+        make_codec('msgpack', 'lz4')
@@ -1,3 +1,7 @@
+from digest.schemas import PostRank, UserPostRank
+from digest.services.filters import at_least_one_subscription, dummy_filter
+
+
 def test_gateway_read_posts(gateway, refill_database):
     assert gateway.read_posts_for_user(3) == []
     football_posts = gateway.read_posts_for_user(1)
@@ -32,3 +36,153 @@ def test_gateway_read_digest(gateway, refill_database):
     assert all(post in check.posts for post in digest_.posts)
 
     assert gateway.read_digest(2) is None
+
+
+def test_gateway_read_candidate_posts(gateway, refill_database):
+    for filter_function in (dummy_filter, at_least_one_subscription):
+        for user_id in (1, 2, 3):
+            posts = gateway.read_posts_for_user(user_id)
+            for limit in range(1, 8):
+                candidates = gateway.read_candidate_posts_for_user(
+                    user_id, limit, **filter_function.pushdown
+                )
+                assert len(candidates) <= 2 * limit
+                assert filter_function(
+                    *candidates, limit=limit
+                ) == filter_function(*posts, limit=limit)
+
+
+def test_gateway_read_post_ranks(gateway, refill_database):
+    for user_id in (1, 2, 3):
+        posts = gateway.read_posts_for_user(user_id)
+        ranks = gateway.read_post_ranks_for_user(user_id)
+        assert ranks == [
+            (post.id, post.subscription_id, post.rating) for post in posts
+        ]
+        for limit in (1, 5):
+            candidates = gateway.read_candidate_posts_for_user(user_id, limit)
+            assert gateway.read_candidate_ranks_for_user(user_id, limit) == [
+                (post.id, post.subscription_id, post.rating)
+                for post in candidates
+            ]
+
+
+def test_gateway_read_candidate_ranks_for_users(gateway, refill_database):
+    for per_subscription in (True, False):
+        for limit in (1, 2, 5):
+            ranks = gateway.read_candidate_ranks_for_users(
+                [3, 1, 2], limit, per_subscription
+            )
+            assert ranks == [
+                UserPostRank(user_id, *rank)
+                for user_id in (1, 2, 3)
+                for rank in gateway.read_candidate_ranks_for_user(
+                    user_id, limit, per_subscription
+                )
+            ]
+    assert gateway.read_candidate_ranks_for_users([], 5) == []
+
+
+def test_gateway_read_posts_by_ids(gateway, refill_database):
+    posts = gateway.read_posts_for_user(2)
+    chosen = [posts[3].id, posts[0].id, 100500]
+    assert gateway.read_posts(*chosen) == [posts[3], posts[0]]
+    assert gateway.read_posts() == []
+
+
+def test_gateway_copy_digests(gateway, refill_database):
+    posts = {
+        user_id: gateway.read_posts_for_user(user_id) for user_id in (1, 2)
+    }
+    chosen = {
+        1: [posts[1][2].id, posts[1][0].id],
+        2: [posts[2][5].id],
+        3: [],
+    }
+    digests = gateway.copy_digests(chosen)
+    assert digests[3] is None
+    assert [digests[1].id, digests[2].id] == [1, 2]
+    for user_id in (1, 2):
+        assert [post.id for post in digests[user_id].posts] == chosen[user_id]
+        check = gateway.read_digest(digests[user_id].id)
+        assert check.user_id == user_id
+        assert check.timestamp == digests[user_id].timestamp
+        assert sorted(post.id for post in check.posts) == sorted(
+            chosen[user_id]
+        )
+
+    known = [post for user_posts in posts.values() for post in user_posts]
+    digests = gateway.copy_digests({1: chosen[1]}, posts=known)
+    assert digests[1].id == 3
+    assert digests[1].posts == [posts[1][2], posts[1][0]]
+    # sequence stays usable for regular inserts
+    assert gateway.create_digest(1, posts[1][1].id).id == 4
+
+
+def test_gateway_touch_digests(gateway, refill_database):
+    posts = gateway.read_posts_for_user(1)
+    digest_ = gateway.create_digest(1, posts[0].id, posts[1].id)
+    touched = gateway.touch_digests(
+        {digest_.id: (1, [posts[1].id, posts[0].id]), 100500: (1, [1])}
+    )
+    assert list(touched) == [digest_.id]
+    assert touched[digest_.id].posts == [posts[1], posts[0]]
+    assert touched[digest_.id].timestamp >= digest_.timestamp
+    assert gateway.touch_digests({digest_.id: (2, [posts[0].id])}) == {}
+
+
+def test_gateway_read_top_posts(gateway, refill_database):
+    assert gateway.read_subscriptions_for_users([1, 2, 3]) == {
+        1: [1],
+        2: [2, 3, 4],
+        3: [],
+    }
+    assert gateway.read_top_posts([2, 4, 99], 2) == [
+        PostRank(12, 2, 6),
+        PostRank(11, 2, 5),
+        PostRank(21, 4, 1),
+        PostRank(22, 4, 1),
+    ]
+
+
+def test_gateway_read_post_ranks_above(gateway, refill_database):
+    assert gateway.read_last_post_id() == 25
+    assert gateway.read_post_ranks_above({1: 8, 2: 20, 3: 0}) == [
+        UserPostRank(1, 9, 1, 9),
+        UserPostRank(1, 10, 1, 10),
+        UserPostRank(2, 21, 4, 1),
+        UserPostRank(2, 22, 4, 1),
+    ]
+
+
+def test_gateway_leaderboards(sessionmaker_, gateway, refill_database):
+    from sqlalchemy import text
+    from digest.adapters.database import Gateway
+
+    gateway.refresh_leaderboards()
+    boards = Gateway(sessionmaker_, leaderboards=True)
+    assert boards.read_post_ranks_for_users(
+        [1, 2, 3]
+    ) == gateway.read_post_ranks_for_users([1, 2, 3])
+    assert boards.read_post_ranks_for_user(2) == gateway.read_post_ranks_for_user(2)
+    assert boards.read_posts_for_user(1) == gateway.read_posts_for_user(1)
+    assert boards.read_candidate_ranks_for_users(
+        [1, 2, 3], 5
+    ) == gateway.read_candidate_ranks_for_users([1, 2, 3], 5)
+    assert boards.read_candidate_ranks_for_user(
+        2, 5, False
+    ) == gateway.read_candidate_ranks_for_user(2, 5, False)
+
+    with sessionmaker_() as s:
+        s.execute(text('delete from posts where id = 1'))
+        s.commit()
+    assert [post.id for post in boards.read_post_ranks_for_user(1)] == list(
+        range(2, 11)
+    )
+
+    with sessionmaker_() as s:
+        s.execute(text('update posts set rating = 100 where id = 2'))
+        s.commit()
+    assert boards.read_post_ranks_for_user(1)[0] == PostRank(2, 1, 2)
+    gateway.refresh_leaderboards()
+    assert boards.read_post_ranks_for_user(1)[0] == PostRank(2, 1, 100)
@@ -1,14 +1,17 @@
 import json
 from digest.schemas import DigestDTO
+from digest.services.runners import ThreadPoolRunner
 
 
-def test_make_digest(digester):
+def test_make_digest(any_digester):
+    digester = any_digester
     digest_ = digester.make_digest(1, 5)
     assert digest_.user_id == 1
     assert len(digest_.posts) == 5
 
 
-def test_store_digest(digester):
+def test_store_digest(any_digester):
+    digester = any_digester
     digest_ = digester.make_digest(1, 5)
     digester.store_digest(digest_)
     digest_ = DigestDTO.model_validate(json.loads(digester.redis_storage.client.get(1)))
@@ -16,14 +19,16 @@ def test_store_digest(digester):
     assert len(digest_.posts) == 5
 
 
-def test_flow(digester):
+def test_flow(any_digester):
+    digester = any_digester
     digester.flow(2)
     digest_ = DigestDTO.model_validate(json.loads(digester.redis_storage.client.get(2)))
     assert digest_.user_id == 2
     assert len(digest_.posts) == 5
 
 
-def test_run(digester):
+def test_run(any_digester):
+    digester = any_digester
     digester()
     digest_ = DigestDTO.model_validate(json.loads(digester.redis_storage.client.get(1)))
     assert digest_.user_id == 1
@@ -35,3 +40,189 @@ def test_run(digester):
     assert digest_.user_id == 3
     assert len(digest_.posts) == 0
 
+
+
+def test_make_digests(any_digester):
+    digester = any_digester
+    digests = digester.make_digests([1, 2, 3], 5)
+    assert digests[1].user_id == 1
+    assert len(digests[1].posts) == 5
+    assert digests[2].user_id == 2
+    assert len(digests[2].posts) == 5
+    assert digests[3] is None
+    for user_id in (1, 2):
+        stored = digester.gateway.read_digest(digests[user_id].id)
+        assert stored.user_id == user_id
+        assert stored.timestamp == digests[user_id].timestamp
+        assert sorted(post.id for post in stored.posts) == sorted(
+            post.id for post in digests[user_id].posts
+        )
+
+
+def test_flow_many(any_digester):
+    digester = any_digester
+    digester.flow_many([2, 1, 2])
+    for user_id in (1, 2):
+        digest_ = DigestDTO.model_validate(json.loads(digester.redis_storage.client.get(user_id)))
+        assert digest_.user_id == user_id
+        assert len(digest_.posts) == 5
+
+
+def test_run_batched(any_digester):
+    digester = any_digester
+    digester.batch_size = 2
+    digester()
+    for user_id, posts in ((1, 5), (2, 5), (3, 0)):
+        digest_ = DigestDTO.model_validate(json.loads(digester.redis_storage.client.get(user_id)))
+        assert digest_.user_id == user_id
+        assert len(digest_.posts) == posts
+
+
+def test_run_acks_processed(any_digester):
+    digester = any_digester
+    digester()
+    assert digester.rabbit_reader.acked == [1, 2, 3]
+    assert digester.rabbit_reader.rejected == []
+
+
+def test_run_rejects_failed(digester, monkeypatch):
+    flow = digester.flow
+
+    def failing_flow(user_id):
+        if user_id == 2:
+            raise RuntimeError
+        flow(user_id)
+
+    monkeypatch.setattr(digester, 'flow', failing_flow)
+    digester()
+    assert digester.rabbit_reader.acked == [1, 3]
+    assert digester.rabbit_reader.rejected == [2]
+
+    digester.rabbit_reader.acked.clear()
+    digester.rabbit_reader.rejected.clear()
+    monkeypatch.setattr(digester, 'flow_many', lambda user_ids: failing_flow(2))
+    digester.batch_size = 3
+    digester()
+    assert digester.rabbit_reader.acked == [1, 3]
+    assert digester.rabbit_reader.rejected == [2]
+
+
+def test_run_threaded(digester):
+    ThreadPoolRunner(digester, 2)()
+    assert sorted(digester.rabbit_reader.acked) == [1, 2, 3]
+    for user_id, posts in ((1, 5), (2, 5), (3, 0)):
+        digest_ = DigestDTO.model_validate(json.loads(digester.redis_storage.client.get(user_id)))
+        assert digest_.user_id == user_id
+        assert len(digest_.posts) == posts
+    assert digester.stats.succeeded == 3
+
+
+def test_run_async_rejects_failed(async_digester):
+    async def failing_flow(user_id):
+        raise RuntimeError
+
+    async_digester.flow = failing_flow
+    async_digester()
+    assert async_digester.rabbit_reader.acked == []
+    assert async_digester.rabbit_reader.rejected == [1, 2, 3]
+    assert async_digester.stats.failed == 3
+
+
+def test_run_batched_rejects_unstored(digester, monkeypatch):
+    from redis.exceptions import ResponseError
+
+    monkeypatch.setattr(
+        digester.redis_storage,
+        'store_many',
+        lambda data: {2: ResponseError('OOM')},
+    )
+    digester.batch_size = 3
+    digester()
+    assert digester.rabbit_reader.acked == [1, 3]
+    assert digester.rabbit_reader.rejected == [2]
+    assert digester.stats.failed == 1
+
+
+def test_run_batched_copy(any_digester):
+    digester = any_digester
+    digester.batch_size = 3
+    digester.copy_threshold = 2
+    digester()
+    assert digester.rabbit_reader.acked == [1, 2, 3]
+    for user_id, posts in ((1, 5), (2, 5), (3, 0)):
+        digest_ = DigestDTO.model_validate(json.loads(digester.redis_storage.client.get(user_id)))
+        assert digest_.user_id == user_id
+        assert len(digest_.posts) == posts
+        if posts:
+            assert digester.gateway.read_digest(digest_.id).user_id == user_id
+
+
+def test_flow_dedupe(any_digester, refill_database):
+    from digest.adapters.storage import FINGERPRINTS_KEY
+
+    digester = any_digester
+    digester.redis_storage.client.delete(FINGERPRINTS_KEY)
+    digester.dedupe = True
+    first = digester.make_digest(1, 5)
+    second = digester.make_digest(1, 5)
+    assert second.id == first.id
+    assert second.timestamp >= first.timestamp
+    assert second.posts == first.posts
+    assert digester.stats.unchanged == 1
+
+    digests = digester.make_digests([1, 2], 5)
+    assert digests[1].id == first.id
+    assert digests[2].id != first.id
+    assert digester.stats.unchanged == 2
+
+
+def test_choose_posts_cached(any_digester, refill_database):
+    from digest.services.cache import TopPostsCache
+
+    digester = any_digester
+    expected = digester.choose_posts([1, 2, 3], 5)
+    digester.posts_cache = TopPostsCache(top_k=5)
+    assert digester.choose_posts([1, 2, 3], 5) == expected
+    assert digester.posts_cache.misses == 4
+    assert digester.choose_posts([1, 2, 3], 5) == expected
+    assert digester.posts_cache.hits == 4
+    digest_ = digester.make_digest(2, 5)
+    assert [post.id for post in digest_.posts] == expected[2]
+
+
+def test_choose_posts_incremental(any_digester, refill_database):
+    from digest.services.incremental import IncrementalState
+
+    digester = any_digester
+    expected = digester.choose_posts([1, 2, 3], 5)
+    digester.incremental = IncrementalState(check_every=2)
+    for _ in range(3):
+        assert digester.choose_posts([1, 2, 3], 5) == expected
+    assert digester.incremental.rebuilds == 3
+    assert digester.incremental.updates == 3
+    assert digester.incremental.checks == 3
+    assert digester.incremental.mismatches == 0
+    digest_ = digester.make_digest(2, 5)
+    assert [post.id for post in digest_.posts] == expected[2]
+
+
+def test_choose_posts_leaderboards(
+    any_digester, gateway, sessionmaker_, refill_database
+):
+    from sqlalchemy import text
+    from digest.services.filters import heap_at_least_one_subscription
+
+    digester = any_digester
+    digester.filter_function = heap_at_least_one_subscription
+    gateway.refresh_leaderboards()
+    with sessionmaker_() as s:
+        s.execute(text('update posts set rating = 100 where id = 1'))
+        s.commit()
+    assert 1 in digester.choose_posts([1], 5)[1]
+    # leaderboards keep ratings of last refresh
+    getattr(digester, '_digester', digester).gateway.leaderboards = True
+    assert 1 not in digester.choose_posts([1], 5)[1]
+    digest_ = digester.make_digest(1, 5)
+    assert 1 not in [post.id for post in digest_.posts]
+    gateway.refresh_leaderboards()
+    assert 1 in digester.choose_posts([1], 5)[1]
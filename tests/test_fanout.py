@@ -0,0 +1,89 @@
+import json
+from types import SimpleNamespace
+
+from digest.schemas import DigestDTO
+from digest.services.fanout import SubscriptionFanout
+
+
+def test_gateway_read_subscribers(gateway, refill_database):
+    assert gateway.read_subscribers([2, 3, 4]) == [2]
+    assert gateway.read_subscribers([1, 2, 5]) == [1, 2]
+    assert gateway.read_subscribers([]) == []
+
+
+def test_fanout_choose_posts(digester, refill_database):
+    fanout = SubscriptionFanout(digester, digester.rabbit_reader)
+    top = {}
+    assert fanout.choose_posts([1, 2, 3], top) == digester.choose_posts(
+        [1, 2, 3], 5
+    )
+    assert sorted(top) == [1, 2, 3, 4]
+
+
+def test_fanout_run(digester, refill_database):
+    digester.redis_storage.client.delete(1, 2)
+    rabbit_reader = digester.rabbit_reader
+    rabbit_reader.user_list = ['2', '3', '2', '5']
+    fanout = SubscriptionFanout(
+        digester, rabbit_reader, max_events=3, chunk_size=1
+    )
+    fanout()
+    assert rabbit_reader.acked == ['2', '3', '2', '5']
+    assert fanout.recomputed == 1
+    assert fanout.stats.succeeded == 4
+    assert digester.redis_storage.client.get(1) is None
+    digest_ = DigestDTO.model_validate(
+        json.loads(digester.redis_storage.client.get(2))
+    )
+    assert digest_.user_id == 2
+    assert len(digest_.posts) == 5
+
+
+def test_fanout_discards_malformed(fake_rabbit_reader):
+    class RecordingFanout(SubscriptionFanout):
+        def flow(self, subscription_ids):
+            self.flows.append(subscription_ids)
+            return {}
+
+    fake_rabbit_reader.user_list = ['2', 'abc', '1', '', '2']
+    fanout = RecordingFanout(SimpleNamespace(metrics=None), fake_rabbit_reader)
+    fanout.flows = []
+    fanout()
+    assert fanout.flows == [[1, 2]]
+    assert fake_rabbit_reader.discarded == ['abc', '']
+    assert fake_rabbit_reader.rejected == []
+    assert fake_rabbit_reader.acked == ['2', '1', '2']
+    assert fanout.stats.succeeded == 3
+    assert fanout.stats.failed == 2
+
+    fake_rabbit_reader.user_list = ['x']
+    fanout()
+    assert fanout.flows == [[1, 2]]
+    assert fake_rabbit_reader.discarded == ['abc', '', 'x']
+
+
+def test_fanout_retries_failed_users(fake_rabbit_reader):
+    class FailingFanout(SubscriptionFanout):
+        def recompute(self, user_ids, top):
+            self.recomputed_users.append(list(user_ids))
+            return {
+                user_id: RuntimeError('store failed')
+                for user_id in user_ids
+                if self.failures.get(user_id, 0) >= len(self.recomputed_users)
+            }
+
+    gateway = SimpleNamespace(read_subscribers=lambda _: [1, 2, 3])
+    digester = SimpleNamespace(gateway=gateway, metrics=None)
+    fake_rabbit_reader.user_list = ['1', '2']
+    fanout = FailingFanout(digester, fake_rabbit_reader, retries=2)
+    fanout.recomputed_users = []
+    fanout.failures = {2: 1}
+    fanout()
+    assert fanout.recomputed_users == [[1, 2, 3], [2]]
+    assert fake_rabbit_reader.acked == ['1', '2']
+
+    fanout.recomputed_users = []
+    fanout.failures = {3: 3}
+    fanout()
+    assert fanout.recomputed_users == [[1, 2, 3], [3], [3]]
+    assert fake_rabbit_reader.rejected == ['1', '2']
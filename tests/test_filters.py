@@ -1,6 +1,16 @@
 import logging
+import random
 
-from digest.services.filters import dummy_filter, at_least_one_subscription
+import pytest
+
+from digest.schemas import PostRank
+from digest.services.filters import (
+    at_least_one_subscription,
+    dummy_filter,
+    heap_at_least_one_subscription,
+    heap_dummy_filter,
+)
+from digest.services.selection import top_rated, top_rated_per_subscription
 
 
 def test_dummy_filter(gateway):
@@ -37,3 +47,30 @@ def test_at_least_one_subscription(gateway):
     filtered_dtos = list(filter(lambda x: x.id in filtered_posts, posts))
     assert len(filtered_posts) == 2
     assert filtered_dtos[0].subscription_id != filtered_dtos[1].subscription_id
+
+
+def random_posts(seed: int) -> list[PostRank]:
+    rnd = random.Random(seed)
+    subscriptions = rnd.randint(1, 8)
+    return [
+        PostRank(post_id, rnd.randint(1, subscriptions), rnd.randint(0, 5))
+        for post_id in rnd.sample(range(1, 1000), rnd.randint(0, 40))
+    ]
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_heap_dummy_filter(seed):
+    posts = random_posts(seed)
+    for limit in range(12):
+        expected = dummy_filter(*posts, limit=limit)
+        assert heap_dummy_filter(*posts, limit=limit) == expected
+        assert top_rated(iter(posts), limit) == expected
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_heap_at_least_one_subscription(seed):
+    posts = random_posts(seed)
+    for limit in range(12):
+        expected = at_least_one_subscription(*posts, limit=limit)
+        assert heap_at_least_one_subscription(*posts, limit=limit) == expected
+        assert top_rated_per_subscription(iter(posts), limit) == expected
@@ -0,0 +1,177 @@
+import random
+
+from digest.schemas import PostRank, UserPostRank
+from digest.services.filters import heap_at_least_one_subscription
+from digest.services.incremental import IncrementalState, merge_top
+
+
+class FakePosts:
+    def __init__(self, subscriptions):
+        self.subscriptions = subscriptions
+        self.posts = {}
+        self.last_id = 0
+
+    def insert(self, subscription_id, rating):
+        self.last_id += 1
+        self.posts[self.last_id] = PostRank(
+            self.last_id, subscription_id, rating
+        )
+
+    def top(self, subscription_ids, limit):
+        result = []
+        for subscription_id in sorted(subscription_ids):
+            posts = [
+                post
+                for post in self.posts.values()
+                if post.subscription_id == subscription_id
+            ]
+            posts.sort(key=lambda post: (-post.rating, post.id))
+            result.extend(posts[:limit])
+        return result
+
+    def above(self, watermarks):
+        return [
+            UserPostRank(user_id, *post)
+            for user_id, watermark in watermarks.items()
+            for post in self.posts.values()
+            if post.id > watermark
+            and post.subscription_id in self.subscriptions[user_id]
+        ]
+
+    def candidates(self, user_ids, limit, state):
+        subscriptions = {
+            user_id: self.subscriptions[user_id] for user_id in user_ids
+        }
+        plan = state.plan(subscriptions, limit)
+        return state.apply(
+            plan,
+            subscriptions,
+            limit,
+            self.last_id,
+            self.above(plan.watermarks),
+            self.top(plan.refetch, limit),
+        )
+
+
+def test_merge_top():
+    top = [PostRank(1, 1, 5), PostRank(2, 1, 3)]
+    added = [PostRank(3, 1, 4), PostRank(2, 1, 3), PostRank(4, 1, 5)]
+    assert merge_top(top, added, 3) == [
+        PostRank(1, 1, 5),
+        PostRank(4, 1, 5),
+        PostRank(3, 1, 4),
+    ]
+
+
+def test_incremental_matches_full_recompute():
+    rng = random.Random(7)
+    subscriptions = {
+        user_id: rng.sample(range(1, 11), rng.randint(0, 5))
+        for user_id in range(1, 21)
+    }
+    fake = FakePosts(subscriptions)
+    state = IncrementalState(check_every=0)
+    for _ in range(200):
+        fake.insert(rng.randint(1, 10), rng.randint(0, 20))
+    for _ in range(50):
+        for _ in range(rng.randint(0, 10)):
+            fake.insert(rng.randint(1, 10), rng.randint(0, 20))
+        if rng.random() < 0.3:
+            post = fake.posts.pop(rng.choice(list(fake.posts)))
+            state.invalidate(post.subscription_id)
+        if rng.random() < 0.3:
+            post_id = rng.choice(list(fake.posts))
+            post = fake.posts[post_id]._replace(rating=rng.randint(0, 20))
+            fake.posts[post_id] = post
+            state.invalidate(post.subscription_id)
+        if rng.random() < 0.2:
+            user_id = rng.randint(1, 20)
+            subscriptions[user_id] = rng.sample(range(1, 11), 3)
+        user_ids = rng.sample(range(1, 21), 5)
+        result = fake.candidates(user_ids, 3, state)
+        for user_id in user_ids:
+            expected = sorted(
+                fake.top(subscriptions[user_id], 3), key=lambda p: p.id
+            )
+            assert result[user_id] == expected
+            assert heap_at_least_one_subscription(
+                *result[user_id], limit=3
+            ) == heap_at_least_one_subscription(
+                *fake.above({user_id: 0}), limit=3
+            )
+    assert state.updates > 0
+    assert state.mismatches == 0
+
+
+def test_incremental_check_detects_missed_edit():
+    fake = FakePosts({1: [1]})
+    state = IncrementalState(check_every=1, margin=0)
+    for rating in (1, 2, 3):
+        fake.insert(1, rating)
+    fake.candidates([1], 2, state)
+    fake.posts[3] = fake.posts[3]._replace(rating=0)
+    result = fake.candidates([1], 2, state)
+    assert (state.checks, state.mismatches) == (1, 1)
+    assert result[1] == [PostRank(1, 1, 1), PostRank(2, 1, 2)]
+
+
+def test_incremental_edit_during_reads():
+    fake = FakePosts({1: [1]})
+    state = IncrementalState(check_every=0)
+    fake.insert(1, 1)
+    fake.candidates([1], 2, state)
+    plan = state.plan({1: [1]}, 2)
+    state.invalidate(1)
+    state.apply(plan, {1: [1]}, 2, fake.last_id, [], [])
+    assert state.plan({1: [1]}, 2).refetch == {1}
+
+
+def test_incremental_margin_catches_late_commits():
+    fake = FakePosts({1: [1]})
+    fake.insert(1, 1)
+    fake.insert(1, 2)
+    late = fake.posts.pop(1)
+    for margin, expected in ((1, [2]), (2, [1, 2])):
+        state = IncrementalState(check_every=0, margin=margin)
+        fake.posts.pop(1, None)
+        fake.candidates([1], 2, state)
+        fake.posts[1] = late
+        result = fake.candidates([1], 2, state)
+        assert [post.id for post in result[1]] == expected
+
+
+def test_incremental_suspended():
+    fake = FakePosts({1: [1]})
+    state = IncrementalState()
+    state.suspend()
+    fake.insert(1, 1)
+    fake.candidates([1], 2, state)
+    assert state.plan({1: [1]}, 2).known == {}
+    state.resume()
+    fake.candidates([1], 2, state)
+    assert 1 in state.plan({1: [1]}, 2).known
+
+
+def test_incremental_prunes_edits():
+    fake = FakePosts({1: [1]})
+    state = IncrementalState(check_every=0, max_edited=4)
+    fake.insert(1, 1)
+    fake.candidates([1], 2, state)
+    state.invalidate(10)
+    plan = state.plan({1: [1]}, 2)
+    state.invalidate(11)
+    state.invalidate(12)
+    fake.candidates([1], 2, state)
+    state.invalidate(13)
+    state.invalidate(14)
+    assert set(state._edited) == {13, 14}
+    # candidates planned before pruned edits are not remembered
+    state.apply(plan, {1: [1]}, 2, fake.last_id, [], [])
+    assert state.plan({1: [1]}, 2).known[1].generation == 3
+    state.invalidate(1)
+    assert state.plan({1: [1]}, 2).refetch == {1}
+
+    for subscription_id in range(20, 25):
+        state.invalidate(subscription_id)
+    assert len(state._edited) <= 4
+    assert state.plan({1: [1]}, 2).known == {}
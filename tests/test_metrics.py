@@ -0,0 +1,96 @@
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from digest.adapters.rabbit import Delivery
+from digest.schemas import UserPostRank
+from digest.services.digester import Digester
+from digest.services.filters import dummy_filter
+from digest.services.metrics import Histogram, Metrics, MetricsServer, Rate
+from digest.services.stats import FlowStats
+
+
+def test_histogram_samples():
+    histogram = Histogram((1, 5))
+    for value in (0, 1, 3, 7):
+        histogram.observe(value)
+    assert histogram.samples('size', 'stage="read"') == [
+        'size_bucket{stage="read",le="1"} 2',
+        'size_bucket{stage="read",le="5"} 3',
+        'size_bucket{stage="read",le="+Inf"} 4',
+        'size_sum{stage="read"} 11.0',
+        'size_count{stage="read"} 4',
+    ]
+    assert histogram.samples('size')[-1] == 'size_count 4'
+
+
+def test_rate():
+    counter = [0]
+    rate = Rate(lambda: counter[0])
+    time.sleep(0.05)
+    counter[0] = 10
+    assert 0 < rate() <= 200
+    assert rate() == 0
+
+
+def test_metrics_render():
+    metrics = Metrics()
+    stats = FlowStats()
+    stats.record(0.01, count=3)
+    metrics.register_stats(stats)
+    metrics.register('digest_queue_backlog', 'gauge', 'Backlog.', lambda: 7)
+    metrics.register('digest_unknown', 'gauge', 'Unknown.', lambda: None)
+    with metrics.time('read'):
+        pass
+    with pytest.raises(ValueError), metrics.time('store'):
+        raise ValueError
+    metrics.observe_batch(3)
+    metrics.observe_posts([0, 4])
+    metrics.observe_lag([-1.0, 2.0])
+    text = metrics.render()
+    assert 'digest_messages_succeeded_total 3' in text
+    assert 'digest_queue_backlog 7' in text
+    assert 'digest_unknown' not in text
+    assert 'digest_stage_seconds_count{stage="read"} 1' in text
+    assert 'digest_stage_seconds_count{stage="store"} 1' in text
+    assert 'digest_batch_size_count 1' in text
+    assert 'digest_user_posts_bucket{le="0"} 1' in text
+    assert 'digest_consumer_lag_seconds_sum 2.0' in text
+
+
+def test_metrics_server():
+    metrics = Metrics()
+    metrics.observe('message', 0.01)
+    server = MetricsServer(metrics, '127.0.0.1', 0)
+    server.start()
+    try:
+        url = f'http://127.0.0.1:{server.port}'
+        with urllib.request.urlopen(f'{url}/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            body = response.read().decode()
+        assert 'digest_stage_seconds_count{stage="message"} 1' in body
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f'{url}/other')
+    finally:
+        server.stop()
+
+
+def test_digester_observes(fake_rabbit_reader):
+    metrics = Metrics()
+    digester = Digester(
+        None, fake_rabbit_reader, None, dummy_filter, metrics=metrics
+    )
+    digester.observe_received(
+        [Delivery('1', 1, published=time.time() - 10), Delivery('2', 2)]
+    )
+    digester.observe_posts(
+        [UserPostRank(1, 1, 1, 0), UserPostRank(1, 2, 1, 0)], [1, 2]
+    )
+    with digester.timed('filter'):
+        pass
+    text = metrics.render()
+    assert 'digest_consumer_lag_seconds_count 1' in text
+    assert 'digest_user_posts_sum 2.0' in text
+    assert 'digest_stage_seconds_count{stage="filter"} 1' in text
@@ -0,0 +1,327 @@
+import random
+import time
+
+import pytest
+
+from digest.schemas import PostRank, UserPostRank
+from digest.services.filters import heap_at_least_one_subscription
+
+pytest.importorskip('numpy')
+
+from digest.adapters.post_store import (  # noqa: E402
+    PostStore,
+    StoreGateway,
+    read_snapshot,
+    rows_array,
+    write_snapshot,
+)
+
+
+def make_data(seed=0, posts=400, subscriptions=20, users=30):
+    rnd = random.Random(seed)
+    post_rows = [
+        (post_id, rnd.randrange(subscriptions), rnd.randrange(10))
+        for post_id in range(1, posts + 1)
+    ]
+    subscription_rows = sorted(
+        {
+            (user_id, rnd.randrange(subscriptions + 5))
+            for user_id in range(users)
+            for _ in range(rnd.randrange(6))
+        }
+    )
+    return post_rows, subscription_rows
+
+
+def make_store(post_rows, subscription_rows, **kwargs):
+    store = PostStore(None, **kwargs)
+    store.install(
+        rows_array(post_rows, 3),
+        rows_array(subscription_rows, 2),
+        max(row[0] for row in post_rows),
+    )
+    return store
+
+
+def user_posts(post_rows, subscription_rows, user_id):
+    subscriptions = {sid for uid, sid in subscription_rows if uid == user_id}
+    return [
+        PostRank(*row) for row in sorted(post_rows) if row[1] in subscriptions
+    ]
+
+
+def candidates(posts, limit, per_subscription=True):
+    """Select the same posts as candidate_posts_stmt."""
+    order = sorted(posts, key=lambda post: (-post.rating, post.id))
+    top = []
+    for subscription_id in {post.subscription_id for post in posts}:
+        top.extend(
+            [
+                post
+                for post in order
+                if post.subscription_id == subscription_id
+            ][:limit]
+        )
+    top.sort(key=lambda post: (-post.rating, post.id))
+    chosen = set(top[:limit])
+    if per_subscription:
+        leaders, seen = [], set()
+        for post in top:
+            if post.subscription_id not in seen:
+                seen.add(post.subscription_id)
+                leaders.append(post)
+        chosen.update(leaders[:limit])
+    return sorted(chosen)
+
+
+def test_store_reads():
+    post_rows, subscription_rows = make_data()
+    store = make_store(post_rows, subscription_rows)
+    assert store.size == len(post_rows)
+    assert store.watermark == len(post_rows)
+    for user_id in range(32):
+        posts = user_posts(post_rows, subscription_rows, user_id)
+        assert store.post_ranks(user_id) == posts
+        assert store.post_ranks(user_id, 200) == [
+            post for post in posts if post.id > 200
+        ]
+        for limit in (1, 5):
+            for per_subscription in (True, False):
+                assert store.candidate_ranks(
+                    user_id, limit, per_subscription
+                ) == candidates(posts, limit, per_subscription)
+
+
+def test_store_top_posts_and_subscribers():
+    post_rows, subscription_rows = make_data()
+    store = make_store(post_rows, subscription_rows)
+    top = store.top_posts([4, 2, 4, 99], 3)
+    assert [post.subscription_id for post in top] == [2, 2, 2, 4, 4, 4]
+    for subscription_id in (2, 4):
+        expected = sorted(
+            (row for row in post_rows if row[1] == subscription_id),
+            key=lambda row: (-row[2], row[0]),
+        )[:3]
+        assert [
+            tuple(post)
+            for post in top
+            if post.subscription_id == subscription_id
+        ] == expected
+    assert store.subscribers([2, 4]) == sorted(
+        {uid for uid, sid in subscription_rows if sid in (2, 4)}
+    )
+    assert store.subscribers([]) == []
+
+
+def test_store_apply_changes():
+    post_rows, subscription_rows = make_data()
+    store = make_store(post_rows, subscription_rows, compact_ratio=10)
+    added = [(401, 3, 7), (402, 21, 1), (403, 3, 9)]
+    edited = [(row[0], 5, 100) for row in post_rows if row[1] == 5][1:]
+    store.apply(rows_array(added, 3), [5], rows_array(edited, 3), 403)
+    changed = [row for row in post_rows if row[1] != 5] + edited + added
+    assert set(store.state.overrides) == {3, 5, 21}
+    assert store.size == len(changed)
+    assert store.watermark == 403
+    for user_id in range(32):
+        posts = user_posts(changed, subscription_rows, user_id)
+        assert store.post_ranks(user_id) == posts
+        assert store.candidate_ranks(user_id, 3) == candidates(posts, 3)
+
+    store.compact_ratio = 0
+    store.apply(rows_array([], 3), [], rows_array([], 3), 403)
+    assert store.state.overrides == {}
+    assert store.size == len(changed)
+    for user_id in range(32):
+        posts = user_posts(changed, subscription_rows, user_id)
+        assert store.post_ranks(user_id) == posts
+
+
+def test_store_apply_skips_known_posts():
+    post_rows, subscription_rows = make_data()
+    store = make_store(post_rows, subscription_rows, compact_ratio=10)
+    reread = [row for row in post_rows if row[0] > 390]
+    store.apply(
+        rows_array([*reread, (401, 3, 7)], 3), [], rows_array([], 3), 401
+    )
+    assert store.size == len(post_rows) + 1
+    changed = [*post_rows, (401, 3, 7)]
+    for user_id in range(32):
+        posts = user_posts(changed, subscription_rows, user_id)
+        assert store.post_ranks(user_id) == posts
+
+
+def test_store_apply_subscriptions():
+    post_rows, subscription_rows = make_data()
+    store = make_store(post_rows, subscription_rows, compact_ratio=10)
+    changed = {1: [2, 4], 2: [], 1000: [4, 99]}
+    rows = [(uid, sid) for uid, sids in changed.items() for sid in sids]
+    empty = rows_array([], 3)
+    store.apply(empty, [], empty, 400, changed, rows_array(rows, 2))
+    subscription_rows = [
+        row for row in subscription_rows if row[0] not in changed
+    ] + rows
+    assert set(store.state.user_overrides) == {1, 2, 1000}
+    for user_id in (*range(32), 1000):
+        posts = user_posts(post_rows, subscription_rows, user_id)
+        assert store.post_ranks(user_id) == posts
+    for subscription_ids in ([4], [2, 99], [2, 3, 4, 5]):
+        assert store.subscribers(subscription_ids) == sorted(
+            {uid for uid, sid in subscription_rows if sid in subscription_ids}
+        )
+
+    store.compact_ratio = 0
+    store.apply(empty, [], empty, 400)
+    assert store.state.user_overrides == {}
+    assert store.subscribers([4]) == sorted(
+        {uid for uid, sid in subscription_rows if sid == 4}
+    )
+    assert store.user_subscriptions(1000).tolist() == [4, 99]
+    assert store.user_subscriptions(2).tolist() == []
+
+
+def test_changed_users():
+    store = make_store([(1, 1, 1)], [(1, 1)], reload_interval=0)
+    users = store.users
+    users.invalidate('3')
+    users.invalidate(5)
+    assert users.take() == {3, 5}
+    assert users.take() == set()
+    users.restore([7])
+    assert users.take() == {7}
+    users.suspend()
+    users.resume()
+    assert not store.reload_due()
+    users.suspend()
+    users.resume()
+    assert store.reload_due()
+
+
+def test_store_reload_due():
+    store = PostStore(None, reload_interval=0)
+    assert not store.ready
+    assert store.reload_due()
+    store.install(rows_array([(1, 1, 1)], 3), rows_array([(1, 1)], 2), 1)
+    assert not store.reload_due()
+    store.suspend()
+    store.resume()
+    assert not store.reload_due()
+    store.suspend()
+    store.resume()
+    assert store.reload_due()
+
+    store = make_store([(1, 1, 1)], [(1, 1)], reload_interval=0)
+    store.clear()
+    assert store.reload_due()
+
+
+def test_store_gateway():
+    post_rows, subscription_rows = make_data()
+    store = make_store(post_rows, subscription_rows)
+    gateway = StoreGateway(None, store)
+    for user_id in (0, 1, 2):
+        posts = user_posts(post_rows, subscription_rows, user_id)
+        assert gateway.read_post_ranks_for_user(user_id) == posts
+        assert gateway.read_candidate_ranks_for_user(user_id, 5) == candidates(
+            posts, 5
+        )
+    ranks = gateway.read_post_ranks_for_users([2, 1])
+    assert ranks == [
+        UserPostRank(user_id, *post)
+        for user_id in (1, 2)
+        for post in user_posts(post_rows, subscription_rows, user_id)
+    ]
+    assert gateway.read_candidate_ranks_for_users([2, 1], 3, False) == [
+        UserPostRank(user_id, *post)
+        for user_id in (1, 2)
+        for post in candidates(
+            user_posts(post_rows, subscription_rows, user_id), 3, False
+        )
+    ]
+    assert gateway.read_post_ranks_above({1: 300}) == [
+        rank for rank in ranks if rank.user_id == 1 and rank.id > 300
+    ]
+    assert gateway.read_subscriptions_for_users([1, 1000]) == {
+        1: [sid for uid, sid in subscription_rows if uid == 1],
+        1000: [],
+    }
+    assert gateway.read_last_post_id() == len(post_rows)
+    posts = user_posts(post_rows, subscription_rows, 1)
+    assert heap_at_least_one_subscription(
+        *gateway.read_candidate_ranks_for_user(1, 5), limit=5
+    ) == heap_at_least_one_subscription(*posts, limit=5)
+
+
+def test_snapshot_roundtrip(tmp_path):
+    post_rows, subscription_rows = make_data()
+    store = make_store(post_rows, subscription_rows)
+    path = str(tmp_path / 'store' / 'posts.snapshot')
+    write_snapshot(path, store.state, 123.5)
+    state, loaded_at = read_snapshot(path)
+    assert loaded_at == 123.5
+    assert state.watermark == store.watermark
+    for mapped, column in zip(state.columns, store.state.columns):
+        assert mapped.tolist() == column.tolist()
+        assert not mapped.flags.writeable
+    assert list(tmp_path.glob('store/*.tmp')) == []
+
+
+def test_snapshot_invalid(tmp_path):
+    path = tmp_path / 'posts.snapshot'
+    path.write_bytes(b'DGPS\x09' + bytes(100))
+    with pytest.raises(ValueError):
+        read_snapshot(str(path))
+    store = PostStore(None, snapshot_path=str(path))
+    assert not store.load_snapshot()
+    store.snapshot_path = str(tmp_path / 'missing')
+    assert not store.load_snapshot()
+    assert not store.ready
+
+
+def test_store_snapshots(tmp_path):
+    post_rows, subscription_rows = make_data()
+    path = str(tmp_path / 'posts.snapshot')
+    store = make_store(
+        post_rows,
+        subscription_rows,
+        snapshot_path=path,
+        snapshot_interval=1e-6,
+        compact_ratio=10,
+    )
+    store.apply(rows_array([(401, 3, 7)], 3), [], rows_array([], 3), 401)
+    assert store.snapshot_due()
+    store.save_snapshot()
+    assert store.state.overrides == {}
+    assert not store.state.columns.post_ids.flags.writeable
+    assert not store.snapshot_due()
+
+    started = PostStore(None, snapshot_path=path)
+    assert started.load_snapshot()
+    assert started.watermark == 401
+    assert started.loaded_at == store.loaded_at
+    assert not started.reload_due()
+    assert not started.snapshot_due()
+    changed = [*post_rows, (401, 3, 7)]
+    for user_id in range(32):
+        posts = user_posts(changed, subscription_rows, user_id)
+        assert started.post_ranks(user_id) == posts
+        assert started.candidate_ranks(user_id, 3) == candidates(posts, 3)
+    started.apply(rows_array([(402, 3, 50)], 3), [], rows_array([], 3), 402)
+    assert started.post_ranks(99) == []
+    assert started.top_posts([3], 1) == [PostRank(402, 3, 50)]
+
+
+def test_snapshot_start_reload_schedule(tmp_path, monkeypatch):
+    post_rows, subscription_rows = make_data()
+    store = make_store(post_rows, subscription_rows)
+    path = str(tmp_path / 'posts.snapshot')
+    write_snapshot(path, store.state, 0.0)
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now)
+    started = PostStore(None, reload_interval=100, snapshot_path=path)
+    assert started.load_snapshot()
+    assert not started.reload_due()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 74)
+    assert not started.reload_due()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 126)
+    assert started.reload_due()
@@ -0,0 +1,96 @@
+import json
+import pstats
+import time
+
+from digest.adapters.rabbit import Delivery
+from digest.services.digester import Digester
+from digest.services.filters import dummy_filter
+from digest.services.profiling import Profiler
+
+
+class SleepyDigester(Digester):
+    def flow(self, user_id):
+        with self.timed('read'):
+            time.sleep(0.02 if int(user_id) == 7 else 0)
+        self.record_posts([3])
+
+
+def reports(directory):
+    return [
+        json.loads(path.read_text())
+        for path in sorted(directory.glob('*.json'))
+    ]
+
+
+def test_profiler_disabled(tmp_path):
+    profiler = Profiler(str(tmp_path), every=1)
+    with profiler.message([1]):
+        pass
+    assert reports(tmp_path) == []
+    profiler.toggle()
+    with profiler.message([1]):
+        pass
+    assert [report['reason'] for report in reports(tmp_path)] == ['sampled']
+    profiler.toggle()
+    assert not profiler.enabled
+
+
+def test_profiler_sampled(tmp_path):
+    profiler = Profiler(str(tmp_path), every=2, enabled=True)
+    for user_id in range(1, 5):
+        with profiler.message([user_id, 10]):
+            profiler.record_stage('read', 0.5)
+            profiler.record_stage('read', 0.25)
+            profiler.record_posts(4)
+    found = reports(tmp_path)
+    assert [report['user_ids'] for report in found] == [[2, 10], [4, 10]]
+    assert found[0]['stages'] == {'read': 0.75}
+    assert found[0]['posts'] == 4
+    stats = pstats.Stats(str(tmp_path / found[0]['profile']))
+    assert stats.total_calls > 0
+    assert 'user-2-and-1' in found[0]['profile']
+
+
+def test_profiler_slow(tmp_path):
+    profiler = Profiler(
+        str(tmp_path), every=0, slow_threshold=0.01, enabled=True
+    )
+    with profiler.message([1]):
+        time.sleep(0.02)
+    with profiler.message([2]):
+        pass
+    with profiler.message([1]):
+        pass
+    found = reports(tmp_path)
+    assert [(r['user_ids'], r['reason']) for r in found] == [
+        ([1], 'slow'),
+        ([1], 'slow user'),
+    ]
+    assert found[0]['profile'] is None
+    assert found[1]['profile'] is not None
+
+
+def test_profiler_rotates(tmp_path):
+    profiler = Profiler(str(tmp_path), every=1, keep=3, enabled=True)
+    for user_id in range(10):
+        with profiler.message([user_id]):
+            pass
+    assert len(list(tmp_path.glob('*.json'))) == 3
+    assert len(list(tmp_path.glob('*.prof'))) == 3
+    assert [r['user_ids'] for r in reports(tmp_path)] == [[7], [8], [9]]
+
+
+def test_digester_profiled(tmp_path, fake_rabbit_reader):
+    profiler = Profiler(
+        str(tmp_path), every=0, slow_threshold=0.01, enabled=True
+    )
+    digester = SleepyDigester(
+        None, fake_rabbit_reader, None, dummy_filter, profiler=profiler
+    )
+    assert digester.process(Delivery('1', 1))
+    assert digester.process(Delivery('7', 2))
+    [report] = reports(tmp_path)
+    assert report['user_ids'] == [7]
+    assert report['posts'] == 3
+    assert set(report['stages']) == {'read', 'message'}
+    assert report['stages']['read'] >= 0.02
@@ -0,0 +1,156 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pika
+import pytest
+
+from digest.adapters.rabbit import ATTEMPTS_HEADER, Delivery, RabbitReader
+
+
+class FakeChannel:
+    def __init__(self):
+        self.calls = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.calls.append(('ack', delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        self.calls.append(('nack', delivery_tag, requeue))
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.calls.append(
+            ('publish', body, properties.headers[ATTEMPTS_HEADER])
+        )
+        self.published = properties
+
+
+def make_reader(deliveries, **kwargs):
+    reader = RabbitReader('queue', **kwargs)
+    reader._unsettled.extend(
+        delivery.delivery_tag for delivery in deliveries
+    )
+    return reader
+
+
+def test_acks_processed_prefix_at_once():
+    deliveries = [Delivery(str(tag), tag) for tag in range(1, 6)]
+    reader = make_reader(deliveries, ack_batch_size=2, ack_interval=60)
+    channel = FakeChannel()
+
+    reader.ack(deliveries[0])
+    reader._flush(channel)
+    assert channel.calls == []
+
+    reader.ack(deliveries[2])
+    reader.ack(deliveries[3])
+    reader._flush(channel)
+    assert channel.calls == []
+
+    reader.ack(deliveries[1])
+    reader._flush(channel)
+    assert channel.calls == [('ack', 4, True)]
+
+    reader._flush(channel, force=True)
+    assert channel.calls == [('ack', 4, True)]
+    reader.ack(deliveries[4])
+    reader._flush(channel, force=True)
+    assert channel.calls == [('ack', 4, True), ('ack', 5, True)]
+
+
+def test_rejected_are_republished_then_dropped():
+    deliveries = [
+        Delivery('1', 1, 0, b'1'),
+        Delivery('2', 2, 3, b'2'),
+        Delivery('3', 3),
+    ]
+    reader = make_reader(deliveries, max_redeliveries=3, ack_interval=60)
+    channel = FakeChannel()
+
+    reader.reject(deliveries[0])
+    reader.reject(deliveries[1])
+    reader.ack(deliveries[2])
+    reader._flush(channel)
+    assert channel.calls == [
+        ('publish', b'1', 1),
+        ('nack', 2, False),
+        ('ack', 3, True),
+    ]
+
+
+def test_republished_keep_properties():
+    properties = pika.BasicProperties(
+        content_type='text/plain',
+        delivery_mode=2,
+        message_id='m1',
+        timestamp=100,
+        user_id='publisher',
+        headers={'trace': 'abc', ATTEMPTS_HEADER: 1},
+    )
+    delivery = Delivery('1', 1, 1, b'1', 100, properties)
+    reader = make_reader([delivery], max_redeliveries=3)
+    channel = FakeChannel()
+
+    reader.reject(delivery)
+    reader._flush(channel)
+    assert channel.calls == [('publish', b'1', 2), ('ack', 1, True)]
+    published = channel.published
+    assert published.content_type == 'text/plain'
+    assert published.delivery_mode == 2
+    assert published.message_id == 'm1'
+    assert published.timestamp == 100
+    assert published.user_id is None
+    assert published.headers == {'trace': 'abc', ATTEMPTS_HEADER: 2}
+    assert properties.headers[ATTEMPTS_HEADER] == 1
+
+
+def test_async_republished_keep_properties():
+    pytest.importorskip('aio_pika')
+    from digest.adapters.async_rabbit import AsyncRabbitReader
+
+    message = SimpleNamespace(
+        body=b'1',
+        headers={'trace': 'abc'},
+        content_type='text/plain',
+        content_encoding=None,
+        delivery_mode=2,
+        priority=None,
+        correlation_id=None,
+        reply_to=None,
+        expiration=None,
+        message_id='m1',
+        timestamp=datetime(2026, 1, 1, tzinfo=timezone.utc),
+        type=None,
+        app_id='app',
+    )
+    republished = AsyncRabbitReader._retry_message(
+        message, {ATTEMPTS_HEADER: 1}
+    )
+    assert republished.headers == {'trace': 'abc', ATTEMPTS_HEADER: 1}
+    assert republished.delivery_mode == 2
+    assert republished.message_id == 'm1'
+    assert republished.timestamp == message.timestamp
+    assert republished.app_id == 'app'
+
+
+def test_discarded_are_dropped_at_once():
+    deliveries = [Delivery('abc', 1, 0, b'abc'), Delivery('1', 2)]
+    reader = make_reader(deliveries, max_redeliveries=3, ack_interval=60)
+    channel = FakeChannel()
+
+    reader.discard(deliveries[0])
+    reader._flush(channel)
+    assert channel.calls == [('nack', 1, False)]
+    reader.ack(deliveries[1])
+    reader._flush(channel, force=True)
+    assert channel.calls == [('nack', 1, False), ('ack', 2, True)]
+
+
+def test_async_reader_fails_on_lost_connection():
+    pytest.importorskip('aio_pika')
+    from digest.adapters.async_rabbit import AsyncRabbitReader
+
+    reader = AsyncRabbitReader('queue')
+    connection = SimpleNamespace(is_closed=True)
+    with pytest.raises(ConnectionError):
+        asyncio.run(reader._receive(connection, None, None, {}, 0))
@@ -1,3 +1,18 @@
+import threading
+
+import pytest
+from redis.exceptions import ResponseError
+
+from digest.adapters.storage import (
+    BufferedWriter,
+    failed_keys,
+    fingerprint,
+    format_fingerprints,
+    parse_fingerprints,
+    write_chunks,
+)
+
+
 def test_redis_store_and_update(redis_client):
     redis_client.client.delete('1')
     assert redis_client.client.get('1') is None
@@ -5,3 +20,221 @@ def test_redis_store_and_update(redis_client):
     assert redis_client.client.get('1') == 'data'
     redis_client.store('1', 'new data')
     assert redis_client.client.get('1') == 'new data'
+
+@pytest.mark.parametrize('mset', [False, True])
+def test_redis_store_many(redis_client, mset):
+    data = {user_id: f'data {user_id}' for user_id in range(1, 6)}
+    assert redis_client.store_many(data, chunk_size=2, mset=mset) == {}
+    for user_id, value in data.items():
+        assert redis_client.client.get(str(user_id)) == value
+
+
+def test_write_chunks():
+    data = {1: 'a', 2: 'b', 3: 'c'}
+    assert write_chunks(data, 2) == [[(1, 'a'), (2, 'b')], [(3, 'c')]]
+    assert write_chunks(data, 1) == [[(1, 'a')], [(2, 'b')], [(3, 'c')]]
+    assert write_chunks({}, 2) == []
+
+
+def test_failed_keys():
+    error = ResponseError('OOM')
+    chunks = [[(1, 'a'), (2, 'b')], [(3, 'c')]]
+    assert failed_keys(chunks, [True, True]) == {}
+    assert failed_keys(chunks, [error, True]) == {1: error, 2: error}
+
+
+class FakeStorage:
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.calls = []
+
+    def store_many(self, data, mset=False):
+        self.calls.append(dict(data))
+        return {
+            user_id: ResponseError('OOM')
+            for user_id in data
+            if user_id in self.failing
+        }
+
+
+def test_buffered_writer_flushes_by_size():
+    storage = FakeStorage(failing={2})
+    writer = BufferedWriter(storage, max_size=3, max_delay=60)
+    futures = [writer.write(user_id, 'data') for user_id in (1, 2)]
+    assert storage.calls == []
+    futures.append(writer.write(3, 'data'))
+    assert storage.calls == [{1: 'data', 2: 'data', 3: 'data'}]
+    assert futures[0].result() is None
+    assert futures[2].result() is None
+    with pytest.raises(ResponseError):
+        futures[1].result()
+
+
+def test_buffered_writer_flushes_by_time():
+    storage = FakeStorage()
+    writer = BufferedWriter(storage, max_size=100, max_delay=0.01)
+    future = writer.write(1, 'old')
+    writer.write(1, 'new')
+    assert future.result(timeout=1) is None
+    assert storage.calls == [{1: 'new'}]
+    writer.close()
+    assert writer.flushes == 1
+
+
+def test_buffered_writer_threads():
+    storage = FakeStorage()
+    writer = BufferedWriter(storage, max_size=10, max_delay=0.01)
+    threads = [
+        threading.Thread(target=lambda i=i: writer.write(i, 'data').result())
+        for i in range(50)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(k for call in storage.calls for k in call) == list(range(50))
+    assert writer.flushes < 50
+
+
+def test_redis_load_any_codec(settings):
+    pytest.importorskip('msgpack')
+    from digest.adapters.codecs import MsgpackCodec
+    from digest.adapters.storage import RedisStorage
+    from digest.schemas import DigestDTO
+
+    digest_ = DigestDTO(
+        id=1, user_id=1, timestamp='2023-07-20T12:30:00', posts=[]
+    )
+    for codec in (None, MsgpackCodec(threshold=0)):
+        storage = RedisStorage(settings.redis_url, codec)
+        storage.store(1, storage.encode(digest_))
+        assert storage.load(1) == digest_
+
+
+def make_normalized_digest(user_id, post_ids):
+    from digest.schemas import DigestDTO, PostDTO
+
+    return DigestDTO(
+        id=user_id,
+        user_id=user_id,
+        timestamp='2023-07-20T12:30:00',
+        posts=[
+            PostDTO(id=i, subscription_id=1, content=f'post {i}', rating=i)
+            for i in post_ids
+        ],
+    )
+
+
+def test_normalized_layout_writes_posts_once():
+    from digest.adapters.storage import NormalizedRedisStorage
+
+    storage = NormalizedRedisStorage('redis://localhost')
+    data = {
+        1: storage.encode(make_normalized_digest(1, [3, 2])),
+        2: storage.encode(make_normalized_digest(2, [2, 4])),
+    }
+    writes = storage._writes(data)
+    assert [sorted(posts) for _, posts, _ in writes] == [[2, 3], [4]]
+    assert writes[1][2] == [data[2].digest, 4, data[2].posts[4]]
+    assert storage._failed(writes, [[], []]) == ({}, [])
+
+    data[3] = storage.encode(make_normalized_digest(3, [4, 5]))
+    writes = storage._writes(data)
+    assert [list(posts) for _, posts, _ in writes] == [[], [], [5]]
+
+    error = ResponseError('OOM')
+    assert storage._failed(writes, [[], error, []]) == ({2: error}, [])
+    assert 5 in storage._known_posts
+
+
+def test_normalized_layout_missing_posts():
+    from digest.adapters.storage import NormalizedRedisStorage
+
+    storage = NormalizedRedisStorage('redis://localhost')
+    data = {
+        1: storage.encode(make_normalized_digest(1, [3, 2])),
+        2: storage.encode(make_normalized_digest(2, [2, 4])),
+    }
+    storage._failed(storage._writes(data), [[], []])
+    writes = storage._writes(data)
+    assert [posts for _, posts, _ in writes] == [{}, {}]
+    assert storage._failed(writes, [['3', '2'], []]) == ({}, [1])
+    assert storage._known_posts == {}
+    assert storage.rewrites == 1
+    writes = storage._writes({1: data[1]}, resend=True)
+    assert sorted(writes[0][1]) == [2, 3]
+
+
+def test_normalized_layout_assemble():
+    from digest.adapters.storage import NormalizedRedisStorage
+
+    storage = NormalizedRedisStorage('redis://localhost')
+    digest_ = make_normalized_digest(1, [3, 2])
+    payload = storage.encode(digest_)
+    reply = [payload.digest, payload.posts[3], payload.posts[2]]
+    assert storage.assemble(reply) == digest_
+    assert storage.assemble([payload.digest, None, payload.posts[2]]).posts == (
+        digest_.posts[1:]
+    )
+    assert storage.assemble(None) is None
+
+
+def test_normalized_redis_store_and_load(settings):
+    from digest.adapters.storage import NormalizedRedisStorage
+
+    storage = NormalizedRedisStorage(settings.redis_url)
+    storage.client.delete(storage.POSTS_KEY)
+    digests = {
+        1: make_normalized_digest(1, [3, 2]),
+        2: make_normalized_digest(2, [2, 4]),
+        3: make_normalized_digest(3, []),
+    }
+    assert storage.store_many(
+        {user_id: storage.encode(d) for user_id, d in digests.items()}
+    ) == {}
+    assert sorted(storage.client.hkeys(storage.POSTS_KEY)) == [
+        '2',
+        '3',
+        '4',
+        'refs:2',
+        'refs:3',
+        'refs:4',
+    ]
+    for user_id, digest_ in digests.items():
+        assert storage.load(user_id) == digest_
+
+
+def test_normalized_redis_collects_posts(settings):
+    from digest.adapters.storage import NormalizedRedisStorage
+
+    storage = NormalizedRedisStorage(settings.redis_url)
+    storage.client.delete(storage.POSTS_KEY, 1, 2)
+    first = make_normalized_digest(1, [3, 2])
+    assert storage.store_many({1: storage.encode(first)}) == {}
+    storage.store(2, storage.encode(make_normalized_digest(2, [2])))
+    storage.store(1, storage.encode(make_normalized_digest(1, [4])))
+    assert storage.client.hget(storage.POSTS_KEY, '3') is None
+    assert storage.client.hget(storage.POSTS_KEY, 'refs:2') == '1'
+
+    storage.client.delete(storage.POSTS_KEY)
+    assert storage.store_many({1: storage.encode(first)}) == {}
+    assert storage.rewrites == 1
+    assert storage.load(1) == first
+
+
+def test_fingerprints():
+    assert fingerprint([1, 2, 3]) == fingerprint([1, 2, 3])
+    assert fingerprint([1, 2, 3]) != fingerprint([3, 2, 1])
+    assert fingerprint([1, 23]) != fingerprint([12, 3])
+    assert len(fingerprint([])) == 16
+    values = format_fingerprints({1: ('abc', 10)})
+    assert values == {1: 'abc:10'}
+    assert parse_fingerprints([1, 2], [values[1], None]) == {1: ('abc', 10)}
+
+
+def test_redis_fingerprints(redis_client):
+    from digest.adapters.storage import FINGERPRINTS_KEY
+
+    redis_client.client.delete(FINGERPRINTS_KEY)
+    redis_client.store_fingerprints({1: ('abc', 10), 2: ('def', 11)})
+    assert redis_client.read_fingerprints([2, 3]) == {2: ('def', 11)}
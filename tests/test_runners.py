@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import pytest
+
+from digest.adapters.rabbit import Delivery, RabbitReader
+from digest.services.filters import dummy_filter
+from digest.services.runners import ProcessSupervisor, ThreadPoolRunner
+from digest.services.stats import FlowStats
+
+
+class CountingWorker:
+    def __init__(self, crash_marker=None):
+        self.stats = FlowStats()
+        self.stopping = threading.Event()
+        self.crash_marker = crash_marker
+
+    def stop(self):
+        self.stopping.set()
+
+    def __call__(self):
+        while not self.stopping.wait(0.01):
+            self.stats.record(0.01)
+            if self.crash_marker and not os.path.exists(self.crash_marker):
+                open(self.crash_marker, 'w').close()
+                os._exit(1)
+
+
+def test_process_supervisor(tmp_path):
+    crash_marker = str(tmp_path / 'crashed')
+    supervisor = ProcessSupervisor(
+        lambda: CountingWorker(crash_marker),
+        2,
+        status_interval=0.1,
+        restart_delay=0.1,
+    )
+    threading.Timer(1.5, supervisor.stop).start()
+    supervisor()
+    assert supervisor.restarts == 1
+    assert all(not worker.is_alive() for worker in supervisor._workers)
+    assert all(worker.exitcode == 0 for worker in supervisor._workers)
+    assert sum(supervisor._counters) > 0
+    assert 'workers 0/2 alive, 1 restarts' in supervisor.status()
+
+
+class FakeBroker:
+    """Connection and channel at once, remembering acknowledged tags."""
+
+    def __init__(self):
+        self.is_open = True
+        self.acked = 0
+        self.lost = []
+
+    def process_data_events(self, time_limit):
+        time.sleep(min(time_limit, 0.01))
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        if not self.is_open:
+            self.lost.append(delivery_tag)
+        else:
+            self.acked = max(self.acked, delivery_tag)
+
+    def close(self):
+        self.is_open = False
+
+
+class BrokerReader(RabbitReader):
+    def __init__(self, count, **kwargs):
+        super().__init__('queue', ack_interval=0.01, **kwargs)
+        self.broker = FakeBroker()
+        self.count = count
+
+    def _connect(self):
+        received = deque()
+        for tag in range(1, self.count + 1):
+            received.append(Delivery(str(tag), tag))
+            self._unsettled.append(tag)
+        return self.broker, self.broker, received
+
+
+class SlowDigester:
+    def __init__(self, rabbit_reader, fail=False, stop_at=1):
+        self.rabbit_reader = rabbit_reader
+        self.stats = FlowStats()
+        self.fail = fail
+        self.stop_at = stop_at
+        self.handled = []
+
+    def deliveries(self):
+        return self.rabbit_reader.message_generator()
+
+    def handle(self, delivery):
+        self.handled.append(delivery.delivery_tag)
+        time.sleep(0.1)
+        if delivery.delivery_tag == self.stop_at:
+            self.stop()
+        if self.fail:
+            raise RuntimeError('flow failed')
+        self.rabbit_reader.ack(delivery)
+
+    def stop(self):
+        self.rabbit_reader.stop()
+
+    def log_cache_summary(self):
+        pass
+
+
+def test_thread_pool_runner_acks_in_flight_on_stop():
+    reader = BrokerReader(100)
+    digester = SlowDigester(reader)
+    ThreadPoolRunner(digester, 2)()
+    assert len(digester.handled) > 1
+    assert reader.broker.acked == max(digester.handled)
+    assert reader.broker.lost == []
+    assert not reader.broker.is_open
+
+
+def test_thread_pool_runner_logs_failed_handle(caplog):
+    reader = BrokerReader(1, drain_timeout=0.1)
+    digester = SlowDigester(reader, fail=True)
+    with caplog.at_level(logging.ERROR):
+        ThreadPoolRunner(digester, 2)()
+    assert 'Failed to handle deliveries' in caplog.text
+    assert 'Closing connection with 1 deliveries in progress' in caplog.text
+    assert reader.broker.acked == 0
+
+
+def test_process_supervisor_acks_in_flight_on_sigterm(tmp_path):
+    report = tmp_path / 'report'
+
+    class ReportingRunner(ThreadPoolRunner):
+        def __call__(self):
+            super().__call__()
+            broker = self.digester.rabbit_reader.broker
+            handled = max(self.digester.handled)
+            report.write_text(f'{broker.acked} {handled} {len(broker.lost)}')
+
+    def build_runner():
+        digester = SlowDigester(BrokerReader(100), stop_at=None)
+        return ReportingRunner(digester, 2)
+
+    supervisor = ProcessSupervisor(build_runner, 1, status_interval=0.1)
+    threading.Timer(0.5, supervisor.stop).start()
+    supervisor()
+    assert supervisor._workers[0].exitcode == 0
+    acked, handled, lost = map(int, report.read_text().split())
+    assert handled > 1
+    assert acked == handled
+    assert lost == 0
+
+
+class FakeAsyncBroker(FakeBroker):
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    async def close(self):
+        self.is_open = False
+
+
+class FakeMessage:
+    def __init__(self, broker, delivery_tag):
+        self.broker = broker
+        self.delivery_tag = delivery_tag
+
+    async def ack(self, multiple=False):
+        self.broker.basic_ack(self.delivery_tag, multiple)
+
+
+def test_async_digester_acks_in_flight_on_stop():
+    pytest.importorskip('aio_pika')
+    from digest.adapters.async_rabbit import AsyncRabbitReader
+    from digest.services.async_digester import AsyncDigester
+
+    class AsyncBrokerReader(AsyncRabbitReader):
+        async def _connect(self):
+            received = asyncio.Queue()
+            messages = {}
+            for tag in range(1, 101):
+                received.put_nowait(Delivery(str(tag), tag))
+                messages[tag] = FakeMessage(broker, tag)
+                self._unsettled.append(tag)
+            return broker, broker, received, messages
+
+    class SlowAsyncDigester(AsyncDigester):
+        async def handle(self, delivery):
+            handled.append(delivery.delivery_tag)
+            await asyncio.sleep(0.1)
+            if delivery.delivery_tag == 1:
+                self.stop()
+            self.rabbit_reader.ack(delivery)
+
+    broker = FakeAsyncBroker()
+    handled = []
+    reader = AsyncBrokerReader('queue', ack_interval=0.01)
+    digester = SlowAsyncDigester(
+        None, reader, None, dummy_filter, max_in_flight=4
+    )
+    digester()
+    assert len(handled) > 1
+    assert broker.acked == max(handled)
+    assert broker.lost == []
+    assert not broker.is_open
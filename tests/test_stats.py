@@ -0,0 +1,21 @@
+from digest.services.stats import FlowStats
+
+
+def test_flow_stats():
+    stats = FlowStats(sample_size=10)
+    assert 'processed 0 messages' in stats.summary()
+    for latency in range(100):
+        stats.record(latency / 1000)
+    stats.record(1, ok=False, count=5)
+    assert stats.succeeded == 100
+    assert stats.failed == 5
+    assert len(stats._latencies) == 10
+    assert 'processed 105 messages (5 failed)' in stats.summary()
+    assert 'p99' in stats.summary()
+
+
+def test_flow_stats_unchanged():
+    stats = FlowStats()
+    stats.record_unchanged(3)
+    assert stats.unchanged == 3
+    assert '3 unchanged digests' in stats.summary()